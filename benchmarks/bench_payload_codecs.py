@@ -0,0 +1,108 @@
+"""
+Compares the storage size and read latency of raw_html/raw_ipynb_json for each payload codec, using a notebook
+with matplotlib charts and pandas tables converted with nbconvert's full HTML template, as notebooker's reports are.
+
+    $ python -m benchmarks.bench_payload_codecs --mongo-host localhost:27017 --n-charts 10 --n-reads 200
+"""
+import base64
+import datetime
+import io
+import time
+import uuid
+
+import bson
+import click
+import matplotlib
+import nbformat
+import numpy as np
+import pandas as pd
+from nbconvert import HTMLExporter
+
+from notebooker.constants import NotebookResultComplete
+from notebooker.serialization.codecs import PAYLOAD_CODECS, check_codec
+from notebooker.serializers.pymongo import PyMongoResultSerializer
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+
+
+def _chart_output():
+    fig, ax = plt.subplots()
+    ax.plot(np.random.randn(500).cumsum())
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    plt.close(fig)
+    return nbformat.v4.new_output(
+        "display_data", data={"image/png": base64.b64encode(buf.getvalue()).decode("ascii"), "text/plain": "<Figure>"}
+    )
+
+
+def _table_output():
+    df = pd.DataFrame(np.random.randn(50, 8), columns=list("abcdefgh"))
+    return nbformat.v4.new_output(
+        "execute_result", data={"text/html": df.to_html(), "text/plain": df.to_string()}, execution_count=1
+    )
+
+
+def _realistic_notebook(n_charts):
+    nb = nbformat.v4.new_notebook()
+    for i in range(n_charts):
+        nb.cells.append(nbformat.v4.new_markdown_cell("## Section {}".format(i)))
+        cell = nbformat.v4.new_code_cell("df.plot()")
+        cell.outputs = [_chart_output(), _table_output()]
+        nb.cells.append(cell)
+    raw_html, _ = HTMLExporter().from_notebook_node(nb)
+    return raw_html, nbformat.writes(nb)
+
+
+def _result(job_id, raw_html, raw_ipynb_json):
+    return NotebookResultComplete(
+        job_id=job_id,
+        report_name="benchmark/report",
+        job_start_time=datetime.datetime.now(),
+        job_finish_time=datetime.datetime.now(),
+        raw_html=raw_html,
+        raw_ipynb_json=raw_ipynb_json,
+        generate_pdf_output=False,
+    )
+
+
+@click.command()
+@click.option("--mongo-host", default="localhost:27017")
+@click.option("--database-name", default="notebooker_benchmarks")
+@click.option("--n-charts", default=10, help="The number of chart and table cells in the notebook.")
+@click.option("--n-reads", default=200, help="The number of raw_html reads to time for each codec.")
+def main(mongo_host, database_name, n_charts, n_reads):
+    raw_html, raw_ipynb_json = _realistic_notebook(n_charts)
+    print("raw_html: {:,} chars, raw_ipynb_json: {:,} chars".format(len(raw_html), len(raw_ipynb_json)))
+    print("{:>6} {:>14} {:>8} {:>16}".format("codec", "payload bytes", "ratio", "read latency ms"))
+    plain_size = None
+    for codec in PAYLOAD_CODECS:
+        try:
+            check_codec(codec)
+        except ValueError as e:
+            print("{:>6} skipped: {}".format(codec, e))
+            continue
+        serializer = PyMongoResultSerializer(
+            mongo_host=mongo_host,
+            database_name=database_name,
+            result_collection_name="BENCHMARK_{}".format(uuid.uuid4().hex),
+            payload_codec=codec,
+        )
+        try:
+            job_id = str(uuid.uuid4())
+            serializer.save_check_result(_result(job_id, raw_html, raw_ipynb_json))
+            size = len(bson.encode(serializer.payload_library.find_one({"job_id": job_id}, {"_id": 0})))
+            plain_size = plain_size or size
+            start = time.perf_counter()
+            for _ in range(n_reads):
+                serializer.get_result_payload(job_id, "raw_html")
+            latency_ms = (time.perf_counter() - start) / n_reads * 1000
+        finally:
+            serializer.library.drop()
+            serializer.payload_library.drop()
+        print("{:>6} {:>14,} {:>7.1f}x {:>16.2f}".format(codec, size, plain_size / size, latency_ms))
+
+
+if __name__ == "__main__":
+    main()
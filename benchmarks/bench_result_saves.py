@@ -0,0 +1,75 @@
+"""
+Measures how many result saves per second MongoResultSerializer can sustain against a local mongod, comparing the
+legacy find-then-replace-then-create_index write path with the single-upsert write path.
+
+    $ python -m benchmarks.bench_result_saves --mongo-host localhost:27017 --n-saves 2000
+"""
+import datetime
+import time
+import uuid
+
+import click
+import pymongo
+
+from notebooker.constants import JobStatus
+from notebooker.serializers.pymongo import PyMongoResultSerializer
+
+
+def _legacy_save_raw_to_db(library, out_data):
+    out_data["update_time"] = datetime.datetime.now()
+    existing = library.find_one({"job_id": out_data["job_id"]})
+    if existing:
+        library.replace_one({"_id": existing["_id"]}, out_data)
+    else:
+        library.insert_one(out_data)
+    library.create_index([("job_id", pymongo.ASCENDING)], background=True)
+    library.create_index([("report_name", pymongo.ASCENDING)], background=True)
+    library.create_index([("update_time", pymongo.DESCENDING)], background=True)
+    library.create_index([("status", pymongo.ASCENDING), ("update_time", pymongo.DESCENDING)], background=True)
+
+
+def _documents(n_saves, n_jobs):
+    job_ids = [str(uuid.uuid4()) for _ in range(n_jobs)]
+    for i in range(n_saves):
+        yield {
+            "job_id": job_ids[i % n_jobs],
+            "report_name": "benchmark/report",
+            "report_title": "benchmark",
+            "status": JobStatus.PENDING.value,
+            "job_start_time": datetime.datetime.now(),
+            "overrides": {"i": i % n_jobs},
+            "mailto": "",
+            "generate_pdf_output": False,
+        }
+
+
+def _time_saves(save_func, n_saves, n_jobs):
+    start = time.perf_counter()
+    for doc in _documents(n_saves, n_jobs):
+        save_func(doc)
+    return n_saves / (time.perf_counter() - start)
+
+
+@click.command()
+@click.option("--mongo-host", default="localhost:27017")
+@click.option("--database-name", default="notebooker_benchmarks")
+@click.option("--n-saves", default=2000, help="The number of saves to time for each write path.")
+@click.option("--n-jobs", default=100, help="The number of distinct job_ids which the saves are spread across.")
+def main(mongo_host, database_name, n_saves, n_jobs):
+    collection_name = "BENCHMARK_{}".format(uuid.uuid4().hex)
+    serializer = PyMongoResultSerializer(
+        mongo_host=mongo_host, database_name=database_name, result_collection_name=collection_name
+    )
+    try:
+        legacy = _time_saves(lambda doc: _legacy_save_raw_to_db(serializer.library, doc), n_saves, n_jobs)
+        serializer.library.delete_many({})
+        upsert = _time_saves(serializer._save_raw_to_db, n_saves, n_jobs)
+    finally:
+        serializer.library.drop()
+    print("find + replace/insert + create_index: {:10.1f} saves/s".format(legacy))
+    print("single upsert:                        {:10.1f} saves/s".format(upsert))
+    print("speedup:                              {:10.2f}x".format(upsert / legacy))
+
+
+if __name__ == "__main__":
+    main()
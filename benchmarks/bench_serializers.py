@@ -0,0 +1,113 @@
+"""
+Compares PyMongoResultSerializer against a local mongod with SqliteResultSerializer on local disk, timing the
+operations which the webapp makes on every page: saving results, reading one back with its payload, finding the
+latest result for some parameters and listing a page of results. Reading the latest result of every set of
+parameters, as the snapshot command does, is timed too. So is InMemoryResultSerializer, for reference.
+
+    $ python -m benchmarks.bench_serializers --mongo-host localhost:27017 --n-results 1000 --n-reads 500
+"""
+import datetime
+import random
+import shutil
+import tempfile
+import time
+import uuid
+
+import click
+
+from notebooker.constants import NotebookResultComplete
+from notebooker.serialization.memory import clear_memory_stores
+from notebooker.serializers.memory import InMemoryResultSerializer
+from notebooker.serializers.pymongo import PyMongoResultSerializer
+from notebooker.serializers.sqlite import SqliteResultSerializer
+
+
+def _result(job_id, i, n_params):
+    return NotebookResultComplete(
+        job_id=job_id,
+        report_name="benchmark/report",
+        job_start_time=datetime.datetime.now(),
+        job_finish_time=datetime.datetime.now(),
+        raw_html="<html>{}</html>".format("<p>result</p>" * 2000),
+        raw_html_resources={"outputs": {"{}/plot.png".format(job_id): uuid.uuid4().bytes * 1000}},
+        raw_ipynb_json="{}",
+        pdf=b"%PDF" * 1000,
+        overrides={"i": i % n_params},
+    )
+
+
+def _per_second(func, n):
+    start = time.perf_counter()
+    for i in range(n):
+        func(i)
+    return n / (time.perf_counter() - start)
+
+
+def _benchmark(serializer, n_results, n_reads, n_params):
+    job_ids = [str(uuid.uuid4()) for _ in range(n_results)]
+
+    def save(i):
+        serializer.save_check_stub(job_ids[i], "benchmark/report", overrides={"i": i % n_params})
+        serializer.save_check_result(_result(job_ids[i], i, n_params))
+
+    def read(_):
+        result = serializer.get_check_result(random.choice(job_ids))
+        assert result.raw_html and result.pdf and list(result.raw_html_resources["outputs"].values())
+
+    def latest(i):
+        serializer.get_latest_successful_job_id_for_name_and_params("benchmark/report", {"i": i % n_params})
+
+    def page(_):
+        serializer.get_results_page(page_size=50)
+
+    def all_params(_):
+        assert len(list(serializer.get_latest_successful_results_for_name_all_params("benchmark/report"))) == n_params
+
+    return {
+        "saves/s": _per_second(save, n_results),
+        "reads/s": _per_second(read, n_reads),
+        "latest lookups/s": _per_second(latest, n_reads),
+        "result pages/s": _per_second(page, n_reads),
+        "all variants/s": _per_second(all_params, n_reads),
+    }
+
+
+@click.command()
+@click.option("--mongo-host", default="localhost:27017")
+@click.option("--database-name", default="notebooker_benchmarks")
+@click.option("--n-results", default=1000, help="The number of results to save with each serializer.")
+@click.option("--n-reads", default=500, help="The number of each kind of read to time.")
+@click.option("--n-params", default=50, help="The number of distinct sets of parameters the results are spread across.")
+def main(mongo_host, database_name, n_results, n_reads, n_params):
+    collection_name = "BENCHMARK_{}".format(uuid.uuid4().hex)
+    mongo = PyMongoResultSerializer(
+        mongo_host=mongo_host, database_name=database_name, result_collection_name=collection_name
+    )
+    sqlite_dir = tempfile.mkdtemp(prefix="notebooker_benchmark")
+    sqlite = SqliteResultSerializer(sqlite_path="{}/results.sqlite".format(sqlite_dir))
+    try:
+        timings = {
+            "mongo": _benchmark(mongo, n_results, n_reads, n_params),
+            "sqlite": _benchmark(sqlite, n_results, n_reads, n_params),
+            "memory": _benchmark(InMemoryResultSerializer(), n_results, n_reads, n_params),
+        }
+    finally:
+        database = mongo.get_mongo_database()
+        for collection_name in database.list_collection_names():
+            if collection_name.startswith(mongo.result_collection_name) or collection_name.startswith("notebook_data"):
+                database.drop_collection(collection_name)
+        sqlite.close()
+        shutil.rmtree(sqlite_dir)
+        clear_memory_stores()
+    print("{:>18} {:>12} {:>12} {:>12} {:>14}".format("", "mongo", "sqlite", "memory", "sqlite/mongo"))
+    for operation in timings["mongo"]:
+        mongo_rate, sqlite_rate, memory_rate = (timings[name][operation] for name in ("mongo", "sqlite", "memory"))
+        print(
+            "{:>18} {:12.1f} {:12.1f} {:12.1f} {:13.2f}x".format(
+                operation, mongo_rate, sqlite_rate, memory_rate, sqlite_rate / mongo_rate
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
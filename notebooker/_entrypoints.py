@@ -1,3 +1,4 @@
+import json
 import os
 import uuid
 
@@ -5,10 +6,14 @@ import click
 
 from notebooker.constants import DEFAULT_SERIALIZER
 from notebooker.execute_notebook import execute_notebook_entrypoint
+from notebooker.retention import load_retention_policies
 from notebooker.serialization import SERIALIZER_TO_CLI_OPTIONS
+from notebooker.serialization.serialization import get_serializer_from_cls
 from notebooker.settings import BaseConfig, WebappConfig
 from notebooker.snapshot import snap_latest_successful_notebooks
+from notebooker.utils.garbage_collection import collect_garbage
 from notebooker.web.app import main
+from notebooker.worker import run_workers
 
 
 class NotebookerEntrypoint(click.Group):
@@ -65,6 +70,18 @@ def filesystem_default_value(dirname):
     default=DEFAULT_SERIALIZER,
     help="The serializer class through which we will save the notebook result.",
 )
+@click.option(
+    "--kernel-pool-size",
+    default=0,
+    help="The number of started kernels to keep ready when execute-notebook runs more than one notebook, e.g. with "
+    "--iterate-override-values-of. Each kernel runs one notebook and is then replaced. The webapp and its workers run "
+    "each report in its own process, so don't use the pool. 0 disables the pool.",
+)
+@click.option(
+    "--kernel-pool-warm-imports",
+    default="",
+    help="Comma-separated modules which pooled kernels import before they run a notebook, e.g. pandas,numpy.",
+)
 @click.pass_context
 def base_notebooker(
     ctx,
@@ -75,6 +92,8 @@ def base_notebooker(
     py_template_subdir,
     notebooker_disable_git,
     serializer_cls,
+    kernel_pool_size,
+    kernel_pool_warm_imports,
     **serializer_args,
 ):
     config = BaseConfig(
@@ -86,6 +105,8 @@ def base_notebooker(
         PY_TEMPLATE_BASE_DIR=py_template_base_dir,
         PY_TEMPLATE_SUBDIR=py_template_subdir,
         NOTEBOOKER_DISABLE_GIT=notebooker_disable_git,
+        KERNEL_POOL_SIZE=kernel_pool_size,
+        KERNEL_POOL_WARM_IMPORTS=kernel_pool_warm_imports,
     )
     ctx.obj = config
 
@@ -95,13 +116,41 @@ def base_notebooker(
 @click.option("--logging-level", default="INFO")
 @click.option("--debug", default=False)
 @click.option("--base-cache-dir", default=filesystem_default_value("webcache"))
+@click.option(
+    "--retention-policies",
+    default="",
+    help="A JSON file of retention policies. If given, deleted and expired results are garbage collected hourly.",
+)
+@click.option(
+    "--max-concurrent-jobs",
+    default=4,
+    help="The most notebooks which the webapp runs at once. Reports which are run while this many are running are "
+    "queued, and started in the order they were submitted.",
+)
+@click.option(
+    "--use-job-queue",
+    is_flag=True,
+    help="Don't run reports in the webapp; submit them to the mongo job queue for `notebooker-cli worker` processes.",
+)
 @pass_config
-def start_webapp(config: BaseConfig, port, logging_level, debug, base_cache_dir):
+def start_webapp(
+    config: BaseConfig,
+    port,
+    logging_level,
+    debug,
+    base_cache_dir,
+    retention_policies,
+    max_concurrent_jobs,
+    use_job_queue,
+):
     web_config = WebappConfig.copy_existing(config)
     web_config.PORT = port
     web_config.LOGGING_LEVEL = logging_level
     web_config.DEBUG = debug
     web_config.CACHE_DIR = base_cache_dir
+    web_config.RETENTION_POLICIES_FILE = retention_policies
+    web_config.MAX_CONCURRENT_JOBS = max_concurrent_jobs
+    web_config.USE_JOB_QUEUE = use_job_queue
     return main(web_config)
 
 
@@ -112,9 +161,9 @@ def start_webapp(config: BaseConfig, port, logging_level, debug, base_cache_dir)
 )
 @click.option(
     "--iterate-override-values-of",
-    default="",
+    multiple=True,
     help="For the key/values in the overrides, set this to the value of one of the keys to run reports for "
-    "each of its values.",
+    "each of its values. Give it more than once to run reports for every combination of the keys' values.",
 )
 @click.option("--report-title", default="", help="A custom title for this notebook. The default is the report_name.")
 @click.option("--n-retries", default=3, help="The number of times to retry when executing this notebook.")
@@ -130,6 +179,11 @@ def start_webapp(config: BaseConfig, port, logging_level, debug, base_cache_dir)
     is_flag=True,
     help='Used for debugging and testing. Whether to actually execute the notebook or just "prepare" it.',
 )
+@click.option(
+    "--parallelism",
+    default=1,
+    help="The number of processes across which the notebooks for different overrides are run at once.",
+)
 @pass_config
 def execute_notebook(
     config: BaseConfig,
@@ -142,6 +196,7 @@ def execute_notebook(
     mailto,
     pdf_output,
     prepare_notebook_only,
+    parallelism,
 ):
     if report_name is None:
         raise ValueError("Error! Please provide a --report-name.")
@@ -156,9 +211,28 @@ def execute_notebook(
         mailto,
         pdf_output,
         prepare_notebook_only,
+        parallelism,
     )
 
 
+@base_notebooker.command()
+@click.option("--concurrency", default=1, help="The number of jobs which this worker executes at once.")
+@click.option(
+    "--lease-seconds",
+    default=60.0,
+    help="How long a claimed job stays leased to this worker without a heartbeat before another worker may claim it.",
+)
+@click.option(
+    "--max-attempts",
+    default=3,
+    help="The number of times a job is claimed before it is failed, when the workers running it stop heartbeating.",
+)
+@click.option("--poll-interval", default=2.0, help="How many seconds to wait before polling an empty queue again.")
+@pass_config
+def worker(config: BaseConfig, concurrency, lease_seconds, max_attempts, poll_interval):
+    run_workers(config, concurrency, lease_seconds, max_attempts, poll_interval)
+
+
 @base_notebooker.command()
 @click.option(
     "--report-name", required=True, help="The name of the template to retrieve, relative to the template directory."
@@ -168,5 +242,74 @@ def snapshot_latest_successful_notebooks(config: BaseConfig, report_name):
     snap_latest_successful_notebooks(config, report_name)
 
 
+@base_notebooker.command()
+@pass_config
+def ensure_indexes(config: BaseConfig):
+    serializer = get_serializer_from_cls(config.SERIALIZER_CLS, **config.SERIALIZER_CONFIG)
+    serializer.ensure_indexes(force=True)
+
+
+@base_notebooker.command()
+@click.option("--batch-size", default=1000, help="The number of GridFS files to update per bulk write.")
+@pass_config
+def tag_result_resources(config: BaseConfig, batch_size: int):
+    serializer = get_serializer_from_cls(config.SERIALIZER_CLS, **config.SERIALIZER_CONFIG)
+    serializer.tag_result_resources_with_job_ids(batch_size=batch_size)
+
+
+@base_notebooker.command()
+@click.option("--batch-size", default=100, help="The number of results to migrate per bulk write.")
+@pass_config
+def move_result_payloads(config: BaseConfig, batch_size: int):
+    serializer = get_serializer_from_cls(config.SERIALIZER_CLS, **config.SERIALIZER_CONFIG)
+    serializer.move_payloads_to_payload_collection(batch_size=batch_size)
+
+
+@base_notebooker.command()
+@click.option("--batch-size", default=1000, help="The number of results to update per bulk write.")
+@pass_config
+def backfill_overrides_hashes(config: BaseConfig, batch_size: int):
+    serializer = get_serializer_from_cls(config.SERIALIZER_CLS, **config.SERIALIZER_CONFIG)
+    serializer.backfill_overrides_hashes(batch_size=batch_size)
+
+
+@base_notebooker.command()
+@pass_config
+def remove_duplicate_results(config: BaseConfig):
+    serializer = get_serializer_from_cls(config.SERIALIZER_CLS, **config.SERIALIZER_CONFIG)
+    serializer.remove_duplicate_results()
+
+
+@base_notebooker.command()
+@pass_config
+def rebuild_latest_pointers(config: BaseConfig):
+    serializer = get_serializer_from_cls(config.SERIALIZER_CLS, **config.SERIALIZER_CONFIG)
+    serializer.rebuild_latest_pointers()
+
+
+@base_notebooker.command()
+@click.option(
+    "--retention-policies",
+    default=None,
+    help="A JSON file of retention policies. Without one, only deleted results and orphaned files are removed.",
+)
+@click.option(
+    "--dry-run", is_flag=True, help="Report what would be removed and the bytes reclaimed, but remove nothing."
+)
+@click.option("--batch-size", default=100, help="The number of results or files to remove at a time.")
+@click.option("--pause-seconds", default=1.0, help="How long to pause between batches.")
+@pass_config
+def gc(config: BaseConfig, retention_policies, dry_run, batch_size, pause_seconds):
+    serializer = get_serializer_from_cls(config.SERIALIZER_CLS, **config.SERIALIZER_CONFIG)
+    report = collect_garbage(
+        serializer,
+        load_retention_policies(retention_policies),
+        dry_run=dry_run,
+        batch_size=batch_size,
+        pause_seconds=pause_seconds,
+    )
+    click.echo(json.dumps(report, indent=2, sort_keys=True))
+
+
 if __name__ == "__main__":
     base_notebooker()
@@ -2,7 +2,7 @@ import datetime
 import logging
 import os
 from enum import Enum, unique
-from typing import AnyStr, Optional
+from typing import Any, AnyStr, Dict, FrozenSet, Iterable, Mapping, Optional, Tuple
 
 import attr
 
@@ -60,6 +60,21 @@ class JobStatus(Enum):
         return mapping
 
 
+# For each status, the statuses which a job may be moved into it from. Anything else is a stale update which is
+# ignored, e.g. a late TIMEOUT from the report hunter arriving after the job has already finished.
+ALLOWED_STATUS_TRANSITIONS = {
+    JobStatus.SUBMITTED: frozenset(),
+    # ERROR -> PENDING happens when an executor retries a failed report.
+    JobStatus.PENDING: frozenset({JobStatus.SUBMITTED, JobStatus.PENDING, JobStatus.ERROR}),
+    # TIMEOUT -> DONE or ERROR happens when a report which the report hunter timed out was still running, and finished.
+    JobStatus.DONE: frozenset({JobStatus.SUBMITTED, JobStatus.PENDING, JobStatus.TIMEOUT}),
+    JobStatus.ERROR: frozenset({JobStatus.SUBMITTED, JobStatus.PENDING, JobStatus.TIMEOUT}),
+    JobStatus.TIMEOUT: frozenset({JobStatus.SUBMITTED, JobStatus.PENDING}),
+    JobStatus.CANCELLED: frozenset({JobStatus.SUBMITTED, JobStatus.PENDING}),
+    JobStatus.DELETED: frozenset(JobStatus) - {JobStatus.DELETED},
+}
+
+
 # Variables for inputs from web
 EMAIL_SPACE_ERR_MSG = "The email address specified had whitespace! Please fix this before resubmitting."
 FORBIDDEN_INPUT_CHARS = list('"')
@@ -171,3 +186,156 @@ class NotebookResultComplete(NotebookResultBase):
                 generate_pdf_output=self.generate_pdf_output,
             )
         )
+
+
+class _PayloadNotLoaded(object):
+    """ Placeholder for a payload field of a LazyNotebookResultComplete which hasn't been read from storage yet. """
+
+    def __repr__(self):
+        return "PAYLOAD_NOT_LOADED"
+
+    def __reduce__(self):
+        return "PAYLOAD_NOT_LOADED"
+
+
+PAYLOAD_NOT_LOADED = _PayloadNotLoaded()
+
+
+class LazyResourceOutputs(Mapping):
+    """
+    The "outputs" of NotebookResultComplete.raw_html_resources, i.e. a mapping of path -> bytes. Each output is only
+    read from the payload source the first time it is accessed, and is then kept.
+    """
+
+    def __init__(self, job_id: str, paths: Iterable[str], payload_source=None):
+        self.job_id = job_id
+        self.payload_source = payload_source
+        self._paths = list(paths)
+        self._loaded: Dict[str, Any] = {}
+
+    def __getitem__(self, path):
+        if path not in self._loaded:
+            if path not in self._paths:
+                raise KeyError(path)
+            self._loaded[path] = _require_payload_source(self).get_result_resource(self.job_id, path)
+        return self._loaded[path]
+
+    def __contains__(self, path):
+        return path in self._paths
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __repr__(self):
+        return "LazyResourceOutputs({})".format(self._paths)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["payload_source"] = None
+        return state
+
+    def items(self):
+        self.load_all()
+        return super(LazyResourceOutputs, self).items()
+
+    def values(self):
+        self.load_all()
+        return super(LazyResourceOutputs, self).values()
+
+    def loaded_paths(self) -> FrozenSet[str]:
+        """ The paths of the outputs which have been read so far. """
+        return frozenset(self._loaded)
+
+    def preload(self, contents: Mapping[str, Any]) -> None:
+        """ Keeps outputs which were read along with other results' outputs, so that they aren't read again. """
+        self._loaded.update((path, content) for path, content in contents.items() if path in self._paths)
+
+    def load_all(self) -> None:
+        """ Reads every output which hasn't been loaded yet in one go. """
+        missing = [path for path in self._paths if path not in self._loaded]
+        if missing:
+            self._loaded.update(_require_payload_source(self).get_result_resources(self.job_id, missing))
+
+
+def _require_payload_source(lazy_obj):
+    if lazy_obj.payload_source is None:
+        raise ValueError(
+            "The payload for job {} hasn't been loaded and there is nowhere to load it from. "
+            "Call bind_payload_source() with a serializer first.".format(lazy_obj.job_id)
+        )
+    return lazy_obj.payload_source
+
+
+def _lazy_payload_field(name):
+    def getter(self):
+        if name not in self._payload:
+            self._payload[name] = _require_payload_source(self).get_result_payload(self.job_id, name)
+        return self._payload[name]
+
+    def setter(self, value):
+        if value is PAYLOAD_NOT_LOADED:
+            self._payload.pop(name, None)
+        else:
+            self._payload[name] = value
+
+    return property(getter, setter)
+
+
+class LazyNotebookResultComplete(NotebookResultComplete):
+    """
+    A NotebookResultComplete whose heavy fields (raw_html, raw_ipynb_json, pdf and the outputs in raw_html_resources)
+    are read from a payload source - usually the serializer which created it - the first time they are accessed.
+    Pass PAYLOAD_NOT_LOADED for any of these fields which haven't been fetched yet.
+
+    Pickling (e.g. into the webapp cache) keeps whatever has been loaded so far but drops the payload source,
+    so call bind_payload_source() again after unpickling.
+    """
+
+    raw_html = _lazy_payload_field("raw_html")
+    raw_ipynb_json = _lazy_payload_field("raw_ipynb_json")
+    pdf = _lazy_payload_field("pdf")
+
+    def __init__(self, *args, payload_source=None, **kwargs):
+        self._payload: Dict[str, Any] = {}
+        self.payload_source = payload_source
+        super(LazyNotebookResultComplete, self).__init__(*args, **kwargs)
+        self.bind_payload_source(payload_source)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["payload_source"] = None
+        return state
+
+    def __eq__(self, other):
+        if not isinstance(other, NotebookResultComplete):
+            return NotImplemented
+        return all(getattr(self, a.name) == getattr(other, a.name) for a in attr.fields(NotebookResultComplete))
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def bind_payload_source(self, payload_source) -> None:
+        self.payload_source = payload_source
+        outputs = self.raw_html_resources.get("outputs")
+        if isinstance(outputs, LazyResourceOutputs):
+            outputs.payload_source = payload_source
+
+    def loaded_payload(self) -> FrozenSet[Tuple[str, str]]:
+        """ ("field", name) for each field and ("output", path) for each output which has been loaded so far. """
+        outputs = self.raw_html_resources.get("outputs")
+        loaded_paths = outputs.loaded_paths() if isinstance(outputs, LazyResourceOutputs) else ()
+        return frozenset([("field", name) for name in self._payload] + [("output", path) for path in loaded_paths])
+
+    def load_payload(self) -> None:
+        """ Reads every field which hasn't been loaded yet. """
+        for name in ("raw_html", "raw_ipynb_json", "pdf"):
+            getattr(self, name)
+        outputs = self.raw_html_resources.get("outputs")
+        if isinstance(outputs, LazyResourceOutputs):
+            outputs.load_all()
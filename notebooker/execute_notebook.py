@@ -1,12 +1,16 @@
 import copy
 import datetime
+import itertools
 import json
 import logging
+import multiprocessing
 import os
 import subprocess
 import traceback
 import uuid
-from typing import Any, AnyStr, Dict, List, Optional, Union
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from typing import Any, AnyStr, Dict, Iterator, List, Optional, Sequence, Tuple, Union
 
 import papermill as pm
 import sys
@@ -16,12 +20,14 @@ from notebooker.constants import (
     JobStatus,
     NotebookResultComplete,
     NotebookResultError,
+    kernel_spec,
     python_template_dir,
 )
 from notebooker.serialization.serialization import get_serializer_from_cls
 from notebooker.settings import BaseConfig
 from notebooker.utils.conversion import _output_ipynb_name, generate_ipynb_from_py, ipython_to_html, ipython_to_pdf
 from notebooker.utils.filesystem import initialise_base_dirs
+from notebooker.utils.kernel_pool import KernelPool, parse_warm_imports
 from notebooker.utils.notebook_execution import _output_dir, send_result_email
 
 logging.basicConfig(level=logging.INFO)
@@ -42,6 +48,7 @@ def _run_checks(
     notebooker_disable_git: bool = False,
     py_template_base_dir: str = "",
     py_template_subdir: str = "",
+    kernel_pool: Optional[KernelPool] = None,
 ) -> NotebookResultComplete:
     """
     This is the actual method which executes a notebook, whether running in the webapp or via the entrypoint.
@@ -69,6 +76,8 @@ def _run_checks(
         Comma-separated email addresses to send on completion (or error).
     prepare_only : `Optional[bool]`
         Internal usage. Whether we want to do everything apart from executing the notebook.
+    kernel_pool : `Optional[KernelPool]`
+        If given, the notebook is executed on a kernel leased from this pool rather than one started for it.
 
 
     Returns
@@ -93,9 +102,17 @@ def _run_checks(
     ipynb_executed_path = os.path.join(output_dir, output_ipynb)
 
     logger.info("Executing notebook at {} using parameters {} --> {}".format(ipynb_raw_path, overrides, output_ipynb))
-    pm.execute_notebook(
-        ipynb_raw_path, ipynb_executed_path, parameters=overrides, log_output=True, prepare_only=prepare_only
-    )
+    use_pool = kernel_pool is not None and not prepare_only
+    with kernel_pool.lease(kernel_spec()["name"]) if use_pool else nullcontext() as kernel_manager:
+        # Without a leased kernel (km=None), papermill starts one of its own.
+        pm.execute_notebook(
+            ipynb_raw_path,
+            ipynb_executed_path,
+            parameters=overrides,
+            log_output=True,
+            prepare_only=prepare_only,
+            km=kernel_manager,
+        )
     with open(ipynb_executed_path, "r") as f:
         raw_executed_ipynb = f.read()
 
@@ -136,6 +153,7 @@ def run_report(
     notebooker_disable_git=False,
     py_template_base_dir="",
     py_template_subdir="",
+    kernel_pool=None,
 ):
 
     job_id = job_id or str(uuid.uuid4())
@@ -168,6 +186,7 @@ def run_report(
             notebooker_disable_git=notebooker_disable_git,
             py_template_base_dir=py_template_base_dir,
             py_template_subdir=py_template_subdir,
+            kernel_pool=kernel_pool,
         )
         logger.info("Successfully got result.")
         result_serializer.save_check_result(result)
@@ -185,13 +204,9 @@ def run_report(
             mailto=mailto,
             generate_pdf_output=generate_pdf_output,
         )
-        logger.error(
-            "Report run failed. Saving error result to mongo library %s@%s...",
-            result_serializer.database_name,
-            result_serializer.mongo_host,
-        )
+        logger.error("Report run failed. Saving error result with %s...", result_serializer.get_name())
         result_serializer.save_check_result(result)
-        logger.info("Error result saved to mongo successfully.")
+        logger.info("Error result saved successfully.")
         if attempts_remaining > 0:
             logger.info("Retrying report.")
             return run_report(
@@ -210,29 +225,33 @@ def run_report(
                 notebooker_disable_git=notebooker_disable_git,
                 py_template_base_dir=py_template_base_dir,
                 py_template_subdir=py_template_subdir,
+                kernel_pool=kernel_pool,
             )
         else:
             logger.info("Abandoning attempt to run report. It failed too many times.")
     return result
 
 
-def _get_overrides(overrides_as_json: AnyStr, iterate_override_values_of: Optional[AnyStr]) -> List[Dict]:
+def _get_overrides(
+    overrides_as_json: AnyStr, iterate_override_values_of: Optional[Union[AnyStr, Sequence[str]]]
+) -> List[Dict]:
     """
     Converts input parameters from a JSON string into a list of parameters for reports to be run.
     A list of parameters will return a list of parameters.
     A dictionary of parameters will return:
 
     * If iterate_override_values_of is set,
-      it will return a copy of itself with each value under the iterate_override_values_of key
+      it will return a copy of itself for every combination of the values under the iterate_override_values_of
+      keys, i.e. their Cartesian product, without any duplicate combinations
     * If iterate_override_values_of is not set,
       it will return the dictionary within a list as the only element.
     Parameters
     ----------
     overrides_as_json : `AnyStr`
         A string containing JSON parameters for the report(s) to be run.
-    iterate_override_values_of : `Optional[AnyStr]`
-        If the overrides are a dictionary, and the dictionary contains this key, the values are exploded out
-        into multiple output dictionaries.
+    iterate_override_values_of : `Optional[Union[AnyStr, Sequence[str]]]`
+        If the overrides are a dictionary, and the dictionary contains this key (or these keys), the values are
+        exploded out into multiple output dictionaries.
 
     Examples
     --------
@@ -240,6 +259,8 @@ def _get_overrides(overrides_as_json: AnyStr, iterate_override_values_of: Option
     [{'test': [1, 2, 3], 'a': 1}]
     >>> _get_overrides('{"test": [1, 2, 3], "a": 1}', "test")
     [{"test": 1, "a": 1}, {"test": 2, "a": 1}, {"test": 3, "a": 1}]
+    >>> _get_overrides('{"test": [1, 2, 1], "a": ["x", "y"]}', ["test", "a"])
+    [{"test": 1, "a": "x"}, {"test": 1, "a": "y"}, {"test": 2, "a": "x"}, {"test": 2, "a": "y"}]
     >>> _get_overrides('[{"test": 1, "a": 1}, {"test": 2, "a": 1}, {"test": 3, "a": 1}]', None)
     [{'test': 1, 'a': 1}, {'test': 2, 'a': 1}, {'test': 3, 'a': 1}]
     >>> _get_overrides('[{"test": 1, "a": 1}, {"test": 2, "a": 1}, {"test": 3, "a": 1}]', "blah")
@@ -252,36 +273,114 @@ def _get_overrides(overrides_as_json: AnyStr, iterate_override_values_of: Option
 
     """
     overrides = json.loads(overrides_as_json) if overrides_as_json else {}
+    if isinstance(iterate_override_values_of, str):
+        iterate_override_values_of = [iterate_override_values_of]
+    iterate_keys = list(dict.fromkeys(key for key in iterate_override_values_of or [] if key))
     all_overrides = []
     if isinstance(overrides, (list, tuple)):
-        if iterate_override_values_of:
+        if iterate_keys:
             logger.warning(
                 "An --iterate-override-values-of has been specified ({}), but a list of overrides ({}) "
                 "has been given. We can't use this parameter as expected, but will continue with the "
-                "list of overrides.".format(iterate_override_values_of, overrides)
+                "list of overrides.".format(", ".join(iterate_keys), overrides)
             )
         all_overrides = overrides
-    elif iterate_override_values_of:
-        if iterate_override_values_of not in overrides:
-            raise ValueError(
-                "Can't iterate over override values unless it is given in the override json! "
-                "Given overrides were: {}".format(overrides)
-            )
-        to_iterate = overrides[iterate_override_values_of]
-        if not isinstance(to_iterate, (list, tuple)):
-            raise ValueError(
-                "Can't iterate over a non-list or tuple of variables. "
-                "The given value was a {} - {}.".format(type(to_iterate), to_iterate)
-            )
-        for iterated_value in to_iterate:
+    elif iterate_keys:
+        for key in iterate_keys:
+            if key not in overrides:
+                raise ValueError(
+                    "Can't iterate over override values unless it is given in the override json! "
+                    "Given overrides were: {}".format(overrides)
+                )
+            to_iterate = overrides[key]
+            if not isinstance(to_iterate, (list, tuple)):
+                raise ValueError(
+                    "Can't iterate over a non-list or tuple of variables. "
+                    "The given value was a {} - {}.".format(type(to_iterate), to_iterate)
+                )
+        seen = set()
+        for combination in itertools.product(*(overrides[key] for key in iterate_keys)):
             new_override = copy.deepcopy(overrides)
-            new_override[iterate_override_values_of] = iterated_value
-            all_overrides.append(new_override)
+            new_override.update(zip(iterate_keys, copy.deepcopy(combination)))
+            # The overrides came from JSON, so this identifies a combination however its values are nested.
+            identity = json.dumps(new_override, sort_keys=True)
+            if identity not in seen:
+                seen.add(identity)
+                all_overrides.append(new_override)
     else:
         all_overrides = [overrides]
     return all_overrides
 
 
+def _run_variant(config: BaseConfig, run_kwargs: Dict[str, Any], result_serializer=None, kernel_pool=None):
+    """ Runs the report for one set of overrides and emails its result. Also runs in --parallelism processes. """
+    if result_serializer is None:
+        result_serializer = get_serializer_from_cls(config.SERIALIZER_CLS, **config.SERIALIZER_CONFIG)
+    result = run_report(result_serializer=result_serializer, kernel_pool=kernel_pool, **run_kwargs)
+    if run_kwargs["mailto"]:
+        send_result_email(result, run_kwargs["mailto"])
+    return result
+
+
+def _run_variant_in_process(config: BaseConfig, run_kwargs: Dict[str, Any]) -> Tuple[str, JobStatus]:
+    """ Runs a variant in a --parallelism process, sending back only its job ID and status rather than its payload. """
+    result = _run_variant(config, run_kwargs)
+    return result.job_id, result.status
+
+
+def _saved_result(result_serializer, run_kwargs: Dict[str, Any], job_id: str, status: JobStatus):
+    """ The result which a --parallelism process saved, read back without its payload. """
+    result = result_serializer.get_check_result(job_id)
+    if result is None:
+        return NotebookResultError(
+            job_id=job_id,
+            job_start_time=run_kwargs["job_submit_time"],
+            report_name=run_kwargs["report_name"],
+            overrides=run_kwargs["overrides"],
+            error_info="Job {} finished as {} but its result can't be found.".format(job_id, status.value),
+        )
+    return result
+
+
+def _log_variant_failure(run_kwargs: Dict[str, Any]) -> None:
+    logger.exception(
+        "Running %s (job id %s) with overrides %s failed.",
+        run_kwargs["report_name"],
+        run_kwargs["job_id"],
+        run_kwargs["overrides"],
+    )
+
+
+def _run_variants(
+    config: BaseConfig, all_run_kwargs: List[Dict[str, Any]], parallelism: int, result_serializer, kernel_pool
+) -> Iterator[Tuple[Dict[str, Any], Any]]:
+    """
+    Runs every variant, in up to `parallelism` processes at once, yielding each one's run_report() kwargs along with
+    its result, or the exception it raised. One variant failing doesn't stop the others.
+    """
+    if parallelism > 1 and len(all_run_kwargs) > 1:
+        # Spawned rather than forked, as this process may already have mongo clients and threads of its own.
+        with ProcessPoolExecutor(
+            max_workers=min(parallelism, len(all_run_kwargs)), mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = [executor.submit(_run_variant_in_process, config, run_kwargs) for run_kwargs in all_run_kwargs]
+            for run_kwargs, future in zip(all_run_kwargs, futures):
+                try:
+                    job_id, status = future.result()
+                except Exception as e:
+                    _log_variant_failure(run_kwargs)
+                    yield run_kwargs, e
+                else:
+                    yield run_kwargs, _saved_result(result_serializer, run_kwargs, job_id, status)
+    else:
+        for run_kwargs in all_run_kwargs:
+            try:
+                yield run_kwargs, _run_variant(config, run_kwargs, result_serializer, kernel_pool)
+            except Exception as e:
+                _log_variant_failure(run_kwargs)
+                yield run_kwargs, e
+
+
 def execute_notebook_entrypoint(
     config: BaseConfig,
     report_name: str,
@@ -293,6 +392,7 @@ def execute_notebook_entrypoint(
     mailto: str,
     pdf_output: bool,
     prepare_notebook_only: bool,
+    parallelism: int = 1,
 ):
     report_title = report_title or report_name
     output_dir, template_dir, _ = initialise_base_dirs(output_dir=config.OUTPUT_DIR, template_dir=config.TEMPLATE_DIR)
@@ -319,18 +419,24 @@ def execute_notebook_entrypoint(
     logger.info("py_template_subdir = %s", py_template_subdir)
     logger.info("serializer_cls = %s", config.SERIALIZER_CLS)
     logger.info("serializer_config = %s", config.SERIALIZER_CONFIG)
+    logger.info("kernel_pool_size = %s", config.KERNEL_POOL_SIZE)
+    logger.info("kernel_pool_warm_imports = %s", config.KERNEL_POOL_WARM_IMPORTS)
+    logger.info("parallelism = %s", parallelism)
 
     logger.info("Calculated overrides are: %s", str(all_overrides))
-    result_serializer = get_serializer_from_cls(config.SERIALIZER_CLS, **config.SERIALIZER_CONFIG)
-    results = []
-    for overrides in all_overrides:
-        result = run_report(
-            start_time,
-            report_name,
-            overrides,
-            result_serializer,
+    # Each variant is a result of its own, so when there are several they can't all be saved under the one job ID. The
+    # first keeps the given one, so that whoever gave it can still find that result.
+    job_ids = [job_id] + [str(uuid.uuid4()) for _ in all_overrides[1:]]
+    if len(all_overrides) > 1:
+        for overrides, variant_job_id in zip(all_overrides, job_ids):
+            logger.info("The variant with overrides %s is saved as job %s", overrides, variant_job_id)
+    all_run_kwargs = [
+        dict(
+            job_submit_time=start_time,
+            report_name=report_name,
+            overrides=overrides,
             report_title=report_title,
-            job_id=job_id,
+            job_id=variant_job_id,
             output_base_dir=output_dir,
             template_base_dir=template_dir,
             attempts_remaining=n_retries - 1,
@@ -341,16 +447,65 @@ def execute_notebook_entrypoint(
             py_template_base_dir=py_template_base_dir,
             py_template_subdir=py_template_subdir,
         )
-        if mailto:
-            send_result_email(result, mailto)
-        if isinstance(result, NotebookResultError):
-            logger.warning("Notebook execution failed! Output was:")
-            logger.warning(repr(result))
-            raise Exception(result.error_info)
-        results.append(result)
+        for overrides, variant_job_id in zip(all_overrides, job_ids)
+    ]
+    result_serializer = get_serializer_from_cls(config.SERIALIZER_CLS, **config.SERIALIZER_CONFIG)
+    if parallelism > 1 and config.KERNEL_POOL_SIZE > 0:
+        logger.warning("Not using a kernel pool, since each variant runs in its own process with --parallelism.")
+        kernel_pool = None
+    else:
+        kernel_pool = _start_kernel_pool(config, len(all_overrides))
+    results = []
+    failures = []
+    try:
+        for run_kwargs, result in _run_variants(config, all_run_kwargs, parallelism, result_serializer, kernel_pool):
+            if isinstance(result, Exception):
+                error_info = "".join(traceback.format_exception_only(type(result), result))
+            elif isinstance(result, NotebookResultError):
+                error_info = result.error_info
+            else:
+                results.append(result)
+                continue
+            logger.warning(
+                "Notebook execution failed for overrides %s (job id %s)! Output was:",
+                run_kwargs["overrides"],
+                run_kwargs["job_id"],
+            )
+            logger.warning(error_info)
+            failures.append((run_kwargs, error_info))
+    finally:
+        if kernel_pool is not None:
+            kernel_pool.close()
+    if len(all_run_kwargs) == 1 and failures:
+        raise Exception(failures[0][1])
+    if failures:
+        raise Exception(
+            "{} of {} variants of {} failed:\n{}".format(
+                len(failures),
+                len(all_run_kwargs),
+                report_name,
+                "\n".join(
+                    "{} (job id {}): {}".format(
+                        run_kwargs["overrides"], run_kwargs["job_id"], (error_info.strip().splitlines() or [""])[-1]
+                    )
+                    for run_kwargs, error_info in failures
+                ),
+            )
+        )
     return results
 
 
+def _start_kernel_pool(config: BaseConfig, n_notebooks: int) -> Optional[KernelPool]:
+    """ A kernel pool which is already starting kernels, if one is configured and there is more than one notebook. """
+    if config.KERNEL_POOL_SIZE <= 0 or n_notebooks <= 1:
+        return None
+    kernel_pool = KernelPool(
+        min(config.KERNEL_POOL_SIZE, n_notebooks), parse_warm_imports(config.KERNEL_POOL_WARM_IMPORTS)
+    )
+    kernel_pool.prestart(kernel_spec()["name"])
+    return kernel_pool
+
+
 def docker_compose_entrypoint():
     """
     Sadness. This is required because of https://github.com/jupyter/jupyter_client/issues/154
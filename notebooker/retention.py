@@ -0,0 +1,56 @@
+"""
+Retention policies, which say how long the results of each report are kept before garbage collection removes them.
+They are read from a JSON list, where the first policy whose report_name pattern matches a report applies to it:
+
+    [
+        {"report_name": "sample/plot_random", "keep_last": 5},
+        {"report_name": "sample/*", "keep_last": 20, "max_age_days": 30},
+        {"report_name": "*", "max_age_days": 365}
+    ]
+
+Reports which no policy matches are kept forever, apart from results which have been deleted.
+"""
+import datetime
+import fnmatch
+import json
+from dataclasses import dataclass
+from typing import List, Optional
+
+
+@dataclass
+class RetentionPolicy:
+    # A glob pattern for the report names which this policy applies to, e.g. "sample/*".
+    report_name: str
+    # Keep the newest keep_last results of each set of parameters.
+    keep_last: Optional[int] = None
+    # Keep results which were updated in the last max_age_days days.
+    max_age_days: Optional[float] = None
+
+    def __post_init__(self):
+        if self.keep_last is None and self.max_age_days is None:
+            raise ValueError("The retention policy for {} needs keep_last or max_age_days.".format(self.report_name))
+        if (self.keep_last or 0) < 0 or (self.max_age_days or 0) < 0:
+            raise ValueError("The retention policy for {} has a negative limit.".format(self.report_name))
+
+    def matches(self, report_name: str) -> bool:
+        return fnmatch.fnmatchcase(report_name, self.report_name)
+
+    def is_expired(self, position: int, age: datetime.timedelta) -> bool:
+        """
+        Whether a result has expired, given that it is the position'th newest (from 1) for its parameters and that
+        it was last updated age ago. A result is kept if either of the limits keeps it.
+        """
+        kept_by_count = self.keep_last is not None and position <= self.keep_last
+        kept_by_age = self.max_age_days is not None and age <= datetime.timedelta(days=self.max_age_days)
+        return not (kept_by_count or kept_by_age)
+
+
+def find_retention_policy(policies: List[RetentionPolicy], report_name: str) -> Optional[RetentionPolicy]:
+    return next((policy for policy in policies if policy.matches(report_name)), None)
+
+
+def load_retention_policies(path: Optional[str]) -> List[RetentionPolicy]:
+    if not path:
+        return []
+    with open(path) as f:
+        return [RetentionPolicy(**policy) for policy in json.load(f)]
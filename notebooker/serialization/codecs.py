@@ -0,0 +1,50 @@
+"""
+Codecs for compressing the large text fields of a result (raw_html and raw_ipynb_json) before they are stored.
+Documents record the codec which was used in their "payload_codec" field; documents without one were saved
+uncompressed. zstd needs the optional zstandard package (notebooker[zstd]).
+"""
+import zlib
+from typing import AnyStr, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+NO_CODEC = "none"
+ZLIB = "zlib"
+ZSTD = "zstd"
+PAYLOAD_CODECS = (NO_CODEC, ZLIB, ZSTD)
+# The fields of a completed result which are compressed.
+COMPRESSED_FIELDS = ("raw_html", "raw_ipynb_json")
+
+
+def check_codec(codec: str) -> str:
+    if codec not in PAYLOAD_CODECS:
+        raise ValueError("Unknown payload codec {}. Supported: {}".format(codec, list(PAYLOAD_CODECS)))
+    if codec == ZSTD and zstandard is None:
+        raise ValueError("The zstd payload codec needs the zstandard package: pip install notebooker[zstd]")
+    return codec
+
+
+def compress_payload(value: Optional[str], codec: str) -> Optional[AnyStr]:
+    if codec == NO_CODEC or not isinstance(value, str) or not value:
+        return value
+    data = value.encode("utf-8")
+    if codec == ZLIB:
+        return zlib.compress(data)
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor().compress(data)
+    raise ValueError("Unknown payload codec {}".format(codec))
+
+
+def decompress_payload(value: Optional[AnyStr], codec: Optional[str]) -> Optional[str]:
+    if codec in (None, NO_CODEC) or not isinstance(value, bytes):
+        return value
+    if codec == ZLIB:
+        return zlib.decompress(value).decode("utf-8")
+    if codec == ZSTD:
+        if zstandard is None:
+            raise ValueError("This result was compressed with zstd, which needs the zstandard package.")
+        return zstandard.ZstdDecompressor().decompress(value).decode("utf-8")
+    raise ValueError("Unknown payload codec {}".format(codec))
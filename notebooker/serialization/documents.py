@@ -0,0 +1,519 @@
+"""
+Building and reading the documents which the result serializers store, and the filters which find them. Nothing
+here does any I/O, so that each serializer only has to read and write the documents in its own way.
+"""
+
+import base64
+import datetime
+import hashlib
+import json
+from collections import Counter
+from logging import getLogger
+from typing import Any, AnyStr, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import pymongo
+
+from notebooker.constants import (
+    ALLOWED_STATUS_TRANSITIONS,
+    PAYLOAD_NOT_LOADED,
+    JobStatus,
+    LazyNotebookResultComplete,
+    LazyResourceOutputs,
+    NotebookResultComplete,
+    NotebookResultError,
+    NotebookResultPending,
+)
+from notebooker.retention import RetentionPolicy
+from notebooker.serialization.codecs import COMPRESSED_FIELDS, compress_payload, decompress_payload
+
+logger = getLogger(__name__)
+
+# Listings leave out everything which is only needed to display a result.
+LISTING_PROJECTION = {"raw_html_resources": 0, "raw_html": 0, "raw_ipynb_json": 0, "stdout": 0, "_id": 0}
+# The fields of a result document which get_latest_successful_results_for_name_all_params() leaves out.
+LATEST_SUCCESSFUL_PROJECTION = {"_id": 0, "raw_html": 0, "raw_ipynb_json": 0, "stdout": 0}
+# The fields of a result document which are needed to keep the latest pointers up to date.
+LATEST_POINTER_PROJECTION = {
+    "_id": 0,
+    "job_id": 1,
+    "report_name": 1,
+    "overrides": 1,
+    "overrides_hash": 1,
+    "status": 1,
+    "update_time": 1,
+}
+# The latest pointers for a report irrespective of its overrides use this in place of an overrides hash.
+ALL_OVERRIDES = "*"
+# Retention policies never expire results in these statuses: deleted results are removed anyway, and the rest are
+# still running.
+UNEXPIRING_STATUSES = (JobStatus.DELETED, JobStatus.SUBMITTED, JobStatus.PENDING)
+_PAGE_TOKEN_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def check_stub(
+    job_id: str,
+    report_name: str,
+    report_title: Optional[str] = "",
+    job_start_time: Optional[datetime.datetime] = None,
+    status: JobStatus = JobStatus.PENDING,
+    overrides: Optional[Dict] = None,
+    mailto: str = "",
+    generate_pdf_output: bool = True,
+) -> NotebookResultPending:
+    """ The result which save_check_stub() saves for a job which is just starting. """
+    return NotebookResultPending(
+        job_id=job_id,
+        status=status,
+        report_title=report_title or report_name,
+        job_start_time=job_start_time or datetime.datetime.now(),
+        report_name=report_name,
+        mailto=mailto,
+        generate_pdf_output=generate_pdf_output,
+        overrides=overrides or {},
+    )
+
+
+def split_payload(notebook_result) -> Tuple[Dict, Dict[str, Optional[str]]]:
+    """
+    The result document to save for a result, and its payload (raw_html and raw_ipynb_json), which is stored apart
+    from it. stdout is left out of both, since it is appended to its own log as the job runs.
+    """
+    out_data = notebook_result.saveable_output()
+    out_data.pop("stdout", None)
+    payload = {field: out_data.pop(field) for field in COMPRESSED_FIELDS if field in out_data}
+    return out_data, payload
+
+
+def stamp_result_document(out_data: Dict) -> Dict:
+    """ Sets the update_time and overrides_hash of a result document which is about to be saved. """
+    out_data["update_time"] = datetime.datetime.now()
+    out_data["overrides_hash"] = overrides_hash(out_data.get("overrides"))
+    return out_data
+
+
+def hash_outputs(notebook_result) -> Dict[str, AnyStr]:
+    """
+    Records the content hash of each of a completed result's outputs in its raw_html_resources, and returns the
+    outputs to store as blobs (hash -> bytes). Results without outputs have nothing to store.
+    """
+    if not isinstance(notebook_result, NotebookResultComplete) or not notebook_result.raw_html_resources:
+        return {}
+    outputs = notebook_result.raw_html_resources.get("outputs") or {}
+    hashes = [content_hash(binary_data) for binary_data in outputs.values()]
+    if hashes:
+        notebook_result.raw_html_resources["output_hashes"] = hashes
+    return dict(zip(hashes, outputs.values()))
+
+
+def output_hashes(document: Optional[Dict]) -> Dict[str, str]:
+    """ path -> content hash for each of a result's outputs, or {} if it was saved before outputs were hashed. """
+    resources = (document or {}).get("raw_html_resources") or {}
+    return dict(zip(resources.get("outputs", []), resources.get("output_hashes", [])))
+
+
+def status_transition_filter(status: JobStatus) -> Dict[str, Any]:
+    """ Matches the results which are allowed to move into the given status (see ALLOWED_STATUS_TRANSITIONS). """
+    return {"status": {"$in": [previous.value for previous in ALLOWED_STATUS_TRANSITIONS[status]]}}
+
+
+def can_transition(job_id: str, existing: Optional[Dict], status: JobStatus) -> bool:
+    """
+    Whether a job whose result document is `existing` (None if it has none) may move into the given status. Logs
+    why not if it can't.
+    """
+    if existing is None:
+        logger.warning(
+            "Couldn't update check status to {} for job id {} since it is not in the database.".format(status, job_id)
+        )
+        return False
+    previous = JobStatus.from_string(existing.get("status"))
+    if previous not in ALLOWED_STATUS_TRANSITIONS[status]:
+        logger.warning(
+            "Not updating check status for job id {} since it can't move from {} to {}.".format(
+                job_id, previous, status
+            )
+        )
+        return False
+    return True
+
+
+def can_replace(existing: Optional[Dict], out_data: Dict) -> bool:
+    """
+    Whether a result document may be saved over `existing`, the one its job has so far (None if it has none): only
+    by a result whose status the existing one is allowed to move into. Logs why not if it can't.
+    """
+    return existing is None or can_transition(out_data["job_id"], existing, JobStatus.from_string(out_data["status"]))
+
+
+def replace_filter(out_data: Dict) -> Dict[str, Any]:
+    """ Matches the existing result of a result document's job, if it may be replaced by it (see can_replace()). """
+    mongo_filter = {"job_id": out_data["job_id"]}
+    mongo_filter.update(status_transition_filter(JobStatus.from_string(out_data["status"])))
+    return mongo_filter
+
+
+def result_filter(
+    report_name: str,
+    overrides: Optional[Dict] = None,
+    status: Optional[JobStatus] = None,
+    as_of: Optional[datetime.datetime] = None,
+) -> Dict[str, Any]:
+    mongo_filter = {"report_name": report_name}
+    if overrides is not None:
+        # BSON document comparisons are order-specific but we want to compare overrides irrespective of order,
+        # so we match on a hash of their canonical form instead.
+        mongo_filter["overrides_hash"] = overrides_hash(overrides)
+    if status is not None:
+        mongo_filter["status"] = status.value
+    if as_of is not None:
+        mongo_filter["update_time"] = {"$lt": as_of}
+    return mongo_filter
+
+
+def listing_filter(mongo_filter: Optional[Dict] = None, since: Optional[datetime.datetime] = None) -> Dict[str, Any]:
+    """ The filter for listing results which haven't been deleted, optionally only those updated after since. """
+    base_filter = {"status": {"$ne": JobStatus.DELETED.value}}
+    if mongo_filter:
+        base_filter.update(mongo_filter)
+    if since:
+        base_filter.update({"update_time": {"$gt": since}})
+    return base_filter
+
+
+def results_page_filter(
+    report_name: Optional[str] = None,
+    status: Optional[JobStatus] = None,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+) -> Dict[str, Any]:
+    """
+    The filter for get_results_page(): results which haven't been deleted, optionally by report name, status and
+    since <= update_time < until. Deleted results are never listed, so asking for them is a ValueError.
+    """
+    if status == JobStatus.DELETED:
+        raise ValueError("Deleted results aren't listed, so can't be filtered on.")
+    mongo_filter = {"status": {"$ne": JobStatus.DELETED.value}}
+    if report_name is not None:
+        mongo_filter["report_name"] = report_name
+    if status is not None:
+        mongo_filter["status"] = status.value
+    update_time_range = {}
+    if since is not None:
+        update_time_range["$gte"] = since
+    if until is not None:
+        update_time_range["$lt"] = until
+    if update_time_range:
+        mongo_filter["update_time"] = update_time_range
+    return mongo_filter
+
+
+def split_page(docs: List[Dict], page_size: int) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Given up to page_size + 1 result documents in page order, the page_size of them which make up the page and the
+    token of the page after it, or None if there are no more.
+    """
+    if len(docs) <= page_size:
+        return docs, None
+    docs = docs[:page_size]
+    return docs, encode_page_token(docs[-1]["update_time"], docs[-1]["job_id"])
+
+
+def expiring_filter(report_name: str) -> Dict[str, Any]:
+    """ The results of a report which its retention policy can expire. """
+    return {"report_name": report_name, "status": {"$nin": [status.value for status in UNEXPIRING_STATUSES]}}
+
+
+def expired_job_ids(docs: Iterable[Dict], policy: RetentionPolicy, now: datetime.datetime) -> Iterator[str]:
+    """ The job ids of those of a report's expiring_filter() results, newest first, which its policy expires. """
+    # How many results we've seen so far for each set of parameters.
+    positions = Counter()
+    for doc in docs:
+        key = doc.get("overrides_hash") or overrides_hash(doc.get("overrides"))
+        positions[key] += 1
+        if policy.is_expired(positions[key], now - doc["update_time"]):
+            yield doc["job_id"]
+
+
+def latest_per_overrides(docs: Iterable[Dict]) -> List[Dict]:
+    """ The first of some result documents, newest first, for each set of parameters. """
+    latest = {}
+    for doc in docs:
+        latest.setdefault(doc.get("overrides_hash") or overrides_hash(doc.get("overrides")), doc)
+    return list(latest.values())
+
+
+def result_from_document(
+    result: Dict, payload_source=None
+) -> Union[NotebookResultError, NotebookResultComplete, NotebookResultPending, None]:
+    """
+    Converts a result document into a result object. With a payload_source, completed results are returned with
+    their payload and outputs loaded lazily from it; otherwise they hold whatever the document holds.
+    """
+    if not result:
+        return None
+
+    status = result.get("status", "")
+    job_status = JobStatus.from_string(status)
+    if job_status is None:
+        return None
+    cls = {
+        JobStatus.CANCELLED: NotebookResultError,
+        JobStatus.DONE: NotebookResultComplete,
+        JobStatus.PENDING: NotebookResultPending,
+        JobStatus.ERROR: NotebookResultError,
+        JobStatus.SUBMITTED: NotebookResultPending,
+        JobStatus.TIMEOUT: NotebookResultError,
+        JobStatus.DELETED: None,
+    }.get(job_status)
+    if cls is None:
+        return None
+
+    if cls == NotebookResultComplete and payload_source is not None:
+        # The heavy parts of the result are only read from storage when they are first accessed.
+        raw_html_resources = dict(result.get("raw_html_resources", {}))
+        raw_html_resources["outputs"] = LazyResourceOutputs(result["job_id"], raw_html_resources.get("outputs", []))
+        return LazyNotebookResultComplete(
+            job_id=result["job_id"],
+            job_start_time=result["job_start_time"],
+            report_name=result["report_name"],
+            status=job_status,
+            update_time=result["update_time"],
+            job_finish_time=result["job_finish_time"],
+            raw_html_resources=raw_html_resources,
+            raw_ipynb_json=decoded_field(result, "raw_ipynb_json", PAYLOAD_NOT_LOADED),
+            raw_html=decoded_field(result, "raw_html", PAYLOAD_NOT_LOADED),
+            pdf=PAYLOAD_NOT_LOADED if result.get("generate_pdf_output") else "",
+            overrides=result.get("overrides", {}),
+            generate_pdf_output=result.get("generate_pdf_output", True),
+            report_title=result.get("report_title", result["report_name"]),
+            mailto=result.get("mailto", ""),
+            stdout=result.get("stdout", []),
+            payload_source=payload_source,
+        )
+    elif cls == NotebookResultComplete:
+        return NotebookResultComplete(
+            job_id=result["job_id"],
+            job_start_time=result["job_start_time"],
+            report_name=result["report_name"],
+            status=job_status,
+            update_time=result["update_time"],
+            job_finish_time=result["job_finish_time"],
+            raw_html_resources=result.get("raw_html_resources", {}),
+            raw_ipynb_json=decoded_field(result, "raw_ipynb_json"),
+            raw_html=decoded_field(result, "raw_html"),
+            pdf=result.get("pdf", ""),
+            overrides=result.get("overrides", {}),
+            generate_pdf_output=result.get("generate_pdf_output", True),
+            report_title=result.get("report_title", result["report_name"]),
+            mailto=result.get("mailto", ""),
+            stdout=result.get("stdout", []),
+        )
+    elif cls == NotebookResultPending:
+        return NotebookResultPending(
+            job_id=result["job_id"],
+            job_start_time=result["job_start_time"],
+            report_name=result["report_name"],
+            status=job_status,
+            update_time=result["update_time"],
+            overrides=result.get("overrides", {}),
+            generate_pdf_output=result.get("generate_pdf_output", True),
+            report_title=result.get("report_title", result["report_name"]),
+            mailto=result.get("mailto", ""),
+            stdout=result.get("stdout", []),
+        )
+
+    elif cls == NotebookResultError:
+        return NotebookResultError(
+            job_id=result["job_id"],
+            job_start_time=result["job_start_time"],
+            report_name=result["report_name"],
+            status=job_status,
+            update_time=result["update_time"],
+            error_info=result["error_info"],
+            overrides=result.get("overrides", {}),
+            generate_pdf_output=result.get("generate_pdf_output", True),
+            report_title=result.get("report_title", result["report_name"]),
+            mailto=result.get("mailto", ""),
+            stdout=result.get("stdout", []),
+        )
+    else:
+        raise ValueError("Could not deserialise {} into result object.".format(result))
+
+
+def decoded_field(result: Dict, field: str, default: Any = None) -> Any:
+    """ Reads one of the possibly-compressed payload fields from a result document. """
+    if field not in result:
+        return default
+    return decompress_payload(result[field], result.get("payload_codec"))
+
+
+def payload_document(job_id: str, payload: Dict[str, Optional[str]], payload_codec: str) -> Dict:
+    """ The document which holds a result's payload in the payload collection, compressed with payload_codec. """
+    payload_doc = {field: compress_payload(value, payload_codec) for field, value in payload.items()}
+    payload_bytes = sum(len(value) for value in payload_doc.values() if isinstance(value, (bytes, str)))
+    payload_doc.update({"job_id": job_id, "payload_codec": payload_codec, "payload_bytes": payload_bytes})
+    return payload_doc
+
+
+def stdout_chunk(job_id: str, seq: int, first_line: int, lines: List[str]) -> Dict:
+    """ The seq'th chunk of a job's stdout log, which holds lines [first_line, first_line + len(lines)). """
+    return {"job_id": job_id, "seq": seq, "first_line": first_line, "end_line": first_line + len(lines), "lines": lines}
+
+
+def stdout_lines(chunks: Iterable[Dict], offset: int = 0) -> List[str]:
+    """ The lines of a job's stdout from the given line number, given its chunks in order which end after it. """
+    lines = []
+    for chunk in chunks:
+        lines.extend(chunk["lines"][max(offset - chunk["first_line"], 0) :])
+    return lines
+
+
+def overrides_hash(overrides: Optional[Dict]) -> str:
+    """ A hash of the canonical JSON of some overrides, so that equal overrides hash equally whatever their order. """
+    canonical = json.dumps(overrides or {}, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def encode_page_token(update_time: datetime.datetime, job_id: str) -> str:
+    token = json.dumps([update_time.strftime(_PAGE_TOKEN_TIME_FORMAT), job_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(token).decode("ascii")
+
+
+def decode_page_token(page_token: str) -> Tuple[datetime.datetime, str]:
+    try:
+        update_time, job_id = json.loads(base64.urlsafe_b64decode(page_token.encode("ascii")))
+        return datetime.datetime.strptime(update_time, _PAGE_TOKEN_TIME_FORMAT), job_id
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid page token: {}".format(page_token)) from e
+
+
+def latest_successful_all_params_pipeline(report_name: str, projection: Dict[str, int]) -> List[Dict]:
+    """
+    An aggregation for the newest successful result document of each parameter variant of a given name. Variants are
+    told apart by overrides_hash, so overrides given in a different order are the same variant; results saved before
+    overrides were hashed are grouped on their raw overrides until backfill_overrides_hashes() has been run. The
+    projection must keep overrides_hash and overrides.
+    """
+    return [
+        {"$match": result_filter(report_name, status=JobStatus.DONE)},
+        # The (report_name, overrides_hash, status, update_time) index returns documents in this order, so nothing
+        # is sorted in memory.
+        {"$sort": {"overrides_hash": pymongo.ASCENDING, "update_time": pymongo.DESCENDING}},
+        # Projecting before grouping keeps the fields we don't need out of the group stage.
+        {"$project": projection},
+        {"$group": {"_id": {"$ifNull": ["$overrides_hash", "$overrides"]}, "result": {"$first": "$$ROOT"}}},
+        {"$replaceRoot": {"newRoot": "$result"}},
+    ]
+
+
+def blob_ref_increments(blobs: Dict[str, bytes]) -> List[pymongo.UpdateOne]:
+    """
+    Upserts which take a reference on each blob (hash -> bytes), creating the refs of blobs which are new. New refs
+    are pending until the blob's bytes have been written, since until then there is nothing to deduplicate against.
+    """
+    return [
+        pymongo.UpdateOne(
+            {"_id": blob_hash},
+            {"$inc": {"refcount": 1}, "$setOnInsert": {"size": len(data), "pending": True}},
+            upsert=True,
+        )
+        for blob_hash, data in blobs.items()
+    ]
+
+
+def batches(iterable: Iterable, batch_size: int) -> Iterator[List]:
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stdout_collection_name(result_collection_name: str) -> str:
+    return "{}_STDOUT".format(result_collection_name)
+
+
+def payload_collection_name(result_collection_name: str) -> str:
+    return "{}_PAYLOAD".format(result_collection_name)
+
+
+def latest_pointers_collection_name(result_collection_name: str) -> str:
+    return "{}_LATEST".format(result_collection_name)
+
+
+def latest_pointer_id(report_name: str, overrides_hash: str) -> Dict[str, str]:
+    return {"report_name": report_name, "overrides_hash": overrides_hash}
+
+
+def _latest_pointer_ids(report_name: str, overrides_hash: str) -> List[Dict[str, str]]:
+    """ A result moves the pointers for its own overrides and those for its report as a whole. """
+    return [latest_pointer_id(report_name, overrides_hash), latest_pointer_id(report_name, ALL_OVERRIDES)]
+
+
+def latest_pointer_advances(
+    report_name: str, overrides_hash: str, job_id: str, update_time: datetime.datetime, successful: bool
+) -> List[Tuple[Dict, Dict]]:
+    """
+    The (filter, update) upserts which point the latest (and, if successful, the latest successful) pointers for
+    this report at the given job, unless they already point at something newer. As the upserts are conditional,
+    concurrent saves can't move a pointer backwards: if the pointer exists but is newer, the upsert collides with it
+    and fails with a DuplicateKeyError, which should be ignored.
+    """
+    fields = ("latest", "latest_successful") if successful else ("latest",)
+    return [
+        (
+            {
+                "_id": pointer_id,
+                "$or": [{"{}.update_time".format(field): {"$lte": update_time}}, {field: {"$exists": False}}],
+            },
+            {"$set": {field: {"job_id": job_id, "update_time": update_time}}},
+        )
+        for pointer_id in _latest_pointer_ids(report_name, overrides_hash)
+        for field in fields
+    ]
+
+
+def latest_pointer_repoints(report_name: str, overrides_hash: str) -> List[Tuple[Dict, str, Dict]]:
+    """ (pointer _id, field, the filter for the newest result it should point at) for each pointer of a result. """
+    repoints = []
+    for pointer_id in _latest_pointer_ids(report_name, overrides_hash):
+        for field, status_filter in (
+            ("latest", {"$ne": JobStatus.DELETED.value}),
+            ("latest_successful", JobStatus.DONE.value),
+        ):
+            mongo_filter = {"report_name": report_name, "status": status_filter}
+            if pointer_id["overrides_hash"] != ALL_OVERRIDES:
+                mongo_filter["overrides_hash"] = overrides_hash
+            repoints.append((pointer_id, field, mongo_filter))
+    return repoints
+
+
+def repoint_update(pointer_id: Dict, field: str, deleted_job_id: str, newest: Optional[Dict]) -> Tuple[Dict, Dict]:
+    """ The (filter, update) which moves a pointer off a deleted job onto the newest result, if it's still on it. """
+    update = {"$set": {field: newest}} if newest else {"$unset": {field: ""}}
+    return {"_id": pointer_id, "{}.job_id".format(field): deleted_job_id}, update
+
+
+def job_file_metadata(job_id: str, result_collection_name: str) -> Dict[str, str]:
+    """
+    The GridFS metadata of a result's PDF. Every result collection in a database shares the notebook_data bucket, so
+    this records which one the result is in as well as its job_id.
+    """
+    return {"job_id": job_id, "result_collection": result_collection_name}
+
+
+def pdf_filename(job_id: str) -> str:
+    return "{}.pdf".format(job_id)
+
+
+def content_hash(binary_data: AnyStr) -> str:
+    if isinstance(binary_data, str):
+        binary_data = binary_data.encode("utf-8")
+    return hashlib.sha256(binary_data).hexdigest()
+
+
+def blob_filename(content_hash: str) -> str:
+    return "sha256:{}".format(content_hash)
@@ -0,0 +1,155 @@
+"""
+A queue of submitted notebook executions kept in mongo, next to the results, so that `notebooker-cli worker`
+processes on any number of hosts can share the work which a webapp submits. A worker claims a job by atomically
+taking a lease on it, and keeps the lease alive with heartbeats while the job runs. If the worker disappears, the
+lease expires and another worker claims the job again, until it has been started max_attempts times, after which the
+job is failed.
+"""
+import datetime
+from logging import getLogger
+from typing import Any, Dict, List, Optional
+
+import pymongo
+
+from notebooker.constants import JobStatus
+from notebooker.serialization.mongo import MongoResultSerializer
+from notebooker.utils.metrics import counter
+
+logger = getLogger(__name__)
+
+JOBS_CLAIMED = counter("notebooker_job_queue_claimed", "Queued jobs which a worker has claimed.", ["attempt"])
+LEASES_EXPIRED = counter(
+    "notebooker_job_queue_leases_expired", "Jobs which were failed because their workers stopped heartbeating."
+)
+
+QUEUED = "queued"
+CLAIMED = "claimed"
+# The collections which have already had their indexes ensured by this process.
+_INDEXED_COLLECTIONS = set()
+
+
+class MongoJobQueue:
+    """
+    Submitted jobs waiting to be executed, in the mongo collection named after the result collection. Each job is the
+    arguments of an `execute-notebook` command, which the worker runs with its own global options.
+    """
+
+    def __init__(self, serializer: MongoResultSerializer, lease_seconds: float = 60, max_attempts: int = 3):
+        if not isinstance(serializer, MongoResultSerializer):
+            raise ValueError(
+                "The job queue is kept in mongo, so it needs a mongo serializer, not {}.".format(serializer.get_name())
+            )
+        if max_attempts < 1:
+            raise ValueError("A job must be allowed at least one attempt, not {}.".format(max_attempts))
+        self.serializer = serializer
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.collection_name = _job_queue_collection_name(serializer.result_collection_name)
+        self.collection = serializer.get_mongo_database()[self.collection_name]
+        key = (serializer.mongo_host, serializer.database_name, self.collection_name)
+        if key not in _INDEXED_COLLECTIONS:
+            self.collection.create_index([("job_id", pymongo.ASCENDING)], unique=True)
+            self.collection.create_index([("state", pymongo.ASCENDING), ("submitted_at", pymongo.ASCENDING)])
+            self.collection.create_index([("state", pymongo.ASCENDING), ("lease_expires_at", pymongo.ASCENDING)])
+            _INDEXED_COLLECTIONS.add(key)
+
+    def submit(self, job_id: str, execute_notebook_args: List[str]) -> None:
+        """ Queues a job, which must already have a SUBMITTED result stub, behind everything queued before it. """
+        self.collection.insert_one(
+            {
+                "job_id": job_id,
+                "args": list(execute_notebook_args),
+                "state": QUEUED,
+                "submitted_at": _now(),
+                "attempts": 0,
+                "worker": None,
+                "lease_expires_at": None,
+            }
+        )
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Atomically takes a lease on the job which has been waiting longest, or on a job whose previous worker's
+        lease has expired and which has attempts left. Returns the job, or None if there is nothing to run.
+        """
+        now = _now()
+        job = self.collection.find_one_and_update(
+            {
+                "$or": [
+                    {"state": QUEUED},
+                    {"state": CLAIMED, "lease_expires_at": {"$lt": now}, "attempts": {"$lt": self.max_attempts}},
+                ]
+            },
+            {
+                "$set": {"state": CLAIMED, "worker": worker_id, "lease_expires_at": self._lease_expiry(now)},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("submitted_at", pymongo.ASCENDING)],
+            projection={"_id": 0},
+            return_document=pymongo.ReturnDocument.AFTER,
+        )
+        if job is not None:
+            JOBS_CLAIMED.labels(str(min(job["attempts"], self.max_attempts))).inc()
+            if job["attempts"] > 1:
+                logger.warning("Job %s is being retried after its last worker's lease expired.", job["job_id"])
+        return job
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        """ Extends the worker's lease on a job. Returns False if the worker no longer holds the lease. """
+        return bool(
+            self.collection.update_one(
+                {"job_id": job_id, "worker": worker_id, "state": CLAIMED},
+                {"$set": {"lease_expires_at": self._lease_expiry(_now())}},
+            ).matched_count
+        )
+
+    def complete(self, job_id: str, worker_id: str) -> bool:
+        """ Removes a job which the worker has finished with. Returns False if the worker no longer held it. """
+        return bool(self.collection.delete_one({"job_id": job_id, "worker": worker_id}).deleted_count)
+
+    def fail_expired(self) -> List[str]:
+        """
+        Fails the jobs whose lease has expired on their last attempt, marking their results as errors.
+        Returns their job IDs.
+        """
+        expired = {"state": CLAIMED, "lease_expires_at": {"$lt": _now()}, "attempts": {"$gte": self.max_attempts}}
+        failed = []
+        for job in self.collection.find(expired, {"_id": 0, "job_id": 1, "attempts": 1}):
+            # Another worker may be failing it too; only whichever removes it updates the result.
+            if self.collection.delete_one(dict(expired, job_id=job["job_id"])).deleted_count:
+                error_info = "The worker running this job stopped responding on each of its {} attempts.".format(
+                    job["attempts"]
+                )
+                self.serializer.update_check_status(job["job_id"], JobStatus.ERROR, error_info=error_info)
+                LEASES_EXPIRED.inc()
+                failed.append(job["job_id"])
+        if failed:
+            logger.error("Failed jobs %s, whose workers stopped responding.", failed)
+        return failed
+
+    def queue_status(self, job_id: str) -> Optional[Dict[str, float]]:
+        """
+        For a job which is waiting to be claimed, its 1-based "queue_position" and how many seconds it has been
+        queued for ("queued_seconds"). None if the job isn't waiting in the queue.
+        """
+        job = self.collection.find_one({"job_id": job_id, "state": QUEUED}, {"_id": 0, "submitted_at": 1})
+        if job is None:
+            return None
+        ahead = self.collection.count_documents({"state": QUEUED, "submitted_at": {"$lt": job["submitted_at"]}})
+        return {
+            "queue_position": ahead + 1,
+            "queued_seconds": round((_now() - job["submitted_at"]).total_seconds(), 1),
+        }
+
+    def _lease_expiry(self, now: datetime.datetime) -> datetime.datetime:
+        return now + datetime.timedelta(seconds=self.lease_seconds)
+
+
+def _now() -> datetime.datetime:
+    # Leases are compared across hosts, so they are kept in UTC. Mongo stores datetimes to the millisecond.
+    now = datetime.datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def _job_queue_collection_name(result_collection_name: str) -> str:
+    return "{}_JOB_QUEUE".format(result_collection_name)
@@ -0,0 +1,536 @@
+"""
+A result serializer which keeps everything in process-local data structures, for tests and benchmarks of the
+webapp and executors which shouldn't depend on a mongod. It offers the same methods as MongoResultSerializer and
+returns the same results, storing payloads compressed and outputs as content-addressed blobs in GridFS-like files.
+
+Serializers with the same store name share one store, so the webapp, report hunter and anything else in the process
+see the same results. Nothing is shared with other processes, so reports must be executed in-process (e.g. by
+calling notebooker.execute_notebook.run_report directly) rather than through `notebooker-cli execute-notebook`.
+"""
+
+import copy
+import datetime
+import threading
+from collections import Counter, defaultdict
+from logging import getLogger
+from typing import Any, AnyStr, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import click
+
+from notebooker.constants import (
+    JobStatus,
+    LazyNotebookResultComplete,
+    NotebookResultComplete,
+    NotebookResultError,
+    NotebookResultPending,
+)
+from notebooker.retention import RetentionPolicy, find_retention_policy
+from notebooker.serialization import documents
+from notebooker.serialization.codecs import ZLIB, check_codec
+from notebooker.serialization.mongo import (
+    OUTPUT_BLOB_BYTES_DEDUPLICATED,
+    OUTPUT_BLOB_BYTES_SAVED,
+    OUTPUT_BLOB_BYTES_STORED,
+    OUTPUT_BLOB_DEDUP_RATIO,
+    MongoResultSerializer,
+)
+
+logger = getLogger(__name__)
+# The operators which _matches() understands, beyond plain equality.
+_FILTER_OPERATORS = {
+    "$ne": lambda value, operand: value != operand,
+    "$lt": lambda value, operand: value is not None and value < operand,
+    "$lte": lambda value, operand: value is not None and value <= operand,
+    "$gt": lambda value, operand: value is not None and value > operand,
+    "$gte": lambda value, operand: value is not None and value >= operand,
+    "$in": lambda value, operand: value in operand,
+    "$nin": lambda value, operand: value not in operand,
+    "$exists": lambda value, operand: (value is not None) == bool(operand),
+}
+
+
+class MemoryStore:
+    """ Everything which an in-memory serializer stores. Hold the lock while reading or writing any of it. """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # job_id -> result document
+        self.results: Dict[str, Dict] = {}
+        # job_id -> the lines of the job's stdout
+        self.stdout: Dict[str, List[str]] = defaultdict(list)
+        # job_id -> the payload document, as in MongoResultSerializer's payload collection
+        self.payloads: Dict[str, Dict] = {}
+        # filename -> {"data": bytes, "length": int, "metadata": dict}, like GridFS
+        self.files: Dict[str, Dict] = {}
+        # content hash -> {"refcount": int, "size": int}
+        self.blob_refs: Dict[str, Dict] = {}
+
+    def clear(self) -> None:
+        with self.lock:
+            for data in (self.results, self.stdout, self.payloads, self.files, self.blob_refs):
+                data.clear()
+
+
+# store name -> the MemoryStore which every serializer with that name in this process uses.
+_STORES: Dict[str, MemoryStore] = defaultdict(MemoryStore)
+
+
+def clear_memory_stores() -> None:
+    """ Forgets every result held in memory, e.g. between tests. """
+    for store in list(_STORES.values()):
+        store.clear()
+
+
+class BaseInMemoryResultSerializer:
+    # This class is the interface between process memory and the rest of the application
+
+    def __init__(self, memory_store_name: str = "default", payload_codec: str = ZLIB):
+        self.memory_store_name = memory_store_name
+        self.payload_codec = check_codec(payload_codec)
+        self.store = _STORES[memory_store_name]
+
+    def __init_subclass__(cls, cli_options: click.Command = None, **kwargs):
+        if cli_options is None:
+            raise ValueError(
+                "A BaseInMemoryResultSerializer has been declared without cli_options. "
+                "Please add them like so: `class MySerializer(cli_options=cli_opts)`."
+            )
+        cls.cli_options = cli_options
+        super().__init_subclass__(**kwargs)
+
+    serializer_args_to_cmdline_args = MongoResultSerializer.serializer_args_to_cmdline_args
+
+    @classmethod
+    def get_name(cls):
+        return cls.__name__
+
+    def close(self) -> None:
+        pass
+
+    def ensure_indexes(self, force: bool = False) -> None:
+        """ Nothing to do: every query scans the results in memory. """
+
+    def _matching(self, mongo_filter: Dict) -> List[Dict]:
+        """ The stored result documents which match the filter, newest first. Don't modify them. """
+        with self.store.lock:
+            docs = [doc for doc in self.store.results.values() if _matches(doc, mongo_filter)]
+        return sorted(docs, key=lambda doc: (doc["update_time"], doc["job_id"]), reverse=True)
+
+    def _find(self, mongo_filter: Dict, limit: Optional[int] = 0) -> List[Dict]:
+        """ Copies of the result documents which match the filter, newest first. A limit of 0 means no limit. """
+        docs = self._matching(mongo_filter)
+        return copy.deepcopy(docs[:limit] if limit else docs)
+
+    def _get_document(self, job_id: str) -> Optional[Dict]:
+        with self.store.lock:
+            return copy.deepcopy(self.store.results.get(job_id))
+
+    def _save_to_db(self, notebook_result) -> bool:
+        """
+        Saves a result unless its job already has a result which can't move into its status (see
+        ALLOWED_STATUS_TRANSITIONS). Returns whether it was saved.
+        """
+        out_data, payload = documents.split_payload(notebook_result)
+        with self.store.lock:
+            if not documents.can_replace(self.store.results.get(out_data["job_id"]), out_data):
+                return False
+            if payload:
+                self.store.payloads[out_data["job_id"]] = documents.payload_document(
+                    out_data["job_id"], payload, self.payload_codec
+                )
+            self.store.results[out_data["job_id"]] = copy.deepcopy(documents.stamp_result_document(out_data))
+        return True
+
+    def update_stdout(self, job_id: str, new_lines: List[str]) -> None:
+        """ Appends lines to the job's stdout log. """
+        with self.store.lock:
+            self.store.stdout[job_id].extend(new_lines)
+
+    def get_stdout(self, job_id: str, offset: int = 0) -> List[str]:
+        """ Gets the lines of a job's stdout, starting from the given line number. """
+        with self.store.lock:
+            return list(self.store.stdout.get(job_id, [])[offset:])
+
+    def _move_to_status(self, job_id: str, status: JobStatus, extra: Dict) -> bool:
+        with self.store.lock:
+            result = self.store.results.get(job_id)
+            if not documents.can_transition(job_id, result, status):
+                return False
+            result.update(copy.deepcopy(extra), status=status.value, update_time=datetime.datetime.now())
+            return True
+
+    def update_check_status(self, job_id: str, status: JobStatus, **extra) -> bool:
+        """
+        Moves a job into the given status, along with any extra fields, if its current status is allowed to move into
+        the new one (see ALLOWED_STATUS_TRANSITIONS). Returns whether the job was updated.
+        """
+        return self._move_to_status(job_id, status, extra)
+
+    def update_check_statuses(self, job_ids: List[str], status: JobStatus, **extra) -> int:
+        """
+        Bulk version of update_check_status. Jobs which are not allowed to move into the given status are left alone.
+        Returns the number of jobs which were updated.
+        """
+        with self.store.lock:
+            return sum(self._move_to_status(job_id, status, extra) for job_id in job_ids)
+
+    def save_check_stub(
+        self,
+        job_id: str,
+        report_name: str,
+        report_title: Optional[str] = "",
+        job_start_time: Optional[datetime.datetime] = None,
+        status: JobStatus = JobStatus.PENDING,
+        overrides: Optional[Dict] = None,
+        mailto: str = "",
+        generate_pdf_output: bool = True,
+    ) -> None:
+        """ Call this when we are just starting a check. Saves a "pending" job into storage. """
+        self._save_to_db(
+            documents.check_stub(
+                job_id, report_name, report_title, job_start_time, status, overrides, mailto, generate_pdf_output
+            )
+        )
+
+    def save_check_result(self, notebook_result: Union[NotebookResultComplete, NotebookResultError]) -> None:
+        blobs = documents.hash_outputs(notebook_result)
+        previous_hashes = self._get_output_hashes(notebook_result.job_id).values() if blobs else []
+
+        logger.info("Saving {}".format(notebook_result.job_id))
+        if not self._save_to_db(notebook_result):
+            return
+
+        if isinstance(notebook_result, NotebookResultComplete):
+            if blobs:
+                self._store_blobs(blobs)
+                self._release_blobs(previous_hashes)
+            if notebook_result.pdf:
+                metadata = {"job_id": notebook_result.job_id}
+                self._put_file(documents.pdf_filename(notebook_result.job_id), notebook_result.pdf, metadata)
+
+    def _put_file(self, filename: str, data: AnyStr, metadata: Dict) -> None:
+        with self.store.lock:
+            self.store.files[filename] = {"data": data, "length": len(data), "metadata": metadata}
+
+    def _read_file(self, filename: str) -> AnyStr:
+        with self.store.lock:
+            stored = self.store.files.get(filename)
+        if stored is None:
+            logger.error("Could not find file %s in memory store %s", filename, self.memory_store_name)
+            return ""
+        return stored["data"]
+
+    def _store_blobs(self, blobs: Dict[str, bytes]) -> None:
+        """ Takes one reference on each content-addressed blob (hash -> bytes), storing those which are new. """
+        with self.store.lock:
+            for blob_hash, data in blobs.items():
+                ref = self.store.blob_refs.get(blob_hash)
+                if ref is not None:
+                    ref["refcount"] += 1
+                    OUTPUT_BLOB_BYTES_DEDUPLICATED.inc(len(data))
+                    continue
+                self.store.blob_refs[blob_hash] = {"refcount": 1, "size": len(data)}
+                self._put_file(documents.blob_filename(blob_hash), data, {"sha256": blob_hash})
+                OUTPUT_BLOB_BYTES_STORED.inc(len(data))
+
+    def _release_blobs(self, hashes: Iterable[str]) -> None:
+        """ Drops a result's reference on each blob, deleting any blobs which no result references any more. """
+        with self.store.lock:
+            for blob_hash in set(hashes):
+                ref = self.store.blob_refs.get(blob_hash)
+                if ref is None:
+                    continue
+                ref["refcount"] -= 1
+                if ref["refcount"] <= 0:
+                    del self.store.blob_refs[blob_hash]
+                    self.store.files.pop(documents.blob_filename(blob_hash), None)
+
+    def get_blob_stats(self) -> Dict[str, int]:
+        """
+        How well output deduplication is doing: the number of distinct blobs, the bytes they take up, and the bytes
+        the results which reference them would have taken up without deduplication.
+        """
+        with self.store.lock:
+            refs = list(self.store.blob_refs.values())
+        return {
+            "n_blobs": len(refs),
+            "stored_bytes": sum(ref["size"] for ref in refs),
+            "referenced_bytes": sum(ref["size"] * ref["refcount"] for ref in refs),
+        }
+
+    def refresh_blob_metrics(self) -> Dict[str, int]:
+        stats = self.get_blob_stats()
+        OUTPUT_BLOB_BYTES_SAVED.set(stats["referenced_bytes"] - stats["stored_bytes"])
+        OUTPUT_BLOB_DEDUP_RATIO.set(stats["referenced_bytes"] / stats["stored_bytes"] if stats["stored_bytes"] else 1.0)
+        return stats
+
+    def _convert_result(
+        self, result: Optional[Dict], load_payload: bool = True
+    ) -> Union[NotebookResultError, NotebookResultComplete, NotebookResultPending, None]:
+        return documents.result_from_document(result, payload_source=self if load_payload else None)
+
+    def get_check_result(
+        self, job_id: AnyStr
+    ) -> Optional[Union[NotebookResultError, NotebookResultComplete, NotebookResultPending]]:
+        return self._convert_result(self._get_document(job_id))
+
+    def has_pdf(self, job_id: str) -> bool:
+        """ Whether a non-empty PDF was stored for the result, without reading it. """
+        with self.store.lock:
+            return self.store.files.get(documents.pdf_filename(job_id), {}).get("length", 0) > 0
+
+    def get_result_payload(self, job_id: str, field: str) -> Any:
+        """ Reads one of raw_html, raw_ipynb_json or pdf for a completed result, for LazyNotebookResultComplete. """
+        if field == "pdf":
+            return self._read_file(documents.pdf_filename(job_id))
+        with self.store.lock:
+            payload = self.store.payloads.get(job_id, {})
+        return documents.decoded_field(payload, field)
+
+    def _get_output_hashes(self, job_id: str) -> Dict[str, str]:
+        """ path -> content hash for each of a result's outputs. """
+        return documents.output_hashes(self._get_document(job_id))
+
+    def get_result_resource(self, job_id: str, path: str) -> AnyStr:
+        """ Reads one of the outputs in raw_html_resources, for LazyNotebookResultComplete. """
+        return self.get_result_resources(job_id, [path])[path]
+
+    def get_result_resources(self, job_id: str, paths: Iterable[str]) -> Dict[str, AnyStr]:
+        """ Reads many of a job's outputs at once. """
+        output_hashes = self._get_output_hashes(job_id)
+        return {
+            path: self._read_file(documents.blob_filename(output_hashes[path])) if path in output_hashes else ""
+            for path in paths
+        }
+
+    def get_all_results(
+        self,
+        since: Optional[datetime.datetime] = None,
+        limit: Optional[int] = 100,
+        mongo_filter: Optional[Dict] = None,
+        load_payload: bool = True,
+    ) -> Iterator[Union[NotebookResultComplete, NotebookResultError, NotebookResultPending]]:
+        for doc in self._find(documents.listing_filter(mongo_filter, since), limit):
+            converted_result = self._convert_result(doc, load_payload=load_payload)
+            if isinstance(converted_result, LazyNotebookResultComplete):
+                converted_result.load_payload()
+            if converted_result is not None:
+                yield converted_result
+
+    def watch_results(self, resume_token: Optional[Dict] = None, max_await_time_ms: int = 1000):
+        """ There are no change streams in memory, so the report hunter polls for updates instead. """
+        raise NotImplementedError("The in-memory serializer has no change streams.")
+
+    def get_results_page(
+        self,
+        page_size: int = 50,
+        page_token: Optional[str] = None,
+        report_name: Optional[str] = None,
+        status: Optional[JobStatus] = None,
+        since: Optional[datetime.datetime] = None,
+        until: Optional[datetime.datetime] = None,
+    ) -> Tuple[List[Union[NotebookResultComplete, NotebookResultError, NotebookResultPending]], Optional[str]]:
+        """
+        One page of results, newest first and without their payloads, optionally filtered by report name, status
+        and update time (since <= update_time < until). Returns the page and a token which fetches the page after it,
+        or None if this is the last page.
+        """
+        docs = self._find(documents.results_page_filter(report_name, status, since, until))
+        if page_token is not None:
+            last_key = documents.decode_page_token(page_token)
+            docs = [doc for doc in docs if (doc["update_time"], doc["job_id"]) < last_key]
+        docs, next_page_token = documents.split_page(docs[: page_size + 1], page_size)
+        results = [self._convert_result(doc, load_payload=False) for doc in docs]
+        return [result for result in results if result is not None], next_page_token
+
+    def get_all_result_keys(self, limit: int = 0, mongo_filter: Optional[Dict] = None) -> List[Tuple[str, str]]:
+        return [
+            (doc["report_name"], doc["job_id"]) for doc in self._find(documents.listing_filter(mongo_filter), limit)
+        ]
+
+    def _get_all_job_ids(
+        self,
+        report_name: str,
+        overrides: Optional[Dict],
+        status: Optional[JobStatus] = None,
+        as_of: Optional[datetime.datetime] = None,
+        limit: int = 0,
+    ) -> List[str]:
+        mongo_filter = documents.result_filter(report_name, overrides, status, as_of)
+        return [x[1] for x in self.get_all_result_keys(mongo_filter=mongo_filter, limit=limit)]
+
+    def get_all_job_ids_for_name_and_params(self, report_name: str, params: Optional[Dict]) -> List[str]:
+        """ Get all the result ids for a given name and parameters, newest first """
+        return self._get_all_job_ids(report_name, params)
+
+    def get_latest_job_id_for_name_and_params(
+        self, report_name: str, params: Optional[Dict], as_of: Optional[datetime.datetime] = None
+    ) -> Optional[str]:
+        """ Get the latest result id for a given name and parameters """
+        all_job_ids = self._get_all_job_ids(report_name, params, as_of=as_of, limit=1)
+        return all_job_ids[0] if all_job_ids else None
+
+    def get_latest_successful_job_id_for_name_and_params(
+        self, report_name: str, params: Optional[Dict], as_of: Optional[datetime.datetime] = None
+    ) -> Optional[str]:
+        """ Get the latest successful job id for a given name and parameters """
+        all_job_ids = self._get_all_job_ids(report_name, params, JobStatus.DONE, as_of, limit=1)
+        return all_job_ids[0] if all_job_ids else None
+
+    def _latest_successful_all_params(self, report_name: str) -> List[Dict]:
+        return documents.latest_per_overrides(
+            self._matching(documents.result_filter(report_name, status=JobStatus.DONE))
+        )
+
+    def get_latest_successful_job_ids_for_name_all_params(self, report_name: str) -> List[str]:
+        """ Get the latest successful job ids for all parameter variants of a given name """
+        return [doc["job_id"] for doc in self._latest_successful_all_params(report_name)]
+
+    def get_latest_successful_results_for_name_all_params(
+        self, report_name: str
+    ) -> Iterator[Union[NotebookResultComplete, NotebookResultError, NotebookResultPending]]:
+        """ The latest successful result of each parameter variant of a given name, with their payloads. """
+        for doc in self._latest_successful_all_params(report_name):
+            result = self._convert_result(copy.deepcopy(doc))
+            if isinstance(result, LazyNotebookResultComplete):
+                result.load_payload()
+            if result is not None:
+                yield result
+
+    def n_all_results(self) -> int:
+        return len(self._matching(documents.listing_filter()))
+
+    def get_result_counts(self) -> Dict[str, Any]:
+        """ The number of results which haven't been deleted: in total, per status and per report. """
+        by_status, by_report = defaultdict(int), defaultdict(int)
+        for doc in self._matching(documents.listing_filter()):
+            by_status[doc["status"]] += 1
+            by_report[doc["report_name"]] += 1
+        return {"total": sum(by_status.values()), "by_status": dict(by_status), "by_report": dict(by_report)}
+
+    def delete_result(self, job_id: AnyStr) -> None:
+        self.update_check_status(job_id, JobStatus.DELETED)
+
+    def move_payloads_to_payload_collection(self, batch_size: int = 100) -> int:
+        """ Nothing to migrate: payloads have always been kept apart from the results. """
+        return 0
+
+    def tag_result_resources_with_job_ids(self, batch_size: int = 1000) -> int:
+        """ Nothing to migrate: files have always been tagged with their job_id. """
+        return 0
+
+    def backfill_overrides_hashes(self, batch_size: int = 1000) -> int:
+        """ Nothing to migrate: every result has always had an overrides_hash. """
+        return 0
+
+    def remove_duplicate_results(self) -> int:
+        """ Nothing to migrate: results have always been keyed on their job_id. """
+        return 0
+
+    def rebuild_latest_pointers(self) -> int:
+        """ Nothing to rebuild: latest results are found by scanning rather than kept in pointers. """
+        return 0
+
+    def get_expired_job_ids(
+        self, policies: List[RetentionPolicy], now: Optional[datetime.datetime] = None
+    ) -> Iterator[str]:
+        """
+        The job ids of the results which garbage collection should remove: every deleted result, and those which
+        have expired under the retention policy of their report. Results which are still running never expire.
+        """
+        for doc in self._matching({"status": JobStatus.DELETED.value}):
+            yield doc["job_id"]
+        now = now or datetime.datetime.now()
+        with self.store.lock:
+            report_names = sorted({doc["report_name"] for doc in self.store.results.values()})
+        for report_name in report_names:
+            policy = find_retention_policy(policies, report_name)
+            if policy is not None:
+                yield from documents.expired_job_ids(
+                    self._matching(documents.expiring_filter(report_name)), policy, now
+                )
+
+    def get_reclaimable_bytes(self, job_ids: List[str]) -> Dict[str, int]:
+        """
+        Roughly how much memory removing these results would free: their payloads, their PDFs, and the output blobs
+        which only they reference. Blobs which are shared with results in another call count as nothing.
+        """
+        references = Counter()
+        for job_id in job_ids:
+            references.update(set(self._get_output_hashes(job_id).values()))
+        with self.store.lock:
+            payload_bytes = sum(self.store.payloads.get(job_id, {}).get("payload_bytes", 0) for job_id in job_ids)
+            file_bytes = sum(
+                self.store.files.get(documents.pdf_filename(job_id), {}).get("length", 0) for job_id in job_ids
+            )
+            blob_bytes = sum(
+                ref["size"]
+                for blob_hash, ref in self.store.blob_refs.items()
+                if blob_hash in references and ref["refcount"] <= references[blob_hash]
+            )
+        return {"payload_bytes": payload_bytes, "file_bytes": file_bytes, "blob_bytes": blob_bytes}
+
+    def purge_results(self, job_ids: List[str]) -> int:
+        """
+        Removes results, along with their stdout, payloads and PDFs, and drops their references on output blobs.
+        Returns the number of results removed.
+        """
+        n_purged = 0
+        with self.store.lock:
+            for job_id in job_ids:
+                result = self.store.results.pop(job_id, None)
+                if result is None:
+                    continue
+                self.store.stdout.pop(job_id, None)
+                self.store.payloads.pop(job_id, None)
+                self.store.files.pop(documents.pdf_filename(job_id), None)
+                self._release_blobs((result.get("raw_html_resources") or {}).get("output_hashes", []))
+                n_purged += 1
+        return n_purged
+
+    def find_orphaned_files(self, batch_size: int = 1000) -> Iterator[Dict]:
+        """
+        Files which nothing uses any more: those of results which no longer exist, and output blobs which no result
+        references. Each is a dict of the file's _id (its filename), length and metadata.
+        """
+        with self.store.lock:
+            orphaned = [
+                {"_id": filename, "length": stored["length"], "metadata": stored["metadata"]}
+                for filename, stored in self.store.files.items()
+                if self._is_orphaned(stored["metadata"])
+            ]
+        return iter(orphaned)
+
+    def _is_orphaned(self, metadata: Dict) -> bool:
+        if "sha256" in metadata:
+            return metadata["sha256"] not in self.store.blob_refs
+        return metadata.get("job_id") not in self.store.results
+
+    def delete_orphaned_files(self, orphaned_files: List[Dict]) -> int:
+        """ Deletes files found by find_orphaned_files(), unless their result or blob has been saved again since. """
+        n_deleted = 0
+        with self.store.lock:
+            for orphaned_file in orphaned_files:
+                if self._is_orphaned(orphaned_file["metadata"]):
+                    n_deleted += self.store.files.pop(orphaned_file["_id"], None) is not None
+        return n_deleted
+
+
+def _matches(doc: Dict, mongo_filter: Dict) -> bool:
+    """ Whether a document matches a simple mongo filter: equality, comparisons, $in, $nin and $exists on fields. """
+    for field, condition in mongo_filter.items():
+        value = doc
+        for key in field.split("."):
+            value = value.get(key) if isinstance(value, dict) else None
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            if operator == "$eq":
+                if value != operand:
+                    return False
+            elif operator in _FILTER_OPERATORS:
+                if not _FILTER_OPERATORS[operator](value, operand):
+                    return False
+            else:
+                raise ValueError("Can't filter results with {} in memory.".format(operator))
+    return True
@@ -1,27 +1,96 @@
 import datetime
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
-from typing import Any, AnyStr, Dict, List, Optional, Tuple, Union, Iterator
+from typing import Any, AnyStr, Dict, Iterable, List, Optional, Set, Tuple, Union, Iterator
 
 import click
 import gridfs
 import pymongo
 from gridfs import NoFile
+from pymongo.errors import DuplicateKeyError, OperationFailure
 
-from notebooker.constants import JobStatus, NotebookResultComplete, NotebookResultError, NotebookResultPending
+from notebooker.constants import (
+    JobStatus,
+    LazyNotebookResultComplete,
+    LazyResourceOutputs,
+    NotebookResultComplete,
+    NotebookResultError,
+    NotebookResultPending,
+)
+from notebooker.retention import RetentionPolicy, find_retention_policy
+from notebooker.serialization import documents
+from notebooker.serialization.codecs import COMPRESSED_FIELDS, ZLIB, check_codec
+from notebooker.utils.metrics import counter, gauge
 
 logger = getLogger(__name__)
+MAX_CONCURRENT_RESOURCE_READS = 8
+# get_all_results() fetches the payloads of completed results from the payload collection this many at a time.
+PAYLOAD_BATCH_SIZE = 100
+OUTPUT_BLOB_BYTES_STORED = counter(
+    "notebooker_output_blob_bytes_stored", "Bytes of notebook outputs written to GridFS as new blobs."
+)
+OUTPUT_BLOB_BYTES_DEDUPLICATED = counter(
+    "notebooker_output_blob_bytes_deduplicated",
+    "Bytes of notebook outputs which were not written because an identical blob was already stored.",
+)
+OUTPUT_BLOB_DEDUP_RATIO = gauge(
+    "notebooker_output_blob_dedup_ratio",
+    "Bytes of notebook outputs referenced by results divided by the bytes actually stored.",
+)
+OUTPUT_BLOB_BYTES_SAVED = gauge(
+    "notebooker_output_blob_bytes_saved", "Bytes of storage which output deduplication is currently saving."
+)
+# The fields of a result document which purge_results() needs in order to clean up after it.
+_PURGE_PROJECTION = {**documents.LATEST_POINTER_PROJECTION, "raw_html_resources.output_hashes": 1}
+# The (host, database, collection) triples which have already had their indexes ensured by this process.
+_INDEXED_COLLECTIONS = set()
 
 
 class MongoResultSerializer:
     # This class is the interface between Mongo and the rest of the application
 
-    def __init__(self, database_name="notebooker", mongo_host="localhost", result_collection_name="NOTEBOOK_OUTPUT"):
+    def __init__(
+        self,
+        database_name="notebooker",
+        mongo_host="localhost",
+        result_collection_name="NOTEBOOK_OUTPUT",
+        payload_codec=ZLIB,
+        listing_read_preference=None,
+        result_read_preference=None,
+    ):
         self.database_name = database_name
         self.mongo_host = mongo_host
+        # How raw_html and raw_ipynb_json are compressed when saved; see notebooker.serialization.codecs.
+        self.payload_codec = check_codec(payload_codec)
         self.result_collection_name = result_collection_name
         mongo_connection = self.get_mongo_database()
         self.library = mongo_connection[result_collection_name]
+        # Job stdout is kept out of the result documents, as sequence-numbered chunks of lines.
+        self.stdout_library = mongo_connection[documents.stdout_collection_name(result_collection_name)]
+        # raw_html and raw_ipynb_json are kept out of the result documents too, so that listing and status queries
+        # only ever touch small documents.
+        self.payload_library = mongo_connection[documents.payload_collection_name(result_collection_name)]
+        # The latest and latest successful job for each report and set of overrides, kept up to date on every save so
+        # that "latest result" lookups are a point read; see _advance_latest_pointers().
+        self.latest_pointers = mongo_connection[documents.latest_pointers_collection_name(result_collection_name)]
         self.result_data_store = gridfs.GridFS(mongo_connection, "notebook_data")
+        self.result_data_files = mongo_connection["notebook_data.files"]
+        # Output blobs are stored once per distinct content; this counts how many result outputs point at each one.
+        self.blob_refs = mongo_connection["notebook_data.refs"]
+        # Result listings, and the payloads and outputs of completed results (which never change once written), can
+        # be read with their own read preferences, e.g. from secondaries. Status polling, latest lookups and anything
+        # else which must see the latest writes stay on the primary.
+        self.listing_library = _with_read_preference(self.library, listing_read_preference)
+        self.result_payload_library = _with_read_preference(self.payload_library, result_read_preference)
+        self.result_data_reader = (
+            gridfs.GridFS(mongo_connection.with_options(read_preference=result_read_preference), "notebook_data")
+            if result_read_preference is not None
+            else self.result_data_store
+        )
+        # job_id -> (the next chunk sequence number, the index of the next line) for stdout written from here.
+        self._stdout_positions: Dict[str, Tuple[int, int]] = {}
+        self.ensure_indexes()
 
     def __init_subclass__(cls, cli_options: click.Command = None, **kwargs):
         if cli_options is None:
@@ -42,7 +111,7 @@ class MongoResultSerializer:
                 )
             opt, value = cli_arg.opts[0], getattr(self, cli_arg.name)
             if value is not None:
-                args.extend([opt, value])
+                args.extend([opt, str(value)])
         return args
 
     @classmethod
@@ -52,40 +121,211 @@ class MongoResultSerializer:
     def get_mongo_database(self):
         raise NotImplementedError()
 
-    def _save_raw_to_db(self, out_data):
-        out_data["update_time"] = datetime.datetime.now()
-        existing = self.library.find_one({"job_id": out_data["job_id"]})
-        if existing:
-            self.library.replace_one({"_id": existing["_id"]}, out_data)
+    @staticmethod
+    def _job_id_index() -> pymongo.IndexModel:
+        # Unique, so that concurrent upserts of a job's result can't insert it twice.
+        return pymongo.IndexModel([("job_id", pymongo.ASCENDING)], unique=True, background=True)
+
+    @staticmethod
+    def _result_indexes() -> List[pymongo.IndexModel]:
+        return [
+            pymongo.IndexModel([("report_name", pymongo.ASCENDING)], background=True),
+            pymongo.IndexModel([("update_time", pymongo.DESCENDING)], background=True),
+            pymongo.IndexModel([("status", pymongo.ASCENDING), ("update_time", pymongo.DESCENDING)], background=True),
+            # For exact "latest result for these parameters" lookups.
+            pymongo.IndexModel(
+                [
+                    ("report_name", pymongo.ASCENDING),
+                    ("overrides_hash", pymongo.ASCENDING),
+                    ("status", pymongo.ASCENDING),
+                    ("update_time", pymongo.DESCENDING),
+                ],
+                background=True,
+            ),
+            # For get_results_page(), which pages through results on (update_time, job_id).
+            pymongo.IndexModel([("update_time", pymongo.DESCENDING), ("job_id", pymongo.DESCENDING)], background=True),
+            pymongo.IndexModel(
+                [
+                    ("report_name", pymongo.ASCENDING),
+                    ("update_time", pymongo.DESCENDING),
+                    ("job_id", pymongo.DESCENDING),
+                ],
+                background=True,
+            ),
+        ]
+
+    def ensure_indexes(self, force: bool = False) -> None:
+        """
+        Creates the indexes which the result collection relies upon. This only goes to mongo once per collection
+        for the lifetime of the process, unless force=True (e.g. from `notebooker-cli ensure-indexes`).
+        """
+        key = (self.mongo_host, self.database_name, self.result_collection_name)
+        if key in _INDEXED_COLLECTIONS and not force:
+            return
+        logger.info("Ensuring indexes exist on %s.%s", self.database_name, self.result_collection_name)
+        try:
+            self.library.create_indexes([self._job_id_index()])
+        except OperationFailure:
+            # Collections from before job_ids were unique have a non-unique index on them, and may hold duplicates.
+            logger.exception(
+                "Couldn't create a unique job_id index on %s.%s. Run `notebooker-cli remove-duplicate-results`.",
+                self.database_name,
+                self.result_collection_name,
+            )
+        self.library.create_indexes(self._result_indexes())
+        self.stdout_library.create_index([("job_id", pymongo.ASCENDING), ("seq", pymongo.ASCENDING)], unique=True)
+        self.payload_library.create_index([("job_id", pymongo.ASCENDING)], unique=True)
+        self.result_data_files.create_index([("metadata.job_id", pymongo.ASCENDING)], background=True)
+        _INDEXED_COLLECTIONS.add(key)
+
+    def _save_raw_to_db(self, out_data) -> bool:
+        """
+        Saves a result document, unless its job already has a result which can't move into the new one's status
+        (see ALLOWED_STATUS_TRANSITIONS), e.g. a late TIMEOUT after the job finished. Returns whether it was saved.
+        """
+        documents.stamp_result_document(out_data)
+        job_id = out_data["job_id"]
+        # Atomic writes rather than a find followed by an insert/replace: the existing result is only replaced if it
+        # is allowed to move into the new status, and otherwise the result is only inserted if it doesn't exist.
+        if not self.library.replace_one(documents.replace_filter(out_data), out_data).matched_count:
+            inserted = self.library.update_one({"job_id": job_id}, {"$setOnInsert": out_data}, upsert=True)
+            if inserted.upserted_id is None:
+                documents.can_replace(self._get_status_document(job_id), out_data)
+                return False
+        if "report_name" in out_data:
+            self._update_latest_pointers(out_data)
+        return True
+
+    def _get_status_document(self, job_id: str) -> Optional[Dict]:
+        return self.library.find_one({"job_id": job_id}, {"_id": 0, "status": 1})
+
+    def _update_latest_pointers(self, result: Dict) -> None:
+        """ Keeps the latest_pointers up to date after the given result document was written. """
+        overrides_hash = result.get("overrides_hash") or documents.overrides_hash(result.get("overrides"))
+        status = JobStatus.from_string(result.get("status"))
+        if status == JobStatus.DELETED:
+            self._repoint_latest_pointers(result["report_name"], overrides_hash, result["job_id"])
         else:
-            self.library.insert_one(out_data)
-        # Ensure that the job_id index exists
-        self.library.create_index([("job_id", pymongo.ASCENDING)], background=True)
-        self.library.create_index([("report_name", pymongo.ASCENDING)], background=True)
-        self.library.create_index([("update_time", pymongo.DESCENDING)], background=True)
-        self.library.create_index([("status", pymongo.ASCENDING), ("update_time", pymongo.DESCENDING)], background=True)
-
-    def _save_to_db(self, notebook_result):
-        out_data = notebook_result.saveable_output()
-        self._save_raw_to_db(out_data)
-
-    def update_stdout(self, job_id, new_lines):
-        result = self.library.find_one_and_update({"job_id": job_id}, {"$push": {"stdout": {"$each": new_lines}}})
-        return result
-
-    def update_check_status(self, job_id: str, status: JobStatus, **extra):
-        existing = self.library.find_one({"job_id": job_id})
-        if not existing:
+            self._advance_latest_pointers(
+                result["report_name"], overrides_hash, result["job_id"], result["update_time"], status == JobStatus.DONE
+            )
+
+    def _advance_latest_pointers(
+        self, report_name: str, overrides_hash: str, job_id: str, update_time: datetime.datetime, successful: bool
+    ) -> None:
+        advances = documents.latest_pointer_advances(report_name, overrides_hash, job_id, update_time, successful)
+        for mongo_filter, update in advances:
+            try:
+                self.latest_pointers.update_one(mongo_filter, update, upsert=True)
+            except DuplicateKeyError:
+                pass
+
+    def _repoint_latest_pointers(self, report_name: str, overrides_hash: str, deleted_job_id: str) -> None:
+        """ Moves any pointers which point at a deleted job back onto the newest result which remains. """
+        for pointer_id, field, mongo_filter in documents.latest_pointer_repoints(report_name, overrides_hash):
+            newest = self.library.find_one(
+                mongo_filter, {"_id": 0, "job_id": 1, "update_time": 1}, sort=[("update_time", pymongo.DESCENDING)]
+            )
+            self.latest_pointers.update_one(*documents.repoint_update(pointer_id, field, deleted_job_id, newest))
+
+    def _get_latest_pointer(self, report_name: str, params: Optional[Dict], field: str) -> Optional[str]:
+        overrides_hash = documents.ALL_OVERRIDES if params is None else documents.overrides_hash(params)
+        pointer = self.latest_pointers.find_one(
+            {"_id": documents.latest_pointer_id(report_name, overrides_hash)}, {field: 1}
+        )
+        return ((pointer or {}).get(field) or {}).get("job_id")
+
+    def _save_to_db(self, notebook_result) -> bool:
+        out_data, payload = documents.split_payload(notebook_result)
+        # The payload is saved first so that it is there by the time the result document says the job is done, as
+        # long as it isn't about to be rejected and leave the existing result with another result's payload.
+        if payload:
+            if not documents.can_replace(self._get_status_document(out_data["job_id"]), out_data):
+                return False
+            self._save_payload(out_data["job_id"], payload)
+        return self._save_raw_to_db(out_data)
+
+    def _save_payload(self, job_id: str, payload: Dict[str, Optional[str]]) -> None:
+        payload_doc = documents.payload_document(job_id, payload, self.payload_codec)
+        self.payload_library.replace_one({"job_id": job_id}, payload_doc, upsert=True)
+
+    def _next_stdout_position(self, job_id: str) -> Tuple[int, int]:
+        if job_id not in self._stdout_positions:
+            last_chunk = self.stdout_library.find_one(
+                {"job_id": job_id}, {"_id": 0, "seq": 1, "end_line": 1}, sort=[("seq", pymongo.DESCENDING)]
+            )
+            self._stdout_positions[job_id] = (last_chunk["seq"] + 1, last_chunk["end_line"]) if last_chunk else (0, 0)
+        return self._stdout_positions[job_id]
+
+    def update_stdout(self, job_id: str, new_lines: List[str]) -> None:
+        """ Appends a chunk of lines to the job's stdout log. """
+        if not new_lines:
+            return
+        while True:
+            seq, first_line = self._next_stdout_position(job_id)
+            chunk = documents.stdout_chunk(job_id, seq, first_line, new_lines)
+            try:
+                self.stdout_library.insert_one(chunk)
+            except DuplicateKeyError:
+                # Something else has appended to this log since we last looked; catch up and try again.
+                del self._stdout_positions[job_id]
+                continue
+            self._stdout_positions[job_id] = (seq + 1, chunk["end_line"])
+            return
+
+    def get_stdout(self, job_id: str, offset: int = 0) -> List[str]:
+        """ Gets the lines of a job's stdout, starting from the given line number. """
+        chunks = self.stdout_library.find(
+            {"job_id": job_id, "end_line": {"$gt": offset}}, {"_id": 0, "first_line": 1, "lines": 1}
+        ).sort("seq", pymongo.ASCENDING)
+        lines = documents.stdout_lines(chunks, offset)
+        if not lines:
+            # Results saved before the log collection existed kept their stdout inside the result document.
+            legacy = self.library.find_one({"job_id": job_id}, {"_id": 0, "stdout": 1})
+            lines = (legacy or {}).get("stdout", [])[offset:]
+        return lines
+
+    def update_check_status(self, job_id: str, status: JobStatus, **extra) -> bool:
+        """
+        Moves a job into the given status with a targeted $set, along with any extra fields. The update only applies
+        if the job's current status is allowed to move into the new one (see ALLOWED_STATUS_TRANSITIONS).
+        Returns whether the job was updated.
+        """
+        update = dict(extra, status=status.value, update_time=datetime.datetime.now())
+        mongo_filter = {"job_id": job_id}
+        mongo_filter.update(documents.status_transition_filter(status))
+        if self.library.update_one(mongo_filter, {"$set": update}).matched_count:
+            result = self.library.find_one({"job_id": job_id}, documents.LATEST_POINTER_PROJECTION)
+            if result:
+                self._update_latest_pointers(result)
+            return True
+        # Logs why the job couldn't move.
+        documents.can_transition(job_id, self._get_status_document(job_id), status)
+        return False
+
+    def update_check_statuses(self, job_ids: List[str], status: JobStatus, **extra) -> int:
+        """
+        Bulk version of update_check_status which transitions many jobs in one round trip.
+        Jobs which are not allowed to move into the given status are left alone.
+        Returns the number of jobs which were updated.
+        """
+        if not job_ids:
+            return 0
+        update = dict(extra, status=status.value, update_time=datetime.datetime.now())
+        mongo_filter = {"job_id": {"$in": list(job_ids)}}
+        mongo_filter.update(documents.status_transition_filter(status))
+        n_updated = self.library.update_many(mongo_filter, {"$set": update}).matched_count
+        if n_updated:
+            moved = {"job_id": {"$in": list(job_ids)}, "status": status.value, "update_time": update["update_time"]}
+            for result in self.library.find(moved, documents.LATEST_POINTER_PROJECTION):
+                self._update_latest_pointers(result)
+        if n_updated != len(job_ids):
             logger.warning(
-                "Couldn't update check status to {} for job id {} since it is not in the database.".format(
-                    status, job_id
+                "Only moved {} of {} jobs to status {}; the rest were missing or could not make the transition.".format(
+                    n_updated, len(job_ids), status
                 )
             )
-        else:
-            existing["status"] = status.value
-            for k, v in extra.items():
-                existing[k] = v
-            self._save_raw_to_db(existing)
+        return n_updated
 
     def save_check_stub(
         self,
@@ -99,127 +339,327 @@ class MongoResultSerializer:
         generate_pdf_output: bool = True,
     ) -> None:
         """ Call this when we are just starting a check. Saves a "pending" job into storage. """
-        job_start_time = job_start_time or datetime.datetime.now()
-        report_title = report_title or report_name
-        pending_result = NotebookResultPending(
-            job_id=job_id,
-            status=status,
-            report_title=report_title,
-            job_start_time=job_start_time,
-            report_name=report_name,
-            mailto=mailto,
-            generate_pdf_output=generate_pdf_output,
-            overrides=overrides or {},
+        self._save_to_db(
+            documents.check_stub(
+                job_id, report_name, report_title, job_start_time, status, overrides, mailto, generate_pdf_output
+            )
         )
-        self._save_to_db(pending_result)
 
     def save_check_result(self, notebook_result: Union[NotebookResultComplete, NotebookResultError]) -> None:
+        blobs = documents.hash_outputs(notebook_result)
+        previous_hashes = self._get_output_hashes(notebook_result.job_id).values() if blobs else []
+
         # Save to mongo
         logger.info("Saving {}".format(notebook_result.job_id))
-        self._save_to_db(notebook_result)
+        if not self._save_to_db(notebook_result):
+            return
 
-        # Save to gridfs
+        # Save to gridfs. Outputs are stored by content, so identical images are only stored once across all jobs.
         if isinstance(notebook_result, NotebookResultComplete):
-            if notebook_result.raw_html_resources and "outputs" in notebook_result.raw_html_resources:
-                for filename, binary_data in notebook_result.raw_html_resources["outputs"].items():  # type: ignore
-                    self.result_data_store.put(binary_data, filename=filename, encoding="utf-8")
+            metadata = documents.job_file_metadata(notebook_result.job_id, self.result_collection_name)
+            if blobs:
+                self._store_blobs(blobs)
+                self._release_blobs(previous_hashes)
             if notebook_result.pdf:
                 self.result_data_store.put(
-                    notebook_result.pdf, filename=_pdf_filename(notebook_result.job_id), encoding="utf-8"
+                    notebook_result.pdf,
+                    filename=documents.pdf_filename(notebook_result.job_id),
+                    encoding="utf-8",
+                    metadata=metadata,
                 )
 
     def _convert_result(
         self, result: Dict, load_payload: bool = True
     ) -> Union[NotebookResultError, NotebookResultComplete, NotebookResultPending, None]:
-        if not result:
-            return None
-
-        status = result.get("status", "")
-        job_status = JobStatus.from_string(status)
-        if job_status is None:
-            return None
-        cls = {
-            JobStatus.CANCELLED: NotebookResultError,
-            JobStatus.DONE: NotebookResultComplete,
-            JobStatus.PENDING: NotebookResultPending,
-            JobStatus.ERROR: NotebookResultError,
-            JobStatus.SUBMITTED: NotebookResultPending,
-            JobStatus.TIMEOUT: NotebookResultError,
-            JobStatus.DELETED: None,
-        }.get(job_status)
-        if cls is None:
-            return None
-
-        if load_payload and job_status == JobStatus.DONE:
-
-            def read_file(path):
-                try:
-                    return self.result_data_store.get_last_version(path).read()
-                except NoFile:
-                    logger.error("Could not find file %s in %s", path, self.result_data_store)
-                    return ""
-
-            outputs = {path: read_file(path) for path in result.get("raw_html_resources", {}).get("outputs", [])}
-            result["raw_html_resources"]["outputs"] = outputs
-            if result.get("generate_pdf_output"):
-                pdf_filename = _pdf_filename(result["job_id"])
-                result["pdf"] = read_file(pdf_filename)
-
-        if cls == NotebookResultComplete:
-            return NotebookResultComplete(
-                job_id=result["job_id"],
-                job_start_time=result["job_start_time"],
-                report_name=result["report_name"],
-                status=job_status,
-                update_time=result["update_time"],
-                job_finish_time=result["job_finish_time"],
-                raw_html_resources=result.get("raw_html_resources", {}),
-                raw_ipynb_json=result.get("raw_ipynb_json"),
-                raw_html=result.get("raw_html"),
-                pdf=result.get("pdf", ""),
-                overrides=result.get("overrides", {}),
-                generate_pdf_output=result.get("generate_pdf_output", True),
-                report_title=result.get("report_title", result["report_name"]),
-                mailto=result.get("mailto", ""),
-                stdout=result.get("stdout", []),
-            )
-        elif cls == NotebookResultPending:
-            return NotebookResultPending(
-                job_id=result["job_id"],
-                job_start_time=result["job_start_time"],
-                report_name=result["report_name"],
-                status=job_status,
-                update_time=result["update_time"],
-                overrides=result.get("overrides", {}),
-                generate_pdf_output=result.get("generate_pdf_output", True),
-                report_title=result.get("report_title", result["report_name"]),
-                mailto=result.get("mailto", ""),
-                stdout=result.get("stdout", []),
-            )
-
-        elif cls == NotebookResultError:
-            return NotebookResultError(
-                job_id=result["job_id"],
-                job_start_time=result["job_start_time"],
-                report_name=result["report_name"],
-                status=job_status,
-                update_time=result["update_time"],
-                error_info=result["error_info"],
-                overrides=result.get("overrides", {}),
-                generate_pdf_output=result.get("generate_pdf_output", True),
-                report_title=result.get("report_title", result["report_name"]),
-                mailto=result.get("mailto", ""),
-                stdout=result.get("stdout", []),
-            )
-        else:
-            raise ValueError("Could not deserialise {} into result object.".format(result))
+        return documents.result_from_document(result, payload_source=self if load_payload else None)
 
     def get_check_result(
         self, job_id: AnyStr
     ) -> Optional[Union[NotebookResultError, NotebookResultComplete, NotebookResultPending]]:
-        result = self.library.find_one({"job_id": job_id}, {"_id": 0})
+        result = self.library.find_one({"job_id": job_id}, {"_id": 0, "raw_html": 0, "raw_ipynb_json": 0})
         return self._convert_result(result)
 
+    def _result_data_stores(self) -> List[gridfs.GridFS]:
+        """ Where to look for the files of completed results, in order. """
+        if self.result_data_reader is self.result_data_store:
+            return [self.result_data_store]
+        # A result read just after it was saved may not have reached the secondaries yet.
+        return [self.result_data_reader, self.result_data_store]
+
+    def _read_file(self, path: str) -> AnyStr:
+        for store in self._result_data_stores():
+            try:
+                return store.get_last_version(path).read()
+            except NoFile:
+                pass
+        logger.error("Could not find file %s in %s", path, self.result_data_store)
+        return ""
+
+    def has_pdf(self, job_id: str) -> bool:
+        """ Whether a non-empty PDF was stored for the result, from its GridFS file rather than by reading it. """
+        pdf_file = {"filename": documents.pdf_filename(job_id), "length": {"$gt": 0}}
+        return any(store.exists(pdf_file) for store in self._result_data_stores())
+
+    def get_result_payload(self, job_id: str, field: str) -> Any:
+        """ Reads one of raw_html, raw_ipynb_json or pdf for a completed result, for LazyNotebookResultComplete. """
+        if field == "pdf":
+            return self._read_file(documents.pdf_filename(job_id))
+        return self._get_payloads([job_id], (field,)).get(job_id, {}).get(field)
+
+    def _get_payloads(self, job_ids: List[str], fields: Iterable[str] = COMPRESSED_FIELDS) -> Dict[str, Dict]:
+        """
+        job_id -> {field: value} for the payload fields of completed results. These are read from the payload
+        collection or, for results saved before it existed, from the result documents themselves.
+        """
+        projection = {"_id": 0, "job_id": 1, "payload_codec": 1}
+        projection.update({field: 1 for field in fields})
+        sources = [self.payload_library, self.library]
+        if self.result_payload_library is not self.payload_library:
+            # A result read just after it was saved may not have reached the secondaries yet.
+            sources.insert(0, self.result_payload_library)
+        payloads = {}
+        for source in sources:
+            missing_job_ids = [job_id for job_id in job_ids if job_id not in payloads]
+            if not missing_job_ids:
+                break
+            for doc in source.find({"job_id": {"$in": missing_job_ids}}, projection):
+                payloads[doc["job_id"]] = doc
+        return {
+            job_id: {field: documents.decoded_field(doc, field) for field in fields if field in doc}
+            for job_id, doc in payloads.items()
+        }
+
+    def _with_payloads(self, results: List, load_pdf: bool = True) -> List:
+        """
+        Loads the payloads of any completed results in one go, rather than one field of one result at a time. Without
+        load_pdf, their PDFs are only read if they are used, and their outputs are read for the whole batch at once.
+        """
+        lazy_results = [result for result in results if isinstance(result, LazyNotebookResultComplete)]
+        if lazy_results:
+            payloads = self._get_payloads([result.job_id for result in lazy_results])
+            for result in lazy_results:
+                for field, value in payloads.get(result.job_id, {}).items():
+                    setattr(result, field, value)
+                if load_pdf:
+                    result.load_payload()
+            if not load_pdf:
+                self._load_outputs(lazy_results)
+        return results
+
+    def _load_outputs(self, results: List[LazyNotebookResultComplete]) -> None:
+        """
+        Reads the content-addressed outputs of many results with one query for their hashes and one for the blobs.
+        Outputs saved before they were deduplicated are left to be read if they are used.
+        """
+        docs = self.library.find(
+            {"job_id": {"$in": [result.job_id for result in results]}}, {"_id": 0, "job_id": 1, "raw_html_resources": 1}
+        )
+        output_hashes = {doc["job_id"]: documents.output_hashes(doc) for doc in docs}
+        blobs = self._read_blobs(
+            {
+                documents.blob_filename(content_hash)
+                for hashes in output_hashes.values()
+                for content_hash in hashes.values()
+            }
+        )
+        for result in results:
+            outputs = result.raw_html_resources.get("outputs")
+            if isinstance(outputs, LazyResourceOutputs):
+                hashes = output_hashes.get(result.job_id, {})
+                outputs.preload(
+                    {
+                        path: blobs[documents.blob_filename(content_hash)]
+                        for path, content_hash in hashes.items()
+                        if documents.blob_filename(content_hash) in blobs
+                    }
+                )
+
+    def move_payloads_to_payload_collection(self, batch_size: int = 100) -> int:
+        """
+        Migration for result documents saved before raw_html and raw_ipynb_json were moved to their own collection:
+        copies the payload of each one into the payload collection, compressing it if it wasn't already, and then
+        removes it from the result document. Returns the number of results migrated.
+        """
+        n_moved = 0
+        fields_exist = [{field: {"$exists": True}} for field in COMPRESSED_FIELDS]
+        projection = {"_id": 0, "job_id": 1, "payload_codec": 1}
+        projection.update({field: 1 for field in COMPRESSED_FIELDS})
+        while True:
+            docs = list(self.library.find({"$or": fields_exist}, projection).limit(batch_size))
+            if not docs:
+                break
+            payload_writes, result_writes = [], []
+            for doc in docs:
+                payload = {field: documents.decoded_field(doc, field) for field in COMPRESSED_FIELDS if field in doc}
+                payload_doc = documents.payload_document(doc["job_id"], payload, self.payload_codec)
+                # A payload which is already in the payload collection is newer than the one in the result document.
+                payload_writes.append(
+                    pymongo.UpdateOne({"job_id": doc["job_id"]}, {"$setOnInsert": payload_doc}, upsert=True)
+                )
+                unset = {field: "" for field in COMPRESSED_FIELDS}
+                unset["payload_codec"] = ""
+                result_writes.append(pymongo.UpdateOne({"job_id": doc["job_id"]}, {"$unset": unset}))
+            self.payload_library.bulk_write(payload_writes, ordered=False)
+            self.library.bulk_write(result_writes, ordered=False)
+            n_moved += len(docs)
+            logger.info("Moved the payloads of %d results to %s so far.", n_moved, self.payload_library.name)
+        return n_moved
+
+    def _get_output_hashes(self, job_id: str) -> Dict[str, str]:
+        """ path -> content hash for each of a result's outputs, or {} if it was saved before outputs were hashed. """
+        return documents.output_hashes(self.library.find_one({"job_id": job_id}, {"_id": 0, "raw_html_resources": 1}))
+
+    def get_result_resource(self, job_id: str, path: str) -> AnyStr:
+        """ Reads one of the outputs in raw_html_resources, for LazyNotebookResultComplete. """
+        content_hash = self._get_output_hashes(job_id).get(path)
+        return self._read_file(documents.blob_filename(content_hash) if content_hash else path)
+
+    @staticmethod
+    def _read_concurrently(grid_outs: Dict[Any, gridfs.GridOut]) -> Dict[Any, AnyStr]:
+        if not grid_outs:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(len(grid_outs), MAX_CONCURRENT_RESOURCE_READS)) as pool:
+            return dict(zip(grid_outs, pool.map(lambda grid_out: grid_out.read(), grid_outs.values())))
+
+    def _read_blobs(self, blob_filenames: Iterable[str]) -> Dict[str, AnyStr]:
+        """ filename -> contents for content-addressed blobs, found with a single query and read concurrently. """
+        blobs = {}
+        for store in self._result_data_stores():
+            missing_filenames = [filename for filename in blob_filenames if filename not in blobs]
+            if not missing_filenames:
+                break
+            for grid_out in store.find({"filename": {"$in": missing_filenames}}):
+                blobs[grid_out.filename] = grid_out
+        return self._read_concurrently(blobs)
+
+    def get_result_resources(self, job_id: str, paths: Iterable[str]) -> Dict[str, AnyStr]:
+        """
+        Reads many of a job's outputs at once. Content-addressed blobs are found with a single query on their
+        filenames, and files saved per-job before outputs were deduplicated with a single indexed query on their
+        job_id; the contents are then read concurrently. Untagged files from older versions are read one by one.
+        """
+        paths = set(paths)
+        output_hashes = self._get_output_hashes(job_id)
+        hashed_paths = {path: output_hashes[path] for path in paths if path in output_hashes}
+        contents = {}
+        if hashed_paths:
+            blob_contents = self._read_blobs({documents.blob_filename(h) for h in hashed_paths.values()})
+            for path, content_hash in hashed_paths.items():
+                if documents.blob_filename(content_hash) in blob_contents:
+                    contents[path] = blob_contents[documents.blob_filename(content_hash)]
+
+        unhashed_paths = paths - set(contents)
+        latest_versions = {}
+        if unhashed_paths:
+            query = self.result_data_reader.find({"metadata.job_id": job_id}).sort("uploadDate", pymongo.ASCENDING)
+            for grid_out in query:
+                if grid_out.filename in unhashed_paths:
+                    latest_versions[grid_out.filename] = grid_out
+        contents.update(self._read_concurrently(latest_versions))
+        for path in paths - set(contents):
+            contents[path] = self._read_file(path)
+        return contents
+
+    def _store_blobs(self, blobs: Dict[str, bytes]) -> None:
+        """
+        Takes one reference on each content-addressed blob (hash -> bytes) for a result, writing the bytes to GridFS
+        unless another result has already written them. A ref stays pending until its blob has been written, and
+        results which find it pending write the blob too rather than rely on a write which may yet fail.
+        """
+        write_result = self.blob_refs.bulk_write(documents.blob_ref_increments(blobs))
+        pending = set(write_result.upserted_ids.values())
+        existing = [blob_hash for blob_hash in blobs if blob_hash not in pending]
+        if existing:
+            pending.update(
+                ref["_id"] for ref in self.blob_refs.find({"_id": {"$in": existing}, "pending": True}, {"_id": 1})
+            )
+        for blob_hash, data in blobs.items():
+            if blob_hash not in pending:
+                OUTPUT_BLOB_BYTES_DEDUPLICATED.inc(len(data))
+                continue
+            try:
+                self.result_data_store.put(
+                    data, filename=documents.blob_filename(blob_hash), encoding="utf-8", metadata={"sha256": blob_hash}
+                )
+            except Exception:
+                # Other results may have taken a reference since, so only ours is dropped.
+                self.blob_refs.update_one({"_id": blob_hash}, {"$inc": {"refcount": -1}})
+                self.blob_refs.delete_one({"_id": blob_hash, "refcount": {"$lte": 0}, "pending": True})
+                raise
+            self.blob_refs.update_one({"_id": blob_hash}, {"$unset": {"pending": ""}})
+            OUTPUT_BLOB_BYTES_STORED.inc(len(data))
+
+    def _release_blobs(self, hashes: Iterable[str]) -> None:
+        """ Drops a result's reference on each blob, deleting any blobs which no result references any more. """
+        for blob_hash in set(hashes):
+            ref = self.blob_refs.find_one_and_update(
+                {"_id": blob_hash},
+                {"$inc": {"refcount": -1}},
+                return_document=pymongo.ReturnDocument.AFTER,
+            )
+            if ref is None or ref["refcount"] > 0:
+                continue
+            # Only delete the copies which exist now, in case the blob is stored again straight after we drop the ref.
+            copies = self.result_data_store.find({"filename": documents.blob_filename(blob_hash)})
+            file_ids = [grid_out._id for grid_out in copies]
+            if self.blob_refs.delete_one({"_id": blob_hash, "refcount": {"$lte": 0}}).deleted_count:
+                for file_id in file_ids:
+                    self.result_data_store.delete(file_id)
+
+    def get_blob_stats(self) -> Dict[str, int]:
+        """
+        How well output deduplication is doing: the number of distinct blobs, the bytes they take up, and the bytes
+        the results which reference them would have taken up without deduplication.
+        """
+        stats = list(
+            self.blob_refs.aggregate(
+                [
+                    {
+                        "$group": {
+                            "_id": None,
+                            "n_blobs": {"$sum": 1},
+                            "stored_bytes": {"$sum": "$size"},
+                            "referenced_bytes": {"$sum": {"$multiply": ["$size", "$refcount"]}},
+                        }
+                    }
+                ]
+            )
+        )
+        if not stats:
+            return {"n_blobs": 0, "stored_bytes": 0, "referenced_bytes": 0}
+        stats[0].pop("_id")
+        return stats[0]
+
+    def refresh_blob_metrics(self) -> Dict[str, int]:
+        stats = self.get_blob_stats()
+        OUTPUT_BLOB_BYTES_SAVED.set(stats["referenced_bytes"] - stats["stored_bytes"])
+        OUTPUT_BLOB_DEDUP_RATIO.set(stats["referenced_bytes"] / stats["stored_bytes"] if stats["stored_bytes"] else 1.0)
+        return stats
+
+    def tag_result_resources_with_job_ids(self, batch_size: int = 1000) -> int:
+        """
+        Migration for GridFS files saved before they were tagged with their job_id. The job_id is taken from the
+        filename, i.e. <job_id>/resources/... or <job_id>.pdf. Returns the number of files tagged.
+        """
+        n_tagged = 0
+        updates = []
+        untagged = self.result_data_files.find(
+            {"metadata.job_id": {"$exists": False}, "metadata.sha256": {"$exists": False}}, {"filename": 1}
+        )
+        for grid_file in untagged:
+            job_id = _job_id_from_filename(grid_file.get("filename") or "")
+            if job_id is None:
+                logger.warning("Can't work out which job %s belongs to; not tagging it.", grid_file.get("filename"))
+                continue
+            updates.append(pymongo.UpdateOne({"_id": grid_file["_id"]}, {"$set": {"metadata.job_id": job_id}}))
+            if len(updates) >= batch_size:
+                n_tagged += self.result_data_files.bulk_write(updates, ordered=False).modified_count
+                updates = []
+        if updates:
+            n_tagged += self.result_data_files.bulk_write(updates, ordered=False).modified_count
+        logger.info("Tagged %d GridFS files with their job_id.", n_tagged)
+        return n_tagged
+
     def get_all_results(
         self,
         since: Optional[datetime.datetime] = None,
@@ -227,50 +667,99 @@ class MongoResultSerializer:
         mongo_filter: Optional[Dict] = None,
         load_payload: bool = True,
     ) -> Iterator[Union[NotebookResultComplete, NotebookResultError, NotebookResultPending]]:
-        base_filter = {"status": {"$ne": JobStatus.DELETED.value}}
-        if mongo_filter:
-            base_filter.update(mongo_filter)
-        if since:
-            base_filter.update({"update_time": {"$gt": since}})
-        projection = (
-            {"_id": 0} if load_payload else {"raw_html_resources": 0, "raw_html": 0, "raw_ipynb_json": 0, "_id": 0}
-        )
-        results = self.library.find(base_filter, projection).sort("update_time", -1).limit(limit)
-        for res in results:
+        base_filter = documents.listing_filter(mongo_filter, since)
+        projection = {"_id": 0, "raw_html": 0, "raw_ipynb_json": 0} if load_payload else documents.LISTING_PROJECTION
+        # Results without their payloads are for listings; the report hunter reads the full results to see their
+        # latest status, so those come from the primary.
+        library = self.library if load_payload else self.listing_library
+        results = library.find(base_filter, projection).sort("update_time", -1).limit(limit)
+        return self._stream_with_payloads(results, load_payload=load_payload)
+
+    def _stream_with_payloads(
+        self, docs: Iterable[Dict], load_payload: bool = True, load_pdf: bool = True
+    ) -> Iterator[Union[NotebookResultComplete, NotebookResultError, NotebookResultPending]]:
+        """ Converts result documents as they arrive, loading the payloads of each PAYLOAD_BATCH_SIZE in one go. """
+        batch = []
+        for res in docs:
             if res:
                 converted_result = self._convert_result(res, load_payload=load_payload)
                 if converted_result is not None:
-                    yield converted_result
+                    batch.append(converted_result)
+            if len(batch) >= PAYLOAD_BATCH_SIZE:
+                yield from self._with_payloads(batch, load_pdf=load_pdf)
+                batch = []
+        yield from self._with_payloads(batch, load_pdf=load_pdf)
+
+    def watch_results(self, resume_token: Optional[Dict] = None, max_await_time_ms: int = 1000):
+        """
+        A change stream of the saves and status changes of results, each with the whole result document, starting
+        after resume_token if given. Raises OperationFailure where change streams are unavailable, e.g. on a
+        standalone mongod.
+        """
+        pipeline = [
+            {
+                "$match": {
+                    "$or": [
+                        {"operationType": {"$in": ["insert", "replace"]}},
+                        {"operationType": "update", "updateDescription.updatedFields.status": {"$exists": True}},
+                    ]
+                }
+            }
+        ]
+        return self.library.watch(
+            pipeline, full_document="updateLookup", resume_after=resume_token, max_await_time_ms=max_await_time_ms
+        )
+
+    def get_changed_result(
+        self, change: Dict
+    ) -> Optional[Union[NotebookResultError, NotebookResultComplete, NotebookResultPending]]:
+        """ The result from a watch_results() change, with its payload loaded, or None if it has since gone. """
+        result = self._convert_result(change.get("fullDocument"))
+        return self._with_payloads([result])[0] if result is not None else None
+
+    def get_results_page(
+        self,
+        page_size: int = 50,
+        page_token: Optional[str] = None,
+        report_name: Optional[str] = None,
+        status: Optional[JobStatus] = None,
+        since: Optional[datetime.datetime] = None,
+        until: Optional[datetime.datetime] = None,
+    ) -> Tuple[List[Union[NotebookResultComplete, NotebookResultError, NotebookResultPending]], Optional[str]]:
+        """
+        One page of results, newest first and without their payloads, optionally filtered by report name, status
+        and update time (since <= update_time < until). Pages are keyed on (update_time, job_id) rather than skipped
+        through, so a deep page costs the same as the first one. Returns the page and a token which fetches the page
+        after it, or None if this is the last page.
+        """
+        mongo_filter = documents.results_page_filter(report_name, status, since, until)
+        if page_token is not None:
+            last_update_time, last_job_id = documents.decode_page_token(page_token)
+            after_last = {
+                "$or": [
+                    {"update_time": {"$lt": last_update_time}},
+                    {"update_time": last_update_time, "job_id": {"$lt": last_job_id}},
+                ]
+            }
+            mongo_filter = {"$and": [mongo_filter, after_last]}
+        sort = [("update_time", pymongo.DESCENDING), ("job_id", pymongo.DESCENDING)]
+        # One extra document tells us whether there is another page.
+        docs = list(
+            self.listing_library.find(mongo_filter, documents.LISTING_PROJECTION).sort(sort).limit(page_size + 1)
+        )
+        docs, next_page_token = documents.split_page(docs, page_size)
+        results = [self._convert_result(doc, load_payload=False) for doc in docs]
+        return [result for result in results if result is not None], next_page_token
 
     def get_all_result_keys(self, limit: int = 0, mongo_filter: Optional[Dict] = None) -> List[Tuple[str, str]]:
         keys = []
-        base_filter = {"status": {"$ne": JobStatus.DELETED.value}}
-        if mongo_filter:
-            base_filter.update(mongo_filter)
+        base_filter = documents.listing_filter(mongo_filter)
         projection = {"report_name": 1, "job_id": 1, "_id": 0}
         for result in self.library.find(base_filter, projection).sort("update_time", -1).limit(limit):
             keys.append((result["report_name"], result["job_id"]))
         return keys
 
-    @staticmethod
-    def _mongo_filter(
-        report_name: str,
-        overrides: Optional[Dict] = None,
-        status: Optional[JobStatus] = None,
-        as_of: Optional[datetime.datetime] = None,
-    ) -> Dict[str, Any]:
-        mongo_filter = {"report_name": report_name}
-        if overrides is not None:
-            # BSON document comparisons are order-specific but we want to compare overrides
-            # irrespective of order and so we check subparts independently.
-            # See https://stackoverflow.com/questions/14324626/pymongo-or-mongodb-is-treating-two-equal-python-dictionaries-as-different-object
-            for k, v in overrides.items():
-                mongo_filter["overrides.{}".format(k)] = v
-        if status is not None:
-            mongo_filter["status"] = status.value
-        if as_of is not None:
-            mongo_filter["update_time"] = {"$lt": as_of}
-        return mongo_filter
+    _mongo_filter = staticmethod(documents.result_filter)
 
     def _get_all_job_ids(
         self,
@@ -283,6 +772,96 @@ class MongoResultSerializer:
         mongo_filter = self._mongo_filter(report_name, overrides, status, as_of)
         return [x[1] for x in self.get_all_result_keys(mongo_filter=mongo_filter, limit=limit)]
 
+    def backfill_overrides_hashes(self, batch_size: int = 1000) -> int:
+        """
+        Migration for result documents saved before overrides were hashed, which can't be found by
+        get_latest_job_id_for_name_and_params() and friends until they have one. Returns the number of results updated.
+        """
+        n_updated = 0
+        while True:
+            docs = list(
+                self.library.find({"overrides_hash": {"$exists": False}}, {"_id": 1, "overrides": 1}).limit(batch_size)
+            )
+            if not docs:
+                break
+            updates = [
+                pymongo.UpdateOne(
+                    {"_id": doc["_id"]}, {"$set": {"overrides_hash": documents.overrides_hash(doc.get("overrides"))}}
+                )
+                for doc in docs
+            ]
+            self.library.bulk_write(updates, ordered=False)
+            n_updated += len(docs)
+            logger.info("Hashed the overrides of %d results so far.", n_updated)
+        return n_updated
+
+    def remove_duplicate_results(self) -> int:
+        """
+        Makes job_ids unique in result collections from before they had to be. Of the results which share a job_id,
+        the most recently updated is kept and the rest are removed, and then the old job_id index is replaced with a
+        unique one. Returns the number of results removed.
+        """
+        duplicates = self.library.aggregate(
+            [
+                {"$group": {"_id": "$job_id", "results": {"$push": {"_id": "$_id", "update_time": "$update_time"}}}},
+                {"$match": {"results.1": {"$exists": True}}},
+            ],
+            allowDiskUse=True,
+        )
+        n_removed = 0
+        for duplicate in duplicates:
+            results = sorted(
+                duplicate["results"], key=lambda result: result.get("update_time") or datetime.datetime.min
+            )
+            n_removed += self.library.delete_many(
+                {"_id": {"$in": [result["_id"] for result in results[:-1]]}}
+            ).deleted_count
+        logger.info("Removed %d duplicate results.", n_removed)
+        for index in self.library.list_indexes():
+            if list(index["key"].items()) == [("job_id", pymongo.ASCENDING)] and not index.get("unique"):
+                self.library.drop_index(index["name"])
+        self.library.create_indexes([self._job_id_index()])
+        return n_removed
+
+    def rebuild_latest_pointers(self) -> int:
+        """
+        Recomputes every latest_pointer from the result collection, e.g. for results saved before the pointers
+        existed. Results without an overrides_hash are left out, so run backfill_overrides_hashes() first.
+        Returns the number of pointers written.
+        """
+        n_written = 0
+        for field, status_filter in (
+            ("latest", {"$ne": JobStatus.DELETED.value}),
+            ("latest_successful", JobStatus.DONE.value),
+        ):
+            for overrides_group in ("$overrides_hash", documents.ALL_OVERRIDES):
+                newest = self.library.aggregate(
+                    [
+                        {"$match": {"status": status_filter, "overrides_hash": {"$exists": True}}},
+                        {"$sort": {"update_time": pymongo.DESCENDING}},
+                        {
+                            "$group": {
+                                "_id": {"report_name": "$report_name", "overrides_hash": overrides_group},
+                                "job_id": {"$first": "$job_id"},
+                                "update_time": {"$first": "$update_time"},
+                            }
+                        },
+                    ]
+                )
+                writes = [
+                    pymongo.UpdateOne(
+                        {"_id": documents.latest_pointer_id(doc["_id"]["report_name"], doc["_id"]["overrides_hash"])},
+                        {"$set": {field: {"job_id": doc["job_id"], "update_time": doc["update_time"]}}},
+                        upsert=True,
+                    )
+                    for doc in newest
+                ]
+                if writes:
+                    self.latest_pointers.bulk_write(writes, ordered=False)
+                n_written += len(writes)
+        logger.info("Rebuilt %d latest result pointers.", n_written)
+        return n_written
+
     def get_all_job_ids_for_name_and_params(self, report_name: str, params: Optional[Dict]) -> List[str]:
         """ Get all the result ids for a given name and parameters, newest first """
         return self._get_all_job_ids(report_name, params)
@@ -291,6 +870,10 @@ class MongoResultSerializer:
         self, report_name: str, params: Optional[Dict], as_of: Optional[datetime.datetime] = None
     ) -> Optional[str]:
         """ Get the latest result id for a given name and parameters """
+        if as_of is None:
+            job_id = self._get_latest_pointer(report_name, params, "latest")
+            if job_id:
+                return job_id
         all_job_ids = self._get_all_job_ids(report_name, params, as_of=as_of, limit=1)
         return all_job_ids[0] if all_job_ids else None
 
@@ -298,28 +881,207 @@ class MongoResultSerializer:
         self, report_name: str, params: Optional[Dict], as_of: Optional[datetime.datetime] = None
     ) -> Optional[str]:
         """ Get the latest successful job id for a given name and parameters """
+        if as_of is None:
+            job_id = self._get_latest_pointer(report_name, params, "latest_successful")
+            if job_id:
+                return job_id
         all_job_ids = self._get_all_job_ids(report_name, params, JobStatus.DONE, as_of, limit=1)
         return all_job_ids[0] if all_job_ids else None
 
     def get_latest_successful_job_ids_for_name_all_params(self, report_name: str) -> List[str]:
-        """ Get the latest successful job ids for all parameter variants of a given name"""
-        mongo_filter = self._mongo_filter(report_name, status=JobStatus.DONE)
-        results = self.library.aggregate(
+        """ Get the latest successful job ids for all parameter variants of a given name """
+        projection = {"_id": 0, "job_id": 1, "overrides_hash": 1, "overrides": 1}
+        results = self.library.aggregate(documents.latest_successful_all_params_pipeline(report_name, projection))
+        return [result["job_id"] for result in results]
+
+    def get_latest_successful_results_for_name_all_params(
+        self, report_name: str
+    ) -> Iterator[Union[NotebookResultComplete, NotebookResultError, NotebookResultPending]]:
+        """
+        The latest successful result of each parameter variant of a given name, with their payloads and outputs. The
+        results come from a single aggregation cursor and are yielded as it is read, and the payloads and outputs of
+        each batch are read together rather than one result at a time. PDFs are only read if they are used.
+        """
+        pipeline = documents.latest_successful_all_params_pipeline(report_name, documents.LATEST_SUCCESSFUL_PROJECTION)
+        return self._stream_with_payloads(self.library.aggregate(pipeline), load_pdf=False)
+
+    def n_all_results(self) -> int:
+        # The estimated count comes from collection metadata rather than a scan, and deleted results are counted
+        # using the status index.
+        return self.listing_library.estimated_document_count() - self.listing_library.count_documents(
+            {"status": JobStatus.DELETED.value}
+        )
+
+    def get_result_counts(self) -> Dict[str, Any]:
+        """ The number of results which haven't been deleted: in total, per status and per report. """
+        by_status, by_report = defaultdict(int), defaultdict(int)
+        groups = self.listing_library.aggregate(
             [
-                {"$match": mongo_filter},
-                {"$sort": {"update_time": -1}},
-                {"$group": {"_id": "$overrides", "job_id": {"$first": "$job_id"}}},
+                {"$match": {"status": {"$ne": JobStatus.DELETED.value}}},
+                {"$group": {"_id": {"status": "$status", "report_name": "$report_name"}, "count": {"$sum": 1}}},
             ]
         )
-
-        return [result["job_id"] for result in results]
-
-    def n_all_results(self):
-        return self.library.find({"status": {"$ne": JobStatus.DELETED.value}}).count()
+        for group in groups:
+            by_status[group["_id"]["status"]] += group["count"]
+            by_report[group["_id"]["report_name"]] += group["count"]
+        return {"total": sum(by_status.values()), "by_status": dict(by_status), "by_report": dict(by_report)}
 
     def delete_result(self, job_id: AnyStr) -> None:
         self.update_check_status(job_id, JobStatus.DELETED)
 
+    def get_expired_job_ids(
+        self, policies: List[RetentionPolicy], now: Optional[datetime.datetime] = None
+    ) -> Iterator[str]:
+        """
+        The job ids of the results which garbage collection should remove: every deleted result, and those which
+        have expired under the retention policy of their report. Results which are still running never expire.
+        """
+        for doc in self.library.find({"status": JobStatus.DELETED.value}, {"_id": 0, "job_id": 1}):
+            yield doc["job_id"]
+        now = now or datetime.datetime.now()
+        for report_name in self.library.distinct("report_name"):
+            policy = find_retention_policy(policies, report_name)
+            if policy is not None:
+                yield from self._get_expired_job_ids_for_report(report_name, policy, now)
+
+    def _get_expired_job_ids_for_report(
+        self, report_name: str, policy: RetentionPolicy, now: datetime.datetime
+    ) -> Iterator[str]:
+        docs = self.library.find(
+            documents.expiring_filter(report_name),
+            {"_id": 0, "job_id": 1, "overrides": 1, "overrides_hash": 1, "update_time": 1},
+        ).sort("update_time", pymongo.DESCENDING)
+        return documents.expired_job_ids(docs, policy, now)
+
+    def get_reclaimable_bytes(self, job_ids: List[str]) -> Dict[str, int]:
+        """
+        Roughly how much storage removing these results would free: their payloads, their PDFs and per-job output
+        files, and the output blobs which only they reference. Payloads saved before their size was recorded count
+        as nothing, as do blobs which are shared with results in another call.
+        """
+        payload_bytes = sum(
+            doc.get("payload_bytes", 0)
+            for doc in self.payload_library.find({"job_id": {"$in": job_ids}}, {"_id": 0, "payload_bytes": 1})
+        )
+        file_bytes = sum(
+            doc.get("length", 0)
+            for doc in self.result_data_files.find(self._job_files_filter({"$in": job_ids}), {"_id": 0, "length": 1})
+        )
+        references = Counter()
+        for doc in self.library.find({"job_id": {"$in": job_ids}}, {"_id": 0, "raw_html_resources.output_hashes": 1}):
+            references.update(set((doc.get("raw_html_resources") or {}).get("output_hashes", [])))
+        blob_bytes = sum(
+            ref.get("size", 0)
+            for ref in self.blob_refs.find({"_id": {"$in": list(references)}})
+            if ref["refcount"] <= references[ref["_id"]]
+        )
+        return {"payload_bytes": payload_bytes, "file_bytes": file_bytes, "blob_bytes": blob_bytes}
+
+    def purge_results(self, job_ids: List[str]) -> int:
+        """
+        Physically removes results, along with their payloads, stdout, PDFs and output files, and drops their
+        references on output blobs. Each result document is removed first, so that if two collectors race only the
+        one which removed it releases its blobs. Returns the number of results removed.
+        """
+        purged = []
+        for job_id in job_ids:
+            doc = self.library.find_one_and_delete({"job_id": job_id}, projection=_PURGE_PROJECTION)
+            if doc is None:
+                continue
+            purged.append(job_id)
+            self._release_blobs((doc.get("raw_html_resources") or {}).get("output_hashes", []))
+            if doc.get("status") != JobStatus.DELETED.value:
+                self._repoint_latest_pointers(
+                    doc["report_name"],
+                    doc.get("overrides_hash") or documents.overrides_hash(doc.get("overrides")),
+                    job_id,
+                )
+        if purged:
+            self.payload_library.delete_many({"job_id": {"$in": purged}})
+            self.stdout_library.delete_many({"job_id": {"$in": purged}})
+            for grid_file in self.result_data_files.find(self._job_files_filter({"$in": purged}), {"_id": 1}):
+                self.result_data_store.delete(grid_file["_id"])
+        return len(purged)
+
+    def find_orphaned_files(self, batch_size: int = 1000) -> Iterator[Dict]:
+        """
+        GridFS files which nothing uses any more: those of this collection's results which no longer exist, and output
+        blobs which no result references. Each is a notebook_data.files document with its _id, length and metadata.
+        """
+        projection = {"_id": 1, "length": 1, "metadata": 1}
+        job_files = self.result_data_files.find(self._job_files_filter({"$exists": True}), projection)
+        for batch in documents.batches(job_files, batch_size):
+            existing = self._existing_job_ids(batch)
+            yield from (grid_file for grid_file in batch if grid_file["metadata"]["job_id"] not in existing)
+        blob_files = self.result_data_files.find({"metadata.sha256": {"$exists": True}}, projection)
+        for batch in documents.batches(blob_files, batch_size):
+            hashes = list({grid_file["metadata"]["sha256"] for grid_file in batch})
+            live = {ref["_id"] for ref in self.blob_refs.find({"_id": {"$in": hashes}, "refcount": {"$gt": 0}})}
+            yield from (grid_file for grid_file in batch if grid_file["metadata"]["sha256"] not in live)
+
+    def _job_files_filter(self, job_id_filter: Any) -> Dict[str, Any]:
+        """
+        Matches the GridFS files of this collection's results, given a filter on their job_id. Files saved before
+        they were tagged with their result collection match whichever collection they belong to.
+        """
+        return {
+            "metadata.job_id": job_id_filter,
+            "metadata.result_collection": {"$in": [self.result_collection_name, None]},
+        }
+
+    def _existing_job_ids(self, grid_files: List[Dict]) -> Set[str]:
+        """ Which of the jobs that these GridFS files belong to still have a result. """
+        tagged = {
+            grid_file["metadata"]["job_id"]
+            for grid_file in grid_files
+            if grid_file["metadata"].get("result_collection")
+        }
+        untagged = {grid_file["metadata"]["job_id"] for grid_file in grid_files} - tagged
+        # We can't tell which collection untagged files belong to, so they are kept if any collection in the
+        # database has their job, other than those of the notebook_data bucket itself.
+        collections = [(tagged, self.library)]
+        if untagged:
+            database = self.library.database
+            collections.extend(
+                (untagged, database[name])
+                for name in database.list_collection_names()
+                if not name.startswith(("notebook_data.", "system."))
+            )
+        existing = set()
+        for job_ids, collection in collections:
+            if job_ids:
+                existing.update(
+                    doc["job_id"]
+                    for doc in collection.find({"job_id": {"$in": list(job_ids)}}, {"_id": 0, "job_id": 1})
+                )
+        return existing
+
+    def delete_orphaned_files(self, grid_files: List[Dict]) -> int:
+        """ Deletes files found by find_orphaned_files(), unless their result or blob has been saved again since. """
+        n_deleted = 0
+        for grid_file in grid_files:
+            blob_hash = grid_file["metadata"].get("sha256")
+            if blob_hash is not None:
+                # A ref which is still at zero is dropped first, so that a result saved from now on stores the blob
+                # afresh rather than relying on this copy.
+                dropped = self.blob_refs.find_one_and_delete({"_id": blob_hash, "refcount": {"$lte": 0}})
+                if dropped is None and self.blob_refs.find_one({"_id": blob_hash}) is not None:
+                    continue
+            elif self._existing_job_ids([grid_file]):
+                continue
+            self.result_data_store.delete(grid_file["_id"])
+            n_deleted += 1
+        return n_deleted
+
+
+def _with_read_preference(collection: pymongo.collection.Collection, read_preference) -> pymongo.collection.Collection:
+    return collection if read_preference is None else collection.with_options(read_preference=read_preference)
+
 
-def _pdf_filename(job_id: str) -> str:
-    return "{}.pdf".format(job_id)
+def _job_id_from_filename(filename: str) -> Optional[str]:
+    """ The inverse of get_resources_dir() and documents.pdf_filename(). """
+    if "/" in filename:
+        return filename.split("/", 1)[0]
+    if filename.endswith(".pdf"):
+        return filename[: -len(".pdf")]
+    return None
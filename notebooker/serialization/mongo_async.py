@@ -0,0 +1,399 @@
+"""
+An asyncio counterpart to MongoResultSerializer, built on pymongo's own async API (pymongo>=4.9), for async
+frontends which want to overlap their mongo I/O. It reads and writes exactly the same documents as
+MongoResultSerializer, so the two can be used side by side on the same collections. Completed results are returned
+with their payload, outputs and PDF already loaded, since they can't be loaded lazily from synchronous code.
+
+A client is bound to the event loop which first uses it, so keep one AsyncMongoResultSerializer per event loop.
+"""
+
+import asyncio
+import datetime
+from logging import getLogger
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Union
+
+import pymongo
+from gridfs import NoFile
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+try:
+    from gridfs import AsyncGridFS
+    from pymongo import AsyncMongoClient
+except ImportError:
+    AsyncGridFS = AsyncMongoClient = None
+
+from notebooker.constants import (
+    JobStatus,
+    NotebookResultComplete,
+    NotebookResultError,
+    NotebookResultPending,
+)
+from notebooker.serialization.codecs import COMPRESSED_FIELDS, ZLIB, check_codec
+from notebooker.serialization import documents
+from notebooker.serialization.mongo import (
+    OUTPUT_BLOB_BYTES_DEDUPLICATED,
+    OUTPUT_BLOB_BYTES_STORED,
+    PAYLOAD_BATCH_SIZE,
+    MongoResultSerializer,
+)
+
+logger = getLogger(__name__)
+Result = Union[NotebookResultError, NotebookResultComplete, NotebookResultPending]
+
+
+class AsyncMongoResultSerializer:
+    def __init__(
+        self,
+        database_name="notebooker",
+        mongo_host="localhost",
+        result_collection_name="NOTEBOOK_OUTPUT",
+        payload_codec=ZLIB,
+        mongo_user=None,
+        mongo_password=None,
+        **client_kwargs,
+    ):
+        if AsyncMongoClient is None:
+            raise ImportError("AsyncMongoResultSerializer needs pymongo>=4.9, which has an asyncio API.")
+        self.database_name = database_name
+        self.mongo_host = mongo_host
+        self.payload_codec = check_codec(payload_codec)
+        self.result_collection_name = result_collection_name
+        client_kwargs = {k: v for k, v in client_kwargs.items() if v is not None}
+        self.client = AsyncMongoClient(mongo_host, username=mongo_user, password=mongo_password, **client_kwargs)
+        mongo_connection = self.client[database_name]
+        self.library = mongo_connection[result_collection_name]
+        self.stdout_library = mongo_connection[documents.stdout_collection_name(result_collection_name)]
+        self.payload_library = mongo_connection[documents.payload_collection_name(result_collection_name)]
+        self.latest_pointers = mongo_connection[documents.latest_pointers_collection_name(result_collection_name)]
+        self.result_data_store = AsyncGridFS(mongo_connection, "notebook_data")
+        self.result_data_files = mongo_connection["notebook_data.files"]
+        self.blob_refs = mongo_connection["notebook_data.refs"]
+        self._stdout_positions: Dict[str, tuple] = {}
+
+    async def close(self) -> None:
+        await self.client.close()
+
+    async def ensure_indexes(self) -> None:
+        """ The async counterpart of MongoResultSerializer.ensure_indexes(); call it once at startup. """
+        try:
+            await self.library.create_indexes([MongoResultSerializer._job_id_index()])
+        except OperationFailure:
+            logger.exception(
+                "Couldn't create a unique job_id index on %s. Run `notebooker-cli remove-duplicate-results`.",
+                self.library.name,
+            )
+        await self.library.create_indexes(MongoResultSerializer._result_indexes())
+        await self.stdout_library.create_index([("job_id", pymongo.ASCENDING), ("seq", pymongo.ASCENDING)], unique=True)
+        await self.payload_library.create_index([("job_id", pymongo.ASCENDING)], unique=True)
+        await self.result_data_files.create_index([("metadata.job_id", pymongo.ASCENDING)], background=True)
+
+    async def _save_raw_to_db(self, out_data: Dict) -> bool:
+        """ Saves a result document if its job's result may move into its status; see MongoResultSerializer. """
+        documents.stamp_result_document(out_data)
+        job_id = out_data["job_id"]
+        if not (await self.library.replace_one(documents.replace_filter(out_data), out_data)).matched_count:
+            inserted = await self.library.update_one({"job_id": job_id}, {"$setOnInsert": out_data}, upsert=True)
+            if inserted.upserted_id is None:
+                documents.can_replace(await self._get_status_document(job_id), out_data)
+                return False
+        if "report_name" in out_data:
+            await self._update_latest_pointers(out_data)
+        return True
+
+    async def _get_status_document(self, job_id: str) -> Optional[Dict]:
+        return await self.library.find_one({"job_id": job_id}, {"_id": 0, "status": 1})
+
+    async def _save_to_db(self, notebook_result) -> bool:
+        out_data, payload = documents.split_payload(notebook_result)
+        if payload:
+            if not documents.can_replace(await self._get_status_document(out_data["job_id"]), out_data):
+                return False
+            payload_doc = documents.payload_document(out_data["job_id"], payload, self.payload_codec)
+            await self.payload_library.replace_one({"job_id": out_data["job_id"]}, payload_doc, upsert=True)
+        return await self._save_raw_to_db(out_data)
+
+    async def _update_latest_pointers(self, result: Dict) -> None:
+        overrides_hash = result.get("overrides_hash") or documents.overrides_hash(result.get("overrides"))
+        if JobStatus.from_string(result.get("status")) == JobStatus.DELETED:
+            for pointer_id, field, mongo_filter in documents.latest_pointer_repoints(
+                result["report_name"], overrides_hash
+            ):
+                newest = await self.library.find_one(
+                    mongo_filter, {"_id": 0, "job_id": 1, "update_time": 1}, sort=[("update_time", pymongo.DESCENDING)]
+                )
+                await self.latest_pointers.update_one(
+                    *documents.repoint_update(pointer_id, field, result["job_id"], newest)
+                )
+            return
+        successful = JobStatus.from_string(result.get("status")) == JobStatus.DONE
+        for mongo_filter, update in documents.latest_pointer_advances(
+            result["report_name"], overrides_hash, result["job_id"], result["update_time"], successful
+        ):
+            try:
+                await self.latest_pointers.update_one(mongo_filter, update, upsert=True)
+            except DuplicateKeyError:
+                pass
+
+    async def update_stdout(self, job_id: str, new_lines: List[str]) -> None:
+        """ Appends a chunk of lines to the job's stdout log. """
+        if not new_lines:
+            return
+        while True:
+            if job_id not in self._stdout_positions:
+                last_chunk = await self.stdout_library.find_one(
+                    {"job_id": job_id}, {"_id": 0, "seq": 1, "end_line": 1}, sort=[("seq", pymongo.DESCENDING)]
+                )
+                self._stdout_positions[job_id] = (
+                    (last_chunk["seq"] + 1, last_chunk["end_line"]) if last_chunk else (0, 0)
+                )
+            seq, first_line = self._stdout_positions[job_id]
+            chunk = documents.stdout_chunk(job_id, seq, first_line, new_lines)
+            try:
+                await self.stdout_library.insert_one(chunk)
+            except DuplicateKeyError:
+                del self._stdout_positions[job_id]
+                continue
+            self._stdout_positions[job_id] = (seq + 1, chunk["end_line"])
+            return
+
+    async def get_stdout(self, job_id: str, offset: int = 0) -> List[str]:
+        """ Gets the lines of a job's stdout, starting from the given line number. """
+        chunks = self.stdout_library.find(
+            {"job_id": job_id, "end_line": {"$gt": offset}}, {"_id": 0, "first_line": 1, "lines": 1}
+        ).sort("seq", pymongo.ASCENDING)
+        lines = documents.stdout_lines([chunk async for chunk in chunks], offset)
+        if not lines:
+            legacy = await self.library.find_one({"job_id": job_id}, {"_id": 0, "stdout": 1})
+            lines = (legacy or {}).get("stdout", [])[offset:]
+        return lines
+
+    async def update_check_status(self, job_id: str, status: JobStatus, **extra) -> bool:
+        """ Moves a job into the given status, if it is allowed to (see MongoResultSerializer.update_check_status). """
+        update = dict(extra, status=status.value, update_time=datetime.datetime.now())
+        mongo_filter = {"job_id": job_id}
+        mongo_filter.update(documents.status_transition_filter(status))
+        if not (await self.library.update_one(mongo_filter, {"$set": update})).matched_count:
+            documents.can_transition(job_id, await self._get_status_document(job_id), status)
+            return False
+        result = await self.library.find_one({"job_id": job_id}, documents.LATEST_POINTER_PROJECTION)
+        if result:
+            await self._update_latest_pointers(result)
+        return True
+
+    async def save_check_stub(
+        self,
+        job_id: str,
+        report_name: str,
+        report_title: Optional[str] = "",
+        job_start_time: Optional[datetime.datetime] = None,
+        status: JobStatus = JobStatus.PENDING,
+        overrides: Optional[Dict] = None,
+        mailto: str = "",
+        generate_pdf_output: bool = True,
+    ) -> None:
+        """ Call this when we are just starting a check. Saves a "pending" job into storage. """
+        await self._save_to_db(
+            documents.check_stub(
+                job_id, report_name, report_title, job_start_time, status, overrides, mailto, generate_pdf_output
+            )
+        )
+
+    async def save_check_result(self, notebook_result: Union[NotebookResultComplete, NotebookResultError]) -> None:
+        blobs = documents.hash_outputs(notebook_result)
+        previous_hashes = (await self._get_output_hashes(notebook_result.job_id)).values() if blobs else []
+
+        logger.info("Saving {}".format(notebook_result.job_id))
+        if not await self._save_to_db(notebook_result):
+            return
+
+        if isinstance(notebook_result, NotebookResultComplete):
+            if blobs:
+                await self._store_blobs(blobs)
+                await self._release_blobs(previous_hashes)
+            if notebook_result.pdf:
+                await self.result_data_store.put(
+                    notebook_result.pdf,
+                    filename=documents.pdf_filename(notebook_result.job_id),
+                    encoding="utf-8",
+                    metadata=documents.job_file_metadata(notebook_result.job_id, self.result_collection_name),
+                )
+
+    async def _get_output_hashes(self, job_id: str) -> Dict[str, str]:
+        return documents.output_hashes(
+            await self.library.find_one({"job_id": job_id}, {"_id": 0, "raw_html_resources": 1})
+        )
+
+    async def _store_blobs(self, blobs: Dict[str, bytes]) -> None:
+        """ See MongoResultSerializer._store_blobs(). """
+        write_result = await self.blob_refs.bulk_write(documents.blob_ref_increments(blobs))
+        pending = set(write_result.upserted_ids.values())
+        existing = [blob_hash for blob_hash in blobs if blob_hash not in pending]
+        if existing:
+            refs = self.blob_refs.find({"_id": {"$in": existing}, "pending": True}, {"_id": 1})
+            pending.update([ref["_id"] async for ref in refs])
+        for blob_hash, data in blobs.items():
+            if blob_hash not in pending:
+                OUTPUT_BLOB_BYTES_DEDUPLICATED.inc(len(data))
+                continue
+            try:
+                await self.result_data_store.put(
+                    data, filename=documents.blob_filename(blob_hash), encoding="utf-8", metadata={"sha256": blob_hash}
+                )
+            except Exception:
+                await self.blob_refs.update_one({"_id": blob_hash}, {"$inc": {"refcount": -1}})
+                await self.blob_refs.delete_one({"_id": blob_hash, "refcount": {"$lte": 0}, "pending": True})
+                raise
+            await self.blob_refs.update_one({"_id": blob_hash}, {"$unset": {"pending": ""}})
+            OUTPUT_BLOB_BYTES_STORED.inc(len(data))
+
+    async def _release_blobs(self, hashes: Iterable[str]) -> None:
+        for blob_hash in set(hashes):
+            ref = await self.blob_refs.find_one_and_update(
+                {"_id": blob_hash}, {"$inc": {"refcount": -1}}, return_document=pymongo.ReturnDocument.AFTER
+            )
+            if ref is None or ref["refcount"] > 0:
+                continue
+            copies = self.result_data_store.find({"filename": documents.blob_filename(blob_hash)})
+            file_ids = [grid_out._id async for grid_out in copies]
+            if (await self.blob_refs.delete_one({"_id": blob_hash, "refcount": {"$lte": 0}})).deleted_count:
+                for file_id in file_ids:
+                    await self.result_data_store.delete(file_id)
+
+    async def _read_file(self, path: str) -> Union[bytes, str]:
+        try:
+            grid_out = await self.result_data_store.get_last_version(path)
+            return await grid_out.read()
+        except NoFile:
+            logger.error("Could not find file %s in %s", path, self.result_data_store)
+            return ""
+
+    async def has_pdf(self, job_id: str) -> bool:
+        """ Whether a non-empty PDF was stored for the result, from its GridFS file rather than by reading it. """
+        pdf_file = {"filename": documents.pdf_filename(job_id), "length": {"$gt": 0}}
+        async for _ in self.result_data_store.find(pdf_file, limit=1):
+            return True
+        return False
+
+    async def _with_payloads(self, docs: List[Dict]) -> List[Result]:
+        """ Converts result documents, first filling in the payloads, outputs and PDFs of completed results. """
+        done = {doc["job_id"]: doc for doc in docs if doc.get("status") == JobStatus.DONE.value}
+        if done:
+            projection = {"_id": 0, "job_id": 1, "payload_codec": 1}
+            projection.update({field: 1 for field in COMPRESSED_FIELDS})
+            job_ids = list(done)
+            payloads = {
+                payload["job_id"]: payload
+                async for payload in self.payload_library.find({"job_id": {"$in": job_ids}}, projection)
+            }
+            legacy_job_ids = [job_id for job_id in job_ids if job_id not in payloads]
+            if legacy_job_ids:
+                async for payload in self.library.find({"job_id": {"$in": legacy_job_ids}}, projection):
+                    payloads[payload["job_id"]] = payload
+            for job_id, payload in payloads.items():
+                done[job_id].update(payload)
+            await asyncio.gather(*(self._load_files(doc) for doc in done.values()))
+        return await self._without_payloads(docs)
+
+    @staticmethod
+    async def _without_payloads(docs: List[Dict]) -> List[Result]:
+        return [result for result in map(documents.result_from_document, docs) if result is not None]
+
+    async def _load_files(self, doc: Dict) -> None:
+        resources = dict(doc.get("raw_html_resources") or {})
+        paths = resources.get("outputs") or []
+        hashes = resources.get("output_hashes") or [None] * len(paths)
+        filenames = [documents.blob_filename(h) if h else path for path, h in zip(paths, hashes)]
+        resources["outputs"] = dict(zip(paths, await asyncio.gather(*map(self._read_file, filenames))))
+        doc["raw_html_resources"] = resources
+        if doc.get("generate_pdf_output"):
+            doc["pdf"] = await self._read_file(documents.pdf_filename(doc["job_id"]))
+
+    async def get_check_result(self, job_id: str) -> Optional[Result]:
+        doc = await self.library.find_one({"job_id": job_id}, {"_id": 0, "raw_html": 0, "raw_ipynb_json": 0})
+        results = await self._with_payloads([doc]) if doc else []
+        return results[0] if results else None
+
+    async def get_all_results(
+        self,
+        since: Optional[datetime.datetime] = None,
+        limit: Optional[int] = 100,
+        mongo_filter: Optional[Dict] = None,
+        load_payload: bool = True,
+    ) -> AsyncIterator[Result]:
+        base_filter = documents.listing_filter(mongo_filter, since)
+        projection = {"_id": 0, "raw_html": 0, "raw_ipynb_json": 0} if load_payload else documents.LISTING_PROJECTION
+        convert = self._with_payloads if load_payload else self._without_payloads
+        batch = []
+        async for doc in self.library.find(base_filter, projection).sort("update_time", -1).limit(limit):
+            batch.append(doc)
+            if len(batch) >= PAYLOAD_BATCH_SIZE:
+                for result in await convert(batch):
+                    yield result
+                batch = []
+        for result in await convert(batch):
+            yield result
+
+    async def _get_all_job_ids(
+        self,
+        report_name: str,
+        overrides: Optional[Dict],
+        status: Optional[JobStatus] = None,
+        as_of: Optional[datetime.datetime] = None,
+        limit: int = 0,
+    ) -> List[str]:
+        mongo_filter = documents.listing_filter(documents.result_filter(report_name, overrides, status, as_of))
+        cursor = self.library.find(mongo_filter, {"_id": 0, "job_id": 1}).sort("update_time", -1).limit(limit)
+        return [doc["job_id"] async for doc in cursor]
+
+    async def _get_latest_pointer(self, report_name: str, params: Optional[Dict], field: str) -> Optional[str]:
+        overrides_hash = documents.ALL_OVERRIDES if params is None else documents.overrides_hash(params)
+        pointer = await self.latest_pointers.find_one(
+            {"_id": documents.latest_pointer_id(report_name, overrides_hash)}, {field: 1}
+        )
+        return ((pointer or {}).get(field) or {}).get("job_id")
+
+    async def get_all_job_ids_for_name_and_params(self, report_name: str, params: Optional[Dict]) -> List[str]:
+        """ Get all the result ids for a given name and parameters, newest first """
+        return await self._get_all_job_ids(report_name, params)
+
+    async def get_latest_job_id_for_name_and_params(
+        self, report_name: str, params: Optional[Dict], as_of: Optional[datetime.datetime] = None
+    ) -> Optional[str]:
+        """ Get the latest result id for a given name and parameters """
+        job_id = await self._get_latest_pointer(report_name, params, "latest") if as_of is None else None
+        if job_id:
+            return job_id
+        all_job_ids = await self._get_all_job_ids(report_name, params, as_of=as_of, limit=1)
+        return all_job_ids[0] if all_job_ids else None
+
+    async def get_latest_successful_job_id_for_name_and_params(
+        self, report_name: str, params: Optional[Dict], as_of: Optional[datetime.datetime] = None
+    ) -> Optional[str]:
+        """ Get the latest successful job id for a given name and parameters """
+        job_id = await self._get_latest_pointer(report_name, params, "latest_successful") if as_of is None else None
+        if job_id:
+            return job_id
+        all_job_ids = await self._get_all_job_ids(report_name, params, JobStatus.DONE, as_of, limit=1)
+        return all_job_ids[0] if all_job_ids else None
+
+    async def get_latest_successful_job_ids_for_name_all_params(self, report_name: str) -> List[str]:
+        """ Get the latest successful job ids for all parameter variants of a given name """
+        projection = {"_id": 0, "job_id": 1, "overrides_hash": 1, "overrides": 1}
+        results = await self.library.aggregate(documents.latest_successful_all_params_pipeline(report_name, projection))
+        return [result["job_id"] async for result in results]
+
+    async def get_latest_successful_results_for_name_all_params(self, report_name: str) -> AsyncIterator[Result]:
+        """ The latest successful result of each parameter variant of a given name, from a single aggregation. """
+        pipeline = documents.latest_successful_all_params_pipeline(report_name, documents.LATEST_SUCCESSFUL_PROJECTION)
+        batch = []
+        async for doc in await self.library.aggregate(pipeline):
+            batch.append(doc)
+            if len(batch) >= PAYLOAD_BATCH_SIZE:
+                for result in await self._with_payloads(batch):
+                    yield result
+                batch = []
+        for result in await self._with_payloads(batch):
+            yield result
+
+    async def delete_result(self, job_id: str) -> None:
+        await self.update_check_status(job_id, JobStatus.DELETED)
@@ -0,0 +1,131 @@
+"""
+One MongoClient per set of connection settings per process. MongoClient is thread-safe and pools its own
+connections, so every serializer in the webapp (one per request), the report hunter and the stdout monitors
+share a client rather than each opening connections - and doing a TLS/auth handshake - of their own.
+"""
+import os
+import threading
+from logging import getLogger
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo import MongoClient, monitoring
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred, _ServerMode
+
+from notebooker.utils.metrics import counter, gauge
+
+logger = getLogger(__name__)
+
+MONGO_POOL_CONNECTIONS = gauge(
+    "notebooker_mongo_pool_connections", "Connections open in this process's MongoClient pools.", ["address"]
+)
+MONGO_POOL_CHECKED_OUT = gauge(
+    "notebooker_mongo_pool_checked_out", "Connections currently checked out of this process's pools.", ["address"]
+)
+MONGO_POOL_CHECKOUTS = counter("notebooker_mongo_pool_checkouts", "Connections checked out of the pool.", ["address"])
+MONGO_POOL_CHECKOUT_FAILURES = counter(
+    "notebooker_mongo_pool_checkout_failures", "Failures to check a connection out of the pool.", ["address", "reason"]
+)
+MONGO_POOL_CLEARS = counter(
+    "notebooker_mongo_pool_clears", "Times a pool was cleared, e.g. after a network error.", ["address"]
+)
+MONGO_CLIENTS = gauge("notebooker_mongo_clients", "MongoClients shared by this process.")
+
+# Read preference mode names, as in a mongo connection string, for the --mongo-*-read-preference options.
+_READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+READ_PREFERENCE_MODES = tuple(_READ_PREFERENCES)
+
+_clients: Dict[Tuple, MongoClient] = {}
+_clients_lock = threading.Lock()
+
+
+def _address(event) -> str:
+    return "{}:{}".format(*event.address)
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """ Publishes the state of MongoClient connection pools as prometheus metrics. """
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        MONGO_POOL_CLEARS.labels(_address(event)).inc()
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.labels(_address(event)).inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.labels(_address(event)).dec()
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        MONGO_POOL_CHECKOUT_FAILURES.labels(_address(event), str(event.reason)).inc()
+
+    def connection_checked_out(self, event):
+        MONGO_POOL_CHECKOUTS.labels(_address(event)).inc()
+        MONGO_POOL_CHECKED_OUT.labels(_address(event)).inc()
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.labels(_address(event)).dec()
+
+
+def get_mongo_client(
+    host: str, username: Optional[str] = None, password: Optional[str] = None, **client_kwargs: Any
+) -> MongoClient:
+    """
+    Returns the MongoClient for these settings, creating it the first time they are seen. Settings which are None
+    are left to pymongo's defaults. Clients are not shared across a fork, since MongoClient isn't fork-safe.
+    """
+    client_kwargs = {k: v for k, v in client_kwargs.items() if v is not None}
+    key = (os.getpid(), host, username, password, tuple(sorted(client_kwargs.items())))
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                logger.info("Creating a MongoClient for %s with %s", host, client_kwargs)
+                client = MongoClient(
+                    host, username=username, password=password, event_listeners=[PoolStatsListener()], **client_kwargs
+                )
+                _clients[key] = client
+                MONGO_CLIENTS.set(len(_clients))
+    return client
+
+
+def close_mongo_clients() -> None:
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        MONGO_CLIENTS.set(0)
+
+
+def get_read_preference(mode: Optional[str], max_staleness_seconds: Optional[int] = None) -> Optional[_ServerMode]:
+    """
+    The pymongo read preference for a mode in READ_PREFERENCE_MODES, or None to read from the primary like the rest
+    of the serializer. max_staleness_seconds (90 at least) keeps reads away from secondaries lagging further behind.
+    """
+    if mode not in (None,) + READ_PREFERENCE_MODES:
+        raise ValueError("Unknown read preference {!r}. Choose from {}.".format(mode, ", ".join(READ_PREFERENCE_MODES)))
+    if mode in (None, "primary"):
+        if max_staleness_seconds is not None:
+            raise ValueError("A max staleness can only be given with a read preference which allows secondaries.")
+        return None if mode is None else Primary()
+    return _READ_PREFERENCES[mode](max_staleness=-1 if max_staleness_seconds is None else max_staleness_seconds)
@@ -0,0 +1,779 @@
+"""
+A result serializer for single-node deployments which keeps everything on local disk, with no database server to
+talk to. Result metadata and stdout live in a SQLite database, in WAL mode so that readers never wait for the
+writer, and payloads, PDFs and outputs live as files in a data directory next to it:
+
+    jobs/<job id>/raw_html.<codec>, raw_ipynb_json.<codec>, report.pdf
+    blobs/<hash[:2]>/<hash>     the content-addressed outputs, shared between results like the GridFS blobs
+
+It offers the same methods as MongoResultSerializer and returns the same results, so the webapp, report hunter and
+garbage collector work with either. SQLite has no change streams, so the report hunter polls.
+"""
+
+import contextlib
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from logging import getLogger
+from typing import Any, AnyStr, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from urllib.parse import quote, unquote
+
+import click
+
+from notebooker.constants import (
+    JobStatus,
+    LazyNotebookResultComplete,
+    NotebookResultComplete,
+    NotebookResultError,
+    NotebookResultPending,
+)
+from notebooker.retention import RetentionPolicy, find_retention_policy
+from notebooker.serialization import documents
+from notebooker.serialization.codecs import NO_CODEC, ZLIB, check_codec, compress_payload, decompress_payload
+from notebooker.serialization.mongo import (
+    OUTPUT_BLOB_BYTES_DEDUPLICATED,
+    OUTPUT_BLOB_BYTES_SAVED,
+    OUTPUT_BLOB_BYTES_STORED,
+    OUTPUT_BLOB_DEDUP_RATIO,
+    PAYLOAD_BATCH_SIZE,
+    MongoResultSerializer,
+)
+
+logger = getLogger(__name__)
+# How long a connection waits for another process's write to finish before giving up.
+BUSY_TIMEOUT_SECONDS = 30
+# Times are stored as fixed-width strings so that they sort and compare in time order.
+_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    job_id TEXT PRIMARY KEY,
+    report_name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    update_time TEXT NOT NULL,
+    overrides_hash TEXT NOT NULL,
+    document TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_latest ON results (report_name, overrides_hash, status, update_time DESC);
+CREATE INDEX IF NOT EXISTS results_status ON results (status, update_time DESC);
+CREATE INDEX IF NOT EXISTS results_page ON results (update_time DESC, job_id DESC);
+CREATE INDEX IF NOT EXISTS results_report_page ON results (report_name, update_time DESC, job_id DESC);
+CREATE TABLE IF NOT EXISTS stdout (
+    job_id TEXT NOT NULL,
+    line_number INTEGER NOT NULL,
+    line TEXT NOT NULL,
+    PRIMARY KEY (job_id, line_number)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS blob_refs (
+    hash TEXT PRIMARY KEY,
+    refcount INTEGER NOT NULL,
+    size INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+# The columns which mongo-style filters (see _where()) can match on.
+_FILTER_COLUMNS = {"job_id", "report_name", "status", "update_time", "overrides_hash"}
+_FILTER_OPERATORS = {"$ne": "!=", "$lt": "<", "$lte": "<=", "$gt": ">", "$gte": ">="}
+_PDF_FILENAME = "report.pdf"
+# The database files which have already had their schema created by this process.
+_INITIALISED_DATABASES = set()
+
+
+class BaseSqliteResultSerializer:
+    # This class is the interface between SQLite plus the local filesystem and the rest of the application
+
+    def __init__(self, sqlite_path: str, sqlite_data_dir: Optional[str] = None, payload_codec: str = ZLIB):
+        self.sqlite_path = os.path.abspath(os.path.expanduser(sqlite_path))
+        self.sqlite_data_dir = os.path.abspath(
+            os.path.expanduser(sqlite_data_dir or os.path.splitext(self.sqlite_path)[0] + "_data")
+        )
+        self.payload_codec = check_codec(payload_codec)
+        # sqlite3 connections can't be shared between threads, so each thread which uses this serializer gets its own.
+        self._local = threading.local()
+        self.ensure_indexes()
+
+    def __init_subclass__(cls, cli_options: click.Command = None, **kwargs):
+        if cli_options is None:
+            raise ValueError(
+                "A BaseSqliteResultSerializer has been declared without cli_options. "
+                "Please add them like so: `class MySerializer(cli_options=cli_opts)`."
+            )
+        cls.cli_options = cli_options
+        super().__init_subclass__(**kwargs)
+
+    serializer_args_to_cmdline_args = MongoResultSerializer.serializer_args_to_cmdline_args
+
+    @classmethod
+    def get_name(cls):
+        return cls.__name__
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Transactions are begun explicitly; see _transaction().
+            connection = sqlite3.connect(self.sqlite_path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            # In WAL mode this is still safe against corruption; only the last commits can be lost on a power cut.
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def close(self) -> None:
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """ A write transaction, which takes the write lock up front. Nested transactions join the outer one. """
+        connection = self._connection()
+        if connection.in_transaction:
+            yield connection
+            return
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def ensure_indexes(self, force: bool = False) -> None:
+        """
+        Creates the tables and indexes, and the data directory. This only happens once per database for the lifetime
+        of the process, unless force=True (e.g. from `notebooker-cli ensure-indexes`).
+        """
+        if self.sqlite_path in _INITIALISED_DATABASES and not force:
+            return
+        logger.info("Ensuring the result tables exist in %s", self.sqlite_path)
+        os.makedirs(os.path.dirname(self.sqlite_path), exist_ok=True)
+        for subdir in ("jobs", "blobs"):
+            os.makedirs(os.path.join(self.sqlite_data_dir, subdir), exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+        _INITIALISED_DATABASES.add(self.sqlite_path)
+
+    def _job_dir(self, job_id: str) -> str:
+        # Quoting keeps job ids from escaping the data directory.
+        return os.path.join(self.sqlite_data_dir, "jobs", quote(job_id, safe=""))
+
+    def _blob_path(self, content_hash: str) -> str:
+        return os.path.join(self.sqlite_data_dir, "blobs", content_hash[:2], content_hash)
+
+    def _save_raw_to_db(self, connection: sqlite3.Connection, out_data: Dict) -> None:
+        documents.stamp_result_document(out_data)
+        connection.execute(
+            "INSERT OR REPLACE INTO results (job_id, report_name, status, update_time, overrides_hash, document) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                out_data["job_id"],
+                out_data["report_name"],
+                out_data["status"],
+                _format_time(out_data["update_time"]),
+                out_data["overrides_hash"],
+                _dump_document(out_data),
+            ),
+        )
+
+    def _save_to_db(self, notebook_result) -> bool:
+        """
+        Saves a result unless its job already has a result which can't move into its status (see
+        ALLOWED_STATUS_TRANSITIONS). Returns whether it was saved.
+        """
+        out_data, payload = documents.split_payload(notebook_result)
+        with self._transaction() as connection:
+            if not documents.can_replace(self._get_document(out_data["job_id"]), out_data):
+                return False
+            # The payload's files are written first so that they are there by the time the result says the job is
+            # done.
+            if payload:
+                self._save_payload(out_data["job_id"], payload)
+            self._save_raw_to_db(connection, out_data)
+        return True
+
+    def _save_payload(self, job_id: str, payload: Dict[str, Optional[str]]) -> None:
+        job_dir = self._job_dir(job_id)
+        for field, value in payload.items():
+            codec = None
+            if value is not None:
+                data = compress_payload(value, self.payload_codec)
+                # Values which the codec leaves alone (e.g. empty strings) are stored as plain text.
+                codec = self.payload_codec if isinstance(data, bytes) else NO_CODEC
+                _write_file(os.path.join(job_dir, "{}.{}".format(field, codec)), _to_bytes(data))
+            # Drop any copy saved with another codec.
+            for filename in _listdir(job_dir):
+                if filename.startswith(field + ".") and filename != "{}.{}".format(field, codec):
+                    _remove_file(os.path.join(job_dir, filename))
+
+    def update_stdout(self, job_id: str, new_lines: List[str]) -> None:
+        """ Appends lines to the job's stdout log. """
+        if not new_lines:
+            return
+        with self._transaction() as connection:
+            (next_line,) = connection.execute(
+                "SELECT COALESCE(MAX(line_number) + 1, 0) FROM stdout WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            connection.executemany(
+                "INSERT INTO stdout (job_id, line_number, line) VALUES (?, ?, ?)",
+                [(job_id, next_line + i, line) for i, line in enumerate(new_lines)],
+            )
+
+    def get_stdout(self, job_id: str, offset: int = 0) -> List[str]:
+        """ Gets the lines of a job's stdout, starting from the given line number. """
+        rows = self._connection().execute(
+            "SELECT line FROM stdout WHERE job_id = ? AND line_number >= ? ORDER BY line_number", (job_id, offset)
+        )
+        return [row["line"] for row in rows]
+
+    def _move_to_status(self, connection: sqlite3.Connection, job_id: str, status: JobStatus, extra: Dict) -> bool:
+        row = connection.execute("SELECT document FROM results WHERE job_id = ?", (job_id,)).fetchone()
+        document = _load_document(row["document"]) if row else None
+        if not documents.can_transition(job_id, document, status):
+            return False
+        document.update(extra, status=status.value, update_time=datetime.datetime.now())
+        connection.execute(
+            "UPDATE results SET status = ?, update_time = ?, document = ? WHERE job_id = ?",
+            (status.value, _format_time(document["update_time"]), _dump_document(document), job_id),
+        )
+        return True
+
+    def update_check_status(self, job_id: str, status: JobStatus, **extra) -> bool:
+        """
+        Moves a job into the given status, along with any extra fields, if its current status is allowed to move into
+        the new one (see ALLOWED_STATUS_TRANSITIONS). Returns whether the job was updated.
+        """
+        with self._transaction() as connection:
+            return self._move_to_status(connection, job_id, status, extra)
+
+    def update_check_statuses(self, job_ids: List[str], status: JobStatus, **extra) -> int:
+        """
+        Bulk version of update_check_status which transitions many jobs in one transaction.
+        Jobs which are not allowed to move into the given status are left alone.
+        Returns the number of jobs which were updated.
+        """
+        with self._transaction() as connection:
+            return sum(self._move_to_status(connection, job_id, status, extra) for job_id in job_ids)
+
+    def save_check_stub(
+        self,
+        job_id: str,
+        report_name: str,
+        report_title: Optional[str] = "",
+        job_start_time: Optional[datetime.datetime] = None,
+        status: JobStatus = JobStatus.PENDING,
+        overrides: Optional[Dict] = None,
+        mailto: str = "",
+        generate_pdf_output: bool = True,
+    ) -> None:
+        """ Call this when we are just starting a check. Saves a "pending" job into storage. """
+        self._save_to_db(
+            documents.check_stub(
+                job_id, report_name, report_title, job_start_time, status, overrides, mailto, generate_pdf_output
+            )
+        )
+
+    def save_check_result(self, notebook_result: Union[NotebookResultComplete, NotebookResultError]) -> None:
+        blobs = documents.hash_outputs(notebook_result)
+        previous_hashes = self._get_output_hashes(notebook_result.job_id).values() if blobs else []
+
+        logger.info("Saving {}".format(notebook_result.job_id))
+        if not self._save_to_db(notebook_result):
+            return
+
+        if isinstance(notebook_result, NotebookResultComplete):
+            if blobs:
+                self._store_blobs(blobs)
+                self._release_blobs(previous_hashes)
+            if notebook_result.pdf:
+                pdf_path = os.path.join(self._job_dir(notebook_result.job_id), _PDF_FILENAME)
+                _write_file(pdf_path, _to_bytes(notebook_result.pdf))
+
+    def _store_blobs(self, blobs: Dict[str, bytes]) -> None:
+        """
+        Takes one reference on each content-addressed blob (hash -> bytes) for a result, writing the bytes to disk
+        only if no other result already holds them. The write lock is held throughout, so that a blob can't be
+        deleted by _release_blobs() between being referenced and being written.
+        """
+        with self._transaction() as connection:
+            for blob_hash, data in blobs.items():
+                existing = connection.execute("SELECT 1 FROM blob_refs WHERE hash = ?", (blob_hash,)).fetchone()
+                if existing:
+                    connection.execute("UPDATE blob_refs SET refcount = refcount + 1 WHERE hash = ?", (blob_hash,))
+                    OUTPUT_BLOB_BYTES_DEDUPLICATED.inc(len(data))
+                    continue
+                _write_file(self._blob_path(blob_hash), _to_bytes(data))
+                connection.execute(
+                    "INSERT INTO blob_refs (hash, refcount, size) VALUES (?, 1, ?)", (blob_hash, len(data))
+                )
+                OUTPUT_BLOB_BYTES_STORED.inc(len(data))
+
+    def _release_blobs(self, hashes: Iterable[str]) -> None:
+        """ Drops a result's reference on each blob, deleting any blobs which no result references any more. """
+        with self._transaction() as connection:
+            for blob_hash in set(hashes):
+                connection.execute("UPDATE blob_refs SET refcount = refcount - 1 WHERE hash = ?", (blob_hash,))
+                if connection.execute("DELETE FROM blob_refs WHERE hash = ? AND refcount <= 0", (blob_hash,)).rowcount:
+                    _remove_file(self._blob_path(blob_hash))
+
+    def get_blob_stats(self) -> Dict[str, int]:
+        """
+        How well output deduplication is doing: the number of distinct blobs, the bytes they take up, and the bytes
+        the results which reference them would have taken up without deduplication.
+        """
+        query = "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(size * refcount), 0) FROM blob_refs"
+        row = self._connection().execute(query).fetchone()
+        return {"n_blobs": row[0], "stored_bytes": row[1], "referenced_bytes": row[2]}
+
+    def refresh_blob_metrics(self) -> Dict[str, int]:
+        stats = self.get_blob_stats()
+        OUTPUT_BLOB_BYTES_SAVED.set(stats["referenced_bytes"] - stats["stored_bytes"])
+        OUTPUT_BLOB_DEDUP_RATIO.set(stats["referenced_bytes"] / stats["stored_bytes"] if stats["stored_bytes"] else 1.0)
+        return stats
+
+    def _get_document(self, job_id: str) -> Optional[Dict]:
+        row = self._connection().execute("SELECT document FROM results WHERE job_id = ?", (job_id,)).fetchone()
+        return _load_document(row["document"]) if row else None
+
+    def _convert_result(
+        self, result: Optional[Dict], load_payload: bool = True
+    ) -> Union[NotebookResultError, NotebookResultComplete, NotebookResultPending, None]:
+        return documents.result_from_document(result, payload_source=self if load_payload else None)
+
+    def get_check_result(
+        self, job_id: AnyStr
+    ) -> Optional[Union[NotebookResultError, NotebookResultComplete, NotebookResultPending]]:
+        return self._convert_result(self._get_document(job_id))
+
+    def has_pdf(self, job_id: str) -> bool:
+        """ Whether a non-empty PDF was stored for the result, from the size of its file rather than by reading it. """
+        try:
+            return os.path.getsize(os.path.join(self._job_dir(job_id), _PDF_FILENAME)) > 0
+        except FileNotFoundError:
+            return False
+
+    def get_result_payload(self, job_id: str, field: str) -> Any:
+        """ Reads one of raw_html, raw_ipynb_json or pdf for a completed result, for LazyNotebookResultComplete. """
+        job_dir = self._job_dir(job_id)
+        if field == "pdf":
+            return _read_file(os.path.join(job_dir, _PDF_FILENAME))
+        for filename in _listdir(job_dir):
+            name, _, codec = filename.partition(".")
+            if name == field:
+                data = _read_file(os.path.join(job_dir, filename))
+                return data.decode("utf-8") if codec == NO_CODEC else decompress_payload(data, codec)
+        return None
+
+    def _get_output_hashes(self, job_id: str) -> Dict[str, str]:
+        """ path -> content hash for each of a result's outputs. """
+        return documents.output_hashes(self._get_document(job_id))
+
+    def get_result_resource(self, job_id: str, path: str) -> AnyStr:
+        """ Reads one of the outputs in raw_html_resources, for LazyNotebookResultComplete. """
+        return self.get_result_resources(job_id, [path])[path]
+
+    def get_result_resources(self, job_id: str, paths: Iterable[str]) -> Dict[str, AnyStr]:
+        """ Reads many of a job's outputs at once. """
+        output_hashes = self._get_output_hashes(job_id)
+        contents = {}
+        for path in paths:
+            content_hash = output_hashes.get(path)
+            contents[path] = _read_file(self._blob_path(content_hash)) if content_hash else ""
+        return contents
+
+    def _with_payloads(self, results: List) -> List:
+        for result in results:
+            if isinstance(result, LazyNotebookResultComplete):
+                result.load_payload()
+        return results
+
+    def get_all_results(
+        self,
+        since: Optional[datetime.datetime] = None,
+        limit: Optional[int] = 100,
+        mongo_filter: Optional[Dict] = None,
+        load_payload: bool = True,
+    ) -> Iterator[Union[NotebookResultComplete, NotebookResultError, NotebookResultPending]]:
+        where, params = _where(documents.listing_filter(mongo_filter, since))
+        query = "SELECT document FROM results WHERE {} ORDER BY update_time DESC{}".format(where, _limit(limit))
+        batch = []
+        for row in self._connection().execute(query, params):
+            converted_result = self._convert_result(_load_document(row["document"]), load_payload=load_payload)
+            if converted_result is not None:
+                batch.append(converted_result)
+            if len(batch) >= PAYLOAD_BATCH_SIZE:
+                yield from self._with_payloads(batch)
+                batch = []
+        yield from self._with_payloads(batch)
+
+    def watch_results(self, resume_token: Optional[Dict] = None, max_await_time_ms: int = 1000):
+        """ SQLite has no change streams, so the report hunter polls for updates instead. """
+        raise NotImplementedError("SQLite has no change streams.")
+
+    def get_results_page(
+        self,
+        page_size: int = 50,
+        page_token: Optional[str] = None,
+        report_name: Optional[str] = None,
+        status: Optional[JobStatus] = None,
+        since: Optional[datetime.datetime] = None,
+        until: Optional[datetime.datetime] = None,
+    ) -> Tuple[List[Union[NotebookResultComplete, NotebookResultError, NotebookResultPending]], Optional[str]]:
+        """
+        One page of results, newest first and without their payloads, optionally filtered by report name, status
+        and update time (since <= update_time < until). Pages are keyed on (update_time, job_id) rather than skipped
+        through, so a deep page costs the same as the first one. Returns the page and a token which fetches the page
+        after it, or None if this is the last page.
+        """
+        where, params = _where(documents.results_page_filter(report_name, status, since, until))
+        if page_token is not None:
+            last_update_time, last_job_id = documents.decode_page_token(page_token)
+            where += " AND (update_time < ? OR (update_time = ? AND job_id < ?))"
+            params += [_format_time(last_update_time), _format_time(last_update_time), last_job_id]
+        # One extra row tells us whether there is another page.
+        query = "SELECT document FROM results WHERE {} ORDER BY update_time DESC, job_id DESC LIMIT ?".format(where)
+        docs = [_load_document(row["document"]) for row in self._connection().execute(query, params + [page_size + 1])]
+        docs, next_page_token = documents.split_page(docs, page_size)
+        results = [self._convert_result(doc, load_payload=False) for doc in docs]
+        return [result for result in results if result is not None], next_page_token
+
+    def get_all_result_keys(self, limit: int = 0, mongo_filter: Optional[Dict] = None) -> List[Tuple[str, str]]:
+        where, params = _where(documents.listing_filter(mongo_filter))
+        query = "SELECT report_name, job_id FROM results WHERE {} ORDER BY update_time DESC{}".format(
+            where, _limit(limit)
+        )
+        return [(row["report_name"], row["job_id"]) for row in self._connection().execute(query, params)]
+
+    def _get_all_job_ids(
+        self,
+        report_name: str,
+        overrides: Optional[Dict],
+        status: Optional[JobStatus] = None,
+        as_of: Optional[datetime.datetime] = None,
+        limit: int = 0,
+    ) -> List[str]:
+        mongo_filter = documents.result_filter(report_name, overrides, status, as_of)
+        return [x[1] for x in self.get_all_result_keys(mongo_filter=mongo_filter, limit=limit)]
+
+    def get_all_job_ids_for_name_and_params(self, report_name: str, params: Optional[Dict]) -> List[str]:
+        """ Get all the result ids for a given name and parameters, newest first """
+        return self._get_all_job_ids(report_name, params)
+
+    def get_latest_job_id_for_name_and_params(
+        self, report_name: str, params: Optional[Dict], as_of: Optional[datetime.datetime] = None
+    ) -> Optional[str]:
+        """ Get the latest result id for a given name and parameters """
+        all_job_ids = self._get_all_job_ids(report_name, params, as_of=as_of, limit=1)
+        return all_job_ids[0] if all_job_ids else None
+
+    def get_latest_successful_job_id_for_name_and_params(
+        self, report_name: str, params: Optional[Dict], as_of: Optional[datetime.datetime] = None
+    ) -> Optional[str]:
+        """ Get the latest successful job id for a given name and parameters """
+        all_job_ids = self._get_all_job_ids(report_name, params, JobStatus.DONE, as_of, limit=1)
+        return all_job_ids[0] if all_job_ids else None
+
+    def _latest_successful_all_params(self, report_name: str, column: str) -> Iterator[sqlite3.Row]:
+        # SQLite takes the bare column from the row which has the MAX(update_time) of each group.
+        return self._connection().execute(
+            "SELECT {}, MAX(update_time) FROM results "
+            "WHERE report_name = ? AND status = ? GROUP BY overrides_hash".format(column),
+            (report_name, JobStatus.DONE.value),
+        )
+
+    def get_latest_successful_job_ids_for_name_all_params(self, report_name: str) -> List[str]:
+        """ Get the latest successful job ids for all parameter variants of a given name """
+        return [row["job_id"] for row in self._latest_successful_all_params(report_name, "job_id")]
+
+    def get_latest_successful_results_for_name_all_params(
+        self, report_name: str
+    ) -> Iterator[Union[NotebookResultComplete, NotebookResultError, NotebookResultPending]]:
+        """ The latest successful result of each parameter variant of a given name, with their payloads. """
+        for row in self._latest_successful_all_params(report_name, "document"):
+            result = self._convert_result(_load_document(row["document"]))
+            if result is not None:
+                yield from self._with_payloads([result])
+
+    def n_all_results(self) -> int:
+        query = "SELECT COUNT(*) FROM results WHERE status != ?"
+        return self._connection().execute(query, (JobStatus.DELETED.value,)).fetchone()[0]
+
+    def get_result_counts(self) -> Dict[str, Any]:
+        """ The number of results which haven't been deleted: in total, per status and per report. """
+        by_status, by_report = defaultdict(int), defaultdict(int)
+        groups = self._connection().execute(
+            "SELECT status, report_name, COUNT(*) AS count FROM results WHERE status != ? GROUP BY status, report_name",
+            (JobStatus.DELETED.value,),
+        )
+        for group in groups:
+            by_status[group["status"]] += group["count"]
+            by_report[group["report_name"]] += group["count"]
+        return {"total": sum(by_status.values()), "by_status": dict(by_status), "by_report": dict(by_report)}
+
+    def delete_result(self, job_id: AnyStr) -> None:
+        self.update_check_status(job_id, JobStatus.DELETED)
+
+    def move_payloads_to_payload_collection(self, batch_size: int = 100) -> int:
+        """ Nothing to migrate: payloads have always been kept out of the results table. """
+        return 0
+
+    def tag_result_resources_with_job_ids(self, batch_size: int = 1000) -> int:
+        """ Nothing to migrate: files have always been kept under their job's directory. """
+        return 0
+
+    def backfill_overrides_hashes(self, batch_size: int = 1000) -> int:
+        """ Nothing to migrate: every result has always had an overrides_hash. """
+        return 0
+
+    def remove_duplicate_results(self) -> int:
+        """ Nothing to migrate: job_id has always been the primary key. """
+        return 0
+
+    def rebuild_latest_pointers(self) -> int:
+        """ Nothing to rebuild: latest results are found with an index lookup rather than kept in pointers. """
+        return 0
+
+    def get_expired_job_ids(
+        self, policies: List[RetentionPolicy], now: Optional[datetime.datetime] = None
+    ) -> Iterator[str]:
+        """
+        The job ids of the results which garbage collection should remove: every deleted result, and those which
+        have expired under the retention policy of their report. Results which are still running never expire.
+        """
+        connection = self._connection()
+        # Rows are fetched up front, since the caller purges results as it goes.
+        deleted = connection.execute("SELECT job_id FROM results WHERE status = ?", (JobStatus.DELETED.value,))
+        for row in deleted.fetchall():
+            yield row["job_id"]
+        now = now or datetime.datetime.now()
+        for row in connection.execute("SELECT DISTINCT report_name FROM results").fetchall():
+            policy = find_retention_policy(policies, row["report_name"])
+            if policy is not None:
+                yield from self._get_expired_job_ids_for_report(row["report_name"], policy, now)
+
+    def _get_expired_job_ids_for_report(
+        self, report_name: str, policy: RetentionPolicy, now: datetime.datetime
+    ) -> Iterator[str]:
+        where, params = _where(documents.expiring_filter(report_name))
+        rows = self._connection().execute(
+            "SELECT job_id, overrides_hash, update_time FROM results WHERE {} ORDER BY update_time DESC".format(where),
+            params,
+        )
+        docs = [dict(row, update_time=_parse_time(row["update_time"])) for row in rows.fetchall()]
+        return documents.expired_job_ids(docs, policy, now)
+
+    def get_reclaimable_bytes(self, job_ids: List[str]) -> Dict[str, int]:
+        """
+        Roughly how much storage removing these results would free: their payloads, their PDFs, and the output
+        blobs which only they reference. Blobs which are shared with results in another call count as nothing.
+        """
+        payload_bytes = file_bytes = 0
+        references = Counter()
+        for job_id in job_ids:
+            job_dir = self._job_dir(job_id)
+            for filename in _listdir(job_dir):
+                size = _file_size(os.path.join(job_dir, filename))
+                if filename == _PDF_FILENAME:
+                    file_bytes += size
+                else:
+                    payload_bytes += size
+            references.update(set(self._get_output_hashes(job_id).values()))
+        blob_bytes = 0
+        for hashes in documents.batches(references, 500):
+            rows = self._connection().execute(
+                "SELECT hash, refcount, size FROM blob_refs WHERE hash IN ({})".format(_placeholders(hashes)), hashes
+            )
+            blob_bytes += sum(row["size"] for row in rows if row["refcount"] <= references[row["hash"]])
+        return {"payload_bytes": payload_bytes, "file_bytes": file_bytes, "blob_bytes": blob_bytes}
+
+    def purge_results(self, job_ids: List[str]) -> int:
+        """
+        Physically removes results, along with their stdout, payloads and PDFs, and drops their references on output
+        blobs. Returns the number of results removed.
+        """
+        n_purged = 0
+        for job_id in job_ids:
+            with self._transaction() as connection:
+                row = connection.execute("SELECT document FROM results WHERE job_id = ?", (job_id,)).fetchone()
+                if row is None:
+                    continue
+                connection.execute("DELETE FROM results WHERE job_id = ?", (job_id,))
+                connection.execute("DELETE FROM stdout WHERE job_id = ?", (job_id,))
+                resources = _load_document(row["document"]).get("raw_html_resources") or {}
+                self._release_blobs(resources.get("output_hashes", []))
+            shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+            n_purged += 1
+        return n_purged
+
+    def find_orphaned_files(self, batch_size: int = 1000) -> Iterator[Dict]:
+        """
+        Files which nothing uses any more: the directories of results which no longer exist, and output blobs which
+        no result references. Each is a dict of its path, its length in bytes and metadata saying what it held.
+        """
+        connection = self._connection()
+        job_dirs = os.path.join(self.sqlite_data_dir, "jobs")
+        for dirnames in documents.batches(_listdir(job_dirs), batch_size):
+            job_ids = {unquote(dirname): dirname for dirname in dirnames}
+            query = "SELECT job_id FROM results WHERE job_id IN ({})".format(_placeholders(job_ids))
+            existing = {row["job_id"] for row in connection.execute(query, list(job_ids))}
+            for job_id in set(job_ids) - existing:
+                path = os.path.join(job_dirs, job_ids[job_id])
+                length = sum(_file_size(os.path.join(path, filename)) for filename in _listdir(path))
+                yield {"path": path, "length": length, "metadata": {"job_id": job_id}}
+        blob_paths = (
+            os.path.join(self.sqlite_data_dir, "blobs", prefix, blob_hash)
+            for prefix in _listdir(os.path.join(self.sqlite_data_dir, "blobs"))
+            for blob_hash in _listdir(os.path.join(self.sqlite_data_dir, "blobs", prefix))
+        )
+        for paths in documents.batches(blob_paths, batch_size):
+            hashes = {os.path.basename(path): path for path in paths}
+            query = "SELECT hash FROM blob_refs WHERE hash IN ({})".format(_placeholders(hashes))
+            live = {row["hash"] for row in connection.execute(query, list(hashes))}
+            for blob_hash in set(hashes) - live:
+                path = hashes[blob_hash]
+                yield {"path": path, "length": _file_size(path), "metadata": {"sha256": blob_hash}}
+
+    def delete_orphaned_files(self, orphaned_files: List[Dict]) -> int:
+        """ Deletes files found by find_orphaned_files(), unless their result or blob has been saved again since. """
+        n_deleted = 0
+        for orphaned_file in orphaned_files:
+            metadata = orphaned_file["metadata"]
+            with self._transaction() as connection:
+                if "sha256" in metadata:
+                    query, key = "SELECT 1 FROM blob_refs WHERE hash = ?", metadata["sha256"]
+                else:
+                    query, key = "SELECT 1 FROM results WHERE job_id = ?", metadata["job_id"]
+                if connection.execute(query, (key,)).fetchone():
+                    continue
+                if os.path.isdir(orphaned_file["path"]):
+                    shutil.rmtree(orphaned_file["path"], ignore_errors=True)
+                else:
+                    _remove_file(orphaned_file["path"])
+            n_deleted += 1
+        return n_deleted
+
+
+def _format_time(value: datetime.datetime) -> str:
+    return value.strftime(_TIME_FORMAT)
+
+
+def _parse_time(value: str) -> datetime.datetime:
+    return datetime.datetime.strptime(value, _TIME_FORMAT)
+
+
+def _encode_json_value(value: Any) -> Dict[str, str]:
+    """ Stores the values which BSON has but JSON doesn't as single-key objects; _decode_json_object() reverses it. """
+    if isinstance(value, datetime.datetime):
+        return {"$datetime": _format_time(value)}
+    if isinstance(value, datetime.date):
+        return {"$date": value.isoformat()}
+    if isinstance(value, bytes):
+        return {"$binary": value.hex()}
+    raise TypeError("Can't store {!r} in a result".format(value))
+
+
+def _decode_json_object(obj: Dict) -> Any:
+    if len(obj) == 1:
+        [(key, value)] = obj.items()
+        if key == "$datetime":
+            return _parse_time(value)
+        if key == "$date":
+            return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+        if key == "$binary":
+            return bytes.fromhex(value)
+    return obj
+
+
+def _dump_document(document: Dict) -> str:
+    return json.dumps(document, default=_encode_json_value)
+
+
+def _load_document(document: str) -> Dict:
+    return json.loads(document, object_hook=_decode_json_object)
+
+
+def _where(mongo_filter: Dict) -> Tuple[str, List]:
+    """
+    Translates the simple mongo filters which the rest of notebooker uses - equality, $in, $nin and comparisons on
+    the indexed columns - into a WHERE clause and its parameters.
+    """
+    clauses, params = [], []
+    for field, condition in mongo_filter.items():
+        if field not in _FILTER_COLUMNS:
+            raise ValueError("Can't filter results on {} with SQLite.".format(field))
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, value in condition.items():
+            if operator in ("$in", "$nin"):
+                values = [_filter_value(v) for v in value]
+                negation = "NOT " if operator == "$nin" else ""
+                clauses.append("{} {}IN ({})".format(field, negation, _placeholders(values)))
+                params.extend(values)
+            elif operator == "$eq" or operator in _FILTER_OPERATORS:
+                clauses.append("{} {} ?".format(field, _FILTER_OPERATORS.get(operator, "=")))
+                params.append(_filter_value(value))
+            else:
+                raise ValueError("Can't filter results with {} in SQLite.".format(operator))
+    return " AND ".join(clauses) or "1", params
+
+
+def _filter_value(value: Any) -> Any:
+    return _format_time(value) if isinstance(value, datetime.datetime) else value
+
+
+def _limit(limit: Optional[int]) -> str:
+    # As with mongo, a limit of 0 means no limit.
+    return " LIMIT {:d}".format(limit) if limit else ""
+
+
+def _placeholders(values: Iterable) -> str:
+    return ", ".join("?" for _ in values)
+
+
+def _to_bytes(data: AnyStr) -> bytes:
+    return data.encode("utf-8") if isinstance(data, str) else data
+
+
+def _write_file(path: str, data: bytes) -> None:
+    """ Writes a file atomically, so that readers see either the old contents or the new ones. """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        _remove_file(tmp_path)
+        raise
+
+
+def _read_file(path: str) -> AnyStr:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        logger.error("Could not find file %s", path)
+        return ""
+
+
+def _remove_file(path: str) -> None:
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+
+def _listdir(path: str) -> List[str]:
+    """ The entries of a directory, without any files which are still being written by _write_file(). """
+    try:
+        return sorted(name for name in os.listdir(path) if not name.startswith(".tmp"))
+    except FileNotFoundError:
+        return []
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
@@ -0,0 +1,29 @@
+import click
+
+from notebooker.serialization.codecs import PAYLOAD_CODECS, ZLIB
+from notebooker.serialization.memory import BaseInMemoryResultSerializer
+
+
+@click.command()
+@click.option(
+    "--memory-store-name",
+    default="default",
+    help="The in-memory store to save notebook results to. Serializers in the same process with the same name share "
+    "their results.",
+)
+@click.option(
+    "--payload-codec",
+    default=ZLIB,
+    type=click.Choice(PAYLOAD_CODECS),
+    help="How the HTML and ipynb of notebook results are compressed when they are saved.",
+)
+def cli_options():
+    pass
+
+
+class InMemoryResultSerializer(BaseInMemoryResultSerializer, cli_options=cli_options):
+    def __init__(self, memory_store_name="default", payload_codec=ZLIB, **kwargs):
+        super(InMemoryResultSerializer, self).__init__(memory_store_name, payload_codec=payload_codec)
+
+
+name = InMemoryResultSerializer.get_name()
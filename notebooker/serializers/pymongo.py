@@ -1,8 +1,9 @@
 import click
-from pymongo import MongoClient
 
 from notebooker.constants import DEFAULT_DATABASE_NAME, DEFAULT_MONGO_HOST, DEFAULT_RESULT_COLLECTION_NAME
+from notebooker.serialization.codecs import PAYLOAD_CODECS, ZLIB
 from notebooker.serialization.mongo import MongoResultSerializer
+from notebooker.serialization.mongo_clients import READ_PREFERENCE_MODES, get_mongo_client, get_read_preference
 
 
 @click.command()
@@ -21,6 +22,53 @@ from notebooker.serialization.mongo import MongoResultSerializer
     default=DEFAULT_RESULT_COLLECTION_NAME,
     help="The name of the collection to which we are saving notebook results.",
 )
+@click.option(
+    "--payload-codec",
+    default=ZLIB,
+    type=click.Choice(PAYLOAD_CODECS),
+    help="How the HTML and ipynb of notebook results are compressed when they are saved.",
+)
+@click.option(
+    "--mongo-max-pool-size",
+    default=None,
+    type=int,
+    help="The maximum number of connections to mongo per process, shared by all of its threads.",
+)
+@click.option(
+    "--mongo-connect-timeout-ms", default=None, type=int, help="How long to wait when opening a mongo connection."
+)
+@click.option(
+    "--mongo-server-selection-timeout-ms",
+    default=None,
+    type=int,
+    help="How long to wait for a suitable mongo server before an operation fails.",
+)
+@click.option("--mongo-socket-timeout-ms", default=None, type=int, help="How long to wait for a reply from mongo.")
+@click.option(
+    "--mongo-listing-read-preference",
+    default=None,
+    type=click.Choice(READ_PREFERENCE_MODES),
+    help="Where result listings and counts are read from, e.g. secondaryPreferred. Defaults to the primary.",
+)
+@click.option(
+    "--mongo-listing-max-staleness-seconds",
+    default=None,
+    type=int,
+    help="How far behind the primary (90 seconds at least) a secondary may be to serve listings.",
+)
+@click.option(
+    "--mongo-result-read-preference",
+    default=None,
+    type=click.Choice(READ_PREFERENCE_MODES),
+    help="Where the HTML, ipynb, PDF and outputs of completed results are read from. Defaults to the primary. "
+    "Status polling and latest result lookups always read from the primary.",
+)
+@click.option(
+    "--mongo-result-max-staleness-seconds",
+    default=None,
+    type=int,
+    help="How far behind the primary (90 seconds at least) a secondary may be to serve completed results.",
+)
 def cli_options():
     pass
 
@@ -33,16 +81,51 @@ class PyMongoResultSerializer(MongoResultSerializer, cli_options=cli_options):
         database_name="notebooker",
         mongo_host="localhost",
         result_collection_name="NOTEBOOK_OUTPUT",
+        payload_codec=ZLIB,
+        mongo_max_pool_size=None,
+        mongo_connect_timeout_ms=None,
+        mongo_server_selection_timeout_ms=None,
+        mongo_socket_timeout_ms=None,
+        mongo_listing_read_preference=None,
+        mongo_listing_max_staleness_seconds=None,
+        mongo_result_read_preference=None,
+        mongo_result_max_staleness_seconds=None,
         **kwargs,
     ):
         self.mongo_user = mongo_user or None
         self.mongo_password = mongo_password or None
-        super(PyMongoResultSerializer, self).__init__(database_name, mongo_host, result_collection_name)
+        self.mongo_max_pool_size = mongo_max_pool_size
+        self.mongo_connect_timeout_ms = mongo_connect_timeout_ms
+        self.mongo_server_selection_timeout_ms = mongo_server_selection_timeout_ms
+        self.mongo_socket_timeout_ms = mongo_socket_timeout_ms
+        self.mongo_listing_read_preference = mongo_listing_read_preference
+        self.mongo_listing_max_staleness_seconds = mongo_listing_max_staleness_seconds
+        self.mongo_result_read_preference = mongo_result_read_preference
+        self.mongo_result_max_staleness_seconds = mongo_result_max_staleness_seconds
+        super(PyMongoResultSerializer, self).__init__(
+            database_name,
+            mongo_host,
+            result_collection_name,
+            payload_codec=payload_codec,
+            listing_read_preference=get_read_preference(
+                mongo_listing_read_preference, mongo_listing_max_staleness_seconds
+            ),
+            result_read_preference=get_read_preference(
+                mongo_result_read_preference, mongo_result_max_staleness_seconds
+            ),
+        )
 
     def get_mongo_database(self):
-        return MongoClient(self.mongo_host, username=self.mongo_user, password=self.mongo_password).get_database(
-            self.database_name
+        client = get_mongo_client(
+            self.mongo_host,
+            username=self.mongo_user,
+            password=self.mongo_password,
+            maxPoolSize=self.mongo_max_pool_size,
+            connectTimeoutMS=self.mongo_connect_timeout_ms,
+            serverSelectionTimeoutMS=self.mongo_server_selection_timeout_ms,
+            socketTimeoutMS=self.mongo_socket_timeout_ms,
         )
+        return client.get_database(self.database_name)
 
 
 name = PyMongoResultSerializer.get_name()
@@ -0,0 +1,36 @@
+import os
+
+import click
+
+from notebooker.serialization.codecs import PAYLOAD_CODECS, ZLIB
+from notebooker.serialization.sqlite import BaseSqliteResultSerializer
+
+DEFAULT_SQLITE_PATH = os.path.join(os.path.expanduser("~"), ".notebooker", "results.sqlite")
+
+
+@click.command()
+@click.option(
+    "--sqlite-path", default=DEFAULT_SQLITE_PATH, help="The SQLite database file in which notebook results are saved."
+)
+@click.option(
+    "--sqlite-data-dir",
+    default=None,
+    help="The directory in which the HTML, PDFs and outputs of notebook results are saved. "
+    "Defaults to <sqlite path without its extension>_data.",
+)
+@click.option(
+    "--payload-codec",
+    default=ZLIB,
+    type=click.Choice(PAYLOAD_CODECS),
+    help="How the HTML and ipynb of notebook results are compressed when they are saved.",
+)
+def cli_options():
+    pass
+
+
+class SqliteResultSerializer(BaseSqliteResultSerializer, cli_options=cli_options):
+    def __init__(self, sqlite_path=DEFAULT_SQLITE_PATH, sqlite_data_dir=None, payload_codec=ZLIB, **kwargs):
+        super(SqliteResultSerializer, self).__init__(sqlite_path, sqlite_data_dir, payload_codec=payload_codec)
+
+
+name = SqliteResultSerializer.get_name()
@@ -25,6 +25,13 @@ class BaseConfig:
     # or list the available templates.
     NOTEBOOKER_DISABLE_GIT: bool = False
 
+    # The number of started kernels to keep ready when execute-notebook runs more than one notebook, e.g. with
+    # --iterate-override-values-of. The webapp and its workers run each report in its own process, so don't use it.
+    # 0 disables the pool.
+    KERNEL_POOL_SIZE: int = 0
+    # Comma-separated modules which pooled kernels import before they are leased, e.g. "pandas,numpy".
+    KERNEL_POOL_WARM_IMPORTS: str = ""
+
     # The serializer class we are using for storage, e.g. PyMongoResultSerializer
     SERIALIZER_CLS: DEFAULT_SERIALIZER = None
     # The dictionary of parameters which are used to initialize the serializer class above
@@ -44,3 +51,14 @@ class WebappConfig(BaseConfig):
     # The temporary directory which will contain the .ipynb templates which have been converted from the .py templates.
     # Defaults to a random directory in ~/.notebooker/webcache.
     CACHE_DIR: str = ""
+
+    # A JSON file of retention policies (see notebooker.retention). If set, the webapp garbage collects deleted and
+    # expired results in the background.
+    RETENTION_POLICIES_FILE: str = ""
+
+    # The most notebooks which the webapp runs at once. Any more which are submitted wait in a queue.
+    MAX_CONCURRENT_JOBS: int = 4
+
+    # Whether reports are submitted to the mongo job queue for `notebooker-cli worker` processes to run, rather than
+    # being run by the webapp itself.
+    USE_JOB_QUEUE: bool = False
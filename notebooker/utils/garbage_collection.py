@@ -0,0 +1,68 @@
+import datetime
+import itertools
+import time
+from collections import defaultdict
+from logging import getLogger
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from notebooker.retention import RetentionPolicy
+from notebooker.serialization.mongo import MongoResultSerializer
+from notebooker.utils.metrics import counter
+
+logger = getLogger(__name__)
+GC_RESULTS_PURGED = counter("notebooker_gc_results_purged", "Results physically removed by garbage collection.")
+GC_FILES_PURGED = counter("notebooker_gc_orphaned_files_purged", "Orphaned GridFS files removed by garbage collection.")
+GC_BYTES_RECLAIMED = counter("notebooker_gc_bytes_reclaimed", "Bytes of storage freed by garbage collection.")
+
+
+def _batches(iterable: Iterable, batch_size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def collect_garbage(
+    serializer: MongoResultSerializer,
+    policies: List[RetentionPolicy],
+    dry_run: bool = False,
+    batch_size: int = 100,
+    pause_seconds: float = 1.0,
+    now: Optional[datetime.datetime] = None,
+) -> Dict[str, int]:
+    """
+    Removes deleted and expired results (see notebooker.retention) and orphaned GridFS files, batch_size at a time
+    with a pause in between so as not to swamp the database. With dry_run=True nothing is removed.
+    Returns a report of what was (or would be) removed and the bytes reclaimed.
+    """
+    report = defaultdict(int)
+    for job_ids in _batches(serializer.get_expired_job_ids(policies, now), batch_size):
+        reclaimable = serializer.get_reclaimable_bytes(job_ids)
+        for key, n_bytes in reclaimable.items():
+            report[key] += n_bytes
+        report["n_results"] += len(job_ids)
+        if not dry_run:
+            GC_RESULTS_PURGED.inc(serializer.purge_results(job_ids))
+            GC_BYTES_RECLAIMED.inc(sum(reclaimable.values()))
+            time.sleep(pause_seconds)
+    for grid_files in _batches(serializer.find_orphaned_files(), batch_size):
+        orphaned_bytes = sum(grid_file.get("length", 0) for grid_file in grid_files)
+        report["n_orphaned_files"] += len(grid_files)
+        report["orphaned_file_bytes"] += orphaned_bytes
+        if not dry_run:
+            GC_FILES_PURGED.inc(serializer.delete_orphaned_files(grid_files))
+            GC_BYTES_RECLAIMED.inc(orphaned_bytes)
+            time.sleep(pause_seconds)
+    report["total_bytes"] = sum(
+        report[key] for key in ("payload_bytes", "file_bytes", "blob_bytes", "orphaned_file_bytes")
+    )
+    logger.info(
+        "Garbage collection %s %d results and %d orphaned files, reclaiming %d bytes.",
+        "would remove" if dry_run else "removed",
+        report["n_results"],
+        report["n_orphaned_files"],
+        report["total_bytes"],
+    )
+    return dict(report)
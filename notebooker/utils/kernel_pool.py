@@ -0,0 +1,205 @@
+"""
+A pool of kernels which have already been started, and have optionally already imported some modules, so that a
+notebook execution doesn't spend the first few seconds of every run starting a kernel and importing pandas. Each
+kernel executes exactly one notebook: it is shut down once its lease ends and is never handed out again, and a fresh
+kernel is started in the background to take its place as soon as it is leased.
+
+The pool lives for the length of one `execute-notebook` process, so it only helps when that process runs more than one
+notebook, e.g. with --iterate-override-values-of. The webapp and `notebooker-cli worker` run each report in a process
+of its own, and so don't use it.
+"""
+
+import queue
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from logging import getLogger
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from jupyter_client.manager import AsyncKernelManager
+from jupyter_core.utils import run_sync
+
+from notebooker.utils.metrics import counter, gauge, histogram
+
+logger = getLogger(__name__)
+
+KERNEL_POOL_HITS = counter(
+    "notebooker_kernel_pool_hits", "Notebook executions which were given a pre-started kernel.", ["kernel_name"]
+)
+KERNEL_POOL_MISSES = counter(
+    "notebooker_kernel_pool_misses", "Notebook executions which had to start their own kernel.", ["kernel_name"]
+)
+KERNEL_POOL_WAIT_SECONDS = histogram(
+    "notebooker_kernel_pool_wait_seconds", "How long executions waited for a pre-started kernel.", ["kernel_name"]
+)
+KERNEL_POOL_IDLE_KERNELS = gauge(
+    "notebooker_kernel_pool_idle_kernels", "Pre-started kernels waiting to be leased.", ["kernel_name"]
+)
+
+_MODULE_NAME = re.compile(r"^[A-Za-z_]\w*(\.[A-Za-z_]\w*)*$")
+
+
+def parse_warm_imports(warm_imports: Optional[str]) -> List[str]:
+    """ The module names in a comma-separated list such as "pandas,numpy", as given to --kernel-pool-warm-imports. """
+    modules = [module.strip() for module in (warm_imports or "").split(",") if module.strip()]
+    for module in modules:
+        if not _MODULE_NAME.match(module):
+            raise ValueError("{!r} is not a module name which a kernel can import.".format(module))
+    return modules
+
+
+class KernelPool:
+    """
+    Keeps `size` started kernels ready for each kernelspec which has been asked for, each of which has imported
+    `warm_imports`. Kernels for a kernelspec start being started the first time it is leased, or by prestart().
+    """
+
+    def __init__(self, size: int, warm_imports: Sequence[str] = (), startup_timeout: float = 60):
+        if size < 1:
+            raise ValueError("A kernel pool needs at least one kernel, not {}.".format(size))
+        self.size = size
+        self.warm_imports = list(warm_imports)
+        self.startup_timeout = startup_timeout
+        self._idle: Dict[str, queue.Queue] = defaultdict(queue.Queue)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def prestart(self, kernel_name: str) -> None:
+        """ Starts filling the pool for this kernelspec, if it isn't being filled already. """
+        with self._lock:
+            if self._closed or kernel_name in self._idle:
+                return
+            idle = self._idle[kernel_name]
+        for _ in range(self.size):
+            self._start_in_background(kernel_name, idle)
+
+    @contextmanager
+    def lease(self, kernel_name: str) -> Iterator[Optional[AsyncKernelManager]]:
+        """
+        Yields a started kernel for the duration of one notebook execution, and shuts it down afterwards. Waits for
+        one of the pool's kernels to finish starting if none is ready. Yields None if the pool couldn't start one,
+        in which case the caller should start a kernel of its own as it would without a pool.
+        """
+        self.prestart(kernel_name)
+        kernel_manager = self._take(kernel_name)
+        try:
+            yield kernel_manager
+        finally:
+            if kernel_manager is not None:
+                # The execution's clients belong to this thread, so their channels are closed here rather than in the
+                # thread which shuts the kernel down.
+                _stop_channels(kernel_manager)
+                threading.Thread(target=_shutdown, args=(kernel_manager,), daemon=True).start()
+
+    def close(self) -> None:
+        """ Shuts down every idle kernel. Kernels which are still starting are shut down as soon as they start. """
+        with self._lock:
+            self._closed = True
+            idle_queues = list(self._idle.items())
+        for kernel_name, idle in idle_queues:
+            while True:
+                try:
+                    kernel_manager = idle.get_nowait()
+                except queue.Empty:
+                    break
+                if kernel_manager is not None:
+                    _shutdown(kernel_manager)
+            KERNEL_POOL_IDLE_KERNELS.labels(kernel_name).set(0)
+
+    def _take(self, kernel_name: str) -> Optional[AsyncKernelManager]:
+        idle = self._idle[kernel_name]
+        start_time = time.perf_counter()
+        while True:
+            try:
+                # Each pooled kernel is put on the queue once it has started, or None if starting it failed.
+                kernel_manager = idle.get(timeout=self.startup_timeout)
+            except queue.Empty:
+                # The pool's kernels are all still starting, so there is no place to refill.
+                kernel_manager = None
+                break
+            KERNEL_POOL_IDLE_KERNELS.labels(kernel_name).set(idle.qsize())
+            # Whatever we took off the queue, its place in the pool is now free.
+            self._start_in_background(kernel_name, idle)
+            if kernel_manager is None or run_sync(kernel_manager.is_alive)():
+                break
+            logger.warning("A pooled %s kernel died while it was idle.", kernel_name)
+            _shutdown(kernel_manager)
+        KERNEL_POOL_WAIT_SECONDS.labels(kernel_name).observe(time.perf_counter() - start_time)
+        if kernel_manager is None:
+            KERNEL_POOL_MISSES.labels(kernel_name).inc()
+        else:
+            KERNEL_POOL_HITS.labels(kernel_name).inc()
+        return kernel_manager
+
+    def _start_in_background(self, kernel_name: str, idle: queue.Queue) -> None:
+        threading.Thread(target=self._start, args=(kernel_name, idle), daemon=True).start()
+
+    def _start(self, kernel_name: str, idle: queue.Queue) -> None:
+        if self._closed:
+            return
+        try:
+            kernel_manager = _start_kernel(kernel_name, self.warm_imports, self.startup_timeout)
+        except Exception:
+            logger.exception("Could not start a %s kernel for the kernel pool.", kernel_name)
+            idle.put(None)
+            return
+        with self._lock:
+            if not self._closed:
+                idle.put(kernel_manager)
+                KERNEL_POOL_IDLE_KERNELS.labels(kernel_name).set(idle.qsize())
+                return
+        _shutdown(kernel_manager)
+
+
+class _PooledKernelManager(AsyncKernelManager):
+    """
+    Remembers the clients it makes. papermill doesn't stop the channels of its client when it is given a kernel
+    manager, since it doesn't own the kernel, so the pool stops them once the lease ends.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.clients = []
+
+    def client(self, **kwargs):
+        client = super().client(**kwargs)
+        self.clients.append(client)
+        return client
+
+
+def _start_kernel(kernel_name: str, warm_imports: Sequence[str], startup_timeout: float) -> AsyncKernelManager:
+    kernel_manager = _PooledKernelManager(kernel_name=kernel_name)
+    run_sync(kernel_manager.start_kernel)()
+    if warm_imports:
+        client = kernel_manager.blocking_client()
+        client.start_channels()
+        try:
+            client.wait_for_ready(timeout=startup_timeout)
+            code = "import {}".format(", ".join(warm_imports))
+            reply = client.execute_interactive(code, timeout=startup_timeout, store_history=False, silent=True)
+            if reply["content"]["status"] != "ok":
+                logger.warning("A pooled %s kernel couldn't run %r: %s", kernel_name, code, reply["content"])
+        except Exception:
+            _shutdown(kernel_manager)
+            raise
+        finally:
+            client.stop_channels()
+    return kernel_manager
+
+
+def _stop_channels(kernel_manager: AsyncKernelManager) -> None:
+    for client in getattr(kernel_manager, "clients", ()):
+        try:
+            client.stop_channels()
+        except Exception:
+            logger.exception("Could not stop the channels of a client of kernel %s", kernel_manager.kernel_id)
+    kernel_manager.clients = []
+
+
+def _shutdown(kernel_manager: AsyncKernelManager) -> None:
+    try:
+        run_sync(kernel_manager.shutdown_kernel)(now=True)
+    except Exception:
+        logger.exception("Could not shut down kernel %s", kernel_manager.kernel_id)
@@ -0,0 +1,46 @@
+"""
+Prometheus metrics which can be declared from anywhere in notebooker. prometheus_client is an optional dependency
+(notebooker[prometheus]), so if it isn't installed these metrics silently do nothing.
+"""
+
+from typing import Sequence
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+
+class _NoopMetric(object):
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, amount):
+        pass
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Counter(name, documentation, labelnames=labelnames)
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Gauge(name, documentation, labelnames=labelnames)
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Histogram(name, documentation, labelnames=labelnames, **kwargs)
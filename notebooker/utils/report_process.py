@@ -0,0 +1,35 @@
+"""
+Runs the `notebooker-cli execute-notebook` subprocess of a job and streams its stderr into the job's stdout. Used
+both by the webapp's worker pool and by `notebooker-cli worker`, so this mustn't depend on the webapp.
+"""
+
+import subprocess
+from logging import getLogger
+from typing import Any, Dict, List
+
+from notebooker.serialization.serialization import get_serializer_from_cls
+from notebooker.utils.stdout_buffer import BufferedStdoutSink
+
+logger = getLogger(__name__)
+
+
+def start_report_process(command: List[str]) -> subprocess.Popen:
+    return subprocess.Popen(command, stderr=subprocess.PIPE)
+
+
+def monitor_stderr(process: subprocess.Popen, job_id: str, serializer_cls: str, serializer_args: Dict[str, Any]) -> str:
+    """ Saves the process's stderr to the job's stdout until the process exits, and returns all of it. """
+    stderr = []
+    # Unsure whether flask app contexts are thread-safe; just reinitialise the serializer here.
+    result_serializer = get_serializer_from_cls(serializer_cls, **serializer_args)
+    with BufferedStdoutSink(result_serializer, job_id) as stdout_sink:
+        while True:
+            line = process.stderr.readline().decode("utf-8")
+            if line == "":
+                # EOF: nothing more will be written, so reap the process rather than polling until it exits.
+                process.wait()
+                break
+            stderr.append(line)
+            logger.info(line)  # So that we have it in the log, not just in memory.
+            stdout_sink.write(line)
+    return "".join(stderr)
@@ -1,6 +1,7 @@
+import warnings
 from datetime import datetime as dt
 from logging import getLogger
-from typing import Callable, Dict, Iterator, List, Mapping, Optional, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Tuple, TypeVar
 
 from flask import url_for
 
@@ -11,6 +12,10 @@ from notebooker.utils.caching import get_cache, get_report_cache, set_cache, set
 from notebooker.utils.web import convert_report_name_url_to_path
 
 logger = getLogger(__name__)
+T = TypeVar("T")
+RESULT_COUNTS_CACHE_KEY = "result_counts"
+# The report hunter refreshes the counts much more often than this; the timeout only matters if it stops.
+RESULT_COUNTS_CACHE_TIMEOUT = 60
 
 
 def _get_job_results(
@@ -25,6 +30,9 @@ def _get_job_results(
     if current_result and not ignore_cache:
         logger.info("Fetched result from cache.")
         notebook_result = current_result
+        if isinstance(notebook_result, constants.LazyNotebookResultComplete):
+            # Anything which wasn't loaded before the result was cached is read from our serializer.
+            notebook_result.bind_payload_source(serializer)
     else:
         notebook_result = serializer.get_check_result(job_id)
         set_report_cache(report_name, job_id, notebook_result)
@@ -44,6 +52,21 @@ def _get_job_results(
     return notebook_result
 
 
+def read_job_result(job_id: str, report_name: str, result: constants.NotebookResultBase, read: Callable[[Any], T]) -> T:
+    """
+    Returns read(result), e.g. one field or output of a result from _get_job_results(). The cache only keeps what a
+    result had loaded when it was cached, so if reading it loaded any of its payload, the result is cached again and
+    later hits don't read that part again. Nothing else in the payload is read.
+    """
+    if not isinstance(result, constants.LazyNotebookResultComplete):
+        return read(result)
+    loaded_before = result.loaded_payload()
+    value = read(result)
+    if result.loaded_payload() != loaded_before:
+        set_report_cache(convert_report_name_url_to_path(report_name), job_id, result)
+    return value
+
+
 def _get_results_from_name_and_params(
     job_id_func: Callable[[str, Optional[Dict], Optional[dt]], str],
     report_name: str,
@@ -106,31 +129,67 @@ def get_all_result_keys(
     return all_keys
 
 
+def get_result_counts(
+    serializer: MongoResultSerializer, force_reload: bool = False, cache_dir: Optional[str] = None
+) -> Dict[str, Any]:
+    """ Result counts in total, per status and per report, as kept up to date in the cache by the report hunter. """
+    counts = get_cache(RESULT_COUNTS_CACHE_KEY, cache_dir=cache_dir)
+    if not counts or force_reload:
+        counts = serializer.get_result_counts()
+        set_cache(RESULT_COUNTS_CACHE_KEY, counts, timeout=RESULT_COUNTS_CACHE_TIMEOUT, cache_dir=cache_dir)
+    return counts
+
+
+def get_n_results_available(serializer: MongoResultSerializer) -> int:
+    counts = get_cache(RESULT_COUNTS_CACHE_KEY)
+    return counts["total"] if counts else serializer.n_all_results()
+
+
+def _result_listing_json(result: constants.NotebookResultBase) -> Dict[str, Any]:
+    output = result.saveable_output()
+    output["result_url"] = url_for(
+        "serve_results_bp.task_results", job_id=output["job_id"], report_name=output["report_name"]
+    )
+    output["ipynb_url"] = url_for(
+        "serve_results_bp.download_ipynb_result", job_id=output["job_id"], report_name=output["report_name"]
+    )
+    output["pdf_url"] = url_for(
+        "serve_results_bp.download_pdf_result", job_id=output["job_id"], report_name=output["report_name"]
+    )
+    output["rerun_url"] = url_for(
+        "run_report_bp.rerun_report", job_id=output["job_id"], report_name=output["report_name"]
+    )
+    return output
+
+
 def get_all_available_results_json(serializer: MongoResultSerializer, limit: int) -> List[constants.NotebookResultBase]:
-    json_output = []
-    for result in serializer.get_all_results(limit=limit, load_payload=False):
-        output = result.saveable_output()
-        output["result_url"] = url_for(
-            "serve_results_bp.task_results", job_id=output["job_id"], report_name=output["report_name"]
-        )
-        output["ipynb_url"] = url_for(
-            "serve_results_bp.download_ipynb_result", job_id=output["job_id"], report_name=output["report_name"]
-        )
-        output["pdf_url"] = url_for(
-            "serve_results_bp.download_pdf_result", job_id=output["job_id"], report_name=output["report_name"]
-        )
-        output["rerun_url"] = url_for(
-            "run_report_bp.rerun_report", job_id=output["job_id"], report_name=output["report_name"]
-        )
-        json_output.append(output)
-    return json_output
+    return [_result_listing_json(result) for result in serializer.get_all_results(limit=limit, load_payload=False)]
+
+
+def get_results_page_json(
+    serializer: MongoResultSerializer, page_size: int, page_token: Optional[str] = None, **filters
+) -> Dict[str, Any]:
+    results, next_page_token = serializer.get_results_page(page_size=page_size, page_token=page_token, **filters)
+    return {"results": [_result_listing_json(result) for result in results], "next_page_token": next_page_token}
 
 
 def get_latest_successful_job_results_all_params(
     report_name: str,
     serializer: MongoResultSerializer,
-    retrying: Optional[bool] = False,
-    ignore_cache: Optional[bool] = False,
+    retrying: Optional[bool] = None,
+    ignore_cache: Optional[bool] = None,
 ) -> Iterator[constants.NotebookResultComplete]:
-    for job_id in serializer.get_latest_successful_job_ids_for_name_all_params(report_name):
-        yield _get_job_results(job_id, report_name, serializer, retrying, ignore_cache)
+    """
+    Streams the latest successful result of each parameter variant of a report straight from the serializer, which
+    reads them in batches rather than one result at a time. The results cache is bypassed, so retrying and
+    ignore_cache are deprecated and make no difference.
+    """
+    if retrying is not None or ignore_cache is not None:
+        warnings.warn(
+            "retrying and ignore_cache are ignored by get_latest_successful_job_results_all_params, which always reads "
+            "from the serializer, and will be removed.",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+    report_name = convert_report_name_url_to_path(report_name)
+    yield from serializer.get_latest_successful_results_for_name_all_params(report_name)
@@ -0,0 +1,99 @@
+import threading
+from logging import getLogger
+from typing import List
+
+from notebooker.utils.metrics import counter, histogram
+
+logger = getLogger(__name__)
+
+STDOUT_LINES_BUFFERED = counter("notebooker_stdout_lines_buffered", "Lines of job stdout buffered before saving")
+STDOUT_FLUSHES = counter("notebooker_stdout_flushes", "Batches of job stdout pushed to storage")
+STDOUT_LINES_PER_JOB = histogram(
+    "notebooker_stdout_lines_per_job",
+    "Lines of stdout saved per job",
+    buckets=(10, 100, 1000, 10000, 100000, float("inf")),
+)
+STDOUT_FLUSHES_PER_JOB = histogram(
+    "notebooker_stdout_flushes_per_job",
+    "Batches of stdout pushed to storage per job",
+    buckets=(1, 5, 25, 100, 500, 2500, float("inf")),
+)
+
+
+def _n_bytes(line: str) -> int:
+    return len(line.encode("utf-8"))
+
+
+class BufferedStdoutSink(object):
+    """
+    Collects the stdout of a running job and pushes it to storage in batches, rather than one round trip per line.
+    A batch is pushed once max_bytes have been buffered, every max_interval_seconds while there is anything
+    buffered, and when the sink is closed so that the tail of the output is never lost.
+    Use it as a context manager so that close() is always called.
+    """
+
+    def __init__(self, result_serializer, job_id: str, max_bytes: int = 64 * 1024, max_interval_seconds: float = 0.25):
+        self.result_serializer = result_serializer
+        self.job_id = job_id
+        self.max_bytes = max_bytes
+        self.max_interval_seconds = max_interval_seconds
+        self.lines_buffered = 0
+        self.n_flushes = 0
+        self._lines: List[str] = []
+        self._n_bytes = 0
+        # _lock guards the buffer; _flush_lock makes sure that batches reach storage in the order they were written.
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically)
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, line: str) -> None:
+        with self._lock:
+            self._lines.append(line)
+            self._n_bytes += _n_bytes(line)
+            self.lines_buffered += 1
+            is_full = self._n_bytes >= self.max_bytes
+        STDOUT_LINES_BUFFERED.inc()
+        if is_full:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                lines, self._lines, self._n_bytes = self._lines, [], 0
+            if not lines:
+                return
+            try:
+                self.result_serializer.update_stdout(self.job_id, new_lines=lines)
+            except Exception:
+                logger.exception("Failed to save %d lines of stdout for job %s; will retry.", len(lines), self.job_id)
+                with self._lock:
+                    self._lines[:0] = lines
+                    self._n_bytes += sum(_n_bytes(line) for line in lines)
+                return
+            self.n_flushes += 1
+            STDOUT_FLUSHES.inc()
+
+    def _flush_periodically(self) -> None:
+        while not self._closed.wait(self.max_interval_seconds):
+            self.flush()
+
+    def close(self) -> None:
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._flusher.join()
+        self.flush()
+        STDOUT_LINES_PER_JOB.observe(self.lines_buffered)
+        STDOUT_FLUSHES_PER_JOB.observe(self.n_flushes)
+        logger.info(
+            "Saved %d lines of stdout for job %s in %d batches.", self.lines_buffered, self.job_id, self.n_flushes
+        )
@@ -14,25 +14,30 @@ from notebooker.serialization.serialization import initialize_serializer_from_co
 from notebooker.settings import WebappConfig
 from notebooker.utils.filesystem import _cleanup_dirs, initialise_base_dirs
 from notebooker.web.converters import DateConverter
+from notebooker.web.garbage_collector import _garbage_collector
 from notebooker.web.report_hunter import _report_hunter
 from notebooker.web.routes.core import core_bp
 from notebooker.web.routes.index import index_bp
 from notebooker.web.routes.pending_results import pending_results_bp
 from notebooker.web.routes.run_report import run_report_bp
 from notebooker.web.routes.serve_results import serve_results_bp
+from notebooker.web.worker_pool import WorkerPool
 
 logger = logging.getLogger(__name__)
 all_report_refresher: Optional[threading.Thread] = None
+garbage_collector: Optional[threading.Thread] = None
+worker_pool: Optional[WorkerPool] = None
 GLOBAL_CONFIG: Optional[WebappConfig] = None
 
 
 def _cancel_all_jobs():
     serializer = initialize_serializer_from_config(GLOBAL_CONFIG)
-    all_pending = serializer.get_all_results(
+    all_pending = serializer.get_all_result_keys(
         mongo_filter={"status": {"$in": [JobStatus.SUBMITTED.value, JobStatus.PENDING.value]}}
     )
-    for result in all_pending:
-        serializer.update_check_status(result.job_id, JobStatus.CANCELLED, error_info=CANCEL_MESSAGE)
+    serializer.update_check_statuses(
+        [job_id for _, job_id in all_pending], JobStatus.CANCELLED, error_info=CANCEL_MESSAGE
+    )
 
 
 @atexit.register
@@ -41,7 +46,12 @@ def _cleanup_on_exit():
     if "pytest" in sys.modules or not all_report_refresher:
         return
     os.environ["NOTEBOOKER_APP_STOPPING"] = "1"
-    _cancel_all_jobs()
+    if worker_pool:
+        # Don't start anything which is still queued; it is cancelled below along with everything else.
+        worker_pool.close()
+    if not GLOBAL_CONFIG.USE_JOB_QUEUE:
+        # Otherwise the jobs are run by workers, which carry on without the webapp.
+        _cancel_all_jobs()
     _cleanup_dirs(GLOBAL_CONFIG)
     if all_report_refresher:
         # Wait until it terminates.
@@ -51,13 +61,20 @@ def _cleanup_on_exit():
     time.sleep(2)
 
 
-def start_app(webapp_config: WebappConfig):
-    global all_report_refresher
+def start_app(webapp_config: WebappConfig, worker_pool: Optional[WorkerPool] = None):
+    global all_report_refresher, garbage_collector
     if os.getenv("NOTEBOOKER_APP_STOPPING"):
         del os.environ["NOTEBOOKER_APP_STOPPING"]
-    all_report_refresher = threading.Thread(target=_report_hunter, args=(webapp_config,))
+    all_report_refresher = threading.Thread(
+        target=_report_hunter, args=(webapp_config,), kwargs={"worker_pool": worker_pool}
+    )
     all_report_refresher.daemon = True
     all_report_refresher.start()
+    if webapp_config.RETENTION_POLICIES_FILE:
+        # Not joined on exit: it is safe to stop at any point, and a collection can take a while.
+        garbage_collector = threading.Thread(target=_garbage_collector, args=(webapp_config,))
+        garbage_collector.daemon = True
+        garbage_collector.start()
 
 
 def create_app():
@@ -94,15 +111,17 @@ def setup_app(flask_app: Flask, web_config: WebappConfig):
     flask_app.config.update(
         TEMPLATES_AUTO_RELOAD=web_config.DEBUG, EXPLAIN_TEMPLATE_LOADING=True, DEBUG=web_config.DEBUG
     )
+    flask_app.extensions["notebooker_worker_pool"] = WorkerPool(web_config.MAX_CONCURRENT_JOBS)
     return flask_app
 
 
 def main(web_config: WebappConfig):
-    global GLOBAL_CONFIG
+    global GLOBAL_CONFIG, worker_pool
     GLOBAL_CONFIG = web_config
     flask_app = create_app()
     flask_app = setup_app(flask_app, web_config)
-    start_app(web_config)
+    worker_pool = flask_app.extensions["notebooker_worker_pool"]
+    start_app(web_config, worker_pool)
     logger.info("Notebooker is now running at http://0.0.0.0:%d", web_config.PORT)
     http_server = WSGIServer(("0.0.0.0", web_config.PORT), flask_app)
     http_server.serve_forever()
@@ -0,0 +1,33 @@
+import datetime
+import os
+import time
+from logging import getLogger
+
+from notebooker.retention import load_retention_policies
+from notebooker.serialization.serialization import initialize_serializer_from_config
+from notebooker.settings import WebappConfig
+from notebooker.utils.garbage_collection import collect_garbage
+
+logger = getLogger(__name__)
+GC_INTERVAL = datetime.timedelta(hours=1)
+
+
+def _garbage_collector(webapp_config: WebappConfig, run_once: bool = False):
+    """
+    Runs in a thread alongside the webapp when it has retention policies, removing deleted and expired results and
+    orphaned GridFS files every GC_INTERVAL. Like the report hunter, it stops once "NOTEBOOKER_APP_STOPPING" is set.
+    """
+    policies = load_retention_policies(webapp_config.RETENTION_POLICIES_FILE)
+    serializer = initialize_serializer_from_config(webapp_config)
+    next_run = datetime.datetime.now()
+    while not os.getenv("NOTEBOOKER_APP_STOPPING"):
+        if datetime.datetime.now() >= next_run:
+            try:
+                collect_garbage(serializer, policies)
+            except Exception as e:
+                logger.exception(str(e))
+            next_run = datetime.datetime.now() + GC_INTERVAL
+        if run_once:
+            break
+        time.sleep(10)
+    logger.info("Garbage collection thread successfully killed.")
@@ -1,21 +1,136 @@
 import datetime
 import os
 import time
+from collections import defaultdict
 from logging import getLogger
+from typing import Any, Optional, Tuple
+
+from pymongo.errors import OperationFailure
 
 from notebooker.constants import RUNNING_TIMEOUT, SUBMISSION_TIMEOUT, JobStatus
 from notebooker.serialization.serialization import initialize_serializer_from_config
-from notebooker.utils.caching import get_report_cache, set_report_cache
+from notebooker.utils.caching import get_cache, get_report_cache, set_cache, set_report_cache
+from notebooker.utils.results import get_result_counts
 from notebooker.settings import WebappConfig
+from notebooker.web.worker_pool import WorkerPool
 
 logger = getLogger(__name__)
+# Output deduplication stats need an aggregation over every stored blob, so they are refreshed less often.
+BLOB_METRICS_REFRESH_INTERVAL = datetime.timedelta(minutes=5)
+# How often the hunter times out stale jobs and refreshes the result counts, and polls for updates when it can't
+# follow a change stream.
+HUNTER_INTERVAL_SECONDS = 10
+RESUME_TOKEN_CACHE_KEY = "report_hunter_resume_token"
+
+
+def _cache_if_status_changed(result, webapp_config: WebappConfig, timeout: int) -> None:
+    existing = get_report_cache(result.report_name, result.job_id, cache_dir=webapp_config.CACHE_DIR)
+    if not existing or result.status != existing.status:  # Only update the cache when the status changes
+        set_report_cache(result.report_name, result.job_id, result, timeout=timeout, cache_dir=webapp_config.CACHE_DIR)
+        logger.info(
+            "Report-hunter found a change for {} (status: {}->{})".format(
+                result.job_id, existing.status if existing else None, result.status
+            )
+        )
 
 
-def _report_hunter(webapp_config: WebappConfig, run_once: bool = False, timeout: int = 5):
+def _time_out_jobs(serializer, worker_pool: Optional[WorkerPool] = None, use_job_queue: bool = False) -> None:
+    """
+    Moves submitted and running jobs which have been going for too long into the TIMEOUT status. Jobs which are
+    queued in the worker pool are left alone, and the submission timeout of a job which the pool is running counts
+    from when a worker took it off the queue. With the mongo job queue, submitted jobs are left to its leases.
+    """
+    statuses = [JobStatus.PENDING] if use_job_queue else [JobStatus.SUBMITTED, JobStatus.PENDING]
+    all_pending = serializer.get_all_results(mongo_filter={"status": {"$in": [status.value for status in statuses]}})
+    now = datetime.datetime.now()
+    cutoff = {
+        JobStatus.SUBMITTED: now - datetime.timedelta(minutes=SUBMISSION_TIMEOUT),
+        JobStatus.PENDING: now - datetime.timedelta(minutes=RUNNING_TIMEOUT),
+    }
+    timed_out = defaultdict(list)
+    for result in all_pending:
+        this_cutoff = cutoff.get(result.status)
+        submitted_at = result.job_start_time
+        if result.status == JobStatus.SUBMITTED and worker_pool is not None:
+            if worker_pool.queue_status(result.job_id) is not None:
+                continue
+            submitted_at = worker_pool.started_at(result.job_id) or submitted_at
+        if submitted_at <= this_cutoff:
+            timed_out[result.status].append(result.job_id)
+    for status, job_ids in timed_out.items():
+        delta_seconds = (now - cutoff[status]).total_seconds()
+        serializer.update_check_statuses(
+            job_ids,
+            JobStatus.TIMEOUT,
+            error_info="This request timed out while being submitted to run. "
+            "Please try again! Timed out after {:.0f} minutes "
+            "{:.0f} seconds.".format(delta_seconds / 60, delta_seconds % 60),
+        )
+
+
+def _poll_for_updates(
+    serializer, webapp_config: WebappConfig, last_query: Optional[datetime.datetime], timeout: int
+) -> datetime.datetime:
+    """ Caches the results which have been updated since last_query. Returns the time to poll from next. """
+    ct = 0
+    _last_query = datetime.datetime.now() - datetime.timedelta(minutes=1)
+    for result in serializer.get_all_results(since=last_query):
+        ct += 1
+        _cache_if_status_changed(result, webapp_config, timeout)
+    logger.info("Found {} updates since {}.".format(ct, last_query))
+    return _last_query
+
+
+def _open_change_stream(serializer, webapp_config: WebappConfig) -> Tuple[Optional[Any], bool]:
+    """
+    Opens a change stream on the results, resuming from the stored resume token if there is one.
+    Returns the stream, or None if change streams are unavailable, and whether it resumed from the stored token.
+    """
+    resume_token = get_cache(RESUME_TOKEN_CACHE_KEY, cache_dir=webapp_config.CACHE_DIR)
+    if resume_token:
+        try:
+            return serializer.watch_results(resume_token=resume_token), True
+        except (OperationFailure, NotImplementedError) as e:
+            # e.g. the token is older than anything left in the oplog.
+            logger.warning("Couldn't resume the report-hunter's change stream (%s); starting a new one.", e)
+    try:
+        return serializer.watch_results(), False
+    except (OperationFailure, NotImplementedError) as e:
+        logger.warning("Change streams are unavailable (%s); the report-hunter will poll for updates instead.", e)
+        return None, False
+
+
+def _follow_change_stream(stream, serializer, webapp_config: WebappConfig, timeout: int, until: float) -> None:
+    """
+    Caches results as their changes arrive on the stream, until the given time.monotonic() or until there are
+    no more changes waiting, whichever is later. The resume token is stored whenever it moves on.
+    """
+    resume_token = None
+    while not os.getenv("NOTEBOOKER_APP_STOPPING"):
+        change = stream.try_next()
+        if change is not None:
+            result = serializer.get_changed_result(change)
+            if result is not None:
+                _cache_if_status_changed(result, webapp_config, timeout)
+        if stream.resume_token and stream.resume_token != resume_token:
+            resume_token = stream.resume_token
+            set_cache(RESUME_TOKEN_CACHE_KEY, resume_token, timeout=0, cache_dir=webapp_config.CACHE_DIR)
+        if change is None and time.monotonic() >= until:
+            return
+
+
+def _report_hunter(
+    webapp_config: WebappConfig,
+    run_once: bool = False,
+    timeout: int = 5,
+    worker_pool: Optional[WorkerPool] = None,
+):
     """
     This is a function designed to run in a thread alongside the webapp. It updates the cache which the
     web app reads from and performs some admin on pending/running jobs. The function terminates either when
     run_once is set to True, or the "NOTEBOOKER_APP_STOPPING" environment variable is set.
+    Where the database supports them, the cache is updated from a change stream on the results as soon as they
+    change; otherwise results which have recently been updated are polled for every HUNTER_INTERVAL_SECONDS.
     :param serializer_cls:
         The name of the serialiser (as acquired from Serializer.SERIALIZERNAME.value)
     :param run_once:
@@ -24,52 +139,43 @@ def _report_hunter(webapp_config: WebappConfig, run_once: bool = False, timeout:
         The time in seconds that we cache results.
     :param serializer_kwargs:
         Any kwargs which are required for a Serializer to be initialised successfully.
+    :param worker_pool:
+        The pool which runs the webapp's jobs, whose queued jobs aren't timed out.
     """
     serializer = initialize_serializer_from_config(webapp_config)
     last_query = None
+    last_blob_metrics_refresh = None
+    stream, use_change_streams = None, True
     while not os.getenv("NOTEBOOKER_APP_STOPPING"):
         try:
-            ct = 0
-            # Now, get all pending requests and check they haven't timed out...
-            all_pending = serializer.get_all_results(
-                mongo_filter={"status": {"$in": [JobStatus.SUBMITTED.value, JobStatus.PENDING.value]}}
-            )
+            if stream is None and use_change_streams:
+                stream, resumed = _open_change_stream(serializer, webapp_config)
+                use_change_streams = stream is not None
+                if stream is not None and not resumed:
+                    # Catch up on anything from before the stream started.
+                    _poll_for_updates(serializer, webapp_config, None, timeout)
+            _time_out_jobs(serializer, worker_pool, webapp_config.USE_JOB_QUEUE)
+            if stream is None:
+                last_query = _poll_for_updates(serializer, webapp_config, last_query, timeout)
+            get_result_counts(serializer, force_reload=True, cache_dir=webapp_config.CACHE_DIR)
             now = datetime.datetime.now()
-            cutoff = {
-                JobStatus.SUBMITTED: now - datetime.timedelta(minutes=SUBMISSION_TIMEOUT),
-                JobStatus.PENDING: now - datetime.timedelta(minutes=RUNNING_TIMEOUT),
-            }
-            for result in all_pending:
-                this_cutoff = cutoff.get(result.status)
-                if result.job_start_time <= this_cutoff:
-                    delta_seconds = (now - this_cutoff).total_seconds()
-                    serializer.update_check_status(
-                        result.job_id,
-                        JobStatus.TIMEOUT,
-                        error_info="This request timed out while being submitted to run. "
-                        "Please try again! Timed out after {:.0f} minutes "
-                        "{:.0f} seconds.".format(delta_seconds / 60, delta_seconds % 60),
-                    )
-            # Finally, check we have the latest updates
-            _last_query = datetime.datetime.now() - datetime.timedelta(minutes=1)
-            query_results = serializer.get_all_results(since=last_query)
-            for result in query_results:
-                ct += 1
-                existing = get_report_cache(result.report_name, result.job_id, cache_dir=webapp_config.CACHE_DIR)
-                if not existing or result.status != existing.status:  # Only update the cache when the status changes
-                    set_report_cache(
-                        result.report_name, result.job_id, result, timeout=timeout, cache_dir=webapp_config.CACHE_DIR
-                    )
-                    logger.info(
-                        "Report-hunter found a change for {} (status: {}->{})".format(
-                            result.job_id, existing.status if existing else None, result.status
-                        )
-                    )
-            logger.info("Found {} updates since {}.".format(ct, last_query))
-            last_query = _last_query
+            if last_blob_metrics_refresh is None or now - last_blob_metrics_refresh >= BLOB_METRICS_REFRESH_INTERVAL:
+                serializer.refresh_blob_metrics()
+                last_blob_metrics_refresh = now
         except Exception as e:
             logger.exception(str(e))
+        until = time.monotonic() + (0 if run_once else HUNTER_INTERVAL_SECONDS)
+        if stream is not None:
+            try:
+                _follow_change_stream(stream, serializer, webapp_config, timeout, until)
+            except Exception as e:
+                # It will be reopened from the stored resume token on the next loop.
+                logger.exception(str(e))
+                stream.close()
+                stream = None
         if run_once:
             break
-        time.sleep(10)
+        time.sleep(max(until - time.monotonic(), 0))
+    if stream is not None:
+        stream.close()
     logger.info("Report-hunting thread successfully killed.")
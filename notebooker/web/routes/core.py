@@ -1,9 +1,12 @@
+from dateutil.parser import parse
 from flask import Blueprint, jsonify, request
 
-from notebooker.utils.results import get_all_available_results_json
+from notebooker.constants import JobStatus
+from notebooker.utils.results import get_all_available_results_json, get_result_counts, get_results_page_json
 from notebooker.web.utils import get_serializer, get_all_possible_templates
 
 core_bp = Blueprint("core_bp", __name__)
+MAX_PAGE_SIZE = 1000
 
 
 @core_bp.route("/core/user_profile")
@@ -32,6 +35,52 @@ def all_available_results():
     return jsonify(get_all_available_results_json(get_serializer(), limit))
 
 
+@core_bp.route("/core/results_page")
+def results_page():
+    """
+    Returns one page of results, newest first. Pass the "next_page_token" of a page as the page_token of the next
+    request to get the page after it.
+
+    Request args (all optional): page_size (default 50), page_token, report_name, status (e.g. "Checks done!"), \
+    and since/until, which bound the time that results were last updated.
+
+    :returns: A JSON containing "results", a list of results in the same format as \
+    /core/get_all_available_results, and "next_page_token", which is null on the last page.
+    """
+    page_size = request.args.get("page_size", 50, type=int)
+    status = request.args.get("status")
+    try:
+        if not 0 < page_size <= MAX_PAGE_SIZE:
+            raise ValueError("page_size must be between 1 and {}".format(MAX_PAGE_SIZE))
+        job_status = JobStatus.from_string(status) if status else None
+        if status and job_status is None:
+            raise ValueError("Unknown status {}".format(status))
+        since, until = request.args.get("since"), request.args.get("until")
+        page = get_results_page_json(
+            get_serializer(),
+            page_size,
+            page_token=request.args.get("page_token") or None,
+            report_name=request.args.get("report_name") or None,
+            status=job_status,
+            since=parse(since) if since else None,
+            until=parse(until) if until else None,
+        )
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+    return jsonify(page)
+
+
+@core_bp.route("/core/result_counts")
+def result_counts():
+    """
+    The number of results which are available, as refreshed by the report hunter.
+
+    :returns: A JSON containing "total", plus "by_status" and "by_report" which map each status and report name \
+    to its number of results.
+    """
+    return jsonify(get_result_counts(get_serializer()))
+
+
 @core_bp.route("/core/all_possible_templates")
 def get_all_possible_templates_url():
     """
@@ -2,7 +2,7 @@ import traceback
 
 from flask import Blueprint, current_app, request, render_template, url_for, jsonify
 from notebooker.constants import JobStatus
-from notebooker.utils.results import get_all_result_keys
+from notebooker.utils.results import get_all_result_keys, get_n_results_available
 from notebooker.web.utils import get_serializer, get_all_possible_templates
 
 index_bp = Blueprint("index_bp", __name__)
@@ -22,7 +22,7 @@ def index():
             "index.html",
             all_jobs_url=url_for("core_bp.all_available_results"),
             all_reports=all_reports,
-            n_results_available=get_serializer().n_all_results(),
+            n_results_available=get_n_results_available(get_serializer()),
             donevalue=JobStatus.DONE,  # needed so we can check if a result is available
             username=username,
         )
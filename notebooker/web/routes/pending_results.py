@@ -2,7 +2,7 @@ from flask import render_template, url_for, jsonify, Blueprint, request
 
 from notebooker.constants import JobStatus
 from notebooker.utils.results import _get_job_results, get_latest_job_results
-from notebooker.web.utils import get_serializer, _params_from_request_args
+from notebooker.web.utils import get_queue_status, get_serializer, _params_from_request_args
 
 pending_results_bp = Blueprint("pending_results_bp", __name__)
 
@@ -16,11 +16,14 @@ def task_loading(report_name, job_id):
     )
 
 
-def _get_job_status(job_id, report_name):
+def _get_job_status(job_id, report_name, stdout_offset=0):
     """
     Continuously polled for updates by the user client, until the notebook has completed execution (or errored).
+    Only the lines of stdout after stdout_offset are returned, along with the offset to ask for next time. Jobs which
+    are waiting for a worker also have their "queue_position" and how long they have waited ("queued_seconds").
     """
-    job_result = _get_job_results(job_id, report_name, get_serializer(), ignore_cache=True)
+    serializer = get_serializer()
+    job_result = _get_job_results(job_id, report_name, serializer, ignore_cache=True)
     if job_result is None:
         return {"status": "Job not found. Did you use an old job ID?"}
     if job_result.status in (JobStatus.DONE, JobStatus.ERROR, JobStatus.TIMEOUT, JobStatus.CANCELLED):
@@ -29,7 +32,14 @@ def _get_job_status(job_id, report_name):
             "results_url": url_for("serve_results_bp.task_results", report_name=report_name, job_id=job_id),
         }
     else:
-        response = {"status": job_result.status.value, "run_output": "\n".join(job_result.stdout)}
+        new_lines = serializer.get_stdout(job_id, offset=stdout_offset)
+        response = {
+            "status": job_result.status.value,
+            "run_output": "\n".join(new_lines),
+            "stdout_offset": stdout_offset + len(new_lines),
+        }
+        if job_result.status == JobStatus.SUBMITTED:
+            response.update(get_queue_status(job_id) or {})
     return response
 
 
@@ -43,8 +53,11 @@ def task_status(report_name, job_id):
     :param job_id: The UUID of the job which we ran.
 
     :return: A JSON which contains "status" and either stdout in "run_output" or a URL to results in "results_url".
+        If the request has a "stdout_offset" arg, only stdout after that line is returned, and the response contains \
+        the "stdout_offset" to use for the next request. Jobs which are queued for a worker also have their \
+        "queue_position" and "queued_seconds".
     """
-    return jsonify(_get_job_status(job_id, report_name))
+    return jsonify(_get_job_status(job_id, report_name, request.args.get("stdout_offset", 0, type=int)))
 
 
 @pending_results_bp.route("/status/<path:report_name>/latest")
@@ -61,5 +74,5 @@ def task_latest_status(report_name):
     result = get_latest_job_results(report_name, params, get_serializer())
     job_id = result.job_id
     if job_id:
-        return jsonify(_get_job_status(job_id, report_name))
+        return jsonify(_get_job_status(job_id, report_name, request.args.get("stdout_offset", 0, type=int)))
     return jsonify({"status": "Job not found for given overrides"})
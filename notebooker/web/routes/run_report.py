@@ -1,10 +1,9 @@
 from __future__ import unicode_literals
 
 import datetime
+import functools
 import json
-import subprocess
 import sys
-import threading
 import uuid
 from logging import getLogger
 from typing import Any, Dict, List, Tuple
@@ -18,6 +17,7 @@ from notebooker.serialization.serialization import get_serializer_from_cls
 from notebooker.utils.conversion import generate_ipynb_from_py
 
 from notebooker.utils.filesystem import get_template_dir, get_output_dir
+from notebooker.utils.report_process import monitor_stderr, start_report_process
 from notebooker.utils.templates import _get_parameters_cell_idx, _get_preview
 from notebooker.utils.web import (
     convert_report_name_url_to_path,
@@ -27,7 +27,13 @@ from notebooker.utils.web import (
     validate_title,
 )
 from notebooker.web.handle_overrides import handle_overrides
-from notebooker.web.utils import get_serializer, _get_python_template_dir, get_all_possible_templates
+from notebooker.web.utils import (
+    get_job_queue,
+    get_serializer,
+    get_worker_pool,
+    _get_python_template_dir,
+    get_all_possible_templates,
+)
 
 try:
     FileNotFoundError
@@ -102,24 +108,24 @@ def run_report_http(report_name):
     )
 
 
-def _monitor_stderr(process, job_id, serializer_cls, serializer_args):
-    stderr = []
-    # Unsure whether flask app contexts are thread-safe; just reinitialise the serializer here.
+def _execute_report(command, job_id, serializer_cls, serializer_args):
+    """ Runs on one of the worker pool's threads, once the job has reached the front of the queue. """
     result_serializer = get_serializer_from_cls(serializer_cls, **serializer_args)
-    while True:
-        line = process.stderr.readline().decode("utf-8")
-        if line == "" and process.poll() is not None:
-            break
-        stderr.append(line)
-        logger.info(line)  # So that we have it in the log, not just in memory.
-        result_serializer.update_stdout(job_id, new_lines=[line])
-    return "".join(stderr)
+    result = result_serializer.get_check_result(job_id)
+    if result is None or result.status != JobStatus.SUBMITTED:
+        # It was deleted or cancelled while it was queued.
+        logger.info("Not running job %s, which is no longer waiting to be run.", job_id)
+        return
+    p = start_report_process(command)
+    monitor_stderr(p, job_id, serializer_cls, serializer_args)
 
 
 def run_report(report_name, report_title, mailto, overrides, generate_pdf_output=False, prepare_only=False):
     """
     Actually run the report in earnest.
-    Uses a subprocess to execute the report asynchronously, which is identical to the non-webapp entrypoint.
+    Queues the report on the webapp's worker pool, which executes it in a subprocess that is identical to the
+    non-webapp entrypoint, or on the mongo job queue for `notebooker-cli worker` to execute if USE_JOB_QUEUE is set.
+    The report is SUBMITTED until a worker is free to start it.
     :param report_name: `str` The report which we are executing
     :param report_title: `str` The user-specified title of the report
     :param mailto: `Optional[str]` Who the results will be emailed to
@@ -142,7 +148,24 @@ def run_report(report_name, report_title, mailto, overrides, generate_pdf_output
         generate_pdf_output=generate_pdf_output,
     )
     app_config = current_app.config
-    p = subprocess.Popen(
+    execute_notebook_args = [
+        "--job-id",
+        job_id,
+        "--report-name",
+        report_name,
+        "--report-title",
+        report_title,
+        "--mailto",
+        mailto,
+        "--overrides-as-json",
+        json.dumps(overrides),
+        "--pdf-output" if generate_pdf_output else "--no-pdf-output",
+    ] + (["--prepare-notebook-only"] if prepare_only else [])
+    if app_config["USE_JOB_QUEUE"]:
+        # A worker runs it with its own global options.
+        get_job_queue().submit(job_id, execute_notebook_args)
+        return job_id
+    command = (
         [
             "notebooker-cli",
             "--output-base-dir",
@@ -157,29 +180,15 @@ def run_report(report_name, report_title, mailto, overrides, generate_pdf_output
         + (["--notebooker-disable-git"] if app_config["NOTEBOOKER_DISABLE_GIT"] else [])
         + ["--serializer-cls", result_serializer.__class__.__name__]
         + result_serializer.serializer_args_to_cmdline_args()
-        + [
-            "execute-notebook",
-            "--job-id",
-            job_id,
-            "--report-name",
-            report_name,
-            "--report-title",
-            report_title,
-            "--mailto",
-            mailto,
-            "--overrides-as-json",
-            json.dumps(overrides),
-            "--pdf-output" if generate_pdf_output else "--no-pdf-output",
-        ]
-        + (["--prepare-notebook-only"] if prepare_only else []),
-        stderr=subprocess.PIPE,
+        + ["execute-notebook"]
+        + execute_notebook_args
     )
-    stderr_thread = threading.Thread(
-        target=_monitor_stderr,
-        args=(p, job_id, current_app.config["SERIALIZER_CLS"], current_app.config["SERIALIZER_CONFIG"]),
+    get_worker_pool().submit(
+        job_id,
+        functools.partial(
+            _execute_report, command, job_id, app_config["SERIALIZER_CLS"], app_config["SERIALIZER_CONFIG"]
+        ),
     )
-    stderr_thread.daemon = True
-    stderr_thread.start()
     return job_id
 
 
@@ -12,11 +12,16 @@ from notebooker.constants import (
     NotebookResultError,
     NotebookResultPending,
 )
-from notebooker.serialization.mongo import _pdf_filename
+from notebooker.serialization.documents import pdf_filename
 from notebooker.web.routes.pending_results import task_loading
 from notebooker.web.utils import get_serializer, _params_from_request_args, get_all_possible_templates
 from notebooker.utils.conversion import get_resources_dir
-from notebooker.utils.results import _get_job_results, get_latest_job_results, get_latest_successful_job_results
+from notebooker.utils.results import (
+    _get_job_results,
+    get_latest_job_results,
+    get_latest_successful_job_results,
+    read_job_result,
+)
 from notebooker.utils.web import convert_report_name_path_to_url, convert_report_name_url_to_path
 
 serve_results_bp = Blueprint("serve_results_bp", __name__)
@@ -35,6 +40,8 @@ def _render_results(job_id: str, report_name: str, result: NotebookResultBase) -
     pdf_url = url_for("serve_results_bp.download_pdf_result", report_name=report_name, job_id=job_id) if job_id else ""
     rerun_url = url_for("run_report_bp.rerun_report", report_name=report_name, job_id=job_id) if job_id else ""
     clone_url = url_for("run_report_bp.run_report_http", report_name=report_name)
+    # Whether there is a PDF to download, which may not be the case even if one was asked for, e.g. if making it failed.
+    has_pdf = isinstance(result, NotebookResultComplete) and get_serializer().has_pdf(result.job_id)
     if result and result.overrides:
         clone_url = clone_url + "?json_params={}".format(json.dumps(result.overrides))
     return render_template(
@@ -46,6 +53,7 @@ def _render_results(job_id: str, report_name: str, result: NotebookResultBase) -
         html_render=result_url,
         ipynb_url=ipynb_url,
         pdf_url=pdf_url,
+        has_pdf=has_pdf,
         rerun_url=rerun_url,
         clone_url=clone_url,
         all_reports=get_all_possible_templates(),
@@ -84,9 +92,9 @@ def task_results_latest(report_name):
     return _render_results(job_id, report_name, result)
 
 
-def _process_result_or_abort(result: NotebookResultBase) -> Union[str, Any]:
+def _process_result_or_abort(result: NotebookResultBase, report_name: str) -> Union[str, Any]:
     if isinstance(result, (NotebookResultError, NotebookResultComplete)):
-        return result.raw_html
+        return read_job_result(result.job_id, report_name, result, lambda r: r.raw_html)
     if isinstance(result, NotebookResultPending):
         return task_loading(result.report_name, result.job_id)
     abort(404)
@@ -107,7 +115,7 @@ def task_results_html(job_id, report_name):
 
     :return: The HTML rendering of the .ipynb for the given report_name & job_id.
     """
-    return _process_result_or_abort(_get_job_results(job_id, report_name, get_serializer()))
+    return _process_result_or_abort(_get_job_results(job_id, report_name, get_serializer()), report_name)
 
 
 @serve_results_bp.route("/result_html_render/<path:report_name>/latest")
@@ -128,7 +136,7 @@ def latest_parameterised_task_results_html(report_name):
     """
     params = _params_from_request_args(request.args)
     result = get_latest_job_results(report_name, params, get_serializer())
-    return _process_result_or_abort(result)
+    return _process_result_or_abort(result, report_name)
 
 
 @serve_results_bp.route("/result_html_render/as_of/<date:as_of>/<path:report_name>/latest")
@@ -150,7 +158,7 @@ def latest_parameterised_task_results_as_of(report_name, as_of):
     """
     params = _params_from_request_args(request.args)
     result = get_latest_job_results(report_name, params, get_serializer(), as_of=as_of)
-    return _process_result_or_abort(result)
+    return _process_result_or_abort(result, report_name)
 
 
 @serve_results_bp.route("/result_html_render/<path:report_name>/latest-all")
@@ -166,7 +174,7 @@ def latest_task_results_html(report_name):
 
     :return: The HTML render of the absolute-latest run of a report, regardless of parametrization.
     """
-    return _process_result_or_abort(get_latest_job_results(report_name, None, get_serializer()))
+    return _process_result_or_abort(get_latest_job_results(report_name, None, get_serializer()), report_name)
 
 
 @serve_results_bp.route("/result_html_render/as_of/<date:as_of>/<path:report_name>/latest-all")
@@ -183,7 +191,9 @@ def latest_task_results_as_of(report_name, as_of):
 
     :return: The HTML render of the absolute-latest run of a report, regardless of parametrization.
     """
-    return _process_result_or_abort(get_latest_job_results(report_name, None, get_serializer(), as_of=as_of))
+    return _process_result_or_abort(
+        get_latest_job_results(report_name, None, get_serializer(), as_of=as_of), report_name
+    )
 
 
 @serve_results_bp.route("/result_html_render/<path:report_name>/latest-successful")
@@ -204,7 +214,7 @@ def latest_successful_task_results_html(report_name):
     """
     params = _params_from_request_args(request.args)
     result = get_latest_successful_job_results(report_name, params, get_serializer())
-    return _process_result_or_abort(result)
+    return _process_result_or_abort(result, report_name)
 
 
 @serve_results_bp.route("/result_html_render/as_of/<date:as_of>/<path:report_name>/latest-successful")
@@ -226,7 +236,7 @@ def latest_successful_task_results_as_of(report_name, as_of):
     """
     params = _params_from_request_args(request.args)
     result = get_latest_successful_job_results(report_name, params, get_serializer(), as_of=as_of)
-    return _process_result_or_abort(result)
+    return _process_result_or_abort(result, report_name)
 
 
 # ---- Downloads and ancillary data ---- #
@@ -248,7 +258,9 @@ def task_result_resources_html(job_id, resource, report_name):
         html_resources = result.raw_html_resources
         resource_path = os.path.join(get_resources_dir(job_id), resource)
         if resource_path in html_resources.get("outputs", {}):
-            return html_resources["outputs"][resource_path]
+            return read_job_result(
+                job_id, report_name, result, lambda r: r.raw_html_resources["outputs"][resource_path]
+            )
     abort(404)
 
 
@@ -265,7 +277,7 @@ def download_ipynb_result(job_id, report_name):
     result = _get_job_results(job_id, report_name, get_serializer())
     if isinstance(result, NotebookResultComplete):
         return Response(
-            result.raw_ipynb_json,
+            read_job_result(job_id, report_name, result, lambda r: r.raw_ipynb_json),
             mimetype="application/vnd.jupyter",
             headers={"Content-Disposition": "attachment;filename={}.ipynb".format(job_id)},
         )
@@ -286,9 +298,9 @@ def download_pdf_result(job_id, report_name):
     result = _get_job_results(job_id, report_name, get_serializer())
     if isinstance(result, NotebookResultComplete):
         return Response(
-            result.pdf,
+            read_job_result(job_id, report_name, result, lambda r: r.pdf),
             mimetype="application/pdf",
-            headers={"Content-Disposition": "attachment;filename={}".format(_pdf_filename(job_id))},
+            headers={"Content-Disposition": "attachment;filename={}".format(pdf_filename(job_id))},
         )
     else:
         abort(404)
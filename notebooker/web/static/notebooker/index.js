@@ -1,5 +1,5 @@
 add_delete_callback = () => {
-    $('.deletebutton').click((clicked) => {
+    $('.deletebutton').off('click').click((clicked) => {
         const to_delete = clicked.target.closest('button').id.split('_')[1];
         $('#deleteModal').modal({
             closable: true,
@@ -27,15 +27,26 @@ add_delete_callback = () => {
     });
 };
 
-load_data = (limit) => {
+let nextPageToken = null;
+
+load_data = (pageSize, append) => {
+    const params = { page_size: pageSize };
+    if (append && nextPageToken) {
+        params.page_token = nextPageToken;
+    }
     $.ajax({
-        url: `/core/get_all_available_results?limit=${limit}`,
+        url: '/core/results_page',
+        data: params,
         dataType: 'json',
-        success: (result) => {
+        success: (page) => {
             const table = $('#resultsTable').DataTable();
-            table.clear();
-            table.rows.add(result);
-            table.draw();
+            if (!append) {
+                table.clear();
+            }
+            table.rows.add(page.results);
+            table.draw(false);
+            nextPageToken = page.next_page_token;
+            $('#loadMoreResults').toggle(nextPageToken !== null);
             $('#indexTableContainer').fadeIn();
             add_delete_callback();
         },
@@ -45,6 +56,8 @@ load_data = (limit) => {
     });
 };
 
+load_more_data = (pageSize) => load_data(pageSize, true);
+
 
 $(document).ready(() => {
     $('#resultsTable').DataTable({
@@ -122,5 +135,5 @@ $(document).ready(() => {
         ],
         order: [[3, 'desc']],
     });
-    load_data(50);
+    load_data(50, false);
 });
@@ -1,6 +1,8 @@
 $(document).ready(() => {
     let results_url = '';
     let last_data;
+    let stdout_offset = 0;
+    let run_output = '';
     const load_status = function () {
         if (typeof last_data !== 'undefined' && typeof last_data.results_url !== 'undefined') {
             clearInterval(intervalId);
@@ -8,12 +10,25 @@ $(document).ready(() => {
         }
         $.ajax({
             url: loc, // We get this from loading.html, which comes from flask
+            data: { stdout_offset },
             dataType: 'json',
             success(data, status, request) {
                 console.log(data);
                 results_url = data.results_url;
-                $('#loadingStatus').text(data.status);
-                $('#run_output').text(data.run_output);
+                if (typeof data.queue_position !== 'undefined') {
+                    $('#loadingStatus').text(
+                        `${data.status} (number ${data.queue_position} in the queue, waiting for ${data.queued_seconds}s)`,
+                    );
+                } else {
+                    $('#loadingStatus').text(data.status);
+                }
+                if (data.run_output) {
+                    run_output = run_output ? `${run_output}\n${data.run_output}` : data.run_output;
+                    $('#run_output').text(run_output);
+                }
+                if (typeof data.stdout_offset !== 'undefined') {
+                    stdout_offset = data.stdout_offset;
+                }
                 last_data = data;
                 const i = $('#resultsIframe', window.parent.document);
                 // Add 40 pixels to make sure we actually get the whole iframe contents...
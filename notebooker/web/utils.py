@@ -7,9 +7,11 @@ from flask import g, current_app
 from werkzeug.datastructures import ImmutableMultiDict
 
 from notebooker.constants import python_template_dir
+from notebooker.serialization.job_queue import MongoJobQueue
 from notebooker.serialization.mongo import MongoResultSerializer
 from notebooker.serialization.serialization import get_serializer_from_cls
 from notebooker.utils.templates import _valid_dirname, _valid_filename, _gen_all_templates
+from notebooker.web.worker_pool import WorkerPool
 
 logger = getLogger(__name__)
 
@@ -21,6 +23,25 @@ def get_serializer() -> MongoResultSerializer:
     return g.notebook_serializer
 
 
+def get_worker_pool() -> WorkerPool:
+    """ The pool which runs this webapp's notebooks, as created by setup_app(). """
+    return current_app.extensions["notebooker_worker_pool"]
+
+
+def get_job_queue() -> MongoJobQueue:
+    """ The mongo job queue which reports are submitted to when the webapp runs with --use-job-queue. """
+    if not hasattr(g, "notebook_job_queue"):
+        g.notebook_job_queue = MongoJobQueue(get_serializer())
+    return g.notebook_job_queue
+
+
+def get_queue_status(job_id: str) -> Optional[Dict[str, float]]:
+    """ Where a SUBMITTED job is in whichever queue it is waiting in, or None if it isn't queued. """
+    if current_app.config["USE_JOB_QUEUE"]:
+        return get_job_queue().queue_status(job_id)
+    return get_worker_pool().queue_status(job_id)
+
+
 def _params_from_request_args(request_args: ImmutableMultiDict) -> Dict:
     return {k: (v[0] if len(v) == 1 else v) for k, v in request_args.lists()}
 
@@ -0,0 +1,113 @@
+"""
+A fixed number of worker threads which run the webapp's notebook executions, so that a burst of requests queues up
+rather than starting a notebooker-cli process (and a kernel) for every one of them at once. Jobs are started in the
+order in which they were submitted.
+"""
+import datetime
+import threading
+import time
+from collections import OrderedDict
+from logging import getLogger
+from typing import Callable, Dict, List, Optional
+
+from notebooker.utils.metrics import gauge, histogram
+
+logger = getLogger(__name__)
+
+QUEUED_JOBS = gauge("notebooker_webapp_queued_jobs", "Submitted notebook executions waiting for a free worker.")
+RUNNING_JOBS = gauge("notebooker_webapp_running_jobs", "Notebook executions which the webapp is running.")
+QUEUE_WAIT_SECONDS = histogram(
+    "notebooker_webapp_queue_wait_seconds", "How long notebook executions waited for a free worker."
+)
+
+
+class _QueuedJob:
+    def __init__(self, job_id: str, run: Callable[[], None]):
+        self.job_id = job_id
+        self.run = run
+        self.submitted_at = time.time()
+        # When a worker took the job off the queue.
+        self.started_at: Optional[datetime.datetime] = None
+
+
+class WorkerPool:
+    """
+    Runs submitted jobs on at most `max_concurrent_jobs` threads at once. Workers are started as jobs arrive, and
+    each one takes the job which has been waiting longest whenever it finishes the last.
+    """
+
+    def __init__(self, max_concurrent_jobs: int):
+        if max_concurrent_jobs < 1:
+            raise ValueError("At least one job must be able to run at a time, not {}.".format(max_concurrent_jobs))
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self._queued: "OrderedDict[str, _QueuedJob]" = OrderedDict()
+        self._running: Dict[str, _QueuedJob] = {}
+        self._workers: List[threading.Thread] = []
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def submit(self, job_id: str, run: Callable[[], None]) -> None:
+        """ Queues run() to be called once a worker is free. """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The worker pool has been closed, so job {} can't be run.".format(job_id))
+            self._queued[job_id] = _QueuedJob(job_id, run)
+            QUEUED_JOBS.set(len(self._queued))
+            if len(self._workers) < self.max_concurrent_jobs and len(self._queued) > self._idle_workers():
+                worker = threading.Thread(target=self._work, name="notebooker-worker-{}".format(len(self._workers)))
+                worker.daemon = True
+                self._workers.append(worker)
+                worker.start()
+            self._condition.notify()
+
+    def queue_status(self, job_id: str) -> Optional[Dict[str, float]]:
+        """
+        For a job which is waiting for a worker, its 1-based "queue_position" and how many seconds it has been
+        queued for ("queued_seconds"). None if the job isn't waiting in this pool.
+        """
+        with self._condition:
+            for position, job in enumerate(self._queued.values(), start=1):
+                if job.job_id == job_id:
+                    return {"queue_position": position, "queued_seconds": round(time.time() - job.submitted_at, 1)}
+        return None
+
+    def started_at(self, job_id: str) -> Optional[datetime.datetime]:
+        """ When a worker started running the job, or None if the job isn't running in this pool. """
+        with self._condition:
+            job = self._running.get(job_id)
+            return job.started_at if job else None
+
+    def close(self) -> List[str]:
+        """ Stops any more jobs from starting, and returns the IDs of the jobs which were still queued. """
+        with self._condition:
+            self._closed = True
+            cancelled = list(self._queued)
+            self._queued.clear()
+            QUEUED_JOBS.set(0)
+            self._condition.notify_all()
+        return cancelled
+
+    def _idle_workers(self) -> int:
+        return len(self._workers) - len(self._running)
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                while not self._queued and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                _, job = self._queued.popitem(last=False)
+                job.started_at = datetime.datetime.now()
+                self._running[job.job_id] = job
+                QUEUED_JOBS.set(len(self._queued))
+                RUNNING_JOBS.set(len(self._running))
+            QUEUE_WAIT_SECONDS.observe(time.time() - job.submitted_at)
+            try:
+                job.run()
+            except Exception:
+                logger.exception("Job %s failed to run.", job.job_id)
+            finally:
+                with self._condition:
+                    del self._running[job.job_id]
+                    RUNNING_JOBS.set(len(self._running))
@@ -0,0 +1,150 @@
+"""
+`notebooker-cli worker`: claims jobs which a webapp has submitted to the mongo job queue and executes them, so that
+execution capacity can be added by starting workers on more hosts. Each job is run as an `execute-notebook`
+subprocess with this worker's global options, exactly as the webapp would have run it.
+"""
+import socket
+import subprocess
+import threading
+import uuid
+from logging import getLogger
+from typing import List, Optional
+
+from notebooker.constants import JobStatus
+from notebooker.serialization.job_queue import MongoJobQueue
+from notebooker.serialization.serialization import initialize_serializer_from_config
+from notebooker.settings import BaseConfig
+from notebooker.utils.report_process import monitor_stderr, start_report_process
+
+logger = getLogger(__name__)
+
+# Jobs which are still in one of these states when they are claimed haven't finished, so are (re)run.
+_RUNNABLE_STATUSES = (JobStatus.SUBMITTED, JobStatus.PENDING)
+
+
+class Worker:
+    """ Executes jobs from the queue one at a time. A process runs several of these to run jobs concurrently. """
+
+    def __init__(self, config: BaseConfig, job_queue: MongoJobQueue, worker_id: Optional[str] = None):
+        self.config = config
+        self.job_queue = job_queue
+        self.worker_id = worker_id or "{}-{}".format(socket.gethostname(), uuid.uuid4().hex[:8])
+
+    def run_one(self) -> bool:
+        """ Claims and executes one job. Returns False if there was nothing to claim. """
+        self.job_queue.fail_expired()
+        job = self.job_queue.claim(self.worker_id)
+        if job is None:
+            return False
+        job_id = job["job_id"]
+        try:
+            result = self.job_queue.serializer.get_check_result(job_id)
+            if result is None or result.status not in _RUNNABLE_STATUSES:
+                logger.info("Not running job %s, which was deleted or cancelled while it was queued.", job_id)
+            else:
+                logger.info("Worker %s is running job %s (attempt %d).", self.worker_id, job_id, job["attempts"])
+                self._execute(job_id, self.notebooker_cli_command(job["args"]))
+                # The report hunter leaves submitted jobs to the queue, so one which never started mustn't be left.
+                result = self.job_queue.serializer.get_check_result(job_id)
+                if result is not None and result.status == JobStatus.SUBMITTED:
+                    self.job_queue.serializer.update_check_status(
+                        job_id, JobStatus.ERROR, error_info="The worker couldn't start executing this job."
+                    )
+        finally:
+            self.job_queue.complete(job_id, self.worker_id)
+        return True
+
+    def run_forever(self, stop: threading.Event, poll_interval: float) -> None:
+        while not stop.is_set():
+            try:
+                claimed = self.run_one()
+            except Exception:
+                logger.exception("Worker %s failed to run a job.", self.worker_id)
+                claimed = False
+            if not claimed:
+                stop.wait(poll_interval)
+
+    def notebooker_cli_command(self, execute_notebook_args: List[str]) -> List[str]:
+        config = self.config
+        global_options = {
+            "--output-base-dir": config.OUTPUT_DIR,
+            "--template-base-dir": config.TEMPLATE_DIR,
+            "--py-template-base-dir": config.PY_TEMPLATE_BASE_DIR,
+            "--py-template-subdir": config.PY_TEMPLATE_SUBDIR,
+            "--notebook-kernel-name": config.NOTEBOOK_KERNEL_NAME,
+        }
+        command = ["notebooker-cli"]
+        for option, value in global_options.items():
+            if value:
+                command.extend([option, value])
+        return (
+            command
+            + (["--notebooker-disable-git"] if config.NOTEBOOKER_DISABLE_GIT else [])
+            + ["--serializer-cls", self.job_queue.serializer.get_name()]
+            + self.job_queue.serializer.serializer_args_to_cmdline_args()
+            + ["execute-notebook"]
+            + list(execute_notebook_args)
+        )
+
+    def _execute(self, job_id: str, command: List[str]) -> None:
+        process = start_report_process(command)
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, process, finished), daemon=True)
+        heartbeat.start()
+        try:
+            monitor_stderr(process, job_id, self.config.SERIALIZER_CLS, self.config.SERIALIZER_CONFIG)
+        finally:
+            finished.set()
+            heartbeat.join()
+
+    def _heartbeat(self, job_id: str, process: subprocess.Popen, finished: threading.Event) -> None:
+        # Heartbeat often enough that a couple of slow or failed updates don't lose the lease.
+        while not finished.wait(self.job_queue.lease_seconds / 3):
+            try:
+                held = self.job_queue.heartbeat(job_id, self.worker_id)
+            except Exception:
+                logger.exception("Worker %s couldn't heartbeat job %s.", self.worker_id, job_id)
+                continue
+            if not held:
+                # Another worker has claimed it since, so stop rather than run it twice at once.
+                logger.error("Worker %s lost its lease on job %s, so is stopping it.", self.worker_id, job_id)
+                process.terminate()
+                return
+
+
+def run_workers(
+    config: BaseConfig,
+    n_workers: int,
+    lease_seconds: float,
+    max_attempts: int,
+    poll_interval: float,
+    stop: Optional[threading.Event] = None,
+) -> None:
+    """ Runs n_workers workers, each executing one job at a time, until stop is set. """
+    stop = stop or threading.Event()
+    serializer = initialize_serializer_from_config(config)
+    job_queue = MongoJobQueue(serializer, lease_seconds=lease_seconds, max_attempts=max_attempts)
+    workers = [Worker(config, job_queue) for _ in range(n_workers)]
+    logger.info(
+        "Starting workers %s on %s, with leases of %ss and up to %d attempts per job.",
+        [worker.worker_id for worker in workers],
+        job_queue.collection_name,
+        lease_seconds,
+        max_attempts,
+    )
+    threads = [
+        threading.Thread(target=worker.run_forever, args=(stop, poll_interval), name=worker.worker_id, daemon=True)
+        for worker in workers
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            # Joining in a loop with a timeout leaves the main thread able to receive KeyboardInterrupt.
+            while thread.is_alive():
+                thread.join(1)
+    except KeyboardInterrupt:
+        logger.info("Stopping workers once their current jobs have finished.")
+        stop.set()
+        for thread in threads:
+            thread.join()
@@ -73,6 +73,7 @@ setup(
     ],
     extras_require={
         "prometheus": ["prometheus_client"],
+        "zstd": ["zstandard"],
         "test": test_requirements,
         "docs": [
             "sphinx<3.0.0",
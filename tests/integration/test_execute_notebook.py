@@ -1,13 +1,17 @@
 from __future__ import unicode_literals
 
 import mock
+import pytest
 from click.testing import CliRunner
 from nbformat import NotebookNode
 from nbformat import __version__ as nbv
 
 from notebooker._entrypoints import base_notebooker
-from notebooker.constants import NotebookResultComplete, DEFAULT_SERIALIZER
+from notebooker.constants import JobStatus, NotebookResultComplete, DEFAULT_SERIALIZER
+from notebooker.execute_notebook import execute_notebook_entrypoint
 from notebooker.serializers.pymongo import PyMongoResultSerializer
+from notebooker.serializers.sqlite import SqliteResultSerializer
+from notebooker.settings import BaseConfig
 
 
 def mock_nb_execute(input_path, output_path, **kw):
@@ -54,3 +58,43 @@ def test_main(mongo_host):
         )
         assert result.raw_ipynb_json
         assert result.pdf == pdf_contents
+
+
+SWEEP_REPORT = """
+# + {"tags": ["parameters"]}
+n = 1
+letter = "a"
+# -
+
+print(letter * int(1 / n))
+"""
+
+
+def test_variants_run_in_parallel_processes(tmp_path, monkeypatch):
+    monkeypatch.setenv("NOTEBOOK_KERNEL_NAME", "python3")
+    (tmp_path / "templates").mkdir()
+    (tmp_path / "templates" / "sweep.py").write_text(SWEEP_REPORT)
+    config = BaseConfig(
+        SERIALIZER_CLS="SqliteResultSerializer",
+        SERIALIZER_CONFIG={"sqlite_path": str(tmp_path / "results.sqlite")},
+        OUTPUT_DIR=str(tmp_path / "output"),
+        TEMPLATE_DIR=str(tmp_path / "ipynb"),
+        PY_TEMPLATE_BASE_DIR=str(tmp_path),
+        PY_TEMPLATE_SUBDIR="templates",
+        NOTEBOOKER_DISABLE_GIT=True,
+    )
+    overrides = '{"n": [1, 0, 2, 1], "letter": ["a", "b"]}'
+    with pytest.raises(Exception, match="2 of 6 variants of sweep failed") as error:
+        execute_notebook_entrypoint(config, "sweep", overrides, ["n", "letter"], "", 1, "job", "", False, False, 2)
+    assert str(error.value).count("ZeroDivisionError") == 2
+    serializer = SqliteResultSerializer(sqlite_path=str(tmp_path / "results.sqlite"))
+    results = [serializer.get_check_result(job_id) for _, job_id in serializer.get_all_result_keys()]
+    assert "job" in {result.job_id for result in results}
+    assert sorted((result.overrides["n"], result.overrides["letter"], result.status) for result in results) == [
+        (0, "a", JobStatus.ERROR),
+        (0, "b", JobStatus.ERROR),
+        (1, "a", JobStatus.DONE),
+        (1, "b", JobStatus.DONE),
+        (2, "a", JobStatus.DONE),
+        (2, "b", JobStatus.DONE),
+    ]
@@ -0,0 +1,91 @@
+import datetime
+
+import freezegun
+
+from notebooker.constants import NotebookResultComplete
+from notebooker.retention import RetentionPolicy
+from notebooker.serialization.documents import job_file_metadata
+from notebooker.serialization.serialization import get_serializer_from_cls, initialize_serializer_from_config
+from notebooker.utils.garbage_collection import collect_garbage
+
+
+def _save_done(serializer, job_id, outputs, overrides=None):
+    serializer.save_check_result(
+        NotebookResultComplete(
+            job_id=job_id,
+            report_name="report",
+            job_start_time=datetime.datetime(2020, 1, 1),
+            job_finish_time=datetime.datetime(2020, 1, 1),
+            raw_html="<html/>",
+            raw_html_resources={"outputs": outputs},
+            raw_ipynb_json="{}",
+            pdf=b"%PDF",
+            overrides=overrides or {},
+        )
+    )
+
+
+def _job_ids(serializer):
+    return sorted(doc["job_id"] for doc in serializer.library.find({}, {"job_id": 1}))
+
+
+def test_collect_garbage(bson_library, webapp_config):
+    serializer = initialize_serializer_from_config(webapp_config)
+    for minute, job_id in enumerate(["old", "deleted", "new"]):
+        with freezegun.freeze_time(datetime.datetime(2020, 1, 1, 0, minute)):
+            _save_done(serializer, job_id, {"shared.png": b"shared", "{}.png".format(job_id): job_id.encode()})
+    with freezegun.freeze_time(datetime.datetime(2020, 1, 1, 0, 3)):
+        _save_done(serializer, "other-params", {"shared.png": b"shared"}, overrides={"a": 1})
+    serializer.delete_result("deleted")
+    # A file left behind by a result which no longer exists.
+    serializer.result_data_store.put(b"orphan", filename="gone.pdf", metadata={"job_id": "gone"})
+    policies = [RetentionPolicy("report", keep_last=1)]
+
+    report = collect_garbage(serializer, policies, dry_run=True, pause_seconds=0)
+    assert report["n_results"] == 2
+    # The "deleted" and "old" outputs are only used by the results which are going.
+    assert report["blob_bytes"] == len(b"deleted") + len(b"old")
+    assert report["file_bytes"] == 2 * len(b"%PDF")
+    assert report["n_orphaned_files"] == 1
+    assert report["orphaned_file_bytes"] == len(b"orphan")
+    assert report["total_bytes"] == sum(
+        report[key] for key in ("payload_bytes", "file_bytes", "blob_bytes", "orphaned_file_bytes")
+    )
+    assert _job_ids(serializer) == ["deleted", "new", "old", "other-params"]
+
+    assert collect_garbage(serializer, policies, pause_seconds=0) == report
+    assert _job_ids(serializer) == ["new", "other-params"]
+    assert sorted(doc["job_id"] for doc in serializer.payload_library.find()) == ["new", "other-params"]
+    assert {doc["_id"]: doc["refcount"] for doc in serializer.blob_refs.find()} == {
+        serializer._get_output_hashes("new")["shared.png"]: 2,
+        serializer._get_output_hashes("new")["new.png"]: 1,
+    }
+    assert sorted(f["filename"] for f in serializer.result_data_files.find()) == sorted(
+        ["new.pdf", "other-params.pdf"] + ["sha256:" + h for h in serializer._get_output_hashes("new").values()]
+    )
+    assert serializer.get_latest_job_id_for_name_and_params("report", {}) == "new"
+
+    assert collect_garbage(serializer, policies, pause_seconds=0)["total_bytes"] == 0
+
+
+def test_collections_sharing_the_gridfs_bucket_keep_each_others_files(bson_library, webapp_config):
+    serializer = initialize_serializer_from_config(webapp_config)
+    other_config = dict(webapp_config.SERIALIZER_CONFIG, result_collection_name="OTHER_OUTPUT")
+    other = get_serializer_from_cls(webapp_config.SERIALIZER_CLS, **other_config)
+    _save_done(serializer, "mine", {"mine.png": b"mine"})
+    _save_done(other, "theirs", {"theirs.png": b"theirs"})
+    # Saved before files were tagged with their result collection.
+    other.result_data_store.put(b"legacy", filename="theirs-legacy.pdf", metadata={"job_id": "theirs"})
+    # Left behind by a result which the other collection no longer has.
+    other.result_data_store.put(b"gone", filename="gone.pdf", metadata=job_file_metadata("gone", "OTHER_OUTPUT"))
+
+    assert list(serializer.find_orphaned_files()) == []
+    assert [grid_file["metadata"]["job_id"] for grid_file in other.find_orphaned_files()] == ["gone"]
+    assert collect_garbage(serializer, [], pause_seconds=0)["n_orphaned_files"] == 0
+    assert collect_garbage(other, [], pause_seconds=0)["n_orphaned_files"] == 1
+    assert sorted(f["filename"] for f in serializer.result_data_files.find({"metadata.job_id": {"$exists": True}})) == [
+        "mine.pdf",
+        "theirs-legacy.pdf",
+        "theirs.pdf",
+    ]
+    assert other.get_check_result("theirs").pdf == b"%PDF"
@@ -0,0 +1,121 @@
+import datetime
+import subprocess
+import sys
+
+import freezegun
+import mock
+import pytest
+
+from notebooker.constants import CANCEL_MESSAGE, JobStatus
+from notebooker.serialization.job_queue import MongoJobQueue
+from notebooker.serialization.serialization import initialize_serializer_from_config
+from notebooker.serializers.memory import InMemoryResultSerializer
+from notebooker.web.routes.pending_results import _get_job_status
+from notebooker.web.routes.run_report import run_report
+from notebooker.worker import Worker
+
+
+def _at(second):
+    return freezegun.freeze_time(datetime.datetime(2020, 1, 1, 0, 0, second))
+
+
+@pytest.fixture
+def job_queue(bson_library, webapp_config):
+    return MongoJobQueue(initialize_serializer_from_config(webapp_config), lease_seconds=10, max_attempts=2)
+
+
+def test_jobs_are_claimed_in_order_by_one_worker_each(job_queue):
+    for second, job_id in enumerate("abc"):
+        with _at(second):
+            job_queue.serializer.save_check_stub(job_id, "report")
+            job_queue.submit(job_id, ["--job-id", job_id])
+    with _at(5):
+        assert job_queue.queue_status("c") == {"queue_position": 3, "queued_seconds": 3.0}
+        assert job_queue.claim("worker-1")["job_id"] == "a"
+        assert job_queue.claim("worker-2") == dict(
+            job_id="b",
+            args=["--job-id", "b"],
+            state="claimed",
+            submitted_at=datetime.datetime(2020, 1, 1, 0, 0, 1),
+            attempts=1,
+            worker="worker-2",
+            lease_expires_at=datetime.datetime(2020, 1, 1, 0, 0, 15),
+        )
+        assert job_queue.queue_status("a") is None
+        assert job_queue.queue_status("c")["queue_position"] == 1
+        assert not job_queue.complete("a", "worker-2")
+        assert job_queue.complete("a", "worker-1")
+        assert job_queue.claim("worker-1")["job_id"] == "c"
+        assert job_queue.claim("worker-1") is None
+
+
+def test_expired_leases_are_retried_then_failed(job_queue):
+    job_queue.serializer.save_check_stub("a", "report")
+    job_queue.submit("a", [])
+    with _at(0):
+        assert job_queue.claim("worker-1")["attempts"] == 1
+    with _at(8):
+        assert job_queue.heartbeat("a", "worker-1")
+    with _at(15):
+        # The heartbeat extended the lease to 18 seconds.
+        assert job_queue.claim("worker-2") is None
+    with _at(20):
+        assert job_queue.claim("worker-2")["attempts"] == 2
+        assert not job_queue.heartbeat("a", "worker-1")
+        assert job_queue.fail_expired() == []
+    with _at(40):
+        # Its last attempt has expired too.
+        assert job_queue.claim("worker-3") is None
+        assert job_queue.fail_expired() == ["a"]
+    result = job_queue.serializer.get_check_result("a")
+    assert result.status == JobStatus.ERROR
+    assert "2 attempts" in result.error_info
+    assert job_queue.collection.count_documents({}) == 0
+
+
+def test_worker_runs_claimed_jobs_with_its_own_options(job_queue, webapp_config):
+    webapp_config.NOTEBOOK_KERNEL_NAME = None
+    job_queue.serializer.save_check_stub("a", "report", status=JobStatus.SUBMITTED)
+    job_queue.serializer.save_check_stub("b", "report", status=JobStatus.SUBMITTED)
+    job_queue.serializer.update_check_status("b", JobStatus.CANCELLED, error_info=CANCEL_MESSAGE)
+    job_queue.submit("a", ["--job-id", "a"])
+    job_queue.submit("b", ["--job-id", "b"])
+    worker = Worker(webapp_config, job_queue, worker_id="worker-1")
+    with mock.patch.object(Worker, "_execute") as execute:
+        assert worker.run_one() and worker.run_one()
+        assert not worker.run_one()
+    # The cancelled job is dropped without being run.
+    execute.assert_called_once()
+    job_id, command = execute.call_args[0]
+    assert job_id == "a"
+    assert command[:3] == ["notebooker-cli", "--output-base-dir", webapp_config.OUTPUT_DIR]
+    assert command[command.index("--serializer-cls") + 1] == webapp_config.SERIALIZER_CLS
+    assert command[-3:] == ["execute-notebook", "--job-id", "a"]
+    assert job_queue.collection.count_documents({}) == 0
+    # The mocked execution never started the job, so it was failed rather than left submitted.
+    assert job_queue.serializer.get_check_result("a").status == JobStatus.ERROR
+
+
+def test_webapp_submits_to_the_job_queue(job_queue, flask_app, clean_file_cache):
+    flask_app.config["USE_JOB_QUEUE"] = True
+    with flask_app.test_request_context():
+        with mock.patch("notebooker.web.routes.run_report.start_report_process") as popen:
+            job_id = run_report("report", "title", "", {"a": 1}, prepare_only=True)
+        status = _get_job_status(job_id, "report")
+    popen.assert_not_called()
+    assert status["status"] == JobStatus.SUBMITTED.value
+    assert status["queue_position"] == 1
+    job = job_queue.claim("worker-1")
+    assert job["job_id"] == job_id
+    assert job["args"][job["args"].index("--overrides-as-json") + 1] == '{"a": 1}'
+    assert job["args"][-1] == "--prepare-notebook-only"
+
+
+def test_job_queue_needs_mongo():
+    with pytest.raises(ValueError):
+        MongoJobQueue(InMemoryResultSerializer())
+
+
+def test_worker_doesnt_import_the_webapp():
+    check = "import sys, notebooker.worker; assert not [m for m in sys.modules if m.split('.')[0] == 'flask']"
+    subprocess.check_call([sys.executable, "-c", check])
@@ -0,0 +1,29 @@
+import nbformat
+import papermill as pm
+
+from notebooker.utils.kernel_pool import KernelPool
+
+
+def test_notebooks_run_on_warm_pooled_kernels(tmp_path):
+    notebook = nbformat.v4.new_notebook()
+    notebook.cells = [nbformat.v4.new_code_cell("import os, sys\nprint(os.getpid(), 'csv' in sys.modules)")]
+    notebook.metadata["kernelspec"] = {"name": "python3", "display_name": "Python 3", "language": "python"}
+    input_path, output_path = str(tmp_path / "input.ipynb"), str(tmp_path / "output.ipynb")
+    nbformat.write(notebook, input_path)
+
+    pool = KernelPool(1, warm_imports=["csv"])
+    outputs = []
+    try:
+        for _ in range(2):
+            with pool.lease("python3") as kernel_manager:
+                assert kernel_manager is not None
+                executed = pm.execute_notebook(input_path, output_path, km=kernel_manager, progress_bar=False)
+                (client,) = kernel_manager.clients
+            # papermill leaves its client's channels open on a kernel it was given, so the lease closes them.
+            assert not client.channels_running
+            outputs.append(executed.cells[0].outputs[0]["text"].split())
+    finally:
+        pool.close()
+    # Each notebook ran on its own kernel, which had already imported the warm imports.
+    assert outputs[0][0] != outputs[1][0]
+    assert [warm for _, warm in outputs] == ["True", "True"]
@@ -0,0 +1,122 @@
+import datetime
+
+import freezegun
+import mock
+
+from notebooker.constants import JobStatus, NotebookResultComplete
+from notebooker.serialization.serialization import initialize_serializer_from_config
+
+
+def _at(minute):
+    return freezegun.freeze_time(datetime.datetime(2020, 1, 1, 0, minute))
+
+
+def _save_done(serializer, job_id, overrides):
+    serializer.save_check_result(
+        NotebookResultComplete(
+            job_id=job_id,
+            report_name="report",
+            job_start_time=datetime.datetime(2020, 1, 1),
+            job_finish_time=datetime.datetime(2020, 1, 1),
+            raw_html="",
+            raw_html_resources={"outputs": {}},
+            raw_ipynb_json="[]",
+            overrides=overrides,
+            generate_pdf_output=False,
+        )
+    )
+
+
+def _latest(serializer, params, **kwargs):
+    return (
+        serializer.get_latest_job_id_for_name_and_params("report", params, **kwargs),
+        serializer.get_latest_successful_job_id_for_name_and_params("report", params, **kwargs),
+    )
+
+
+def test_latest_pointers_follow_saves_and_deletes(bson_library, webapp_config):
+    serializer = initialize_serializer_from_config(webapp_config)
+    with _at(0):
+        serializer.save_check_stub("a", "report", overrides={"x": 1})
+    with _at(1):
+        _save_done(serializer, "a", {"x": 1})
+    with _at(2):
+        serializer.save_check_stub("b", "report", overrides={"x": 1})
+    with _at(3):
+        serializer.save_check_stub("c", "report", overrides={"x": 2})
+
+    assert serializer.latest_pointers.count_documents({}) == 3
+    assert _latest(serializer, {"x": 1}) == ("b", "a")
+    assert _latest(serializer, {"x": 2}) == ("c", None)
+    assert _latest(serializer, None) == ("c", "a")
+    assert _latest(serializer, {"x": 1}, as_of=datetime.datetime(2020, 1, 1, 0, 2)) == ("a", "a")
+
+    with _at(4):
+        serializer.delete_result("b")
+    assert _latest(serializer, {"x": 1}) == ("a", "a")
+    with _at(5):
+        serializer.delete_result("a")
+    assert _latest(serializer, {"x": 1}) == (None, None)
+    assert _latest(serializer, None) == ("c", None)
+
+
+def test_rebuild_latest_pointers(bson_library, webapp_config):
+    serializer = initialize_serializer_from_config(webapp_config)
+    with _at(0):
+        _save_done(serializer, "a", {"x": 1})
+    with _at(1):
+        serializer.save_check_stub("b", "report", overrides={"x": 1})
+    expected = [_latest(serializer, None), _latest(serializer, {"x": 1})]
+    assert expected == [("b", "a"), ("b", "a")]
+    serializer.latest_pointers.drop()
+
+    assert serializer.rebuild_latest_pointers() == 4
+    assert serializer.latest_pointers.count_documents({}) == 2
+    assert [_latest(serializer, None), _latest(serializer, {"x": 1})] == expected
+
+
+def test_latest_successful_for_all_params_before_overrides_were_hashed(bson_library, webapp_config):
+    serializer = initialize_serializer_from_config(webapp_config)
+    for minute, (job_id, overrides) in enumerate([("a", {"x": 1}), ("b", {"x": 2}), ("c", {"x": 1})]):
+        with _at(minute):
+            _save_done(serializer, job_id, overrides)
+    serializer.library.update_many({"job_id": {"$in": ["a", "c"]}}, {"$unset": {"overrides_hash": 1}})
+
+    latest = serializer.get_latest_successful_results_for_name_all_params("report")
+    assert sorted(result.job_id for result in latest) == ["b", "c"]
+    serializer.backfill_overrides_hashes()
+    assert sorted(serializer.get_latest_successful_job_ids_for_name_all_params("report")) == ["b", "c"]
+
+
+def test_latest_successful_for_all_params_reads_outputs_together_and_pdfs_lazily(bson_library, webapp_config):
+    serializer = initialize_serializer_from_config(webapp_config)
+    for minute, job_id in enumerate("ab"):
+        with _at(minute):
+            serializer.save_check_result(
+                NotebookResultComplete(
+                    job_id=job_id,
+                    report_name="report",
+                    job_start_time=datetime.datetime(2020, 1, 1),
+                    job_finish_time=datetime.datetime(2020, 1, 1),
+                    raw_html="<html>{}</html>".format(job_id),
+                    raw_html_resources={"outputs": {"plot.png": job_id.encode(), "shared.png": b"shared"}},
+                    raw_ipynb_json="[]",
+                    pdf=b"%PDF",
+                    overrides={"x": job_id},
+                )
+            )
+
+    with mock.patch.object(serializer, "_read_file", wraps=serializer._read_file) as read_file, mock.patch.object(
+        serializer, "get_result_resources", wraps=serializer.get_result_resources
+    ) as get_result_resources:
+        latest = sorted(serializer.get_latest_successful_results_for_name_all_params("report"), key=lambda r: r.job_id)
+        assert [dict(result.raw_html_resources["outputs"].items()) for result in latest] == [
+            {"plot.png": b"a", "shared.png": b"shared"},
+            {"plot.png": b"b", "shared.png": b"shared"},
+        ]
+        assert [result.raw_html for result in latest] == ["<html>a</html>", "<html>b</html>"]
+        read_file.assert_not_called()
+        get_result_resources.assert_not_called()
+        # The PDF is still there for anything which wants it.
+        assert latest[0].pdf == b"%PDF"
+        read_file.assert_called_once()
@@ -1,14 +1,19 @@
 import datetime
+import threading
+import time
 import uuid
 
 import freezegun
+import mock
 import pytest
 
 from notebooker.constants import JobStatus, NotebookResultComplete, NotebookResultError, NotebookResultPending
 from notebooker.serialization.serialization import initialize_serializer_from_config
-from notebooker.utils.caching import get_report_cache
+from notebooker.utils.caching import get_cache, get_report_cache
 from notebooker.utils.filesystem import initialise_base_dirs
-from notebooker.web.report_hunter import _report_hunter
+from notebooker.utils.results import RESULT_COUNTS_CACHE_KEY
+from notebooker.web.report_hunter import RESUME_TOKEN_CACHE_KEY, _report_hunter
+from notebooker.web.worker_pool import WorkerPool
 
 
 @pytest.fixture(autouse=True)
@@ -72,6 +77,19 @@ def test_report_hunter_with_status_change(bson_library, webapp_config):
         assert get_report_cache(report_name, job_id, cache_dir=webapp_config.CACHE_DIR) == expected
 
 
+def test_report_hunter_caches_result_counts(bson_library, webapp_config):
+    serializer = initialize_serializer_from_config(webapp_config)
+    report_name = str(uuid.uuid4())
+    serializer.save_check_stub(str(uuid.uuid4()), report_name)
+    serializer.save_check_stub(str(uuid.uuid4()), report_name)
+    _report_hunter(webapp_config=webapp_config, run_once=True)
+    assert get_cache(RESULT_COUNTS_CACHE_KEY, cache_dir=webapp_config.CACHE_DIR) == {
+        "total": 2,
+        "by_status": {JobStatus.PENDING.value: 2},
+        "by_report": {report_name: 2},
+    }
+
+
 @pytest.mark.parametrize(
     "status, time_later, should_timeout",
     [
@@ -180,3 +198,88 @@ def test_report_hunter_pending_to_done(bson_library, webapp_config):
             raw_ipynb_json="[]",
         )
         assert get_report_cache(report_name, job_id, cache_dir=webapp_config.CACHE_DIR) == expected
+
+
+class _FakeChangeStream:
+    def __init__(self, changes, resume_token=None):
+        self.changes = list(changes)
+        self.resume_token = resume_token
+        self.closed = False
+
+    def try_next(self):
+        if not self.changes:
+            return None
+        change = self.changes.pop(0)
+        self.resume_token = change["_id"]
+        return change
+
+    def close(self):
+        self.closed = True
+
+
+def test_report_hunter_follows_change_stream(bson_library, webapp_config):
+    serializer = initialize_serializer_from_config(webapp_config)
+    job_id = str(uuid.uuid4())
+    report_name = str(uuid.uuid4())
+    with freezegun.freeze_time(datetime.datetime(2018, 1, 12, 2, 30)):
+        serializer.save_check_stub(job_id, report_name)
+    with freezegun.freeze_time(datetime.datetime(2018, 1, 12, 2, 32)):
+        serializer.update_check_status(job_id, JobStatus.CANCELLED, error_info="This was cancelled!")
+    change = {"_id": {"_data": "token-1"}, "fullDocument": bson_library.find_one({"job_id": job_id})}
+    streams = [_FakeChangeStream([], resume_token={"_data": "token-0"}), _FakeChangeStream([change])]
+
+    # Nothing is found by polling, so the only way for the result to reach the cache is from the change stream.
+    with mock.patch(
+        "notebooker.serialization.mongo.MongoResultSerializer.get_all_results", side_effect=lambda **kwargs: iter([])
+    ), mock.patch(
+        "notebooker.serialization.mongo.MongoResultSerializer.watch_results", side_effect=streams
+    ) as watch_results:
+        _report_hunter(webapp_config=webapp_config, run_once=True)
+        assert get_report_cache(report_name, job_id, cache_dir=webapp_config.CACHE_DIR) is None
+        _report_hunter(webapp_config=webapp_config, run_once=True)
+
+    # The second hunter resumes the stream which the first one stored, rather than polling to catch up.
+    assert watch_results.call_args_list == [mock.call(), mock.call(resume_token={"_data": "token-0"})]
+    assert get_report_cache(report_name, job_id, cache_dir=webapp_config.CACHE_DIR).status == JobStatus.CANCELLED
+    assert get_cache(RESUME_TOKEN_CACHE_KEY, cache_dir=webapp_config.CACHE_DIR) == {"_data": "token-1"}
+    assert all(stream.closed for stream in streams)
+
+
+def test_report_hunter_doesnt_time_out_queued_jobs(bson_library, webapp_config):
+    serializer = initialize_serializer_from_config(webapp_config)
+    pool = WorkerPool(1)
+    blocker_done, running_done = threading.Event(), threading.Event()
+    with freezegun.freeze_time(datetime.datetime(2018, 1, 12, 2, 30)):
+        for job_id in ("blocker", "running", "queued"):
+            serializer.save_check_stub(job_id, "report", status=JobStatus.SUBMITTED)
+        pool.submit("blocker", blocker_done.wait)
+        pool.submit("running", running_done.wait)
+        pool.submit("queued", lambda: None)
+    with freezegun.freeze_time(datetime.datetime(2018, 1, 12, 2, 40)):
+        blocker_done.set()
+        for _ in range(500):
+            if pool.started_at("running"):
+                break
+            time.sleep(0.01)
+        # All three are older than the submission timeout, but "running" was only taken off the queue just now.
+        _report_hunter(webapp_config=webapp_config, run_once=True, worker_pool=pool)
+    statuses = {job_id: serializer.get_check_result(job_id).status for job_id in ("blocker", "running", "queued")}
+    assert statuses == {"blocker": JobStatus.TIMEOUT, "running": JobStatus.SUBMITTED, "queued": JobStatus.SUBMITTED}
+    with freezegun.freeze_time(datetime.datetime(2018, 1, 12, 2, 44)):
+        _report_hunter(webapp_config=webapp_config, run_once=True, worker_pool=pool)
+    assert serializer.get_check_result("running").status == JobStatus.TIMEOUT
+    assert serializer.get_check_result("queued").status == JobStatus.SUBMITTED
+    running_done.set()
+    pool.close()
+
+
+def test_report_hunter_leaves_submitted_jobs_to_the_job_queue(bson_library, webapp_config):
+    webapp_config.USE_JOB_QUEUE = True
+    serializer = initialize_serializer_from_config(webapp_config)
+    with freezegun.freeze_time(datetime.datetime(2018, 1, 12, 2, 30)):
+        serializer.save_check_stub("submitted", "report", status=JobStatus.SUBMITTED)
+        serializer.save_check_stub("pending", "report", status=JobStatus.PENDING)
+    with freezegun.freeze_time(datetime.datetime(2018, 1, 12, 4, 30)):
+        _report_hunter(webapp_config=webapp_config, run_once=True)
+    assert serializer.get_check_result("submitted").status == JobStatus.SUBMITTED
+    assert serializer.get_check_result("pending").status == JobStatus.TIMEOUT
@@ -0,0 +1,69 @@
+import datetime
+import uuid
+
+import freezegun
+import pytest
+
+from notebooker.constants import JobStatus
+from notebooker.serialization.serialization import initialize_serializer_from_config
+
+
+@pytest.fixture(autouse=True)
+def clean_file_cache(clean_file_cache):
+    """ Set up cache environment. """
+
+
+def _save_stubs(serializer, report_name, n):
+    job_ids = []
+    for i in range(n):
+        job_id = str(uuid.uuid4())
+        with freezegun.freeze_time(datetime.datetime(2020, 1, 1) + datetime.timedelta(minutes=i // 2)):
+            serializer.save_check_stub(job_id, report_name)
+        job_ids.append(job_id)
+    return job_ids
+
+
+def test_results_page_pages_through_all_results(bson_library, flask_app, webapp_config):
+    serializer = initialize_serializer_from_config(webapp_config)
+    # Pairs of results share an update_time, so the pages have to be keyed on job_id too.
+    _save_stubs(serializer, "report", 7)
+    with flask_app.test_client() as client:
+        seen, page_token = [], None
+        while True:
+            args = {"page_size": 3}
+            if page_token:
+                args["page_token"] = page_token
+            page = client.get("/core/results_page", query_string=args).json
+            seen.extend(page["results"])
+            page_token = page["next_page_token"]
+            if page_token is None:
+                break
+    assert len(seen) == 7
+    assert len({result["job_id"] for result in seen}) == 7
+    keys = [(result["update_time"], result["job_id"]) for result in seen]
+    assert keys == sorted(keys, reverse=True)
+
+
+def test_results_page_filters(bson_library, flask_app, webapp_config):
+    serializer = initialize_serializer_from_config(webapp_config)
+    wanted = _save_stubs(serializer, "wanted", 4)
+    _save_stubs(serializer, "unwanted", 2)
+    serializer.update_check_status(wanted[0], JobStatus.CANCELLED, error_info="Cancelled")
+    with flask_app.test_client() as client:
+        by_report = client.get("/core/results_page", query_string={"report_name": "wanted"}).json
+        by_status = client.get("/core/results_page", query_string={"status": JobStatus.PENDING.value}).json
+        by_time = client.get(
+            "/core/results_page", query_string={"since": "2020-01-01T00:01:00", "until": "2020-01-01T00:02:00"}
+        ).json
+    assert {result["report_name"] for result in by_report["results"]} == {"wanted"}
+    assert len(by_report["results"]) == 4
+    assert len(by_status["results"]) == 5
+    assert {result["job_id"] for result in by_time["results"]} == set(wanted[2:])
+
+
+def test_results_page_rejects_bad_args(bson_library, flask_app):
+    with flask_app.test_client() as client:
+        assert client.get("/core/results_page", query_string={"page_token": "nonsense"}).status_code == 400
+        assert client.get("/core/results_page", query_string={"status": "nonsense"}).status_code == 400
+        assert client.get("/core/results_page", query_string={"status": JobStatus.DELETED.value}).status_code == 400
+        assert client.get("/core/results_page", query_string={"page_size": 0}).status_code == 400
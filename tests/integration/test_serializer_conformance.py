@@ -0,0 +1,102 @@
+"""
+Runs the behaviour which every result serializer must share against the mongo implementations. They run against the
+same mongod, so they also have to be able to read each other's results.
+"""
+
+import asyncio
+import inspect
+
+import pytest
+
+from notebooker.serialization.mongo_async import AsyncMongoResultSerializer
+from notebooker.serialization.serialization import get_serializer_from_cls, initialize_serializer_from_config
+from tests.unit.serialization.test_serializer_conformance import (  # noqa: F401
+    _assert_same_complete_result,
+    _complete,
+    test_stub_round_trip,
+    test_complete_result_round_trip,
+    test_status_transitions,
+    test_finished_results_cant_be_replaced,
+    test_stdout,
+    test_latest_lookups,
+    test_latest_successful_results_for_all_params,
+    test_get_all_results_filters,
+    test_has_pdf,
+)
+from tests.unit.serialization import test_serializer_conformance as shared
+
+
+class _Synchronous:
+    """ Runs each method of an async serializer to completion, so that the same tests can drive it. """
+
+    def __init__(self, async_serializer):
+        self._serializer = async_serializer
+        self._loop = asyncio.new_event_loop()
+
+    def __getattr__(self, name):
+        method = getattr(self._serializer, name)
+
+        def call(*args, **kwargs):
+            result = method(*args, **kwargs)
+            if inspect.isasyncgen(result):
+                return iter(self._loop.run_until_complete(_collect(result)))
+            return self._loop.run_until_complete(result)
+
+        return call
+
+    def close(self):
+        self._loop.run_until_complete(self._serializer.close())
+        self._loop.close()
+
+
+async def _collect(async_iterator):
+    return [item async for item in async_iterator]
+
+
+def _serializer(kind, webapp_config):
+    if kind == "sync":
+        return initialize_serializer_from_config(webapp_config)
+    if kind == "secondary-reads":
+        config = dict(webapp_config.SERIALIZER_CONFIG)
+        config.update(mongo_listing_read_preference="secondaryPreferred", mongo_result_read_preference="nearest")
+        return get_serializer_from_cls(webapp_config.SERIALIZER_CLS, **config)
+    serializer = _Synchronous(AsyncMongoResultSerializer(**webapp_config.SERIALIZER_CONFIG))
+    serializer.ensure_indexes()
+    return serializer
+
+
+@pytest.fixture(params=["sync", "secondary-reads", "async"])
+def serializer(request, bson_library, webapp_config):
+    serializer = _serializer(request.param, webapp_config)
+    yield serializer
+    if request.param == "async":
+        serializer.close()
+
+
+@pytest.fixture(params=[("sync", "async"), ("async", "sync")], ids=["sync-to-async", "async-to-sync"])
+def writer_and_reader(request, bson_library, webapp_config):
+    writer, reader = (_serializer(kind, webapp_config) for kind in request.param)
+    yield writer, reader
+    for kind, serializer in zip(request.param, (writer, reader)):
+        if kind == "async":
+            serializer.close()
+
+
+def test_implementations_read_each_others_results(writer_and_reader):
+    writer, reader = writer_and_reader
+    writer.save_check_result(_complete("abc", overrides={"a": 1}))
+    writer.save_check_stub("pending", "report")
+    writer.update_stdout("pending", ["a\n"])
+
+    _assert_same_complete_result(reader.get_check_result("abc"), _complete("abc", overrides={"a": 1}))
+    assert reader.get_latest_successful_job_id_for_name_and_params("report", {"a": 1}) == "abc"
+    assert reader.get_stdout("pending") == ["a\n"]
+    # Saving again over the other implementation's result keeps one reference per distinct output.
+    reader.save_check_result(_complete("abc", overrides={"a": 1}))
+    _assert_same_complete_result(writer.get_check_result("abc"), _complete("abc", overrides={"a": 1}))
+
+
+# AsyncMongoResultSerializer doesn't page through results.
+@pytest.mark.parametrize("serializer", ["sync", "secondary-reads"], indirect=True)
+def test_results_page_never_lists_deleted_results(serializer):
+    shared.test_results_page_never_lists_deleted_results(serializer)
@@ -0,0 +1,38 @@
+import pytest
+
+from notebooker.serialization import codecs
+from notebooker.serialization.codecs import NO_CODEC, ZLIB, ZSTD, check_codec, compress_payload, decompress_payload
+
+
+@pytest.mark.parametrize("codec", [NO_CODEC, ZLIB])
+def test_compress_round_trip(codec):
+    html = "<html>{}</html>".format("<style>body { margin: 0; }</style>" * 1000)
+    compressed = compress_payload(html, codec)
+    assert decompress_payload(compressed, codec) == html
+
+
+def test_zlib_compresses():
+    html = "<style>body { margin: 0; }</style>" * 1000
+    assert len(compress_payload(html, ZLIB)) < len(html) / 10
+
+
+@pytest.mark.parametrize("value", [None, ""])
+def test_empty_payloads_are_left_alone(value):
+    assert compress_payload(value, ZLIB) == value
+    assert decompress_payload(value, ZLIB) == value
+
+
+def test_uncompressed_documents_are_read_as_is():
+    assert decompress_payload("<html/>", None) == "<html/>"
+
+
+def test_check_codec():
+    assert check_codec(ZLIB) == ZLIB
+    with pytest.raises(ValueError):
+        check_codec("lzma")
+
+
+def test_zstd_needs_zstandard(monkeypatch):
+    monkeypatch.setattr(codecs, "zstandard", None)
+    with pytest.raises(ValueError):
+        check_codec(ZSTD)
@@ -0,0 +1,125 @@
+import datetime
+
+import pytest
+
+from notebooker.constants import JobStatus, NotebookResultComplete, NotebookResultError
+from notebooker.retention import RetentionPolicy
+from notebooker.serialization import documents
+from notebooker.serialization.codecs import ZLIB
+
+
+def _complete_result(outputs):
+    return NotebookResultComplete(
+        job_id="abc",
+        job_start_time=datetime.datetime(2020, 1, 1),
+        job_finish_time=datetime.datetime(2020, 1, 1, 0, 1),
+        report_name="report",
+        raw_html="<html/>",
+        raw_ipynb_json="{}",
+        raw_html_resources={"outputs": outputs},
+        stdout=["a line\n"],
+    )
+
+
+def test_overrides_hash_is_canonical():
+    assert documents.overrides_hash({"b": 1, "a": [1, 2]}) == documents.overrides_hash({"a": [1, 2], "b": 1})
+    assert documents.overrides_hash({"a": 1}) != documents.overrides_hash({"a": 1, "b": 2})
+    assert documents.overrides_hash({"a": 1}) != documents.overrides_hash({"a": "1"})
+    assert documents.overrides_hash(None) == documents.overrides_hash({})
+
+
+def test_page_token_round_trip():
+    update_time = datetime.datetime(2020, 1, 1, 12, 30, 0, 123000)
+    token = documents.encode_page_token(update_time, "abc")
+    assert documents.decode_page_token(token) == (update_time, "abc")
+    with pytest.raises(ValueError):
+        documents.decode_page_token("nonsense")
+
+
+def test_split_payload_keeps_the_payload_and_stdout_out_of_the_result_document():
+    out_data, payload = documents.split_payload(_complete_result({}))
+    assert payload == {"raw_html": "<html/>", "raw_ipynb_json": "{}"}
+    assert not {"raw_html", "raw_ipynb_json", "stdout"} & set(out_data)
+    assert documents.stamp_result_document(out_data)["overrides_hash"] == documents.overrides_hash({})
+
+
+def test_hash_outputs_records_the_hashes_of_the_outputs():
+    result = _complete_result({"a.png": b"image", "b.png": b"image", "c.png": b"other"})
+    blobs = documents.hash_outputs(result)
+    assert blobs == {documents.content_hash(b"image"): b"image", documents.content_hash(b"other"): b"other"}
+    assert documents.output_hashes(result.saveable_output()) == {
+        "a.png": documents.content_hash(b"image"),
+        "b.png": documents.content_hash(b"image"),
+        "c.png": documents.content_hash(b"other"),
+    }
+    error = NotebookResultError(
+        job_id="abc", job_start_time=datetime.datetime(2020, 1, 1), report_name="report", error_info="oops"
+    )
+    assert documents.hash_outputs(error) == {}
+
+
+def test_stdout_chunks_round_trip():
+    chunks = [
+        documents.stdout_chunk("abc", 0, 0, ["a", "b"]),
+        documents.stdout_chunk("abc", 1, 2, ["c"]),
+    ]
+    assert chunks[1]["end_line"] == 3
+    assert documents.stdout_lines(chunks) == ["a", "b", "c"]
+    assert documents.stdout_lines(chunks[:1] + chunks[1:], offset=1) == ["b", "c"]
+
+
+def test_payload_documents_record_their_codec_and_size():
+    payload_doc = documents.payload_document("abc", {"raw_html": "<html/>" * 100}, ZLIB)
+    assert payload_doc["payload_codec"] == ZLIB
+    assert payload_doc["payload_bytes"] == len(payload_doc["raw_html"])
+    assert documents.decoded_field(payload_doc, "raw_html") == "<html/>" * 100
+
+
+def test_status_transition_filter():
+    assert documents.status_transition_filter(JobStatus.SUBMITTED) == {"status": {"$in": []}}
+    assert set(documents.status_transition_filter(JobStatus.DONE)["status"]["$in"]) == {
+        JobStatus.SUBMITTED.value,
+        JobStatus.PENDING.value,
+        JobStatus.TIMEOUT.value,
+    }
+
+
+def test_can_transition_logs_why_not(caplog):
+    assert documents.can_transition("abc", {"status": JobStatus.PENDING.value}, JobStatus.DONE)
+    assert not documents.can_transition("abc", None, JobStatus.DONE)
+    assert not documents.can_transition("abc", {"status": JobStatus.DONE.value}, JobStatus.ERROR)
+    assert "not in the database" in caplog.records[0].message
+    assert "can't move from" in caplog.records[1].message
+
+
+def test_split_page():
+    docs = [{"job_id": str(i), "update_time": datetime.datetime(2020, 1, 1, 0, 0, 10 - i)} for i in range(3)]
+    assert documents.split_page(docs, 3) == (docs, None)
+    page, token = documents.split_page(docs, 2)
+    assert page == docs[:2]
+    assert documents.decode_page_token(token) == (docs[1]["update_time"], "1")
+
+
+def test_expired_job_ids_counts_each_set_of_parameters_separately():
+    now = datetime.datetime(2020, 1, 10)
+    docs = [
+        {"job_id": "a2", "overrides_hash": "a", "update_time": datetime.datetime(2020, 1, 9)},
+        {"job_id": "b1", "overrides_hash": "b", "update_time": datetime.datetime(2020, 1, 8)},
+        {"job_id": "a1", "overrides_hash": "a", "update_time": datetime.datetime(2020, 1, 7)},
+        {"job_id": "legacy", "overrides": {}, "update_time": datetime.datetime(2020, 1, 6)},
+    ]
+    policy = RetentionPolicy(report_name="*", keep_last=1)
+    assert list(documents.expired_job_ids(docs, policy, now)) == ["a1"]
+    assert documents.latest_per_overrides(docs) == [docs[0], docs[1], docs[3]]
+
+
+def test_results_page_filter():
+    assert documents.results_page_filter() == {"status": {"$ne": JobStatus.DELETED.value}}
+    since, until = datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 2)
+    assert documents.results_page_filter("report", JobStatus.PENDING, since, until) == {
+        "status": JobStatus.PENDING.value,
+        "report_name": "report",
+        "update_time": {"$gte": since, "$lt": until},
+    }
+    with pytest.raises(ValueError):
+        documents.results_page_filter(status=JobStatus.DELETED)
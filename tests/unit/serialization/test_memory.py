@@ -0,0 +1,131 @@
+import datetime
+import os
+
+import mock
+import pytest
+
+from notebooker.constants import JobStatus, NotebookResultComplete
+from notebooker.serialization import ALL_SERIALIZERS
+from notebooker.serialization.memory import clear_memory_stores
+from notebooker.serializers.memory import InMemoryResultSerializer
+from notebooker.settings import WebappConfig
+from notebooker.utils import caching
+from notebooker.utils.conversion import get_resources_dir
+from notebooker.web.app import create_app, setup_app
+
+
+@pytest.fixture(autouse=True)
+def clean_memory_stores():
+    yield
+    clear_memory_stores()
+
+
+def _complete(job_id, report_name="report"):
+    return NotebookResultComplete(
+        job_id=job_id,
+        report_name=report_name,
+        job_start_time=datetime.datetime(2020, 1, 1),
+        job_finish_time=datetime.datetime(2020, 1, 1),
+        raw_html="<html>{}</html>".format(job_id),
+        raw_html_resources={"outputs": {"{}/plot.png".format(get_resources_dir(job_id)): b"png"}},
+        raw_ipynb_json="{}",
+        pdf=b"%PDF",
+    )
+
+
+def test_stores_are_shared_by_name():
+    assert ALL_SERIALIZERS["InMemoryResultSerializer"] is InMemoryResultSerializer
+    InMemoryResultSerializer().save_check_stub("abc", "report")
+    assert InMemoryResultSerializer().get_check_result("abc").job_id == "abc"
+    assert InMemoryResultSerializer(memory_store_name="other").get_check_result("abc") is None
+    assert InMemoryResultSerializer().serializer_args_to_cmdline_args() == [
+        "--memory-store-name",
+        "default",
+        "--payload-codec",
+        "zlib",
+    ]
+    clear_memory_stores()
+    assert InMemoryResultSerializer().get_check_result("abc") is None
+
+
+def test_results_are_isolated_from_callers():
+    serializer = InMemoryResultSerializer()
+    overrides = {"a": [1]}
+    serializer.save_check_stub("abc", "report", overrides=overrides)
+    overrides["a"].append(2)
+    serializer.get_check_result("abc").overrides["a"].append(3)
+    assert serializer.get_check_result("abc").overrides == {"a": [1]}
+
+
+def test_blobs_and_filters():
+    serializer = InMemoryResultSerializer()
+    serializer.save_check_result(_complete("abc"))
+    serializer.save_check_result(_complete("def"))
+    serializer.save_check_stub("ghi", "other")
+    assert serializer.get_blob_stats() == {"n_blobs": 1, "stored_bytes": 3, "referenced_bytes": 6}
+    pending = {"status": {"$in": [JobStatus.SUBMITTED.value, JobStatus.PENDING.value]}}
+    assert serializer.get_all_result_keys(mongo_filter=pending) == [("other", "ghi")]
+    assert serializer.get_result_counts()["by_status"] == {JobStatus.DONE.value: 2, JobStatus.PENDING.value: 1}
+    assert serializer.purge_results(["abc", "def"]) == 2
+    assert serializer.get_blob_stats() == {"n_blobs": 0, "stored_bytes": 0, "referenced_bytes": 0}
+    assert list(serializer.find_orphaned_files()) == []
+
+
+def _webapp_config(workspace):
+    os.makedirs(os.path.join(workspace.workspace, "templates"), exist_ok=True)
+    return WebappConfig(
+        CACHE_DIR=workspace.workspace,
+        OUTPUT_DIR=workspace.workspace,
+        TEMPLATE_DIR=workspace.workspace,
+        SERIALIZER_CLS="InMemoryResultSerializer",
+        SERIALIZER_CONFIG={},
+        PY_TEMPLATE_BASE_DIR=workspace.workspace,
+        PY_TEMPLATE_SUBDIR="templates",
+    )
+
+
+def test_webapp_runs_without_mongo(workspace):
+    config = _webapp_config(workspace)
+    InMemoryResultSerializer().save_check_result(_complete("abc"))
+    flask_app = setup_app(create_app(), config)
+    with flask_app.test_client() as client:
+        assert client.get("/result_html_render/report/abc").data == b"<html>abc</html>"
+        assert client.get("/result_html_render/report/abc/resources/plot.png").data == b"png"
+        assert client.get("/result_download_pdf/report/abc").data == b"%PDF"
+        assert b"as .pdf" in client.get("/results/report/abc").data
+        page = client.get("/core/results_page").json
+    assert [result["job_id"] for result in page["results"]] == ["abc"]
+
+
+def test_downloading_the_ipynb_only_reads_the_ipynb(workspace, monkeypatch):
+    # Cache in this test's workspace.
+    monkeypatch.setattr(caching, "cache", None)
+    config = _webapp_config(workspace)
+    InMemoryResultSerializer().save_check_result(_complete("abc"))
+    flask_app = setup_app(create_app(), config)
+    get_result_payload = InMemoryResultSerializer.get_result_payload
+    with mock.patch.object(
+        InMemoryResultSerializer, "get_result_payload", autospec=True, side_effect=get_result_payload
+    ) as read_payload, mock.patch.object(InMemoryResultSerializer, "get_result_resources") as read_outputs:
+        with flask_app.test_client() as client:
+            for _ in range(2):
+                assert client.get("/result_download_ipynb/report/abc").data == b"{}"
+    # The second download is served from the cache.
+    assert [call[0][2] for call in read_payload.call_args_list] == ["raw_ipynb_json"]
+    read_outputs.assert_not_called()
+
+
+def test_results_page_only_offers_a_pdf_which_was_stored(workspace, monkeypatch):
+    monkeypatch.setattr(caching, "cache", None)
+    config = _webapp_config(workspace)
+    result = _complete("abc")
+    # A PDF was asked for, but making it failed.
+    result.pdf = ""
+    InMemoryResultSerializer().save_check_result(result)
+    flask_app = setup_app(create_app(), config)
+    with mock.patch.object(InMemoryResultSerializer, "get_result_payload") as read_payload:
+        with flask_app.test_client() as client:
+            page = client.get("/results/report/abc").data
+    assert b"as .ipynb" in page
+    assert b"as .pdf" not in page
+    read_payload.assert_not_called()
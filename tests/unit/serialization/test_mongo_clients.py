@@ -0,0 +1,97 @@
+import mock
+import pytest
+from mock import patch
+from pymongo.read_preferences import Primary, SecondaryPreferred
+
+from notebooker.serialization import mongo_clients
+from notebooker.serialization.mongo_clients import (
+    PoolStatsListener,
+    close_mongo_clients,
+    get_mongo_client,
+    get_read_preference,
+)
+from notebooker.serializers.pymongo import PyMongoResultSerializer
+
+
+@pytest.fixture(autouse=True)
+def no_clients():
+    close_mongo_clients()
+    yield
+    close_mongo_clients()
+
+
+@patch("notebooker.serialization.mongo_clients.MongoClient")
+def test_clients_are_shared_per_settings(mongo_client):
+    mongo_client.side_effect = lambda *args, **kwargs: mock.Mock()
+    client = get_mongo_client("host", username="user", maxPoolSize=10, socketTimeoutMS=None)
+    assert get_mongo_client("host", username="user", maxPoolSize=10) is client
+    assert get_mongo_client("host", username="user", maxPoolSize=20) is not client
+    assert get_mongo_client("other_host", username="user", maxPoolSize=10) is not client
+    assert mongo_client.call_count == 3
+    mongo_client.assert_any_call("host", username="user", password=None, event_listeners=[mock.ANY], maxPoolSize=10)
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo_clients.MongoClient")
+def test_serializers_share_a_client(mongo_client, gridfs):
+    first = PyMongoResultSerializer(mongo_host="host", mongo_max_pool_size=5)
+    second = PyMongoResultSerializer(mongo_host="host", mongo_max_pool_size=5)
+    assert first.get_mongo_database() is second.get_mongo_database()
+    mongo_client.assert_called_once_with(
+        "host", username=None, password=None, event_listeners=[mock.ANY], maxPoolSize=5
+    )
+
+
+def test_pool_size_is_passed_to_subprocesses_as_a_string():
+    with patch("notebooker.serialization.mongo_clients.MongoClient"), patch("notebooker.serialization.mongo.gridfs"):
+        serializer = PyMongoResultSerializer(mongo_host="host", mongo_max_pool_size=5)
+    args = serializer.serializer_args_to_cmdline_args()
+    assert args[args.index("--mongo-max-pool-size") + 1] == "5"
+
+
+def test_get_read_preference():
+    assert get_read_preference(None) is None
+    assert get_read_preference("primary") == Primary()
+    assert get_read_preference("secondaryPreferred", 120) == SecondaryPreferred(max_staleness=120)
+    with pytest.raises(ValueError):
+        get_read_preference("primary", 120)
+    with pytest.raises(ValueError):
+        get_read_preference(None, 120)
+    with pytest.raises(ValueError):
+        get_read_preference("secondaries")
+
+
+def test_read_preferences_are_passed_to_subprocesses():
+    with patch("notebooker.serialization.mongo_clients.MongoClient"), patch("notebooker.serialization.mongo.gridfs"):
+        serializer = PyMongoResultSerializer(
+            mongo_host="host",
+            mongo_listing_read_preference="secondaryPreferred",
+            mongo_listing_max_staleness_seconds=120,
+            mongo_result_read_preference="nearest",
+        )
+    serializer.library.with_options.assert_any_call(read_preference=SecondaryPreferred(max_staleness=120))
+    args = serializer.serializer_args_to_cmdline_args()
+    assert args[args.index("--mongo-listing-read-preference") :][:4] == [
+        "--mongo-listing-read-preference",
+        "secondaryPreferred",
+        "--mongo-listing-max-staleness-seconds",
+        "120",
+    ]
+    assert args[args.index("--mongo-result-read-preference") + 1] == "nearest"
+    assert "--mongo-result-max-staleness-seconds" not in args
+
+
+@patch.object(mongo_clients, "MONGO_POOL_CHECKED_OUT")
+@patch.object(mongo_clients, "MONGO_POOL_CONNECTIONS")
+def test_pool_stats_listener(connections, checked_out):
+    listener = PoolStatsListener()
+    event = mock.Mock(address=("host", 27017))
+    listener.connection_created(event)
+    connections.labels.assert_called_with("host:27017")
+    connections.labels.return_value.inc.assert_called_once_with()
+    listener.connection_checked_out(event)
+    listener.connection_checked_in(event)
+    checked_out.labels.return_value.inc.assert_called_once_with()
+    checked_out.labels.return_value.dec.assert_called_once_with()
+    listener.connection_closed(event)
+    connections.labels.return_value.dec.assert_called_once_with()
@@ -1,5 +1,20 @@
+import datetime
+import hashlib
+import zlib
+from collections import defaultdict
+
+import freezegun
+import mock
+import pytest
+from gridfs import NoFile
 from mock import patch
+from pymongo import UpdateOne
+from bson import SON
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from pymongo.read_preferences import Nearest, Secondary
 
+from notebooker.constants import NotebookResultComplete
+from notebooker.serialization.documents import decode_page_token, encode_page_token, overrides_hash
 from notebooker.serialization.mongo import JobStatus, MongoResultSerializer
 
 
@@ -10,7 +25,7 @@ def test_mongo_filter():
 
 def test_mongo_filter_overrides():
     mongo_filter = MongoResultSerializer._mongo_filter("report", overrides={"b": 1, "a": 2})
-    assert mongo_filter == {"report_name": "report", "overrides.a": 2, "overrides.b": 1}
+    assert mongo_filter == {"report_name": "report", "overrides_hash": overrides_hash({"a": 2, "b": 1})}
 
 
 def test_mongo_filter_status():
@@ -23,10 +38,29 @@ def test_mongo_filter_status():
 @patch("notebooker.serialization.mongo.MongoResultSerializer._get_all_job_ids")
 def test_get_latest_job_id_for_name_and_params(_get_all_job_ids, conn, gridfs):
     serializer = MongoResultSerializer()
+    serializer.latest_pointers.find_one.return_value = None
     serializer.get_latest_job_id_for_name_and_params("report_name", None)
     _get_all_job_ids.assert_called_once_with("report_name", None, as_of=None, limit=1)
 
 
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+@patch("notebooker.serialization.mongo.MongoResultSerializer._get_all_job_ids")
+def test_get_latest_job_id_for_name_and_params_reads_pointer(_get_all_job_ids, conn, gridfs):
+    conn.return_value = defaultdict(mock.MagicMock)
+    serializer = MongoResultSerializer()
+    serializer.latest_pointers.find_one.return_value = {"latest_successful": {"job_id": "abc"}}
+    assert serializer.get_latest_successful_job_id_for_name_and_params("report_name", {"b": 1, "a": 2}) == "abc"
+    serializer.latest_pointers.find_one.assert_called_once_with(
+        {"_id": {"report_name": "report_name", "overrides_hash": overrides_hash({"a": 2, "b": 1})}},
+        {"latest_successful": 1},
+    )
+    _get_all_job_ids.assert_not_called()
+    as_of = datetime.datetime(2020, 1, 1)
+    serializer.get_latest_successful_job_id_for_name_and_params("report_name", None, as_of=as_of)
+    _get_all_job_ids.assert_called_once_with("report_name", None, JobStatus.DONE, as_of, limit=1)
+
+
 @patch("notebooker.serialization.mongo.gridfs")
 @patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
 def test__get_all_job_ids(conn, gridfs):
@@ -36,3 +70,729 @@ def test__get_all_job_ids(conn, gridfs):
         {"status": {"$ne": JobStatus.DELETED.value}, "report_name": "report_name"},
         {"_id": 0, "job_id": 1, "report_name": 1},
     )
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_save_raw_to_db_is_a_single_guarded_replace(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.library.reset_mock()
+    serializer.library.replace_one.return_value.matched_count = 1
+    assert serializer._save_raw_to_db({"job_id": "abc", "status": JobStatus.DONE.value})
+    (mongo_filter, _), kwargs = serializer.library.replace_one.call_args
+    assert mongo_filter["job_id"] == "abc"
+    assert set(mongo_filter["status"]["$in"]) == {
+        JobStatus.SUBMITTED.value,
+        JobStatus.PENDING.value,
+        JobStatus.TIMEOUT.value,
+    }
+    assert kwargs == {}
+    serializer.library.update_one.assert_not_called()
+    serializer.library.find_one.assert_not_called()
+    serializer.library.create_index.assert_not_called()
+    serializer.library.create_indexes.assert_not_called()
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_save_raw_to_db_only_inserts_results_which_dont_exist(conn, gridfs, caplog):
+    serializer = MongoResultSerializer()
+    serializer.library.replace_one.return_value.matched_count = 0
+    serializer.library.update_one.return_value.upserted_id = "new"
+    assert serializer._save_raw_to_db({"job_id": "abc", "status": JobStatus.TIMEOUT.value})
+    serializer.library.update_one.assert_called_once_with({"job_id": "abc"}, {"$setOnInsert": mock.ANY}, upsert=True)
+    # The job has finished, so a late timeout can't replace its result.
+    serializer.library.update_one.return_value.upserted_id = None
+    serializer.library.find_one.return_value = {"status": JobStatus.DONE.value}
+    assert not serializer._save_raw_to_db({"job_id": "abc", "status": JobStatus.TIMEOUT.value})
+    assert "can't move from" in caplog.text
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_rejected_save_check_result_leaves_the_existing_result_alone(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.library.find_one.return_value = {"status": JobStatus.DONE.value}
+    result = NotebookResultComplete(
+        job_id="abc",
+        report_name="report",
+        job_start_time=datetime.datetime(2020, 1, 1),
+        job_finish_time=datetime.datetime(2020, 1, 1, 1),
+        raw_html="<html/>",
+        raw_html_resources={"outputs": {"a.png": b"a"}},
+        pdf=b"pdf",
+    )
+    serializer.save_check_result(result)
+    serializer.payload_library.replace_one.assert_not_called()
+    serializer.library.replace_one.assert_not_called()
+    serializer.blob_refs.bulk_write.assert_not_called()
+    serializer.result_data_store.put.assert_not_called()
+
+
+@patch("notebooker.serialization.mongo._INDEXED_COLLECTIONS", new_callable=set)
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_ensure_indexes_once_per_collection(conn, gridfs, _):
+    MongoResultSerializer()
+    MongoResultSerializer()
+    # The unique job_id index is created on its own, since older collections may not be able to have it yet.
+    assert conn.return_value.__getitem__.return_value.create_indexes.call_count == 2
+    MongoResultSerializer().ensure_indexes(force=True)
+    assert conn.return_value.__getitem__.return_value.create_indexes.call_count == 4
+
+
+@patch("notebooker.serialization.mongo._INDEXED_COLLECTIONS", new_callable=set)
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_ensure_indexes_carries_on_without_a_unique_job_id_index(conn, gridfs, _, caplog):
+    library = conn.return_value.__getitem__.return_value
+    library.create_indexes.side_effect = [OperationFailure("duplicate key"), None]
+    MongoResultSerializer()
+    (job_id_indexes,), (other_indexes,) = [call[0] for call in library.create_indexes.call_args_list]
+    assert [index.document for index in job_id_indexes] == [
+        {"key": SON([("job_id", 1)]), "name": "job_id_1", "unique": True, "background": True}
+    ]
+    assert len(other_indexes) == len(MongoResultSerializer._result_indexes())
+    assert "remove-duplicate-results" in caplog.text
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_remove_duplicate_results_keeps_the_latest(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.library.aggregate.return_value = [
+        {
+            "_id": "abc",
+            "results": [
+                {"_id": 1, "update_time": datetime.datetime(2020, 1, 2)},
+                {"_id": 2, "update_time": datetime.datetime(2020, 1, 3)},
+                {"_id": 3, "update_time": datetime.datetime(2020, 1, 1)},
+            ],
+        }
+    ]
+    serializer.library.delete_many.return_value.deleted_count = 2
+    serializer.library.list_indexes.return_value = [
+        {"name": "_id_", "key": SON([("_id", 1)])},
+        {"name": "job_id_1", "key": SON([("job_id", 1)])},
+    ]
+    serializer.library.reset_mock()
+    assert serializer.remove_duplicate_results() == 2
+    serializer.library.delete_many.assert_called_once_with({"_id": {"$in": [3, 1]}})
+    serializer.library.drop_index.assert_called_once_with("job_id_1")
+    (indexes,), _ = serializer.library.create_indexes.call_args
+    assert indexes[0].document["unique"]
+
+
+@freezegun.freeze_time(datetime.datetime(2020, 1, 1))
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_update_check_status_is_a_guarded_set(conn, gridfs):
+    conn.return_value = defaultdict(mock.MagicMock)
+    serializer = MongoResultSerializer()
+    serializer.library.update_one.return_value.matched_count = 1
+    serializer.library.find_one.return_value = None
+    assert serializer.update_check_status("abc", JobStatus.DONE, raw_html="<html/>")
+    serializer.library.update_one.assert_called_once_with(
+        {"job_id": "abc", "status": {"$in": mock.ANY}},
+        {
+            "$set": {
+                "raw_html": "<html/>",
+                "status": JobStatus.DONE.value,
+                "update_time": datetime.datetime(2020, 1, 1),
+            }
+        },
+    )
+    allowed = serializer.library.update_one.call_args[0][0]["status"]["$in"]
+    assert sorted(allowed) == sorted([JobStatus.SUBMITTED.value, JobStatus.PENDING.value, JobStatus.TIMEOUT.value])
+    # The only read is of the fields which the latest_pointers need.
+    serializer.library.find_one.assert_called_once_with({"job_id": "abc"}, mock.ANY)
+
+
+@freezegun.freeze_time(datetime.datetime(2020, 1, 1))
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_save_advances_latest_pointers(conn, gridfs):
+    conn.return_value = defaultdict(mock.MagicMock)
+    serializer = MongoResultSerializer()
+    serializer.latest_pointers.update_one.side_effect = [None, DuplicateKeyError("newer"), None, None]
+    serializer._save_raw_to_db({"job_id": "abc", "report_name": "report", "overrides": {}, "status": "Checks done!"})
+    pointer_ids = [call[0][0]["_id"] for call in serializer.latest_pointers.update_one.call_args_list]
+    assert pointer_ids == [
+        {"report_name": "report", "overrides_hash": overrides_hash({})},
+        {"report_name": "report", "overrides_hash": overrides_hash({})},
+        {"report_name": "report", "overrides_hash": "*"},
+        {"report_name": "report", "overrides_hash": "*"},
+    ]
+    assert serializer.latest_pointers.update_one.call_args_list[-1] == mock.call(
+        {
+            "_id": {"report_name": "report", "overrides_hash": "*"},
+            "$or": [
+                {"latest_successful.update_time": {"$lte": datetime.datetime(2020, 1, 1)}},
+                {"latest_successful": {"$exists": False}},
+            ],
+        },
+        {"$set": {"latest_successful": {"job_id": "abc", "update_time": datetime.datetime(2020, 1, 1)}}},
+        upsert=True,
+    )
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_delete_repoints_latest_pointers(conn, gridfs):
+    conn.return_value = defaultdict(mock.MagicMock)
+    serializer = MongoResultSerializer()
+    serializer.library.update_one.return_value.matched_count = 1
+    serializer.library.find_one.side_effect = [
+        {"job_id": "abc", "report_name": "report", "overrides_hash": "h", "status": JobStatus.DELETED.value},
+        {"job_id": "older", "update_time": datetime.datetime(2020, 1, 1)},
+        None,
+        None,
+        None,
+    ]
+    serializer.delete_result("abc")
+    assert serializer.latest_pointers.update_one.call_args_list == [
+        mock.call(
+            {"_id": {"report_name": "report", "overrides_hash": "h"}, "latest.job_id": "abc"},
+            {"$set": {"latest": {"job_id": "older", "update_time": datetime.datetime(2020, 1, 1)}}},
+        ),
+        mock.call(
+            {"_id": {"report_name": "report", "overrides_hash": "h"}, "latest_successful.job_id": "abc"},
+            {"$unset": {"latest_successful": ""}},
+        ),
+        mock.call(
+            {"_id": {"report_name": "report", "overrides_hash": "*"}, "latest.job_id": "abc"},
+            {"$unset": {"latest": ""}},
+        ),
+        mock.call(
+            {"_id": {"report_name": "report", "overrides_hash": "*"}, "latest_successful.job_id": "abc"},
+            {"$unset": {"latest_successful": ""}},
+        ),
+    ]
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_update_check_status_refuses_late_timeout(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.library.update_one.return_value.matched_count = 0
+    serializer.library.find_one.return_value = {"status": JobStatus.DONE.value}
+    assert not serializer.update_check_status("abc", JobStatus.TIMEOUT)
+    assert JobStatus.DONE.value not in serializer.library.update_one.call_args[0][0]["status"]["$in"]
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_update_check_statuses_is_one_round_trip(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.library.update_many.return_value.matched_count = 2
+    assert serializer.update_check_statuses(["a", "b"], JobStatus.CANCELLED, error_info="stopped") == 2
+    serializer.library.update_many.assert_called_once_with(
+        {"job_id": {"$in": ["a", "b"]}, "status": {"$in": mock.ANY}},
+        {"$set": {"error_info": "stopped", "status": JobStatus.CANCELLED.value, "update_time": mock.ANY}},
+    )
+    serializer.library.update_one.assert_not_called()
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_update_stdout_appends_sequenced_chunks(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.stdout_library.find_one.return_value = {"seq": 4, "end_line": 10}
+    serializer.update_stdout("abc", ["a\n", "b\n"])
+    serializer.update_stdout("abc", ["c\n"])
+    serializer.stdout_library.find_one.assert_called_once()
+    serializer.stdout_library.insert_one.assert_has_calls(
+        [
+            mock.call({"job_id": "abc", "seq": 5, "first_line": 10, "end_line": 12, "lines": ["a\n", "b\n"]}),
+            mock.call({"job_id": "abc", "seq": 6, "first_line": 12, "end_line": 13, "lines": ["c\n"]}),
+        ]
+    )
+    serializer.library.update_one.assert_not_called()
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_update_stdout_catches_up_with_other_writers(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.stdout_library.find_one.side_effect = [None, {"seq": 0, "end_line": 3}]
+    serializer.stdout_library.insert_one.side_effect = [DuplicateKeyError("taken"), None]
+    serializer.update_stdout("abc", ["a\n"])
+    assert serializer.stdout_library.insert_one.call_args[0][0]["seq"] == 1
+    assert serializer.stdout_library.insert_one.call_args[0][0]["first_line"] == 3
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_get_stdout_after_offset(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.stdout_library.find.return_value.sort.return_value = [
+        {"first_line": 2, "lines": ["c", "d", "e"]},
+        {"first_line": 5, "lines": ["f"]},
+    ]
+    assert serializer.get_stdout("abc", offset=3) == ["d", "e", "f"]
+    serializer.stdout_library.find.assert_called_once_with(
+        {"job_id": "abc", "end_line": {"$gt": 3}}, {"_id": 0, "first_line": 1, "lines": 1}
+    )
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_get_stdout_from_legacy_result_document(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.stdout_library.find.return_value.sort.return_value = []
+    serializer.library.find_one.return_value = {"stdout": ["a", "b", "c"]}
+    assert serializer.get_stdout("abc", offset=1) == ["b", "c"]
+
+
+def _done_document(**kwargs):
+    doc = {
+        "job_id": "abc",
+        "report_name": "report",
+        "status": JobStatus.DONE.value,
+        "job_start_time": datetime.datetime(2020, 1, 1),
+        "job_finish_time": datetime.datetime(2020, 1, 1, 1),
+        "update_time": datetime.datetime(2020, 1, 1, 1),
+        "generate_pdf_output": True,
+        "raw_html_resources": {"outputs": ["abc/resources/a.png", "abc/resources/b.png"]},
+    }
+    doc.update(kwargs)
+    return doc
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_get_check_result_loads_payload_lazily(conn, gridfs):
+    conn.return_value = defaultdict(mock.MagicMock)
+    serializer = MongoResultSerializer()
+    serializer.library.find_one.return_value = _done_document()
+    result = serializer.get_check_result("abc")
+    serializer.library.find_one.assert_called_once_with(
+        {"job_id": "abc"}, {"_id": 0, "raw_html": 0, "raw_ipynb_json": 0}
+    )
+    serializer.result_data_store.get_last_version.assert_not_called()
+
+    serializer.payload_library.find.return_value = [{"job_id": "abc", "raw_ipynb_json": "{}"}]
+    assert result.raw_ipynb_json == "{}"
+    assert result.raw_ipynb_json == "{}"
+    serializer.payload_library.find.assert_called_once_with(
+        {"job_id": {"$in": ["abc"]}}, {"_id": 0, "job_id": 1, "payload_codec": 1, "raw_ipynb_json": 1}
+    )
+    serializer.library.find.assert_not_called()
+    serializer.result_data_store.get_last_version.assert_not_called()
+
+    serializer.result_data_store.get_last_version.return_value.read.return_value = b"png"
+    assert "abc/resources/b.png" in result.raw_html_resources["outputs"]
+    assert result.raw_html_resources["outputs"]["abc/resources/b.png"] == b"png"
+    serializer.result_data_store.get_last_version.assert_called_once_with("abc/resources/b.png")
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_get_check_result_without_pdf_output(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.library.find_one.return_value = _done_document(generate_pdf_output=False)
+    assert serializer.get_check_result("abc").pdf == ""
+    serializer.result_data_store.get_last_version.assert_not_called()
+
+
+def _grid_out(filename, data):
+    grid_out = mock.MagicMock(filename=filename)
+    grid_out.read.return_value = data
+    return grid_out
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_get_result_resources_reads_tagged_files_in_one_query(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.library.find_one.return_value = _done_document()
+    serializer.result_data_store.find.return_value.sort.return_value = [
+        _grid_out("abc/resources/a.png", b"old"),
+        _grid_out("abc/resources/a.png", b"new"),
+        _grid_out("abc/resources/unwanted.png", b"nope"),
+    ]
+    serializer.result_data_store.get_last_version.return_value.read.return_value = b"legacy"
+    resources = serializer.get_result_resources("abc", ["abc/resources/a.png", "abc/resources/b.png"])
+    assert resources == {"abc/resources/a.png": b"new", "abc/resources/b.png": b"legacy"}
+    serializer.result_data_store.find.assert_called_once_with({"metadata.job_id": "abc"})
+    serializer.result_data_store.get_last_version.assert_called_once_with("abc/resources/b.png")
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_lazy_outputs_are_loaded_in_bulk(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.library.find_one.return_value = _done_document()
+    serializer.result_data_store.find.return_value.sort.return_value = [
+        _grid_out("abc/resources/a.png", b"a"),
+        _grid_out("abc/resources/b.png", b"b"),
+    ]
+    outputs = serializer.get_check_result("abc").raw_html_resources["outputs"]
+    assert dict(outputs.items()) == {"abc/resources/a.png": b"a", "abc/resources/b.png": b"b"}
+    assert outputs["abc/resources/a.png"] == b"a"
+    serializer.result_data_store.find.assert_called_once()
+    serializer.result_data_store.get_last_version.assert_not_called()
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_save_check_result_tags_pdf_with_job_id(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.library.find_one.return_value = None
+    result = NotebookResultComplete(
+        job_id="abc",
+        report_name="report",
+        job_start_time=datetime.datetime(2020, 1, 1),
+        job_finish_time=datetime.datetime(2020, 1, 1, 1),
+        pdf=b"pdf",
+    )
+    serializer.save_check_result(result)
+    serializer.result_data_store.put.assert_called_once_with(
+        b"pdf", filename="abc.pdf", encoding="utf-8", metadata={"job_id": "abc", "result_collection": "NOTEBOOK_OUTPUT"}
+    )
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_tag_result_resources_with_job_ids(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.result_data_files.find.return_value = [
+        {"_id": 1, "filename": "abc/resources/a.png"},
+        {"_id": 2, "filename": "def.pdf"},
+        {"_id": 3, "filename": "mystery"},
+    ]
+    serializer.result_data_files.bulk_write.return_value.modified_count = 1
+    assert serializer.tag_result_resources_with_job_ids(batch_size=1) == 2
+    serializer.result_data_files.bulk_write.assert_has_calls(
+        [
+            mock.call([UpdateOne({"_id": 1}, {"$set": {"metadata.job_id": "abc"}})], ordered=False),
+            mock.call([UpdateOne({"_id": 2}, {"$set": {"metadata.job_id": "def"}})], ordered=False),
+        ]
+    )
+
+
+A_HASH = hashlib.sha256(b"a").hexdigest()
+LOGO_HASH = hashlib.sha256(b"logo").hexdigest()
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_save_check_result_stores_outputs_once_by_content(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.library.find_one.return_value = None
+    # Only the first blob is new; the logo is already stored for another job.
+    serializer.blob_refs.bulk_write.return_value.upserted_ids = {0: A_HASH}
+    serializer.blob_refs.find.return_value = []
+    result = NotebookResultComplete(
+        job_id="abc",
+        report_name="report",
+        job_start_time=datetime.datetime(2020, 1, 1),
+        job_finish_time=datetime.datetime(2020, 1, 1, 1),
+        raw_html_resources={"outputs": {"abc/resources/a.png": b"a", "abc/resources/logo.png": b"logo"}},
+        generate_pdf_output=False,
+    )
+    serializer.save_check_result(result)
+
+    saved = serializer.library.replace_one.call_args[0][1]
+    assert saved["raw_html_resources"] == {
+        "outputs": ["abc/resources/a.png", "abc/resources/logo.png"],
+        "output_hashes": [A_HASH, LOGO_HASH],
+    }
+    serializer.blob_refs.bulk_write.assert_called_once_with(
+        [
+            UpdateOne(
+                {"_id": A_HASH}, {"$inc": {"refcount": 1}, "$setOnInsert": {"size": 1, "pending": True}}, upsert=True
+            ),
+            UpdateOne(
+                {"_id": LOGO_HASH},
+                {"$inc": {"refcount": 1}, "$setOnInsert": {"size": 4, "pending": True}},
+                upsert=True,
+            ),
+        ]
+    )
+    # The logo's ref isn't pending, so its blob has already been written.
+    serializer.blob_refs.find.assert_called_once_with({"_id": {"$in": [LOGO_HASH]}, "pending": True}, {"_id": 1})
+    serializer.result_data_store.put.assert_called_once_with(
+        b"a", filename="sha256:" + A_HASH, encoding="utf-8", metadata={"sha256": A_HASH}
+    )
+    assert serializer.blob_refs.update_one.call_args == mock.call({"_id": A_HASH}, {"$unset": {"pending": ""}})
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_store_blobs_writes_pending_blobs_and_only_drops_its_own_ref_on_failure(conn, gridfs):
+    serializer = MongoResultSerializer()
+    # Another result took the ref on the logo first, but hasn't written it (or failed to).
+    serializer.blob_refs.bulk_write.return_value.upserted_ids = {}
+    serializer.blob_refs.find.return_value = [{"_id": LOGO_HASH}]
+    serializer._store_blobs({LOGO_HASH: b"logo"})
+    serializer.result_data_store.put.assert_called_once_with(
+        b"logo", filename="sha256:" + LOGO_HASH, encoding="utf-8", metadata={"sha256": LOGO_HASH}
+    )
+    serializer.blob_refs.update_one.assert_called_once_with({"_id": LOGO_HASH}, {"$unset": {"pending": ""}})
+
+    serializer.blob_refs.reset_mock()
+    serializer.result_data_store.put.side_effect = IOError("GridFS is down")
+    with pytest.raises(IOError):
+        serializer._store_blobs({LOGO_HASH: b"logo"})
+    serializer.blob_refs.update_one.assert_called_once_with({"_id": LOGO_HASH}, {"$inc": {"refcount": -1}})
+    serializer.blob_refs.delete_one.assert_called_once_with(
+        {"_id": LOGO_HASH, "refcount": {"$lte": 0}, "pending": True}
+    )
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_get_result_resources_reads_deduplicated_blobs(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.library.find_one.return_value = {
+        "raw_html_resources": {
+            "outputs": ["abc/resources/a.png", "abc/resources/also_a.png"],
+            "output_hashes": [A_HASH, A_HASH],
+        }
+    }
+    serializer.result_data_store.find.return_value = [_grid_out("sha256:" + A_HASH, b"a")]
+    resources = serializer.get_result_resources("abc", ["abc/resources/a.png", "abc/resources/also_a.png"])
+    assert resources == {"abc/resources/a.png": b"a", "abc/resources/also_a.png": b"a"}
+    serializer.result_data_store.find.assert_called_once_with({"filename": {"$in": ["sha256:" + A_HASH]}})
+    serializer.result_data_store.get_last_version.assert_not_called()
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_release_blobs_deletes_unreferenced_blobs(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.blob_refs.find_one_and_update.side_effect = [{"refcount": 0}, {"refcount": 3}]
+    serializer.blob_refs.delete_one.return_value.deleted_count = 1
+    serializer.result_data_store.find.return_value = [mock.Mock(_id="file_id")]
+    serializer._release_blobs(["unused", "unused"])
+    serializer._release_blobs(["shared"])
+    serializer.blob_refs.delete_one.assert_called_once_with({"_id": "unused", "refcount": {"$lte": 0}})
+    serializer.result_data_store.delete.assert_called_once_with("file_id")
+
+
+@patch("notebooker.serialization.mongo.OUTPUT_BLOB_DEDUP_RATIO")
+@patch("notebooker.serialization.mongo.OUTPUT_BLOB_BYTES_SAVED")
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_refresh_blob_metrics(conn, gridfs, bytes_saved, dedup_ratio):
+    serializer = MongoResultSerializer()
+    serializer.blob_refs.aggregate.return_value = iter(
+        [{"_id": None, "n_blobs": 2, "stored_bytes": 100, "referenced_bytes": 250}]
+    )
+    assert serializer.refresh_blob_metrics() == {"n_blobs": 2, "stored_bytes": 100, "referenced_bytes": 250}
+    bytes_saved.set.assert_called_once_with(150)
+    dedup_ratio.set.assert_called_once_with(2.5)
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_save_check_result_compresses_payload(conn, gridfs):
+    conn.return_value = defaultdict(mock.MagicMock)
+    serializer = MongoResultSerializer(payload_codec="zlib")
+    serializer.library.find_one.return_value = None
+    result = NotebookResultComplete(
+        job_id="abc",
+        report_name="report",
+        job_start_time=datetime.datetime(2020, 1, 1),
+        job_finish_time=datetime.datetime(2020, 1, 1, 1),
+        raw_html="<html/>",
+        raw_ipynb_json="{}",
+        generate_pdf_output=False,
+    )
+    serializer.save_check_result(result)
+    serializer.payload_library.replace_one.assert_called_once_with(
+        {"job_id": "abc"},
+        {
+            "job_id": "abc",
+            "payload_codec": "zlib",
+            "payload_bytes": len(zlib.compress(b"<html/>")) + len(zlib.compress(b"{}")),
+            "raw_html": zlib.compress(b"<html/>"),
+            "raw_ipynb_json": zlib.compress(b"{}"),
+        },
+        upsert=True,
+    )
+    saved = serializer.library.replace_one.call_args[0][1]
+    assert "raw_html" not in saved
+    assert "raw_ipynb_json" not in saved
+
+
+@pytest.mark.parametrize(
+    "document", [{"raw_html": "<html/>"}, {"raw_html": zlib.compress(b"<html/>"), "payload_codec": "zlib"}]
+)
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_get_result_payload_reads_compressed_and_legacy_documents(conn, gridfs, document):
+    serializer = MongoResultSerializer()
+    serializer.payload_library.find.return_value = [dict(document, job_id="abc")]
+    assert serializer.get_result_payload("abc", "raw_html") == "<html/>"
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_get_result_payload_falls_back_to_result_document(conn, gridfs):
+    conn.return_value = defaultdict(mock.MagicMock)
+    serializer = MongoResultSerializer()
+    serializer.payload_library.find.return_value = []
+    serializer.library.find.return_value = [{"job_id": "abc", "raw_html": "<html/>"}]
+    assert serializer.get_result_payload("abc", "raw_html") == "<html/>"
+    serializer.library.find.assert_called_once_with(
+        {"job_id": {"$in": ["abc"]}}, {"_id": 0, "job_id": 1, "payload_codec": 1, "raw_html": 1}
+    )
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_move_payloads_to_payload_collection(conn, gridfs):
+    conn.return_value = defaultdict(mock.MagicMock)
+    serializer = MongoResultSerializer(payload_codec="zlib")
+    serializer.library.find.return_value.limit.side_effect = [
+        [{"job_id": "abc", "raw_html": "<html/>", "raw_ipynb_json": "{}"}],
+        [],
+    ]
+    assert serializer.move_payloads_to_payload_collection() == 1
+    payload_doc = {
+        "raw_html": zlib.compress(b"<html/>"),
+        "raw_ipynb_json": zlib.compress(b"{}"),
+        "job_id": "abc",
+        "payload_codec": "zlib",
+        "payload_bytes": len(zlib.compress(b"<html/>")) + len(zlib.compress(b"{}")),
+    }
+    serializer.payload_library.bulk_write.assert_called_once_with(
+        [UpdateOne({"job_id": "abc"}, {"$setOnInsert": payload_doc}, upsert=True)], ordered=False
+    )
+    serializer.library.bulk_write.assert_called_once_with(
+        [UpdateOne({"job_id": "abc"}, {"$unset": {"raw_html": "", "raw_ipynb_json": "", "payload_codec": ""}})],
+        ordered=False,
+    )
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_n_all_results(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.library.estimated_document_count.return_value = 10
+    serializer.library.count_documents.return_value = 3
+    assert serializer.n_all_results() == 7
+    serializer.library.count_documents.assert_called_once_with({"status": JobStatus.DELETED.value})
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_get_result_counts(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.library.aggregate.return_value = [
+        {"_id": {"status": JobStatus.DONE.value, "report_name": "a"}, "count": 3},
+        {"_id": {"status": JobStatus.ERROR.value, "report_name": "a"}, "count": 1},
+        {"_id": {"status": JobStatus.DONE.value, "report_name": "b"}, "count": 2},
+    ]
+    assert serializer.get_result_counts() == {
+        "total": 6,
+        "by_status": {JobStatus.DONE.value: 5, JobStatus.ERROR.value: 1},
+        "by_report": {"a": 4, "b": 2},
+    }
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_listings_and_completed_results_use_their_read_preferences(conn, gridfs):
+    conn.return_value.__getitem__.side_effect = defaultdict(mock.MagicMock).__getitem__
+    gridfs.GridFS.side_effect = lambda *args: mock.MagicMock()
+    serializer = MongoResultSerializer(listing_read_preference=Secondary(), result_read_preference=Nearest())
+    serializer.library.with_options.assert_called_once_with(read_preference=Secondary())
+    serializer.payload_library.with_options.assert_called_once_with(read_preference=Nearest())
+    conn.return_value.with_options.assert_called_once_with(read_preference=Nearest())
+
+    serializer.listing_library.find.return_value.sort.return_value.limit.return_value = []
+    serializer.get_results_page()
+    serializer.library.find.assert_not_called()
+
+    # A result which hasn't reached the secondaries yet is read from the primary.
+    serializer.result_payload_library.find.return_value = []
+    serializer.payload_library.find.return_value = [{"job_id": "abc", "raw_html": "<html/>"}]
+    assert serializer.get_result_payload("abc", "raw_html") == "<html/>"
+    serializer.library.find.assert_not_called()
+    serializer.result_data_reader.get_last_version.side_effect = NoFile
+    serializer.result_data_store.get_last_version.return_value.read.return_value = b"%PDF"
+    assert serializer.get_result_payload("abc", "pdf") == b"%PDF"
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_get_results_page(conn, gridfs):
+    serializer = MongoResultSerializer()
+    update_time = datetime.datetime(2020, 1, 1)
+    docs = [
+        {
+            "job_id": job_id,
+            "report_name": "report",
+            "status": JobStatus.PENDING.value,
+            "job_start_time": update_time,
+            "update_time": update_time,
+        }
+        for job_id in ("c", "b", "a")
+    ]
+    serializer.library.find.return_value.sort.return_value.limit.return_value = docs
+    last_token = encode_page_token(datetime.datetime(2020, 1, 2), "z")
+    results, next_page_token = serializer.get_results_page(
+        page_size=2, page_token=last_token, report_name="report", status=JobStatus.PENDING
+    )
+    assert [result.job_id for result in results] == ["c", "b"]
+    assert decode_page_token(next_page_token) == (update_time, "b")
+    serializer.library.find.assert_called_once_with(
+        {
+            "$and": [
+                {"status": JobStatus.PENDING.value, "report_name": "report"},
+                {
+                    "$or": [
+                        {"update_time": {"$lt": datetime.datetime(2020, 1, 2)}},
+                        {"update_time": datetime.datetime(2020, 1, 2), "job_id": {"$lt": "z"}},
+                    ]
+                },
+            ]
+        },
+        mock.ANY,
+    )
+    serializer.library.find.return_value.sort.return_value.limit.assert_called_once_with(3)
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_save_raw_to_db_hashes_overrides(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer._save_raw_to_db({"job_id": "abc", "overrides": {"a": 1}, "status": JobStatus.PENDING.value})
+    saved = serializer.library.replace_one.call_args[0][1]
+    assert saved["overrides_hash"] == overrides_hash({"a": 1})
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_backfill_overrides_hashes(conn, gridfs):
+    serializer = MongoResultSerializer()
+    serializer.library.find.return_value.limit.side_effect = [[{"_id": 1, "overrides": {"a": 1}}, {"_id": 2}], []]
+    assert serializer.backfill_overrides_hashes(batch_size=2) == 2
+    serializer.library.find.assert_called_with({"overrides_hash": {"$exists": False}}, {"_id": 1, "overrides": 1})
+    serializer.library.bulk_write.assert_called_once_with(
+        [
+            UpdateOne({"_id": 1}, {"$set": {"overrides_hash": overrides_hash({"a": 1})}}),
+            UpdateOne({"_id": 2}, {"$set": {"overrides_hash": overrides_hash({})}}),
+        ],
+        ordered=False,
+    )
+
+
+@patch("notebooker.serialization.mongo.gridfs")
+@patch("notebooker.serialization.mongo.MongoResultSerializer.get_mongo_database")
+def test_delete_orphaned_files_skips_blobs_referenced_again(conn, gridfs):
+    conn.return_value = defaultdict(mock.MagicMock)
+    serializer = MongoResultSerializer()
+    serializer.blob_refs.find_one_and_delete.side_effect = [None, None, {"_id": "dead", "refcount": 0}]
+    serializer.blob_refs.find_one.side_effect = [{"_id": "live", "refcount": 1}, None]
+    grid_files = [
+        {"_id": 1, "metadata": {"sha256": "live"}},
+        {"_id": 2, "metadata": {"sha256": "unreferenced"}},
+        {"_id": 3, "metadata": {"sha256": "dead"}},
+        {"_id": 4, "metadata": {"job_id": "gone"}},
+    ]
+    assert serializer.delete_orphaned_files(grid_files) == 3
+    assert serializer.result_data_store.delete.call_args_list == [mock.call(2), mock.call(3), mock.call(4)]
@@ -0,0 +1,190 @@
+"""
+Behaviour which every result serializer must share. These run against the serializers which don't need a mongod, and
+tests/integration/test_serializer_conformance.py runs them against the mongo implementations.
+"""
+
+import datetime
+import os
+
+import freezegun
+import pytest
+
+from notebooker.constants import JobStatus, NotebookResultComplete, NotebookResultError, NotebookResultPending
+from notebooker.serialization.serialization import get_serializer_from_cls
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def serializer(request, tmp_path):
+    if request.param == "sqlite":
+        serializer = get_serializer_from_cls(
+            "SqliteResultSerializer", sqlite_path=os.path.join(tmp_path, "results.sqlite")
+        )
+    else:
+        serializer = get_serializer_from_cls("InMemoryResultSerializer", memory_store_name=str(tmp_path))
+    yield serializer
+    serializer.close()
+
+
+def _complete(job_id, overrides=None, report_name="report"):
+    return NotebookResultComplete(
+        job_id=job_id,
+        report_name=report_name,
+        job_start_time=datetime.datetime(2020, 1, 1),
+        job_finish_time=datetime.datetime(2020, 1, 1, 0, 5),
+        raw_html="<html>{}</html>".format(job_id),
+        raw_html_resources={"outputs": {"{}/plot.png".format(job_id): b"png", "shared.png": b"shared"}},
+        raw_ipynb_json="{}",
+        pdf=b"%PDF",
+        overrides=overrides or {},
+    )
+
+
+def _assert_same_complete_result(actual, expected):
+    assert isinstance(actual, NotebookResultComplete)
+    assert actual.status == JobStatus.DONE
+    for field in ("job_id", "report_name", "raw_html", "raw_ipynb_json", "pdf", "overrides", "job_finish_time"):
+        assert getattr(actual, field) == getattr(expected, field), field
+    assert dict(actual.raw_html_resources["outputs"].items()) == expected.raw_html_resources["outputs"]
+
+
+@freezegun.freeze_time(datetime.datetime(2020, 1, 1))
+def test_stub_round_trip(serializer):
+    serializer.save_check_stub("abc", "report", overrides={"a": 1})
+    assert serializer.get_check_result("abc") == NotebookResultPending(
+        job_id="abc",
+        report_name="report",
+        report_title="report",
+        job_start_time=datetime.datetime(2020, 1, 1),
+        update_time=datetime.datetime(2020, 1, 1),
+        overrides={"a": 1},
+    )
+    assert serializer.get_check_result("missing") is None
+
+
+def test_complete_result_round_trip(serializer):
+    expected = _complete("abc")
+    serializer.save_check_result(_complete("abc"))
+    _assert_same_complete_result(serializer.get_check_result("abc"), expected)
+
+
+def test_has_pdf(serializer):
+    serializer.save_check_result(_complete("abc"))
+    without_pdf = _complete("def")
+    without_pdf.pdf = ""
+    serializer.save_check_result(without_pdf)
+    assert serializer.has_pdf("abc")
+    assert not serializer.has_pdf("def")
+    assert not serializer.has_pdf("missing")
+
+
+def test_status_transitions(serializer):
+    serializer.save_check_stub("abc", "report")
+    assert serializer.update_check_status("abc", JobStatus.CANCELLED, error_info="Stopped")
+    # A finished job can't time out.
+    assert not serializer.update_check_status("abc", JobStatus.TIMEOUT)
+    result = serializer.get_check_result("abc")
+    assert isinstance(result, NotebookResultError)
+    assert (result.status, result.error_info) == (JobStatus.CANCELLED, "Stopped")
+    serializer.delete_result("abc")
+    assert serializer.get_check_result("abc") is None
+
+    # A slow report which was timed out while it was still running keeps its result when it finishes.
+    serializer.save_check_stub("slow", "report")
+    assert serializer.update_check_status("slow", JobStatus.TIMEOUT)
+    serializer.save_check_result(_complete("slow"))
+    _assert_same_complete_result(serializer.get_check_result("slow"), _complete("slow"))
+    assert not serializer.update_check_status("slow", JobStatus.TIMEOUT)
+    serializer.save_check_stub("failing", "report")
+    assert serializer.update_check_status("failing", JobStatus.TIMEOUT)
+    serializer.save_check_result(
+        NotebookResultError(
+            job_id="failing", report_name="report", job_start_time=datetime.datetime(2020, 1, 1), error_info="Failed"
+        )
+    )
+    result = serializer.get_check_result("failing")
+    assert (result.status, result.error_info) == (JobStatus.ERROR, "Failed")
+
+
+def test_finished_results_cant_be_replaced(serializer):
+    serializer.save_check_stub("abc", "report")
+    serializer.save_check_result(_complete("abc"))
+    late = _complete("abc")
+    late.raw_html = "<html>late</html>"
+    serializer.save_check_result(late)
+    serializer.save_check_result(
+        NotebookResultError(job_id="abc", report_name="report", job_start_time=datetime.datetime(2020, 1, 1))
+    )
+    _assert_same_complete_result(serializer.get_check_result("abc"), _complete("abc"))
+
+
+def test_stdout(serializer):
+    serializer.save_check_stub("abc", "report")
+    serializer.update_stdout("abc", ["a\n", "b\n"])
+    serializer.update_stdout("abc", ["c\n"])
+    assert serializer.get_stdout("abc") == ["a\n", "b\n", "c\n"]
+    assert serializer.get_stdout("abc", offset=1) == ["b\n", "c\n"]
+
+
+def test_latest_lookups(serializer):
+    with freezegun.freeze_time(datetime.datetime(2020, 1, 1, 0, 1)):
+        serializer.save_check_result(_complete("done", overrides={"a": 1}))
+    with freezegun.freeze_time(datetime.datetime(2020, 1, 1, 0, 2)):
+        serializer.save_check_stub("pending", "report", overrides={"a": 1})
+    with freezegun.freeze_time(datetime.datetime(2020, 1, 1, 0, 3)):
+        serializer.save_check_stub("other", "report", overrides={"a": 1, "b": 2})
+
+    assert serializer.get_latest_job_id_for_name_and_params("report", {"a": 1}) == "pending"
+    assert serializer.get_latest_successful_job_id_for_name_and_params("report", {"a": 1}) == "done"
+    assert serializer.get_latest_job_id_for_name_and_params("report", None) == "other"
+    assert serializer.get_latest_successful_job_id_for_name_and_params("report", {"b": 2, "a": 1}) is None
+    as_of = datetime.datetime(2020, 1, 1, 0, 2)
+    assert serializer.get_latest_job_id_for_name_and_params("report", {"a": 1}, as_of=as_of) == "done"
+    assert serializer.get_all_job_ids_for_name_and_params("report", {"a": 1}) == ["pending", "done"]
+
+    serializer.delete_result("pending")
+    assert serializer.get_latest_job_id_for_name_and_params("report", {"a": 1}) == "done"
+
+
+def test_latest_successful_results_for_all_params(serializer):
+    for minute, (job_id, overrides) in enumerate([("a", {"x": 1, "y": 2}), ("b", {"x": 2}), ("c", {"y": 2, "x": 1})]):
+        with freezegun.freeze_time(datetime.datetime(2020, 1, 1, 0, minute)):
+            serializer.save_check_result(_complete(job_id, overrides=overrides))
+    with freezegun.freeze_time(datetime.datetime(2020, 1, 1, 0, 5)):
+        serializer.save_check_stub("d", "report", overrides={"x": 2})
+        serializer.save_check_result(_complete("e", overrides={"x": 1}, report_name="other"))
+
+    assert sorted(serializer.get_latest_successful_job_ids_for_name_all_params("report")) == ["b", "c"]
+    results = sorted(serializer.get_latest_successful_results_for_name_all_params("report"), key=lambda r: r.job_id)
+    assert [result.job_id for result in results] == ["b", "c"]
+    _assert_same_complete_result(results[1], _complete("c", overrides={"y": 2, "x": 1}))
+
+
+def test_get_all_results_filters(serializer):
+    with freezegun.freeze_time(datetime.datetime(2020, 1, 1, 0, 1)):
+        serializer.save_check_result(_complete("done"))
+    with freezegun.freeze_time(datetime.datetime(2020, 1, 1, 0, 2)):
+        serializer.save_check_stub("pending", "report")
+    with freezegun.freeze_time(datetime.datetime(2020, 1, 1, 0, 3)):
+        serializer.save_check_stub("deleted", "report")
+        serializer.delete_result("deleted")
+
+    assert [result.job_id for result in serializer.get_all_results()] == ["pending", "done"]
+    assert [result.job_id for result in serializer.get_all_results(since=datetime.datetime(2020, 1, 1, 0, 1))] == [
+        "pending"
+    ]
+    done = list(serializer.get_all_results(mongo_filter={"status": JobStatus.DONE.value}))
+    assert [result.job_id for result in done] == ["done"]
+    _assert_same_complete_result(done[0], _complete("done"))
+
+
+def test_results_page_never_lists_deleted_results(serializer):
+    serializer.save_check_stub("pending", "report")
+    serializer.save_check_stub("deleted", "report")
+    serializer.delete_result("deleted")
+
+    page, _ = serializer.get_results_page()
+    assert [result.job_id for result in page] == ["pending"]
+    page, _ = serializer.get_results_page(status=JobStatus.PENDING)
+    assert [result.job_id for result in page] == ["pending"]
+    with pytest.raises(ValueError):
+        serializer.get_results_page(status=JobStatus.DELETED)
@@ -0,0 +1,161 @@
+import datetime
+import os
+
+import freezegun
+import pytest
+
+from notebooker.constants import JobStatus, NotebookResultComplete
+from notebooker.retention import RetentionPolicy
+from notebooker.serialization.codecs import NO_CODEC
+from notebooker.serialization.serialization import get_serializer_from_cls
+from notebooker.serialization import ALL_SERIALIZERS, SERIALIZER_TO_CLI_OPTIONS
+from notebooker.serializers.sqlite import SqliteResultSerializer
+from notebooker.utils.garbage_collection import collect_garbage
+
+
+@pytest.fixture
+def serializer(tmp_path):
+    serializer = SqliteResultSerializer(sqlite_path=str(tmp_path / "results.sqlite"))
+    yield serializer
+    serializer.close()
+
+
+def _complete(job_id, outputs, overrides=None):
+    return NotebookResultComplete(
+        job_id=job_id,
+        report_name="report",
+        job_start_time=datetime.datetime(2020, 1, 1),
+        job_finish_time=datetime.datetime(2020, 1, 1),
+        raw_html="<html/>",
+        raw_html_resources={"outputs": outputs},
+        raw_ipynb_json="{}",
+        pdf=b"%PDF",
+        overrides=overrides or {},
+    )
+
+
+def _files(serializer):
+    return sorted(
+        os.path.relpath(os.path.join(root, filename), serializer.sqlite_data_dir)
+        for root, _, filenames in os.walk(serializer.sqlite_data_dir)
+        for filename in filenames
+    )
+
+
+def test_sqlite_serializer_is_discovered(tmp_path):
+    assert ALL_SERIALIZERS["SqliteResultSerializer"] is SqliteResultSerializer
+    assert SERIALIZER_TO_CLI_OPTIONS["SqliteResultSerializer"] is SqliteResultSerializer.cli_options
+    path = str(tmp_path / "results.sqlite")
+    serializer = get_serializer_from_cls("SqliteResultSerializer", SQLITE_PATH=path, PAYLOAD_CODEC=NO_CODEC)
+    assert serializer.serializer_args_to_cmdline_args() == [
+        "--sqlite-path",
+        path,
+        "--sqlite-data-dir",
+        str(tmp_path / "results_data"),
+        "--payload-codec",
+        NO_CODEC,
+    ]
+    assert serializer._connection().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_results_are_saved_as_files(serializer):
+    serializer.save_check_result(_complete("abc", {"plot.png": b"png"}))
+    blob_hash = serializer._get_output_hashes("abc")["plot.png"]
+    assert _files(serializer) == [
+        os.path.join("blobs", blob_hash[:2], blob_hash),
+        os.path.join("jobs", "abc", "raw_html.zlib"),
+        os.path.join("jobs", "abc", "raw_ipynb_json.zlib"),
+        os.path.join("jobs", "abc", "report.pdf"),
+    ]
+    # Saving again with another codec leaves one copy of each field behind.
+    serializer.payload_codec = NO_CODEC
+    serializer._save_payload("abc", {"raw_html": "<html/>", "raw_ipynb_json": "{}"})
+    assert [f for f in _files(serializer) if f.startswith("jobs")] == [
+        os.path.join("jobs", "abc", "raw_html.none"),
+        os.path.join("jobs", "abc", "raw_ipynb_json.none"),
+        os.path.join("jobs", "abc", "report.pdf"),
+    ]
+    assert serializer.get_check_result("abc").raw_html == "<html/>"
+    assert serializer.get_blob_stats() == {"n_blobs": 1, "stored_bytes": 3, "referenced_bytes": 3}
+
+
+def test_finished_results_cant_be_replaced(serializer):
+    serializer.save_check_stub("abc", "report")
+    serializer.save_check_result(_complete("abc", {"plot.png": b"png"}))
+    files = _files(serializer)
+    late = _complete("abc", {"other.png": b"other"})
+    late.raw_html = "<late/>"
+    serializer.save_check_result(late)
+    assert _files(serializer) == files
+    assert serializer.get_check_result("abc").raw_html == "<html/>"
+    assert serializer.get_blob_stats()["n_blobs"] == 1
+
+
+def test_job_ids_cannot_escape_the_data_dir(serializer):
+    serializer.save_check_result(_complete("../../abc", {}))
+    job_files = ("raw_html.zlib", "raw_ipynb_json.zlib", "report.pdf")
+    assert _files(serializer) == [os.path.join("jobs", "..%2F..%2Fabc", filename) for filename in job_files]
+    assert serializer.get_check_result("../../abc").pdf == b"%PDF"
+
+
+def test_results_page_and_filters(serializer):
+    for minute, job_id in enumerate(["a", "b", "c", "d"]):
+        with freezegun.freeze_time(datetime.datetime(2020, 1, 1, 0, minute)):
+            serializer.save_check_stub(job_id, "report" if job_id != "c" else "other")
+    serializer.update_check_status("d", JobStatus.ERROR, error_info="oops")
+
+    page, token = serializer.get_results_page(page_size=2)
+    assert [result.job_id for result in page] == ["d", "c"]
+    page, token = serializer.get_results_page(page_size=2, page_token=token)
+    assert ([result.job_id for result in page], token) == (["b", "a"], None)
+    page, _ = serializer.get_results_page(report_name="report", status=JobStatus.PENDING)
+    assert [result.job_id for result in page] == ["b", "a"]
+
+    pending = {"status": {"$in": [JobStatus.SUBMITTED.value, JobStatus.PENDING.value]}}
+    assert serializer.get_all_result_keys(mongo_filter=pending) == [("other", "c"), ("report", "b"), ("report", "a")]
+    assert serializer.get_result_counts() == {
+        "total": 4,
+        "by_status": {JobStatus.PENDING.value: 3, JobStatus.ERROR.value: 1},
+        "by_report": {"report": 3, "other": 1},
+    }
+    with pytest.raises(ValueError):
+        serializer.get_all_result_keys(mongo_filter={"overrides.a": 1})
+
+
+def test_latest_successful_for_all_params(serializer):
+    for minute, (job_id, overrides) in enumerate([("a", {"x": 1}), ("b", {"x": 2}), ("c", {"x": 1})]):
+        with freezegun.freeze_time(datetime.datetime(2020, 1, 1, 0, minute)):
+            serializer.save_check_result(_complete(job_id, {}, overrides))
+    serializer.save_check_stub("d", "report", overrides={"x": 2})
+    assert sorted(serializer.get_latest_successful_job_ids_for_name_all_params("report")) == ["b", "c"]
+
+
+def test_collect_garbage(serializer):
+    for minute, job_id in enumerate(["old", "deleted", "new"]):
+        with freezegun.freeze_time(datetime.datetime(2020, 1, 1, 0, minute)):
+            serializer.save_check_result(_complete(job_id, {"shared.png": b"shared", "own.png": job_id.encode()}))
+    serializer.update_stdout("old", ["a\n"])
+    serializer.delete_result("deleted")
+    # Files left behind by a result which no longer exists.
+    os.makedirs(os.path.join(serializer.sqlite_data_dir, "jobs", "gone"))
+    with open(os.path.join(serializer.sqlite_data_dir, "jobs", "gone", "report.pdf"), "wb") as f:
+        f.write(b"orphan")
+    policies = [RetentionPolicy("report", keep_last=1)]
+
+    report = collect_garbage(serializer, policies, dry_run=True, pause_seconds=0)
+    assert report["n_results"] == 2
+    assert report["blob_bytes"] == len(b"deleted") + len(b"old")
+    assert report["file_bytes"] == 2 * len(b"%PDF")
+    assert report["n_orphaned_files"] == 1
+    assert report["orphaned_file_bytes"] == len(b"orphan")
+
+    assert collect_garbage(serializer, policies, pause_seconds=0) == report
+    assert serializer.get_all_result_keys() == [("report", "new")]
+    assert serializer.get_stdout("old") == []
+    assert os.listdir(os.path.join(serializer.sqlite_data_dir, "jobs")) == ["new"]
+    assert serializer.get_blob_stats() == {"n_blobs": 2, "stored_bytes": 9, "referenced_bytes": 9}
+    assert dict(serializer.get_check_result("new").raw_html_resources["outputs"].items()) == {
+        "shared.png": b"shared",
+        "own.png": b"new",
+    }
+    assert collect_garbage(serializer, policies, pause_seconds=0)["total_bytes"] == 0
@@ -0,0 +1,91 @@
+import datetime
+import pickle
+
+import mock
+import pytest
+
+from notebooker.constants import (
+    PAYLOAD_NOT_LOADED,
+    LazyNotebookResultComplete,
+    LazyResourceOutputs,
+    NotebookResultComplete,
+)
+
+
+def _lazy_result(payload_source):
+    return LazyNotebookResultComplete(
+        job_id="abc",
+        report_name="report",
+        job_start_time=datetime.datetime(2020, 1, 1),
+        job_finish_time=datetime.datetime(2020, 1, 1, 1),
+        update_time=datetime.datetime(2020, 1, 1, 1),
+        raw_html=PAYLOAD_NOT_LOADED,
+        raw_ipynb_json="{}",
+        pdf=PAYLOAD_NOT_LOADED,
+        raw_html_resources={"outputs": LazyResourceOutputs("abc", ["img.png"]), "inlining": {}},
+        payload_source=payload_source,
+    )
+
+
+def test_lazy_result_loads_each_field_once():
+    source = mock.Mock()
+    source.get_result_payload.return_value = "<html/>"
+    result = _lazy_result(source)
+    assert result.raw_ipynb_json == "{}"
+    source.get_result_payload.assert_not_called()
+    assert result.raw_html == "<html/>"
+    assert result.raw_html == "<html/>"
+    source.get_result_payload.assert_called_once_with("abc", "raw_html")
+
+
+def test_lazy_result_pickles_what_has_been_loaded():
+    source = mock.Mock()
+    source.get_result_payload.return_value = "<html/>"
+    source.get_result_resource.return_value = b"png"
+    result = _lazy_result(source)
+    result.raw_html
+    result.raw_html_resources["outputs"]["img.png"]
+
+    unpickled = pickle.loads(pickle.dumps(result))
+    assert unpickled.payload_source is None
+    assert unpickled.raw_html == "<html/>"
+    assert unpickled.raw_html_resources["outputs"]["img.png"] == b"png"
+    with pytest.raises(ValueError):
+        unpickled.pdf
+
+    new_source = mock.Mock()
+    new_source.get_result_payload.return_value = b"pdf"
+    unpickled.bind_payload_source(new_source)
+    assert unpickled.pdf == b"pdf"
+
+
+def test_lazy_result_knows_what_it_has_loaded():
+    source = mock.Mock()
+    source.get_result_payload.side_effect = lambda job_id, field: field
+    source.get_result_resource.return_value = b"png"
+    result = _lazy_result(source)
+    assert result.loaded_payload() == {("field", "raw_ipynb_json")}
+    result.raw_html
+    result.raw_html_resources["outputs"]["img.png"]
+    expected = {("field", "raw_ipynb_json"), ("field", "raw_html"), ("output", "img.png")}
+    assert result.loaded_payload() == expected
+    assert pickle.loads(pickle.dumps(result)).loaded_payload() == expected
+
+
+def test_lazy_result_equals_eager_result():
+    source = mock.Mock()
+    source.get_result_payload.side_effect = lambda job_id, field: field
+    source.get_result_resources.side_effect = lambda job_id, paths: {path: b"png" for path in paths}
+    eager = NotebookResultComplete(
+        job_id="abc",
+        report_name="report",
+        job_start_time=datetime.datetime(2020, 1, 1),
+        job_finish_time=datetime.datetime(2020, 1, 1, 1),
+        update_time=datetime.datetime(2020, 1, 1, 1),
+        raw_html="raw_html",
+        raw_ipynb_json="{}",
+        pdf="pdf",
+        raw_html_resources={"outputs": {"img.png": b"png"}, "inlining": {}},
+    )
+    assert _lazy_result(source) == eager
+    assert eager == _lazy_result(source)
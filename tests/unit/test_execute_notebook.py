@@ -1,8 +1,19 @@
 from __future__ import unicode_literals
 
+from concurrent.futures import ThreadPoolExecutor
+
+import mock
 import pytest
 
-from notebooker.execute_notebook import _get_overrides
+from notebooker.constants import JobStatus, NotebookResultComplete, NotebookResultError, kernel_spec
+from notebooker.execute_notebook import (
+    _get_overrides,
+    _run_variant_in_process,
+    _run_variants,
+    _start_kernel_pool,
+    execute_notebook_entrypoint,
+)
+from notebooker.settings import BaseConfig
 
 
 @pytest.mark.parametrize(
@@ -27,6 +38,17 @@ def test_get_overrides(json_overrides, iterate_override_values_of, expected_outp
         assert override in expected_output
 
 
+def test_get_overrides_cartesian_product():
+    assert _get_overrides('{"test": [1, 2, 1], "a": ["x", "y"], "b": 0}', ("test", "a", "test")) == [
+        {"test": 1, "a": "x", "b": 0},
+        {"test": 1, "a": "y", "b": 0},
+        {"test": 2, "a": "x", "b": 0},
+        {"test": 2, "a": "y", "b": 0},
+    ]
+    assert _get_overrides('{"test": [[1], [1]], "a": []}', ["test"]) == [{"test": [1], "a": []}]
+    assert _get_overrides('{"test": [1, 2], "a": []}', ["test", "a"]) == []
+
+
 @pytest.mark.parametrize(
     "input_json, iterate_override_values_of, error_message",
     [
@@ -42,8 +64,75 @@ def test_get_overrides(json_overrides, iterate_override_values_of, expected_outp
             "Can't iterate over override values unless it is given in the override.*",
         ),
         ("{}", "test", "Can't iterate over override values unless it is given in the override.*"),
+        ('{"test": [1], "a": 1}', ["test", "a"], "Can't iterate over a non-list or tuple of variables.*"),
     ],
 )
 def test_get_overrides_valueerror(input_json, iterate_override_values_of, error_message):
     with pytest.raises(ValueError, match=error_message):
         _get_overrides(input_json, iterate_override_values_of)
+
+
+@pytest.mark.parametrize("pool_size, n_notebooks, expected_size", [(0, 5, None), (4, 1, None), (4, 2, 2), (2, 5, 2)])
+def test_start_kernel_pool(pool_size, n_notebooks, expected_size):
+    config = BaseConfig(KERNEL_POOL_SIZE=pool_size, KERNEL_POOL_WARM_IMPORTS="pandas,numpy")
+    with mock.patch("notebooker.execute_notebook.KernelPool") as kernel_pool:
+        pool = _start_kernel_pool(config, n_notebooks)
+    if expected_size is None:
+        assert pool is None
+        kernel_pool.assert_not_called()
+    else:
+        kernel_pool.assert_called_once_with(expected_size, ["pandas", "numpy"])
+        pool.prestart.assert_called_once_with(kernel_spec()["name"])
+
+
+def test_failing_variants_dont_stop_the_others(tmp_path):
+    config = BaseConfig(
+        OUTPUT_DIR=str(tmp_path),
+        TEMPLATE_DIR=str(tmp_path),
+        SERIALIZER_CLS="InMemoryResultSerializer",
+        SERIALIZER_CONFIG={},
+    )
+
+    def run_report(**kwargs):
+        if kwargs["overrides"]["n"] == 2:
+            return NotebookResultError(kwargs["job_id"], None, "report", error_info="Traceback\nZeroDivisionError")
+        return kwargs["overrides"]
+
+    with mock.patch("notebooker.execute_notebook.run_report", side_effect=run_report) as run:
+        with pytest.raises(Exception, match=r"1 of 3 variants of report failed:\n{'n': 2} \(job id .*\): ZeroDivision"):
+            execute_notebook_entrypoint(config, "report", '{"n": [1, 2, 3]}', ["n"], "", 1, "job", "", False, True)
+    assert [call[1]["overrides"] for call in run.call_args_list] == [{"n": 1}, {"n": 2}, {"n": 3}]
+    # Each variant is saved as its own result, the first under the job ID it was given.
+    assert len({call[1]["job_id"] for call in run.call_args_list}) == 3
+    assert run.call_args_list[0][1]["job_id"] == "job"
+
+
+def test_parallel_variants_only_send_back_their_job_id_and_status():
+    config = BaseConfig(SERIALIZER_CLS="InMemoryResultSerializer", SERIALIZER_CONFIG={})
+    result = NotebookResultComplete(
+        job_id="job",
+        job_start_time=None,
+        job_finish_time=None,
+        report_name="report",
+        raw_html="<html>big</html>",
+    )
+    with mock.patch("notebooker.execute_notebook.run_report", return_value=result):
+        assert _run_variant_in_process(config, {"mailto": ""}) == ("job", JobStatus.DONE)
+
+
+def test_failed_parallel_variants_are_logged(caplog):
+    config = BaseConfig(SERIALIZER_CLS="InMemoryResultSerializer", SERIALIZER_CONFIG={})
+    all_run_kwargs = [{"report_name": "report", "job_id": "job-{}".format(n), "overrides": {"n": n}} for n in range(2)]
+    error = ZeroDivisionError("division by zero")
+    with mock.patch(
+        "notebooker.execute_notebook.ProcessPoolExecutor",
+        lambda max_workers, mp_context: ThreadPoolExecutor(max_workers),
+    ), mock.patch("notebooker.execute_notebook._run_variant_in_process", side_effect=error):
+        results = list(_run_variants(config, all_run_kwargs, 2, None, None))
+    assert results == [(run_kwargs, error) for run_kwargs in all_run_kwargs]
+    assert len(caplog.records) == len(all_run_kwargs)
+    for record, run_kwargs in zip(caplog.records, all_run_kwargs):
+        assert record.getMessage() == "Running report (job id {}) with overrides {} failed.".format(
+            run_kwargs["job_id"], run_kwargs["overrides"]
+        )
+        assert record.exc_info[1] is error
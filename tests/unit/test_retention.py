@@ -0,0 +1,42 @@
+import datetime
+
+import pytest
+
+from notebooker.retention import RetentionPolicy, find_retention_policy, load_retention_policies
+
+
+@pytest.mark.parametrize(
+    "policy, position, age_days, expected",
+    [
+        (RetentionPolicy("r", keep_last=2), 2, 1000, False),
+        (RetentionPolicy("r", keep_last=2), 3, 0, True),
+        (RetentionPolicy("r", max_age_days=7), 100, 7, False),
+        (RetentionPolicy("r", max_age_days=7), 1, 8, True),
+        # Either limit keeps a result.
+        (RetentionPolicy("r", keep_last=1, max_age_days=7), 1, 30, False),
+        (RetentionPolicy("r", keep_last=1, max_age_days=7), 5, 1, False),
+        (RetentionPolicy("r", keep_last=1, max_age_days=7), 5, 30, True),
+    ],
+)
+def test_retention_policy_is_expired(policy, position, age_days, expected):
+    assert policy.is_expired(position, datetime.timedelta(days=age_days)) is expected
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"keep_last": -1}, {"max_age_days": -1}])
+def test_retention_policy_needs_valid_limits(kwargs):
+    with pytest.raises(ValueError):
+        RetentionPolicy("r", **kwargs)
+
+
+def test_find_retention_policy_first_match_wins():
+    policies = [RetentionPolicy("sample/plot_*", keep_last=1), RetentionPolicy("sample/*", keep_last=5)]
+    assert find_retention_policy(policies, "sample/plot_random") is policies[0]
+    assert find_retention_policy(policies, "sample/other") is policies[1]
+    assert find_retention_policy(policies, "other") is None
+
+
+def test_load_retention_policies(tmpdir):
+    path = tmpdir.join("policies.json")
+    path.write('[{"report_name": "*", "keep_last": 3, "max_age_days": 30}]')
+    assert load_retention_policies(str(path)) == [RetentionPolicy("*", keep_last=3, max_age_days=30)]
+    assert load_retention_policies(None) == []
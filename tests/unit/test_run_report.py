@@ -1,33 +1,15 @@
-import subprocess
-import sys
-
 import mock
+import pytest
 
-from notebooker.constants import DEFAULT_SERIALIZER
-from notebooker.web.routes.run_report import _monitor_stderr
-
-
-def test_monitor_stderr():
-    dummy_process = """
-import time, sys
-sys.stdout.write(u'This is going to stdout\\n')
-sys.stderr.write(u'This is going to stderr\\n')
-time.sleep(1)
-sys.stdout.write(u'This is going to stdout a bit later\\n')
-sys.stderr.write(u'This is going to stderr a bit later\\n')
-"""
-    expected_output = """This is going to stderr
-This is going to stderr a bit later
-"""
-    p = subprocess.Popen([sys.executable, "-c", dummy_process], stderr=subprocess.PIPE)
+from notebooker.constants import DEFAULT_SERIALIZER, JobStatus
+from notebooker.web.routes.run_report import _execute_report
 
-    with mock.patch("notebooker.web.routes.run_report.get_serializer_from_cls") as serializer:
-        stderr_output = _monitor_stderr(p, "abc123", DEFAULT_SERIALIZER, {})
-    assert stderr_output == expected_output
 
-    serializer().update_stdout.assert_has_calls(
-        [
-            mock.call("abc123", new_lines=["This is going to stderr\n"]),
-            mock.call("abc123", new_lines=["This is going to stderr a bit later\n"]),
-        ]
-    )
+@pytest.mark.parametrize("status", [JobStatus.CANCELLED, None])
+def test_jobs_which_are_no_longer_submitted_are_not_run(status):
+    with mock.patch("notebooker.web.routes.run_report.get_serializer_from_cls") as serializer, mock.patch(
+        "notebooker.web.routes.run_report.start_report_process"
+    ) as popen:
+        serializer().get_check_result.return_value = status and mock.Mock(status=status)
+        _execute_report(["notebooker-cli"], "abc123", DEFAULT_SERIALIZER, {})
+    popen.assert_not_called()
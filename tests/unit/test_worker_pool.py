@@ -0,0 +1,69 @@
+import threading
+import time
+
+import pytest
+
+from notebooker.web.worker_pool import WorkerPool
+
+
+def _wait_for(condition):
+    deadline = time.time() + 5
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_jobs_run_in_order_with_bounded_concurrency():
+    pool = WorkerPool(2)
+    release = threading.Event()
+    lock = threading.Lock()
+    started, running, most_running = [], [0], [0]
+
+    def job(job_id):
+        def run():
+            with lock:
+                started.append(job_id)
+                running[0] += 1
+                most_running[0] = max(most_running[0], running[0])
+            release.wait()
+            with lock:
+                running[0] -= 1
+
+        return run
+
+    for job_id in "abcde":
+        pool.submit(job_id, job(job_id))
+    _wait_for(lambda: len(started) == 2)
+    assert started == ["a", "b"]
+    assert pool.queue_status("a") is None
+    assert pool.queue_status("c")["queue_position"] == 1
+    assert pool.queue_status("e")["queue_position"] == 3
+    assert pool.queue_status("e")["queued_seconds"] >= 0
+    release.set()
+    _wait_for(lambda: len(started) == 5 and running[0] == 0)
+    assert started == list("abcde")
+    assert most_running[0] == 2
+    pool.close()
+
+
+def test_a_failing_job_frees_its_worker():
+    pool = WorkerPool(1)
+    ran = threading.Event()
+    pool.submit("a", lambda: 1 / 0)
+    pool.submit("b", ran.set)
+    assert ran.wait(5)
+    pool.close()
+
+
+def test_close_returns_queued_jobs():
+    pool = WorkerPool(1)
+    release = threading.Event()
+    pool.submit("a", release.wait)
+    pool.submit("b", lambda: pytest.fail("b should not have run"))
+    _wait_for(lambda: pool.queue_status("b") is not None and pool.queue_status("a") is None)
+    assert pool.close() == ["b"]
+    release.set()
+    with pytest.raises(RuntimeError):
+        pool.submit("c", lambda: None)
+    with pytest.raises(ValueError):
+        WorkerPool(0)
@@ -0,0 +1,97 @@
+import itertools
+import threading
+import time
+
+import mock
+import pytest
+
+from notebooker.utils import kernel_pool
+from notebooker.utils.kernel_pool import KernelPool, parse_warm_imports
+
+
+class FakeKernelManager:
+    ids = itertools.count()
+
+    def __init__(self):
+        self.kernel_id = next(self.ids)
+        self.alive = True
+        self.clients = []
+
+    async def is_alive(self):
+        return self.alive
+
+
+@pytest.fixture
+def kernels():
+    started, shut_down = [], []
+    lock = threading.Lock()
+
+    def start(kernel_name, warm_imports, startup_timeout):
+        kernel_manager = FakeKernelManager()
+        with lock:
+            started.append(kernel_manager)
+        return kernel_manager
+
+    with mock.patch.object(kernel_pool, "_start_kernel", side_effect=start), mock.patch.object(
+        kernel_pool, "_shutdown", side_effect=shut_down.append
+    ):
+        yield started, shut_down
+
+
+def _wait_for(condition):
+    deadline = time.time() + 5
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_kernels_are_replaced_rather_than_reused(kernels):
+    started, shut_down = kernels
+    pool = KernelPool(2)
+    leased = []
+    for _ in range(3):
+        with pool.lease("python3") as kernel_manager:
+            leased.append(kernel_manager)
+    assert len(set(leased)) == 3
+    _wait_for(lambda: len(shut_down) == 3 and len(started) == 5)
+    assert set(shut_down) == set(leased)
+    pool.close()
+    assert set(shut_down) == set(started)
+
+
+def test_clients_channels_are_stopped_when_the_lease_ends(kernels):
+    pool = KernelPool(1)
+    client = mock.Mock()
+    with pool.lease("python3") as kernel_manager:
+        kernel_manager.clients.append(client)
+        client.stop_channels.assert_not_called()
+    client.stop_channels.assert_called_once_with()
+    assert kernel_manager.clients == []
+    pool.close()
+
+
+def test_dead_kernels_are_skipped(kernels):
+    started, shut_down = kernels
+    pool = KernelPool(1)
+    pool.prestart("python3")
+    _wait_for(lambda: len(started) == 1)
+    started[0].alive = False
+    with pool.lease("python3") as kernel_manager:
+        assert kernel_manager is started[1]
+    assert shut_down[0] is started[0]
+    pool.close()
+
+
+def test_lease_yields_none_when_kernels_cannot_start():
+    with mock.patch.object(kernel_pool, "_start_kernel", side_effect=RuntimeError("No such kernel")):
+        pool = KernelPool(1)
+        with pool.lease("missing") as kernel_manager:
+            assert kernel_manager is None
+        pool.close()
+
+
+def test_parse_warm_imports():
+    assert parse_warm_imports("pandas, numpy,,os.path") == ["pandas", "numpy", "os.path"]
+    assert parse_warm_imports("") == []
+    with pytest.raises(ValueError):
+        parse_warm_imports("os; import shutil")
@@ -0,0 +1,44 @@
+import subprocess
+import sys
+
+import mock
+
+from notebooker.constants import DEFAULT_SERIALIZER
+from notebooker.utils.report_process import monitor_stderr
+
+
+def test_monitor_stderr():
+    dummy_process = """
+import time, sys
+sys.stdout.write(u'This is going to stdout\\n')
+sys.stderr.write(u'This is going to stderr\\n')
+time.sleep(1)
+sys.stdout.write(u'This is going to stdout a bit later\\n')
+sys.stderr.write(u'This is going to stderr a bit later\\n')
+"""
+    expected_output = """This is going to stderr
+This is going to stderr a bit later
+"""
+    p = subprocess.Popen([sys.executable, "-c", dummy_process], stderr=subprocess.PIPE)
+
+    with mock.patch("notebooker.utils.report_process.get_serializer_from_cls") as serializer:
+        stderr_output = monitor_stderr(p, "abc123", DEFAULT_SERIALIZER, {})
+    assert stderr_output == expected_output
+
+    serializer().update_stdout.assert_has_calls(
+        [
+            mock.call("abc123", new_lines=["This is going to stderr\n"]),
+            mock.call("abc123", new_lines=["This is going to stderr a bit later\n"]),
+        ]
+    )
+
+
+def test_monitor_stderr_waits_for_the_process_after_eof():
+    process = mock.Mock()
+    process.stderr.readline.return_value = b""
+    process.poll.return_value = None
+    with mock.patch("notebooker.utils.report_process.get_serializer_from_cls"):
+        assert monitor_stderr(process, "abc123", DEFAULT_SERIALIZER, {}) == ""
+    # It blocks until the process exits rather than spinning on readline() and poll().
+    process.stderr.readline.assert_called_once_with()
+    process.wait.assert_called_once_with()
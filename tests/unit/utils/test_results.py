@@ -1,3 +1,6 @@
+import warnings
+
+import pytest
 from mock import MagicMock, patch, sentinel
 
 import notebooker.utils.results as results
@@ -114,18 +117,91 @@ def test_get_latest_successful_job_results_as_of(_get_results_from_name_and_para
     )
 
 
-@patch("notebooker.utils.results._get_job_results")
-def test_get_latest_successful_job_results_all_params(_get_job_results):
+def test_get_latest_successful_job_results_all_params():
+    serializer = MagicMock()
+    serializer.get_latest_successful_results_for_name_all_params.return_value = iter([sentinel.result])
+    res = results.get_latest_successful_job_results_all_params("report_name", serializer)
+    serializer.get_latest_successful_results_for_name_all_params.assert_not_called()
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        all_results = [r for r in res]
+    serializer.get_latest_successful_results_for_name_all_params.assert_called_once_with("report_name")
+    serializer.get_check_result.assert_not_called()
+    assert all_results == [sentinel.result]
+
+
+def test_get_latest_successful_job_results_all_params_deprecates_cache_options():
     serializer = MagicMock()
-    serializer.get_latest_successful_job_ids_for_name_all_params.return_value = [sentinel.job_id]
-    _get_job_results.return_value = sentinel.results
-    res = results.get_latest_successful_job_results_all_params(
-        sentinel.report_name, serializer, sentinel.retrying, sentinel.ignore_cache
+    serializer.get_latest_successful_results_for_name_all_params.return_value = iter([sentinel.result])
+    with pytest.warns(DeprecationWarning):
+        res = list(results.get_latest_successful_job_results_all_params("report_name", serializer, ignore_cache=True))
+    assert res == [sentinel.result]
+
+
+def _lazy_result():
+    return constants.LazyNotebookResultComplete(
+        job_id="abc",
+        report_name="report",
+        job_start_time=None,
+        job_finish_time=None,
+        raw_html=constants.PAYLOAD_NOT_LOADED,
+        raw_ipynb_json=constants.PAYLOAD_NOT_LOADED,
+        pdf=constants.PAYLOAD_NOT_LOADED,
+        raw_html_resources={"outputs": constants.LazyResourceOutputs("abc", ["img.png"])},
     )
-    all_results = [r for r in res]
-    serializer.get_latest_successful_job_ids_for_name_all_params.assert_called_once_with(sentinel.report_name)
-    _get_job_results.assert_called_once_with(
-        sentinel.job_id, sentinel.report_name, serializer, sentinel.retrying, sentinel.ignore_cache
+
+
+def test_get_job_results_caches_lazy_results_without_loading_them():
+    serializer = MagicMock()
+    serializer.get_check_result.return_value = result = _lazy_result()
+    with patch("notebooker.utils.results.get_report_cache", return_value=None), patch(
+        "notebooker.utils.results.set_report_cache"
+    ) as set_report_cache:
+        assert results._get_job_results("abc", "report", serializer) is result
+    set_report_cache.assert_called_once_with("report", "abc", result)
+    serializer.get_result_payload.assert_not_called()
+    serializer.get_result_resources.assert_not_called()
+
+
+def test_read_job_result_caches_only_what_it_loaded():
+    serializer = MagicMock()
+    serializer.get_result_payload.side_effect = lambda job_id, field: field
+    result = _lazy_result()
+    result.bind_payload_source(serializer)
+    with patch("notebooker.utils.results.set_report_cache") as set_report_cache:
+        assert results.read_job_result("abc", "report", result, lambda r: r.raw_ipynb_json) == "raw_ipynb_json"
+        set_report_cache.assert_called_once_with("report", "abc", result)
+        # Once it's loaded, reading it again neither reads the serializer nor caches the result again.
+        assert results.read_job_result("abc", "report", result, lambda r: r.raw_ipynb_json) == "raw_ipynb_json"
+        set_report_cache.assert_called_once()
+    serializer.get_result_payload.assert_called_once_with("abc", "raw_ipynb_json")
+    serializer.get_result_resources.assert_not_called()
+    assert result.loaded_payload() == {("field", "raw_ipynb_json")}
+
+
+def test_get_result_counts_from_cache():
+    serializer = MagicMock()
+    with patch("notebooker.utils.results.get_cache", return_value=sentinel.counts):
+        assert results.get_result_counts(serializer) == sentinel.counts
+    serializer.get_result_counts.assert_not_called()
+
+
+def test_get_result_counts_force_reload():
+    serializer = MagicMock()
+    serializer.get_result_counts.return_value = sentinel.counts
+    with patch("notebooker.utils.results.get_cache", return_value=sentinel.stale_counts), patch(
+        "notebooker.utils.results.set_cache"
+    ) as set_cache:
+        assert results.get_result_counts(serializer, force_reload=True) == sentinel.counts
+    set_cache.assert_called_once_with(
+        results.RESULT_COUNTS_CACHE_KEY, sentinel.counts, timeout=results.RESULT_COUNTS_CACHE_TIMEOUT, cache_dir=None
     )
-    assert len(all_results) == 1
-    assert all_results[0] == sentinel.results
+
+
+def test_get_n_results_available_falls_back_to_serializer():
+    serializer = MagicMock()
+    serializer.n_all_results.return_value = 12
+    with patch("notebooker.utils.results.get_cache", return_value=None):
+        assert results.get_n_results_available(serializer) == 12
+    with patch("notebooker.utils.results.get_cache", return_value={"total": 10}):
+        assert results.get_n_results_available(serializer) == 10
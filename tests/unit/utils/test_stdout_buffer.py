@@ -0,0 +1,54 @@
+import mock
+
+from notebooker.utils.stdout_buffer import BufferedStdoutSink
+
+
+def test_lines_are_batched_until_close():
+    serializer = mock.MagicMock()
+    with BufferedStdoutSink(serializer, "abc123", max_interval_seconds=60) as sink:
+        for i in range(100):
+            sink.write("line {}\n".format(i))
+        serializer.update_stdout.assert_not_called()
+    serializer.update_stdout.assert_called_once_with("abc123", new_lines=["line {}\n".format(i) for i in range(100)])
+    assert sink.lines_buffered == 100
+    assert sink.n_flushes == 1
+
+
+def test_flushes_when_max_bytes_is_reached():
+    serializer = mock.MagicMock()
+    with BufferedStdoutSink(serializer, "abc123", max_bytes=10, max_interval_seconds=60) as sink:
+        sink.write("12345\n")
+        serializer.update_stdout.assert_not_called()
+        sink.write("67890\n")
+        serializer.update_stdout.assert_called_once_with("abc123", new_lines=["12345\n", "67890\n"])
+        sink.write("tail\n")
+    serializer.update_stdout.assert_called_with("abc123", new_lines=["tail\n"])
+    assert sink.n_flushes == 2
+
+
+def test_max_bytes_counts_utf8_bytes_rather_than_characters():
+    serializer = mock.MagicMock()
+    with BufferedStdoutSink(serializer, "abc123", max_bytes=10, max_interval_seconds=60) as sink:
+        # Five characters, but ten bytes once encoded.
+        sink.write("\u00e9\u00e9\u00e9\u00e9\u00e9")
+        serializer.update_stdout.assert_called_once_with("abc123", new_lines=["\u00e9\u00e9\u00e9\u00e9\u00e9"])
+
+
+def test_flushes_on_a_timer():
+    serializer = mock.MagicMock()
+    with BufferedStdoutSink(serializer, "abc123", max_interval_seconds=0.01) as sink:
+        sink.write("hello\n")
+        sink._closed.wait(0.5)
+        serializer.update_stdout.assert_called_once_with("abc123", new_lines=["hello\n"])
+    assert sink.n_flushes == 1
+
+
+def test_failed_flushes_are_retried():
+    serializer = mock.MagicMock()
+    serializer.update_stdout.side_effect = [Exception("mongo is down"), None]
+    with BufferedStdoutSink(serializer, "abc123", max_interval_seconds=60) as sink:
+        sink.write("hello\n")
+        sink.flush()
+        sink.write("world\n")
+    assert serializer.update_stdout.call_args_list[-1] == mock.call("abc123", new_lines=["hello\n", "world\n"])
+    assert sink.n_flushes == 1